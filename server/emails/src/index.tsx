@@ -1,28 +1,98 @@
 import { render } from '@react-email/render'
 import { Command } from 'commander'
+import { createInterface } from 'node:readline'
 
 import emails from './emails'
 
+const renderTemplate = async (
+  template: string,
+  props: Record<string, unknown>,
+): Promise<string> => {
+  const TemplateComponent = emails[template]
+  if (!TemplateComponent) {
+    throw new Error(`Template ${template} not found`)
+  }
+  return render(<TemplateComponent {...props} />)
+}
+
+interface ServerRequest {
+  id: number
+  ping?: boolean
+  template?: string
+  props?: Record<string, unknown>
+}
+
+/**
+ * Render emails requested as line-delimited JSON on stdin, one at a time,
+ * and write each response as a JSON line on stdout.
+ */
+const serve = () => {
+  const respond = (response: Record<string, unknown>) =>
+    process.stdout.write(`${JSON.stringify(response)}\n`)
+
+  const lines = createInterface({ input: process.stdin })
+  lines.on('line', async (line) => {
+    let request: ServerRequest
+    try {
+      request = JSON.parse(line)
+    } catch (error) {
+      respond({ id: null, error: `Error parsing JSON request: ${error}` })
+      return
+    }
+
+    const { id, ping, template, props } = request
+    if (ping) {
+      respond({ id, pong: true })
+      return
+    }
+    try {
+      respond({ id, html: await renderTemplate(template ?? '', props ?? {}) })
+    } catch (error) {
+      respond({ id, error: String(error) })
+    }
+  })
+  lines.on('close', () => process.exit(0))
+}
+
 const program = new Command()
 
 program
-  .argument('<template>', 'name of the email template')
-  .argument('<props>', 'props to pass to the email template, as a JSON string')
-  .action((template: string, props: string) => {
-    try {
-      const parsedProps = JSON.parse(props)
-      const TemplateComponent = emails[template]
-      if (!TemplateComponent) {
-        console.error(`Template ${template} not found`)
+  .argument('[template]', 'name of the email template')
+  .argument('[props]', 'props to pass to the email template, as a JSON string')
+  .option(
+    '--server',
+    'render the emails requested as line-delimited JSON on stdin',
+  )
+  .action(
+    (
+      template: string | undefined,
+      props: string | undefined,
+      options: { server?: boolean },
+    ) => {
+      if (options.server) {
+        serve()
+        return
+      }
+
+      if (!template || !props) {
+        program.help({ error: true })
+      }
+
+      let parsedProps: Record<string, unknown>
+      try {
+        parsedProps = JSON.parse(props as string)
+      } catch (error) {
+        console.error('Error parsing JSON string:', error)
         process.exit(1)
       }
-      render(<TemplateComponent {...parsedProps} />).then((html) =>
-        console.log(html),
+      renderTemplate(template as string, parsedProps).then(
+        (html) => console.log(html),
+        (error) => {
+          console.error(String(error))
+          process.exit(1)
+        },
       )
-    } catch (error) {
-      console.error('Error parsing JSON string:', error)
-      process.exit(1)
-    }
-  })
+    },
+  )
 
 program.parse(process.argv)
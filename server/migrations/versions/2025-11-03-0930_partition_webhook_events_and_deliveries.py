@@ -0,0 +1,209 @@
+"""Partition webhook_events and webhook_deliveries by day
+
+Revision ID: 5d2f8b3a9c17
+Revises: c4a81f5e2d93
+Create Date: 2025-11-03 09:30:14.381027
+
+The existing tables are kept as they are, and attached as the first partition
+of the new partitioned tables, covering everything before a cutoff. Their checks
+and indexes are prepared concurrently beforehand, so the swap itself only
+touches the catalog. The partitioning maintenance job drops them once the cutoff
+is past the retention period.
+
+"""
+
+from datetime import UTC, datetime, time, timedelta
+
+import sqlalchemy as sa
+from alembic import op
+
+# Polar Custom Imports
+
+# revision identifiers, used by Alembic.
+revision = "5d2f8b3a9c17"
+down_revision = "c4a81f5e2d93"
+branch_labels: tuple[str] | None = None
+depends_on: tuple[str] | None = None
+
+
+# Daily partitions created right away, after the cutoff
+PARTITIONS_PREMAKE = 7
+
+EVENTS_INDEXES: list[tuple[str, list[str], str | None]] = [
+    ("ix_webhook_events_created_at", ["created_at"], None),
+    ("ix_webhook_events_deleted_at", ["deleted_at"], None),
+    ("ix_webhook_events_type", ["type"], None),
+    ("ix_webhook_events_webhook_endpoint_id", ["webhook_endpoint_id"], None),
+    (
+        "ix_webhook_events_webhook_endpoint_id_created_at",
+        ["webhook_endpoint_id", "created_at"],
+        None,
+    ),
+    (
+        "ix_webhook_events_created_at_non_archived",
+        ["created_at"],
+        "payload IS NOT NULL",
+    ),
+]
+DELIVERIES_INDEXES: list[tuple[str, list[str], str | None]] = [
+    ("ix_webhook_deliveries_created_at", ["created_at"], None),
+    ("ix_webhook_deliveries_deleted_at", ["deleted_at"], None),
+    ("ix_webhook_deliveries_webhook_endpoint_id", ["webhook_endpoint_id"], None),
+    ("ix_webhook_deliveries_webhook_event_id", ["webhook_event_id"], None),
+]
+TABLES = {
+    "webhook_events": EVENTS_INDEXES,
+    "webhook_deliveries": DELIVERIES_INDEXES,
+}
+
+
+def _get_cutoff() -> datetime:
+    # Leave time for the migration to complete: rows are inserted in the legacy
+    # table until the swap, and routed to it afterwards until the cutoff.
+    return datetime.combine(datetime.now(UTC).date(), time(), UTC) + timedelta(days=2)
+
+
+def _partition_name(table: str, day: datetime) -> str:
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def upgrade() -> None:
+    cutoff = _get_cutoff()
+
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            # Proves the rows are in the range of the partition, so attaching
+            # the table doesn't need to scan it under an exclusive lock.
+            op.execute(
+                f"ALTER TABLE {table} ADD CONSTRAINT {table}_legacy_range_check "
+                f"CHECK (created_at < '{cutoff.isoformat()}') NOT VALID"
+            )
+            op.execute(
+                f"ALTER TABLE {table} VALIDATE CONSTRAINT {table}_legacy_range_check"
+            )
+            # Backs the primary key, which has to include the partition key
+            op.execute(
+                f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {table}_legacy_pkey "
+                f"ON {table} (id, created_at)"
+            )
+
+    # The deliveries can't reference the events anymore: the event partitions
+    # may be dropped before the ones of their deliveries.
+    op.drop_constraint(
+        "webhook_deliveries_webhook_event_id_fkey",
+        "webhook_deliveries",
+        type_="foreignkey",
+    )
+
+    for table, indexes in TABLES.items():
+        legacy = f"{table}_legacy"
+        op.rename_table(table, legacy)
+        op.execute(f"ALTER TABLE {legacy} DROP CONSTRAINT {table}_pkey")
+        op.execute(
+            f"ALTER TABLE {legacy} ADD CONSTRAINT {legacy}_pkey "
+            f"PRIMARY KEY USING INDEX {legacy}_pkey"
+        )
+        op.execute(
+            f"ALTER TABLE {legacy} RENAME CONSTRAINT "
+            f"{table}_webhook_endpoint_id_fkey TO {legacy}_webhook_endpoint_id_fkey"
+        )
+        for name, _, _ in indexes:
+            op.execute(
+                f"ALTER INDEX {name} RENAME TO "
+                f"{name.replace(f'ix_{table}_', f'ix_{legacy}_')}"
+            )
+
+    op.create_table(
+        "webhook_events",
+        sa.Column("webhook_endpoint_id", sa.Uuid(), nullable=False),
+        sa.Column("last_http_code", sa.Integer(), nullable=True),
+        sa.Column("succeeded", sa.Boolean(), nullable=True),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column("payload", sa.String(), nullable=True),
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("modified_at", sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column("deleted_at", sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["webhook_endpoint_id"],
+            ["webhook_endpoints.id"],
+            name=op.f("webhook_events_webhook_endpoint_id_fkey"),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("id", "created_at", name=op.f("webhook_events_pkey")),
+        postgresql_partition_by="RANGE (created_at)",
+    )
+    op.create_table(
+        "webhook_deliveries",
+        sa.Column("webhook_endpoint_id", sa.Uuid(), nullable=False),
+        sa.Column("webhook_event_id", sa.Uuid(), nullable=False),
+        sa.Column("succeeded", sa.Boolean(), nullable=False),
+        sa.Column("http_code", sa.Integer(), nullable=True),
+        sa.Column("response", sa.Text(), nullable=True),
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("modified_at", sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column("deleted_at", sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["webhook_endpoint_id"],
+            ["webhook_endpoints.id"],
+            name=op.f("webhook_deliveries_webhook_endpoint_id_fkey"),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint(
+            "id", "created_at", name=op.f("webhook_deliveries_pkey")
+        ),
+        postgresql_partition_by="RANGE (created_at)",
+    )
+
+    for table, indexes in TABLES.items():
+        legacy = f"{table}_legacy"
+        op.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {legacy} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{cutoff.isoformat()}')"
+        )
+        op.execute(f"ALTER TABLE {legacy} DROP CONSTRAINT {table}_legacy_range_check")
+
+        # The equivalent indexes of the legacy table are attached, not rebuilt
+        for name, columns, where in indexes:
+            op.create_index(name, table, columns, unique=False, postgresql_where=where)
+
+        op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        for days in range(PARTITIONS_PREMAKE):
+            start = cutoff + timedelta(days=days)
+            end = start + timedelta(days=1)
+            op.execute(
+                f"CREATE TABLE {_partition_name(table, start)} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+
+
+def downgrade() -> None:
+    # Only the legacy partitions are restored: rows of the daily partitions,
+    # created after the upgrade, are lost.
+    for table, indexes in TABLES.items():
+        legacy = f"{table}_legacy"
+        op.execute(f"ALTER TABLE {table} DETACH PARTITION {legacy}")
+        op.drop_table(table)
+
+        op.rename_table(legacy, table)
+        op.execute(
+            f"ALTER TABLE {table} RENAME CONSTRAINT "
+            f"{legacy}_webhook_endpoint_id_fkey TO {table}_webhook_endpoint_id_fkey"
+        )
+        for name, _, _ in indexes:
+            op.execute(
+                f"ALTER INDEX {name.replace(f'ix_{table}_', f'ix_{legacy}_')} "
+                f"RENAME TO {name}"
+            )
+        op.execute(f"ALTER TABLE {table} DROP CONSTRAINT {legacy}_pkey")
+        op.create_primary_key(f"{table}_pkey", table, ["id"])
+
+    op.create_foreign_key(
+        "webhook_deliveries_webhook_event_id_fkey",
+        "webhook_deliveries",
+        "webhook_events",
+        ["webhook_event_id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
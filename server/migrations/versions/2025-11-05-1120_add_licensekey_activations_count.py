@@ -0,0 +1,47 @@
+"""Add LicenseKey.activations_count
+
+Revision ID: 9e4b7c1d2f08
+Revises: 5d2f8b3a9c17
+Create Date: 2025-11-05 11:20:37.215496
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# Polar Custom Imports
+
+# revision identifiers, used by Alembic.
+revision = "9e4b7c1d2f08"
+down_revision = "5d2f8b3a9c17"
+branch_labels: tuple[str] | None = None
+depends_on: tuple[str] | None = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "license_keys",
+        sa.Column(
+            "activations_count",
+            sa.Integer(),
+            nullable=False,
+            server_default=sa.text("0"),
+        ),
+    )
+    op.execute(
+        """
+        UPDATE license_keys
+        SET activations_count = activations.count
+        FROM (
+            SELECT license_key_id, count(*) AS count
+            FROM license_key_activations
+            WHERE deleted_at IS NULL
+            GROUP BY license_key_id
+        ) AS activations
+        WHERE license_keys.id = activations.license_key_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("license_keys", "activations_count")
@@ -1,3 +1,4 @@
+import asyncio
 import contextlib
 from collections.abc import AsyncIterator
 from typing import TypedDict
@@ -8,10 +9,13 @@ from fastapi.routing import APIRoute
 
 from polar import worker  # noqa
 from polar.api import router
+from polar.auth import cache as auth_token_cache
 from polar.auth.middlewares import AuthSubjectMiddleware
+from polar.auth.usage import token_usage
 from polar.backoffice import app as backoffice_app
 from polar.checkout import ip_geolocation
 from polar.config import settings
+from polar.email import react as email_renderer
 from polar.exception_handlers import add_exception_handlers
 from polar.health.endpoints import router as health_router
 from polar.kit.cors import CORSConfig, CORSMatcherMiddleware, Scope
@@ -49,6 +53,7 @@ from polar.postgres import (
 from polar.posthog import configure_posthog
 from polar.redis import Redis, create_redis
 from polar.sentry import configure_sentry
+from polar.webhook import cache as webhook_endpoints_cache
 from polar.webhook.webhooks import document_webhooks
 
 from . import rate_limit
@@ -134,6 +139,14 @@ async def lifespan(app: FastAPI) -> AsyncIterator[State]:
         )
         ip_geolocation_client = None
 
+    await email_renderer.start_pool()
+
+    background_tasks = [
+        asyncio.create_task(auth_token_cache.listen_invalidations(redis)),
+        asyncio.create_task(webhook_endpoints_cache.listen_invalidations(redis)),
+        asyncio.create_task(token_usage.run(async_sessionmaker)),
+    ]
+
     log.info("Polar API started")
 
     yield {
@@ -147,6 +160,11 @@ async def lifespan(app: FastAPI) -> AsyncIterator[State]:
         "ip_geolocation_client": ip_geolocation_client,
     }
 
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+    await email_renderer.close_pool()
     await redis.close(True)
     await async_engine.dispose()
     if async_read_engine is not async_engine:
@@ -0,0 +1,100 @@
+"""
+In-process cache of the access tokens authenticating API requests.
+
+Organization and personal access tokens are resolved on every API call.
+Once resolved, a detached snapshot of the token and its subject is cached by
+token hash, and merged into the session of the next requests without a query.
+
+Revoked tokens are evicted from the cache of every process through Redis pub/sub;
+other changes, like a blocked subject, are picked up after the TTL.
+"""
+
+import asyncio
+
+import structlog
+from redis import RedisError
+from sqlalchemy.orm import Session
+
+from polar.config import settings
+from polar.kit.cache import TTLCache
+from polar.kit.db.postgres import AsyncSession
+from polar.kit.utils import utc_now
+from polar.logging import Logger
+from polar.models import OrganizationAccessToken, PersonalAccessToken
+from polar.redis import Redis
+from polar.worker import enqueue_job
+
+log: Logger = structlog.get_logger()
+
+INVALIDATION_CHANNEL = "auth:token_cache:invalidate"
+
+type CachedToken = OrganizationAccessToken | PersonalAccessToken
+
+_cache = TTLCache[str, CachedToken](
+    ttl=settings.AUTH_TOKEN_CACHE_TTL, maxsize=settings.AUTH_TOKEN_CACHE_MAXSIZE
+)
+
+
+def _snapshot[T: CachedToken](token: T) -> T:
+    """
+    Detached copy of a token, and of its loaded relationships.
+
+    Unlike the token itself, it's safe to share between requests:
+    it doesn't belong to any session and never changes.
+    """
+    with Session() as snapshot_session:
+        return snapshot_session.merge(token, load=False)
+
+
+async def get_token[T: CachedToken](
+    session: AsyncSession, model: type[T], token_hash: str
+) -> T | None:
+    snapshot = _cache.get(token_hash)
+    if snapshot is None or not isinstance(snapshot, model):
+        return None
+
+    if snapshot.expires_at is not None and snapshot.expires_at <= utc_now():
+        _cache.pop(token_hash)
+        return None
+
+    return await session.merge(snapshot, load=False)
+
+
+def set_token(token_hash: str, token: CachedToken) -> None:
+    _cache.set(token_hash, _snapshot(token))
+
+
+def invalidate_token(token_hash: str) -> None:
+    """Evict a revoked token from the cache of every process."""
+    _cache.pop(token_hash)
+    # The eventstream task publishes raw messages on Redis channels
+    enqueue_job("eventstream.publish", token_hash, [INVALIDATION_CHANNEL])
+
+
+def clear() -> None:
+    _cache.clear()
+
+
+async def listen_invalidations(redis: Redis) -> None:
+    """Evict the tokens revoked by other processes, until cancelled."""
+    while True:
+        try:
+            async with redis.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        _cache.pop(message["data"])
+        except RedisError as e:
+            # Invalidations may have been missed while disconnected
+            log.warning("Token cache invalidations interrupted", error=str(e))
+            _cache.clear()
+            await asyncio.sleep(1)
+
+
+__all__ = [
+    "get_token",
+    "set_token",
+    "invalidate_token",
+    "clear",
+    "listen_invalidations",
+]
@@ -1,3 +1,5 @@
+from collections.abc import Awaitable, Callable
+
 import logfire
 import structlog
 from fastapi import Request
@@ -5,8 +7,10 @@ from fastapi.security.utils import get_authorization_scheme_param
 from starlette.types import ASGIApp, Receive, Send
 from starlette.types import Scope as ASGIScope
 
+from polar.config import settings
+from polar.customer_session.service import CUSTOMER_SESSION_TOKEN_PREFIX
 from polar.customer_session.service import customer_session as customer_session_service
-from polar.kit.utils import utc_now
+from polar.kit.crypto import get_token_hash
 from polar.logging import Logger
 from polar.models import (
     CustomerSession,
@@ -15,26 +19,36 @@ from polar.models import (
     PersonalAccessToken,
     UserSession,
 )
-from polar.oauth2.constants import is_registration_token_prefix
+from polar.oauth2.constants import ACCESS_TOKEN_PREFIX, is_registration_token_prefix
 from polar.oauth2.exception_handlers import OAuth2Error, oauth2_error_exception_handler
 from polar.oauth2.exceptions import InvalidTokenError
 from polar.oauth2.service.oauth2_token import oauth2_token as oauth2_token_service
+from polar.organization_access_token.service import (
+    TOKEN_PREFIX as ORGANIZATION_ACCESS_TOKEN_PREFIX,
+)
 from polar.organization_access_token.service import (
     organization_access_token as organization_access_token_service,
 )
+from polar.personal_access_token.service import (
+    TOKEN_PREFIX as PERSONAL_ACCESS_TOKEN_PREFIX,
+)
 from polar.personal_access_token.service import (
     personal_access_token as personal_access_token_service,
 )
 from polar.postgres import AsyncSession
 from polar.sentry import set_sentry_user
-from polar.worker._enqueue import enqueue_job
 
+from . import cache as auth_token_cache
 from .models import Anonymous, AuthSubject, Subject
 from .scope import Scope
 from .service import auth as auth_service
+from .usage import token_usage
 
 log: Logger = structlog.get_logger(__name__)
 
+# Common prefix of the tokens issued by Polar
+TOKEN_PREFIX = "polar_"
+
 
 async def get_user_session(
     request: Request, session: AsyncSession
@@ -59,30 +73,32 @@ async def get_oauth2_token(session: AsyncSession, value: str) -> OAuth2Token | N
 async def get_personal_access_token(
     session: AsyncSession, value: str
 ) -> PersonalAccessToken | None:
-    token = await personal_access_token_service.get_by_token(session, value)
-
-    if token is not None:
-        enqueue_job(
-            "personal_access_token.record_usage",
-            personal_access_token_id=token.id,
-            last_used_at=utc_now().timestamp(),
-        )
-
+    token_hash = get_token_hash(value, secret=settings.SECRET)
+    token = await auth_token_cache.get_token(session, PersonalAccessToken, token_hash)
+    if token is None:
+        token = await personal_access_token_service.get_by_token(session, value)
+        if token is None:
+            return None
+        auth_token_cache.set_token(token_hash, token)
+
+    token_usage.record(token)
     return token
 
 
 async def get_organization_access_token(
     session: AsyncSession, value: str
 ) -> OrganizationAccessToken | None:
-    token = await organization_access_token_service.get_by_token(session, value)
-
-    if token is not None:
-        enqueue_job(
-            "organization_access_token.record_usage",
-            organization_access_token_id=token.id,
-            last_used_at=utc_now().timestamp(),
-        )
-
+    token_hash = get_token_hash(value, secret=settings.SECRET)
+    token = await auth_token_cache.get_token(
+        session, OrganizationAccessToken, token_hash
+    )
+    if token is None:
+        token = await organization_access_token_service.get_by_token(session, value)
+        if token is None:
+            return None
+        auth_token_cache.set_token(token_hash, token)
+
+    token_usage.record(token)
     return token
 
 
@@ -92,6 +108,82 @@ async def get_customer_session(
     return await customer_session_service.get_by_token(session, value)
 
 
+async def _get_customer_session_subject(
+    session: AsyncSession, token: str
+) -> AuthSubject[Subject] | None:
+    customer_session = await get_customer_session(session, token)
+    if customer_session is None:
+        return None
+    return AuthSubject(
+        customer_session.customer, {Scope.customer_portal_write}, customer_session
+    )
+
+
+async def _get_organization_access_token_subject(
+    session: AsyncSession, token: str
+) -> AuthSubject[Subject] | None:
+    organization_access_token = await get_organization_access_token(session, token)
+    if organization_access_token is None:
+        return None
+    return AuthSubject(
+        organization_access_token.organization,
+        organization_access_token.scopes,
+        organization_access_token,
+    )
+
+
+async def _get_oauth2_token_subject(
+    session: AsyncSession, token: str
+) -> AuthSubject[Subject] | None:
+    oauth2_token = await get_oauth2_token(session, token)
+    if oauth2_token is None:
+        return None
+    return AuthSubject(oauth2_token.sub, oauth2_token.scopes, oauth2_token)
+
+
+async def _get_personal_access_token_subject(
+    session: AsyncSession, token: str
+) -> AuthSubject[Subject] | None:
+    personal_access_token = await get_personal_access_token(session, token)
+    if personal_access_token is None:
+        return None
+    return AuthSubject(
+        personal_access_token.user,
+        personal_access_token.scopes,
+        personal_access_token,
+    )
+
+
+type _SubjectGetter = Callable[
+    [AsyncSession, str], Awaitable[AuthSubject[Subject] | None]
+]
+
+# Each kind of token has its own prefix, so only its table is looked up
+_SUBJECT_GETTERS: dict[str, _SubjectGetter] = {
+    CUSTOMER_SESSION_TOKEN_PREFIX: _get_customer_session_subject,
+    ORGANIZATION_ACCESS_TOKEN_PREFIX: _get_organization_access_token_subject,
+    **dict.fromkeys(ACCESS_TOKEN_PREFIX.values(), _get_oauth2_token_subject),
+    PERSONAL_ACCESS_TOKEN_PREFIX: _get_personal_access_token_subject,
+}
+
+
+async def get_token_auth_subject(
+    session: AsyncSession, token: str
+) -> AuthSubject[Subject] | None:
+    for prefix, getter in _SUBJECT_GETTERS.items():
+        if token.startswith(prefix):
+            return await getter(session, token)
+
+    # Tokens issued before the prefixes were introduced
+    if not token.startswith(TOKEN_PREFIX):
+        for getter in dict.fromkeys(_SUBJECT_GETTERS.values()):
+            auth_subject = await getter(session, token)
+            if auth_subject is not None:
+                return auth_subject
+
+    return None
+
+
 async def get_auth_subject(
     request: Request, session: AsyncSession
 ) -> AuthSubject[Subject]:
@@ -100,35 +192,10 @@ async def get_auth_subject(
         if is_registration_token_prefix(token):
             return AuthSubject(Anonymous(), set(), None)
 
-        customer_session = await get_customer_session(session, token)
-        if customer_session:
-            return AuthSubject(
-                customer_session.customer,
-                {Scope.customer_portal_write},
-                customer_session,
-            )
-
-        organization_access_token = await get_organization_access_token(session, token)
-        if organization_access_token:
-            return AuthSubject(
-                organization_access_token.organization,
-                organization_access_token.scopes,
-                organization_access_token,
-            )
-
-        oauth2_token = await get_oauth2_token(session, token)
-        if oauth2_token:
-            return AuthSubject(oauth2_token.sub, oauth2_token.scopes, oauth2_token)
-
-        personal_access_token = await get_personal_access_token(session, token)
-        if personal_access_token:
-            return AuthSubject(
-                personal_access_token.user,
-                personal_access_token.scopes,
-                personal_access_token,
-            )
-
-        raise InvalidTokenError()
+        auth_subject = await get_token_auth_subject(session, token)
+        if auth_subject is None:
+            raise InvalidTokenError()
+        return auth_subject
 
     user_session = await get_user_session(request, session)
     if user_session is not None:
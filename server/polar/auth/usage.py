@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime
+from uuid import UUID
+
+import structlog
+
+from polar.config import settings
+from polar.kit.db.postgres import AsyncSessionMaker
+from polar.kit.utils import utc_now
+from polar.logging import Logger
+from polar.models import OrganizationAccessToken, PersonalAccessToken
+from polar.organization_access_token.repository import (
+    OrganizationAccessTokenRepository,
+)
+from polar.personal_access_token.service import (
+    personal_access_token as personal_access_token_service,
+)
+
+log: Logger = structlog.get_logger()
+
+
+class TokenUsageRecorder:
+    """
+    Buffer the last usage of the access tokens, and write it periodically,
+    in a single update per token type.
+
+    Saves a job and an update on every authenticated request.
+    """
+
+    def __init__(self) -> None:
+        self._organization_access_tokens: dict[UUID, datetime] = {}
+        self._personal_access_tokens: dict[UUID, datetime] = {}
+
+    def record(self, token: OrganizationAccessToken | PersonalAccessToken) -> None:
+        if isinstance(token, OrganizationAccessToken):
+            self._organization_access_tokens[token.id] = utc_now()
+        else:
+            self._personal_access_tokens[token.id] = utc_now()
+
+    async def flush(self, sessionmaker: AsyncSessionMaker) -> None:
+        organization_access_tokens = self._organization_access_tokens
+        personal_access_tokens = self._personal_access_tokens
+        self._organization_access_tokens = {}
+        self._personal_access_tokens = {}
+
+        if not organization_access_tokens and not personal_access_tokens:
+            return
+
+        async with sessionmaker() as session:
+            if organization_access_tokens:
+                repository = OrganizationAccessTokenRepository.from_session(session)
+                await repository.record_usages(organization_access_tokens)
+            if personal_access_tokens:
+                await personal_access_token_service.record_usages(
+                    session, personal_access_tokens
+                )
+            await session.commit()
+
+    async def run(self, sessionmaker: AsyncSessionMaker) -> None:
+        """Flush the usages periodically, until cancelled."""
+        interval = settings.AUTH_TOKEN_USAGE_FLUSH_INTERVAL.total_seconds()
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.flush(sessionmaker)
+                except Exception as e:
+                    # Usage is informative: don't stop flushing the next ones
+                    log.error("Failed to record token usages", error=str(e))
+        finally:
+            await self.flush(sessionmaker)
+
+
+token_usage = TokenUsageRecorder()
@@ -38,6 +38,7 @@ class BenefitLicenseKeysService(
 
         key = await license_key_service.customer_grant(
             self.session,
+            self.redis,
             customer=customer,
             benefit=benefit,
             license_key_id=current_lk_id,
@@ -77,6 +78,7 @@ class BenefitLicenseKeysService(
 
         await license_key_service.customer_revoke(
             self.session,
+            self.redis,
             customer=customer,
             benefit=benefit,
             license_key_id=UUID(license_key_id),
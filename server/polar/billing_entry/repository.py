@@ -2,7 +2,7 @@ from collections.abc import AsyncGenerator, Sequence
 from datetime import datetime
 from uuid import UUID
 
-from sqlalchemy import Select, func, update
+from sqlalchemy import FromClause, Select, func, insert, literal, select, update
 from sqlalchemy.orm.strategy_options import contains_eager
 
 from polar.config import settings
@@ -12,7 +12,9 @@ from polar.kit.repository import (
     RepositorySoftDeletionIDMixin,
     RepositorySoftDeletionMixin,
 )
+from polar.kit.utils import utc_now
 from polar.models import BillingEntry
+from polar.models.billing_entry import BillingEntryDirection, BillingEntryType
 from polar.models.product_price import ProductPrice, ProductPriceMeteredUnit
 
 
@@ -23,6 +25,54 @@ class BillingEntryRepository(
 ):
     model = BillingEntry
 
+    async def create_metered(self, events: FromClause, prices: FromClause) -> set[UUID]:
+        """
+        Create the metered billing entries of events in a single `INSERT ... SELECT`.
+
+        `events` has the columns `id`, `timestamp` and `customer_id`; `prices` has
+        the columns `customer_id`, `paying_customer_id`, `subscription_id`
+        and `product_price_id`. Events of customers without price are skipped.
+
+        Returns the IDs of the subscriptions having new entries.
+        """
+        inserted = (
+            insert(BillingEntry)
+            .from_select(
+                [
+                    BillingEntry.id,
+                    BillingEntry.created_at,
+                    BillingEntry.start_timestamp,
+                    BillingEntry.end_timestamp,
+                    BillingEntry.type,
+                    BillingEntry.direction,
+                    BillingEntry.customer_id,
+                    BillingEntry.product_price_id,
+                    BillingEntry.subscription_id,
+                    BillingEntry.event_id,
+                ],
+                select(
+                    func.gen_random_uuid(),
+                    literal(utc_now(), BillingEntry.created_at.type),
+                    events.c.timestamp,
+                    events.c.timestamp,
+                    literal(BillingEntryType.metered, BillingEntry.type.type),
+                    literal(BillingEntryDirection.debit, BillingEntry.direction.type),
+                    prices.c.paying_customer_id,
+                    prices.c.product_price_id,
+                    prices.c.subscription_id,
+                    events.c.id,
+                ).join(prices, onclause=prices.c.customer_id == events.c.customer_id),
+            )
+            .returning(BillingEntry.subscription_id)
+            .cte("inserted")
+        )
+        result = await self.session.execute(
+            select(inserted.c.subscription_id)
+            .where(inserted.c.subscription_id.is_not(None))
+            .distinct()
+        )
+        return set(result.scalars().all())
+
     async def update_order_item_id(
         self, billing_entries: Sequence[UUID], order_item_id: UUID
     ) -> None:
@@ -2008,6 +2008,7 @@ class CheckoutService:
         await webhook_service.send(
             session, organization, WebhookEventType.checkout_created, checkout
         )
+        enqueue_job("metrics.rollup_checkout", checkout.id)
 
     async def _after_checkout_updated(
         self, session: AsyncSession, checkout: Checkout
@@ -2015,6 +2016,7 @@ class CheckoutService:
         await publish_checkout_event(
             checkout.client_secret, CheckoutEvent.updated, {"status": checkout.status}
         )
+        enqueue_job("metrics.rollup_checkout", checkout.id)
         organization_repository = OrganizationRepository.from_session(session)
         organization = await organization_repository.get_by_id(
             checkout.product.organization_id
@@ -54,12 +54,59 @@ class Settings(BaseSettings):
     WORKER_HEALTH_CHECK_INTERVAL: timedelta = timedelta(seconds=30)
     WORKER_MAX_RETRIES: int = 20
     WORKER_MIN_BACKOFF_MILLISECONDS: int = 2_000
+    # Shared HTTP client of the worker, pooling connections across jobs
+    WORKER_HTTP_MAX_CONNECTIONS: int = 200
+    WORKER_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 100
+    WORKER_HTTP_KEEPALIVE_EXPIRY: timedelta = timedelta(seconds=60)
 
     WEBHOOK_MAX_RETRIES: int = 10
+    # Webhook events and deliveries are partitioned by day, and the partitions
+    # are dropped after the retention period
     WEBHOOK_EVENT_RETENTION_PERIOD: timedelta = timedelta(days=30)
+    # Daily partitions created in advance
+    WEBHOOK_PARTITIONS_PREMAKE: int = 7
+    # Concurrent deliveries to the same endpoint origin, per worker process
+    WEBHOOK_MAX_CONNECTIONS_PER_HOST: int = 10
+    WEBHOOK_ENDPOINTS_CACHE_TTL: timedelta = timedelta(seconds=10)
+    WEBHOOK_ENDPOINTS_CACHE_MAXSIZE: int = 10_000
+    # Delivery timeout: the maximum, and the minimum for fast endpoints,
+    # whose timeout is a multiple of their average latency
+    WEBHOOK_TIMEOUT: timedelta = timedelta(seconds=20)
+    WEBHOOK_MIN_TIMEOUT: timedelta = timedelta(seconds=10)
+    WEBHOOK_TIMEOUT_LATENCY_FACTOR: float = 5.0
+    # Latency an endpoint can absorb concurrently: slower endpoints
+    # get fewer concurrent deliveries, down to one
+    WEBHOOK_CONCURRENCY_LATENCY_BUDGET: timedelta = timedelta(seconds=2)
+    # Weight of the last delivery in the latency and error rate averages
+    WEBHOOK_HEALTH_EWMA_ALPHA: float = 0.2
+    # The circuit opens after this many consecutive failures,
+    # if the error rate average is above the threshold too
+    WEBHOOK_CIRCUIT_FAILURE_THRESHOLD: int = 10
+    WEBHOOK_CIRCUIT_ERROR_RATE_THRESHOLD: float = 0.5
+    # Time before probing an endpoint whose circuit is open
+    WEBHOOK_CIRCUIT_OPEN_DURATION: timedelta = timedelta(minutes=1)
+    # Events parked for longer than this, their endpoint still down, fail for good
+    WEBHOOK_MAX_PARK_DURATION: timedelta = timedelta(days=3)
 
     CUSTOMER_METER_UPDATE_DEBOUNCE_MIN_THRESHOLD: timedelta = timedelta(seconds=5)
     CUSTOMER_METER_UPDATE_DEBOUNCE_MAX_THRESHOLD: timedelta = timedelta(minutes=15)
+    # Customers already marked as dirty within this window are not written again
+    CUSTOMER_METER_DIRTY_DEBOUNCE: timedelta = timedelta(seconds=1)
+    # `job_store` schedules one job per customer through APScheduler;
+    # `claim` claims due customers by batches and shards them across replicas
+    CUSTOMER_METER_SCHEDULER_MODE: Literal["job_store", "claim"] = "job_store"
+    CUSTOMER_METER_SCHEDULER_SHARDS: int = 1
+    CUSTOMER_METER_SCHEDULER_SHARD: int = 0
+    CUSTOMER_METER_SCHEDULER_INTERVAL: timedelta = timedelta(seconds=1)
+    CUSTOMER_METER_SCHEDULER_CLAIM_BATCH_SIZE: int = 1000
+    CUSTOMER_METER_SCHEDULER_MAX_BATCHES: int = 10
+    CUSTOMER_METER_UPDATE_JOB_SIZE: int = 50
+    # Events are folded into the running meter balance state once ingested
+    # for this long, so it has to outlast ingestion transactions
+    CUSTOMER_METER_SETTLEMENT_DELAY: timedelta = timedelta(minutes=10)
+    # The running state is recomputed from scratch this often, as a backstop
+    # for the events committed even later than that
+    CUSTOMER_METER_FULL_RECOMPUTE_INTERVAL: timedelta = timedelta(days=1)
 
     SECRET: str = "super secret jwt secret"
     JWKS: JWKSFile = Field(default="./.jwks.json")
@@ -90,6 +137,11 @@ class Settings(BaseSettings):
     USER_SESSION_COOKIE_KEY: str = "polar_session"
     USER_SESSION_COOKIE_DOMAIN: str = "127.0.0.1"
 
+    # Organization and personal access tokens, cached by each API process
+    AUTH_TOKEN_CACHE_TTL: timedelta = timedelta(seconds=30)
+    AUTH_TOKEN_CACHE_MAXSIZE: int = 10_000
+    AUTH_TOKEN_USAGE_FLUSH_INTERVAL: timedelta = timedelta(seconds=30)
+
     # Customer session
     CUSTOMER_SESSION_TTL: timedelta = timedelta(hours=1)
     CUSTOMER_SESSION_CODE_TTL: timedelta = timedelta(minutes=30)
@@ -145,6 +197,11 @@ class Settings(BaseSettings):
         / "bin"
         / f"react-email-pkg{file_extension}"
     )
+    # Long-lived renderer processes kept by each API and worker process
+    EMAIL_RENDERER_POOL_SIZE: int = 2
+    EMAIL_RENDERER_TIMEOUT: timedelta = timedelta(seconds=10)
+    # Idle renderers are pinged before use after this delay
+    EMAIL_RENDERER_HEALTH_CHECK_INTERVAL: timedelta = timedelta(seconds=30)
     EMAIL_SENDER: EmailSender = EmailSender.logger
     RESEND_API_KEY: str = ""
     RESEND_API_BASE_URL: str = "https://api.resend.com"
@@ -220,6 +277,8 @@ class Settings(BaseSettings):
     AWS_SECRET_ACCESS_KEY: str = "polar123456789"
     AWS_REGION: str = "us-east-2"
     AWS_SIGNATURE_VERSION: str = "v4"
+    # Connections to S3 kept by each process, shared by all the buckets
+    S3_MAX_POOL_CONNECTIONS: int = 20
 
     # Downloadable files
     S3_FILES_BUCKET_NAME: str = "polar-s3"
@@ -236,6 +295,8 @@ class Settings(BaseSettings):
     # Invoices
     S3_CUSTOMER_INVOICES_BUCKET_NAME: str = "polar-customer-invoices"
     S3_PAYOUT_INVOICES_BUCKET_NAME: str = "polar-payout-invoices"
+    # Processes generating the invoices PDF, in each worker process
+    INVOICES_PROCESS_POOL_SIZE: int = 2
     INVOICES_NAME: str = "Polar Software, Inc."
     INVOICES_ADDRESS: Address = Address(
         line1="548 Market St",
@@ -291,6 +352,34 @@ class Settings(BaseSettings):
 
     ORGANIZATIONS_BILLING_ENGINE_DEFAULT: bool = True
 
+    # Metrics
+    # Read closed hours from the `metrics_rollups` table instead of the raw tables.
+    # Only enable it once the rollups have been backfilled.
+    METRICS_ROLLUPS_ENABLED: bool = False
+    # Expiration of cached metrics periods. Entries are invalidated before
+    # whenever the organization's data change or the open bucket rolls over.
+    METRICS_CACHE_TTL: timedelta = timedelta(days=7)
+
+    # License keys
+    # Expiration of the validation counters kept in Redis since the last validation.
+    # They're flushed to the database every minute, so it only has to be larger.
+    LICENSE_KEY_COUNTERS_TTL: timedelta = timedelta(days=1)
+    # Expiration of the cached license keys served to validations. Entries are
+    # invalidated before on changes; it bounds the staleness of their customer.
+    # Must stay below the counters TTL, as cached usage may seed the counters.
+    LICENSE_KEY_CACHE_TTL: timedelta = timedelta(minutes=10)
+
+    # Events
+    # Number of lines validated and copied at once by the NDJSON ingestion endpoint.
+    EVENTS_INGEST_STREAM_CHUNK_SIZE: int = 1000
+
+    # Meters
+    # Create a partial expression index on `events` for each metadata key
+    # compared by a meter filter, when the meter is created or updated.
+    METER_METADATA_INDEXES_ENABLED: bool = False
+    # Maximum number of events billed by a single `meter.billing_range` job
+    METER_BILLING_RANGE_SIZE: int = 50_000
+
     # Dunning Configuration
     DUNNING_RETRY_INTERVALS: list[timedelta] = [
         timedelta(days=2),  # First retry after 2 days
@@ -119,28 +119,33 @@ async def export(
         )
 
         repository = CustomerRepository.from_session(session)
-        stream = repository.stream_by_organization(auth_subject, organization_id)
-
-        async for customer in stream:
-            billing_address = customer.billing_address
-
+        stream = repository.stream_export(auth_subject, organization_id)
+
+        async for (
+            id,
+            external_id,
+            created_at,
+            email,
+            name,
+            tax_id,
+            billing_address,
+            user_metadata,
+        ) in stream:
             yield csv_writer.getrow(
                 (
-                    customer.id,
-                    customer.external_id,
-                    customer.created_at.isoformat(),
-                    customer.email,
-                    customer.name,
-                    customer.tax_id,
+                    id,
+                    external_id,
+                    created_at.isoformat(),
+                    email,
+                    name,
+                    tax_id,
                     billing_address.line1 if billing_address else None,
                     billing_address.line2 if billing_address else None,
                     billing_address.city if billing_address else None,
                     billing_address.state if billing_address else None,
                     billing_address.postal_code if billing_address else None,
                     billing_address.country if billing_address else None,
-                    json.dumps(customer.user_metadata)
-                    if customer.user_metadata
-                    else None,
+                    json.dumps(user_metadata) if user_metadata else None,
                 )
             )
 
@@ -1,19 +1,23 @@
 import contextlib
 from collections.abc import AsyncGenerator, Iterable, Sequence
+from datetime import datetime, timedelta
 from typing import Any
 from uuid import UUID
 
-from sqlalchemy import Select, func, select, update
+from sqlalchemy import Select, and_, func, or_, select, union, update
 
 from polar.auth.models import AuthSubject, Organization, User, is_organization, is_user
+from polar.config import settings
+from polar.kit.address import Address
 from polar.kit.repository import (
     Options,
     RepositoryBase,
     RepositorySoftDeletionIDMixin,
     RepositorySoftDeletionMixin,
 )
+from polar.kit.tax import TaxID
 from polar.kit.utils import utc_now
-from polar.models import Customer, UserOrganization
+from polar.models import Customer, Event, UserOrganization
 from polar.models.webhook_endpoint import WebhookEventType
 from polar.worker import enqueue_job
 
@@ -74,13 +78,47 @@ class CustomerRepository(
         enqueue_job("customer.webhook", WebhookEventType.customer_deleted, customer.id)
         return customer
 
-    async def touch_meters(self, customers: Iterable[Customer]) -> None:
+    async def touch_meters_by_events(
+        self, event_ids: Sequence[UUID], *, debounce: timedelta
+    ) -> int:
+        """
+        Mark the customers of the given events as having dirty meters.
+
+        Customers are resolved in SQL, either by ID or by external ID, so no event
+        is loaded. Customers already marked within the `debounce` window are
+        skipped: they're already waiting for a meter update.
+
+        Returns the number of customers marked.
+        """
+        customer_ids = union(
+            select(Event.customer_id).where(
+                Event.id.in_(event_ids), Event.customer_id.is_not(None)
+            ),
+            select(Customer.id)
+            .join(
+                Event,
+                onclause=and_(
+                    Event.external_customer_id == Customer.external_id,
+                    Event.organization_id == Customer.organization_id,
+                ),
+            )
+            .where(Event.id.in_(event_ids)),
+        )
+        now = utc_now()
         statement = (
             update(Customer)
-            .where(Customer.id.in_([c.id for c in customers]))
-            .values(meters_dirtied_at=utc_now())
+            .where(
+                Customer.id.in_(customer_ids),
+                or_(
+                    Customer.meters_dirtied_at.is_(None),
+                    Customer.meters_dirtied_at < now - debounce,
+                ),
+            )
+            .values(meters_dirtied_at=now)
+            .execution_options(synchronize_session="fetch")
         )
-        await self.session.execute(statement)
+        result = await self.session.execute(statement)
+        return result.rowcount
 
     async def set_meters_updated_at(self, customers: Iterable[Customer]) -> None:
         statement = (
@@ -125,20 +163,53 @@ class CustomerRepository(
         )
         return await self.get_one_or_none(statement)
 
-    async def stream_by_organization(
+    async def stream_export(
         self,
         auth_subject: AuthSubject[User | Organization],
         organization_id: Sequence[UUID] | None,
-    ) -> AsyncGenerator[Customer]:
-        statement = self.get_readable_statement(auth_subject)
+    ) -> AsyncGenerator[
+        tuple[
+            UUID,
+            str | None,
+            datetime,
+            str,
+            str | None,
+            TaxID | None,
+            Address | None,
+            dict[str, Any],
+        ]
+    ]:
+        """
+        Stream the columns of the customers CSV export, with a server-side cursor.
+
+        Only plain rows are fetched, so memory usage doesn't depend
+        on the number of customers.
+        """
+        statement = self.get_readable_statement(auth_subject).with_only_columns(
+            Customer.id,
+            Customer.external_id,
+            Customer.created_at,
+            Customer.email,
+            Customer.name,
+            Customer.tax_id,
+            Customer.billing_address,
+            Customer.user_metadata,
+        )
 
         if organization_id is not None:
             statement = statement.where(
                 Customer.organization_id.in_(organization_id),
             )
 
-        async for customer in self.stream(statement):
-            yield customer
+        results = await self.session.stream(
+            statement,
+            execution_options={"yield_per": settings.DATABASE_STREAM_YIELD_PER},
+        )
+        try:
+            async for result in results:
+                yield result._tuple()
+        finally:
+            await results.close()
 
     async def get_readable_by_id(
         self,
@@ -1,13 +1,19 @@
 import datetime
+import itertools
 import uuid
+from collections.abc import Sequence
 from operator import or_
+from typing import cast
 
 import dramatiq
+import logfire
 import structlog
 from apscheduler.job import Job
 from apscheduler.jobstores.base import BaseJobStore
 from apscheduler.triggers.date import DateTrigger
-from sqlalchemy import Select, func, select, update
+from dramatiq.brokers.redis import RedisBroker
+from sqlalchemy import ColumnElement, Select, String, func, select, true, update
+from sqlalchemy import cast as sql_cast
 from sqlalchemy.orm import Session
 
 from polar.config import settings
@@ -16,12 +22,45 @@ from polar.logging import Logger
 from polar.models import Customer
 from polar.postgres import create_sync_engine
 
+backlog_depth = logfire.metric_gauge(
+    "customer_meter.scheduler.backlog",
+    unit="1",
+    description="Number of customers waiting for a meter update.",
+)
+oldest_dirty_age = logfire.metric_gauge(
+    "customer_meter.scheduler.oldest_dirty_age",
+    unit="s",
+    description="Time since the oldest pending customer meter update was requested.",
+)
+
 
 def enqueue_update_customer(customer_id: uuid.UUID) -> None:
     actor = dramatiq.get_broker().get_actor("customer_meter.update_customer")
     actor.send(customer_id=customer_id)
 
 
+def enqueue_update_customers(customer_ids: Sequence[uuid.UUID]) -> None:
+    """
+    Enqueue `customer_meter.update_customers` jobs for the customers,
+    in a single Redis round-trip.
+    """
+    broker = cast(RedisBroker, dramatiq.get_broker())
+    actor = broker.get_actor("customer_meter.update_customers")
+    pipeline = broker.client.pipeline(transaction=False)
+    for batch in itertools.batched(
+        customer_ids, settings.CUSTOMER_METER_UPDATE_JOB_SIZE
+    ):
+        redis_message_id = str(uuid.uuid4())
+        message = actor.message_with_options(
+            args=(list(batch),), redis_message_id=redis_message_id
+        )
+        pipeline.hset(
+            f"dramatiq:{message.queue_name}.msgs", redis_message_id, message.encode()
+        )
+        pipeline.rpush(f"dramatiq:{message.queue_name}", redis_message_id)
+    pipeline.execute()
+
+
 class CustomerMeterJobStore(BaseJobStore):
     """
     A custom job store for APScheduler that creates jobs for customers that
@@ -147,3 +186,90 @@ class CustomerMeterJobStore(BaseJobStore):
                 job = Job(self._scheduler, **job_kwargs)
                 jobs.append(job)
         return jobs
+
+
+class CustomerMeterClaimer:
+    """
+    Claim the customers due for a meter update by batches,
+    and enqueue batched update jobs for them.
+
+    Claiming uses `FOR UPDATE SKIP LOCKED`, so several scheduler replicas can
+    run concurrently. Each replica only considers its own shard of customers,
+    so they don't contend on the same rows.
+    """
+
+    def __init__(
+        self,
+        shard: int = settings.CUSTOMER_METER_SCHEDULER_SHARD,
+        shards: int = settings.CUSTOMER_METER_SCHEDULER_SHARDS,
+    ) -> None:
+        self.engine = create_sync_engine("scheduler")
+        self.shard = shard
+        self.shards = shards
+        self.log: Logger = structlog.get_logger()
+
+    def shutdown(self) -> None:
+        self.engine.dispose()
+
+    def __call__(self) -> None:
+        now = utc_now()
+        claimed = 0
+        for _ in range(settings.CUSTOMER_METER_SCHEDULER_MAX_BATCHES):
+            customer_ids = self._claim_batch(now)
+            claimed += len(customer_ids)
+            if len(customer_ids) < settings.CUSTOMER_METER_SCHEDULER_CLAIM_BATCH_SIZE:
+                break
+        self.log.debug("Claimed customers", count=claimed, shard=self.shard)
+        self._record_backlog(now)
+
+    def _claim_batch(self, now: datetime.datetime) -> Sequence[uuid.UUID]:
+        statement = (
+            select(Customer.id)
+            .where(
+                self._get_shard_clause(),
+                Customer.meters_dirtied_at.is_not(None),
+                or_(
+                    Customer.meters_dirtied_at
+                    < now - settings.CUSTOMER_METER_UPDATE_DEBOUNCE_MIN_THRESHOLD,
+                    Customer.meters_dirtied_at
+                    > func.coalesce(Customer.meters_updated_at, Customer.created_at)
+                    + settings.CUSTOMER_METER_UPDATE_DEBOUNCE_MAX_THRESHOLD,
+                ),
+            )
+            .order_by(Customer.meters_dirtied_at.asc())
+            .limit(settings.CUSTOMER_METER_SCHEDULER_CLAIM_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        with self.engine.begin() as connection:
+            customer_ids = connection.execute(statement).scalars().all()
+            if customer_ids:
+                # Enqueue before releasing the claim: if it fails, the customers
+                # stay dirty and are claimed again on the next run
+                enqueue_update_customers(customer_ids)
+                connection.execute(
+                    update(Customer)
+                    .where(Customer.id.in_(customer_ids))
+                    .values(meters_dirtied_at=None)
+                )
+        return customer_ids
+
+    def _record_backlog(self, now: datetime.datetime) -> None:
+        statement = select(func.count(), func.min(Customer.meters_dirtied_at)).where(
+            self._get_shard_clause(), Customer.meters_dirtied_at.is_not(None)
+        )
+        with self.engine.connect() as connection:
+            count, oldest_dirtied_at = connection.execute(statement).one()._tuple()
+        backlog_depth.set(count)
+        oldest_dirty_age.set(
+            (now - oldest_dirtied_at).total_seconds()
+            if oldest_dirtied_at is not None
+            else 0
+        )
+
+    def _get_shard_clause(self) -> ColumnElement[bool]:
+        if self.shards <= 1:
+            return true()
+        return (
+            func.abs(func.hashtext(sql_cast(Customer.id, String))) % self.shards
+            == self.shard
+        )
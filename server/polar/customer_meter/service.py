@@ -1,5 +1,8 @@
+import hashlib
+import json
 import uuid
 from collections.abc import Sequence
+from datetime import datetime
 from decimal import Decimal
 
 from sqlalchemy import Select, or_
@@ -7,12 +10,15 @@ from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.strategy_options import contains_eager
 
 from polar.auth.models import AuthSubject, Organization, User
+from polar.config import settings
 from polar.customer.repository import CustomerRepository
 from polar.event.repository import EventRepository
 from polar.kit.math import non_negative_running_sum
 from polar.kit.pagination import PaginationParams
 from polar.kit.sorting import Sorting
+from polar.kit.utils import utc_now
 from polar.locker import Locker
+from polar.meter.aggregation import AggregationState, merge_aggregation_states
 from polar.meter.repository import MeterRepository
 from polar.meter.service import meter as meter_service
 from polar.models import Customer, CustomerMeter, Event, Meter
@@ -118,8 +124,11 @@ class CustomerMeterService:
             )
 
             event_repository = EventRepository.from_session(session)
-            events_statement = await self._get_current_window_events_statement(
-                session, customer, meter
+            meter_reset_event = await event_repository.get_latest_meter_reset(
+                customer, meter.id
+            )
+            events_statement = self._get_window_events_statement(
+                event_repository, customer, meter, meter_reset_event
             )
             last_event = await event_repository.get_one_or_none(
                 events_statement.order_by(None)
@@ -135,31 +144,129 @@ class CustomerMeterService:
                     CustomerMeter(customer=customer, meter=meter)
                 )
 
-            if customer_meter.last_balanced_event_id == last_event.id:
+            # Events are folded into the running aggregation state once settled:
+            # concurrent or long ingestions may commit events after others
+            # ingested later. Newer events are applied on top of it each time.
+            now = utc_now()
+            window = _get_window_key(meter, meter_reset_event)
+            state = customer_meter.aggregation_state
+            aggregation_state: AggregationState
+            cursor: datetime | None
+            if (
+                state is not None
+                and state["window"] == window
+                and "computed_at" in state
+                and datetime.fromisoformat(state["computed_at"])
+                > now - settings.CUSTOMER_METER_FULL_RECOMPUTE_INTERVAL
+            ):
+                aggregation_state = state["aggregation"]
+                credited_units = state["credited_units"]
+                cursor = datetime.fromisoformat(state["cursor"])
+                computed_at = datetime.fromisoformat(state["computed_at"])
+            else:
+                aggregation_state = {
+                    "events": 0,
+                    "sum": None,
+                    "min": None,
+                    "max": None,
+                    "values": None,
+                }
+                credited_units = 0
+                cursor = None
+                computed_at = now
+
+            if (
+                customer_meter.last_balanced_event_id == last_event.id
+                and cursor is not None
+                and cursor >= last_event.ingested_at
+            ):
                 return customer_meter, False
 
-            usage_events_statement = events_statement.with_only_columns(Event.id).where(
-                Event.source == EventSource.user
+            settled_at = min(
+                last_event.ingested_at, now - settings.CUSTOMER_METER_SETTLEMENT_DELAY
             )
-            usage_units = await meter_service.get_quantity(
-                session, meter, usage_events_statement
+            if cursor is None or settled_at > cursor:
+                aggregation_state, credited_units = await self._aggregate(
+                    session,
+                    meter,
+                    events_statement,
+                    cursor,
+                    settled_at,
+                    aggregation_state,
+                    credited_units,
+                )
+                cursor = settled_at
+            customer_meter.aggregation_state = {
+                "window": window,
+                "cursor": cursor.isoformat(),
+                "computed_at": computed_at.isoformat(),
+                "aggregation": aggregation_state,
+                "credited_units": credited_units,
+            }
+
+            aggregation_state, credited_units = await self._aggregate(
+                session,
+                meter,
+                events_statement,
+                cursor,
+                last_event.ingested_at,
+                aggregation_state,
+                credited_units,
             )
-            customer_meter.consumed_units = Decimal(usage_units)
-
-            credit_events_statement = events_statement.where(
-                Event.is_meter_credit.is_(True)
+            consumed_units = Decimal(
+                meter.aggregation.get_state_value(aggregation_state)
             )
-            credit_events = await event_repository.get_all(credit_events_statement)
-            credited_units = non_negative_running_sum(
-                event.user_metadata["units"] for event in credit_events
+            updated = (
+                customer_meter.last_balanced_event_id != last_event.id
+                or customer_meter.consumed_units != consumed_units
+                or customer_meter.credited_units != credited_units
             )
+            customer_meter.consumed_units = consumed_units
             customer_meter.credited_units = credited_units
             customer_meter.balance = (
                 customer_meter.credited_units - customer_meter.consumed_units
             )
             customer_meter.last_balanced_event = last_event
 
-            return await repository.update(customer_meter), True
+            return await repository.update(customer_meter), updated
+
+    async def _aggregate(
+        self,
+        session: AsyncSession,
+        meter: Meter,
+        events_statement: Select[tuple[Event]],
+        start: datetime | None,
+        end: datetime,
+        aggregation_state: AggregationState,
+        credited_units: int,
+    ) -> tuple[AggregationState, int]:
+        """
+        Apply the events ingested after `start` and up to `end`
+        to an aggregation state and credited units.
+        """
+        if start is not None:
+            if start >= end:
+                return aggregation_state, credited_units
+            events_statement = events_statement.where(Event.ingested_at > start)
+        events_statement = events_statement.where(Event.ingested_at <= end)
+
+        usage_events_statement = events_statement.with_only_columns(Event.id).where(
+            Event.source == EventSource.user
+        )
+        aggregation_state = merge_aggregation_states(
+            aggregation_state,
+            await meter_service.get_aggregation_state(
+                session, meter, usage_events_statement
+            ),
+        )
+
+        credit_units_statement = events_statement.with_only_columns(
+            Event.user_metadata["units"].as_integer()
+        ).where(Event.is_meter_credit.is_(True))
+        credit_units = await session.scalars(credit_units_statement)
+        credited_units = non_negative_running_sum(iter(credit_units), credited_units)
+
+        return aggregation_state, credited_units
 
     async def get_rollover_units(
         self, session: AsyncSession, customer: Customer, meter: Meter
@@ -207,6 +314,17 @@ class CustomerMeterService:
         meter_reset_event = await event_repository.get_latest_meter_reset(
             customer, meter.id
         )
+        return self._get_window_events_statement(
+            event_repository, customer, meter, meter_reset_event
+        )
+
+    def _get_window_events_statement(
+        self,
+        event_repository: EventRepository,
+        customer: Customer,
+        meter: Meter,
+        meter_reset_event: Event | None,
+    ) -> Select[tuple[Event]]:
         statement = (
             event_repository.get_base_statement()
             .where(
@@ -229,4 +347,20 @@ class CustomerMeterService:
         return statement
 
 
+def _get_window_key(meter: Meter, meter_reset_event: Event | None) -> str:
+    """
+    Identify the meter definition and the window the aggregation state
+    was computed for: if any of them changes, the state is stale.
+    """
+    payload = json.dumps(
+        {
+            "filter": meter.filter.model_dump(mode="json"),
+            "aggregation": meter.aggregation.model_dump(mode="json"),
+            "reset": str(meter_reset_event.id) if meter_reset_event else None,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
 customer_meter = CustomerMeterService()
@@ -1,12 +1,24 @@
 import uuid
+from collections.abc import Sequence
+
+import structlog
 
 from polar.customer.repository import CustomerRepository
 from polar.exceptions import PolarTaskError
-from polar.locker import Locker
-from polar.worker import AsyncSessionMaker, RedisMiddleware, TaskPriority, actor
+from polar.locker import Locker, TimeoutLockError
+from polar.logging import Logger
+from polar.worker import (
+    AsyncSessionMaker,
+    RedisMiddleware,
+    TaskPriority,
+    actor,
+    enqueue_job,
+)
 
 from .service import customer_meter as customer_meter_service
 
+log: Logger = structlog.get_logger()
+
 
 class CustomerMeterTaskError(PolarTaskError): ...
 
@@ -35,3 +47,41 @@ async def update_customer(customer_id: uuid.UUID) -> None:
         locker = Locker(redis)
 
         await customer_meter_service.update_customer(session, locker, customer)
+
+
+@actor(
+    actor_name="customer_meter.update_customers",
+    priority=TaskPriority.LOW,
+    max_retries=1,
+    min_backoff=30_000,
+)
+async def update_customers(customer_ids: Sequence[uuid.UUID]) -> None:
+    redis = RedisMiddleware.get()
+    locker = Locker(redis)
+
+    for customer_id in customer_ids:
+        # One transaction per customer, so they don't hold each other back
+        try:
+            async with AsyncSessionMaker() as session:
+                repository = CustomerRepository.from_session(session)
+                customer = await repository.get_by_id(customer_id)
+                if customer is None:
+                    log.info("Customer does not exist anymore", customer_id=customer_id)
+                    continue
+
+                try:
+                    await customer_meter_service.update_customer(
+                        session, locker, customer
+                    )
+                except TimeoutLockError:
+                    # Being updated concurrently: retry it on its own
+                    enqueue_job("customer_meter.update_customer", customer_id)
+        except Exception:
+            # The batch was claimed: don't let one customer leave the others
+            # with stale meters, and retry it on its own
+            log.error(
+                "Failed to update customer meters",
+                customer_id=customer_id,
+                exc_info=True,
+            )
+            enqueue_job("customer_meter.update_customer", customer_id)
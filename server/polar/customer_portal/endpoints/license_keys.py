@@ -11,6 +11,7 @@ from polar.exceptions import ResourceNotFound
 from polar.kit.db.postgres import AsyncSession
 from polar.kit.pagination import ListResource, PaginationParamsQuery
 from polar.kit.schemas import MultipleQueryFilter
+from polar.license_key import counters as license_key_counters
 from polar.license_key.schemas import (
     ActivationNotPermitted,
     LicenseKeyActivate,
@@ -28,6 +29,7 @@ from polar.models import LicenseKey, LicenseKeyActivation
 from polar.openapi import APITag
 from polar.organization.schemas import OrganizationID
 from polar.postgres import get_db_session
+from polar.redis import Redis, get_redis
 from polar.routing import APIRouter
 
 from .. import auth
@@ -54,6 +56,7 @@ async def list(
         None, description="Filter by a specific benefit"
     ),
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
 ) -> ListResource[LicenseKeyRead]:
     results, count = await license_key_service.get_customer_list(
         session,
@@ -62,6 +65,7 @@ async def list(
         benefit_id=benefit_id,
         pagination=pagination,
     )
+    await license_key_counters.load(redis, results)
 
     return ListResource.from_paginated_results(
         [LicenseKeyRead.model_validate(result) for result in results],
@@ -80,12 +84,15 @@ async def get(
     auth_subject: auth.CustomerPortalRead,
     id: UUID4,
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
 ) -> LicenseKeyWithActivations:
     """Get a license key."""
     lk = await license_key_service.get_customer_license_key(session, auth_subject, id)
     if not lk:
         raise ResourceNotFound()
 
+    await license_key_counters.load(redis, [lk])
+
     ret = LicenseKeyWithActivations.model_validate(lk)
     properties = cast(BenefitLicenseKeysProperties, lk.benefit.properties)
     activations = properties.get("activations")
@@ -106,6 +113,7 @@ async def get(
 async def validate(
     validate: LicenseKeyValidate,
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
 ) -> LicenseKey:
     """
      Validate a license key.
@@ -115,13 +123,14 @@ async def validate(
     > If you plan to validate a license key on a server, use the `/v1/license-keys/validate`
     > endpoint instead.
     """
-    license_key = await license_key_service.get_or_raise_by_key(
+    license_key = await license_key_service.get_cached_or_raise_by_key(
         session,
+        redis,
         organization_id=validate.organization_id,
         key=validate.key,
     )
     return await license_key_service.validate(
-        session, license_key=license_key, validate=validate
+        session, redis, license_key=license_key, validate=validate
     )
 
 
@@ -137,6 +146,7 @@ async def validate(
 async def activate(
     activate: LicenseKeyActivate,
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
 ) -> LicenseKeyActivation:
     """
     Activate a license key instance.
@@ -152,7 +162,7 @@ async def activate(
         key=activate.key,
     )
     return await license_key_service.activate(
-        session, license_key=lk, activate=activate
+        session, redis, license_key=lk, activate=activate
     )
 
 
@@ -168,6 +178,7 @@ async def activate(
 async def deactivate(
     deactivate: LicenseKeyDeactivate,
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
 ) -> None:
     """
     Deactivate a license key instance.
@@ -182,4 +193,6 @@ async def deactivate(
         organization_id=deactivate.organization_id,
         key=deactivate.key,
     )
-    await license_key_service.deactivate(session, license_key=lk, deactivate=deactivate)
+    await license_key_service.deactivate(
+        session, redis, license_key=lk, deactivate=deactivate
+    )
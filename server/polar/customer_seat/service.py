@@ -254,7 +254,7 @@ class SeatService:
         organization_repository = OrganizationRepository.from_session(session)
         organization = await organization_repository.get_by_id(organization_id)
         if organization:
-            send_seat_invitation_email(
+            await send_seat_invitation_email(
                 customer_email=customer.email,
                 seat=seat,
                 organization=organization,
@@ -532,7 +532,7 @@ class SeatService:
         organization_repository = OrganizationRepository.from_session(session)
         organization = await organization_repository.get_by_id(organization_id)
         if organization:
-            send_seat_invitation_email(
+            await send_seat_invitation_email(
                 customer_email=seat.customer.email,
                 seat=seat,
                 organization=organization,
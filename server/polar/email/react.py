@@ -1,26 +1,236 @@
-import subprocess
-from typing import TYPE_CHECKING
+"""
+Rendering of the email templates, by the React Email renderer binary.
+
+Spawning the renderer, and booting its JS runtime, takes far longer than
+rendering an email. The API and the worker processes therefore keep a pool
+of long-lived renderers, speaking line-delimited JSON over stdin/stdout.
+Elsewhere, like in scripts and tests, each email is rendered by a one-off
+renderer process.
+"""
+
+import asyncio
+import itertools
+import json
+import time
+from collections.abc import Sequence
+from typing import TYPE_CHECKING, Any
+
+import structlog
 
 from polar.config import settings
+from polar.exceptions import PolarError
+from polar.logging import Logger
 
 if TYPE_CHECKING:
     from .schemas import Email
 
+log: Logger = structlog.get_logger()
+
+# Rendered emails are written on a single line
+_STREAM_LIMIT = 16 * 1024 * 1024
+
+
+class EmailRendererError(PolarError): ...
+
+
+def _get_command() -> list[str]:
+    return [str(settings.EMAIL_RENDERER_BINARY_PATH), "--server"]
+
+
+class _Renderer:
+    """A long-lived renderer process, rendering one email at a time."""
+
+    def __init__(self, process: asyncio.subprocess.Process) -> None:
+        self.process = process
+        self.last_used_at = time.monotonic()
+        self._ids = itertools.count()
+
+    @classmethod
+    async def spawn(cls, command: Sequence[str]) -> "_Renderer":
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=_STREAM_LIMIT,
+        )
+        return cls(process)
+
+    async def request(self, payload: dict[str, Any]) -> dict[str, Any]:
+        stdin, stdout = self.process.stdin, self.process.stdout
+        assert stdin is not None and stdout is not None
+
+        request_id = next(self._ids)
+        stdin.write(json.dumps({"id": request_id, **payload}).encode() + b"\n")
+        await stdin.drain()
+
+        line = await stdout.readline()
+        if not line:
+            raise EmailRendererError("Email renderer exited unexpectedly.")
+        response: dict[str, Any] = json.loads(line)
+        if response.get("id") != request_id:
+            raise EmailRendererError("Email renderer sent an unexpected response.")
+
+        self.last_used_at = time.monotonic()
+        return response
+
+    async def is_healthy(self) -> bool:
+        if self.process.returncode is not None:
+            return False
+
+        interval = settings.EMAIL_RENDERER_HEALTH_CHECK_INTERVAL.total_seconds()
+        if time.monotonic() - self.last_used_at < interval:
+            return True
+
+        try:
+            async with asyncio.timeout(settings.EMAIL_RENDERER_TIMEOUT.total_seconds()):
+                response = await self.request({"ping": True})
+        except (TimeoutError, OSError, ValueError, EmailRendererError):
+            return False
+        return response.get("pong") is True
+
+    def kill(self) -> None:
+        if self.process.returncode is None:
+            self.process.kill()
+
+    async def close(self) -> None:
+        if self.process.returncode is not None:
+            return
+        assert self.process.stdin is not None
+        # The renderer exits once its stdin is closed
+        self.process.stdin.close()
+        try:
+            async with asyncio.timeout(settings.EMAIL_RENDERER_TIMEOUT.total_seconds()):
+                await self.process.wait()
+        except TimeoutError:
+            self.kill()
+            await self.process.wait()
 
-def render_email_template(email: "Email") -> str:
-    process = subprocess.Popen(
-        [
-            settings.EMAIL_RENDERER_BINARY_PATH,
-            email.template,
-            email.props.model_dump_json(),
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+
+class EmailRendererPool:
+    """
+    Pool of long-lived renderer processes.
+
+    Each renderer handles one email at a time: when they're all busy,
+    renders wait for one to be released, instead of piling up processes.
+
+    A renderer is replaced when it crashes, times out or fails its health
+    check, which it's put through before being used after a while idle.
+    """
+
+    def __init__(self, size: int, command: Sequence[str] | None = None) -> None:
+        self.size = size
+        self.command = command if command is not None else _get_command()
+        # Slots of the pool: `None` when the renderer has to be spawned
+        self._renderers: asyncio.Queue[_Renderer | None] = asyncio.Queue()
+        self._closed = False
+
+    async def start(self) -> None:
+        renderers = await asyncio.gather(
+            *(_Renderer.spawn(self.command) for _ in range(self.size))
+        )
+        for renderer in renderers:
+            self._renderers.put_nowait(renderer)
+        log.info("Started email renderers", size=self.size)
+
+    async def close(self) -> None:
+        self._closed = True
+        renderers: list[_Renderer] = []
+        while not self._renderers.empty():
+            renderer = self._renderers.get_nowait()
+            if renderer is not None:
+                renderers.append(renderer)
+        await asyncio.gather(*(renderer.close() for renderer in renderers))
+        log.info("Closed email renderers")
+
+    async def render(self, template: str, props: dict[str, Any]) -> str:
+        if self._closed:
+            raise EmailRendererError("Email renderer pool is closed.")
+
+        renderer = await self._renderers.get()
+        try:
+            if renderer is None or not await renderer.is_healthy():
+                if renderer is not None:
+                    log.warning(
+                        "Replacing unhealthy email renderer",
+                        pid=renderer.process.pid,
+                    )
+                    renderer.kill()
+                renderer = None
+                renderer = await _Renderer.spawn(self.command)
+
+            async with asyncio.timeout(settings.EMAIL_RENDERER_TIMEOUT.total_seconds()):
+                response = await renderer.request(
+                    {"template": template, "props": props}
+                )
+        except BaseException as e:
+            # Crashed, timed out or cancelled mid-response: its state is unknown
+            if renderer is not None:
+                renderer.kill()
+            renderer = None
+            if isinstance(e, TimeoutError):
+                raise EmailRendererError("Email renderer timed out.") from e
+            raise
+        finally:
+            if self._closed and renderer is not None:
+                renderer.kill()
+            else:
+                self._renderers.put_nowait(renderer)
+
+        if "error" in response:
+            raise EmailRendererError(
+                f"Error in react-email process: {response['error']}"
+            )
+        html: str = response["html"]
+        return html
+
+
+_pool: EmailRendererPool | None = None
+
+
+async def start_pool(size: int | None = None) -> None:
+    global _pool
+    pool = EmailRendererPool(
+        size if size is not None else settings.EMAIL_RENDERER_POOL_SIZE
+    )
+    await pool.start()
+    _pool = pool
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def _render_once(template: str, props_json: str) -> str:
+    process = await asyncio.create_subprocess_exec(
+        settings.EMAIL_RENDERER_BINARY_PATH,
+        template,
+        props_json,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
     )
-    stdout, stderr = process.communicate()
+    stdout, stderr = await process.communicate()
     if process.returncode != 0:
-        raise Exception(f"Error in react-email process: {stderr.decode('utf-8')}")
+        raise EmailRendererError(
+            f"Error in react-email process: {stderr.decode('utf-8')}"
+        )
     return stdout.decode("utf-8")
 
 
-__all__ = ["render_email_template"]
+async def render_email_template(email: "Email") -> str:
+    template = str(email.template)
+    props_json = email.props.model_dump_json()
+    if _pool is not None:
+        return await _pool.render(template, json.loads(props_json))
+    return await _render_once(template, props_json)
+
+
+__all__ = [
+    "EmailRendererError",
+    "EmailRendererPool",
+    "start_pool",
+    "close_pool",
+    "render_email_template",
+]
@@ -80,7 +80,7 @@ class EmailUpdateService(ResourceServiceReader[EmailVerification]):
 
         email = email_update_record.email
         url_params = {"token": token, **extra_url_params}
-        body = render_email_template(
+        body = await render_email_template(
             EmailUpdateEmail(
                 props=EmailUpdateProps(
                     email=email,
@@ -1,4 +1,4 @@
-from fastapi import Depends, Query
+from fastapi import Depends, Query, Request
 from fastapi.exceptions import RequestValidationError
 from pydantic import AwareDatetime, ValidationError
 
@@ -197,3 +197,32 @@ async def ingest(
 ) -> EventsIngestResponse:
     """Ingest batch of events."""
     return await event_service.ingest(session, auth_subject, ingest)
+
+
+@router.post(
+    "/ingest/stream",
+    summary="Ingest Events Stream",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/x-ndjson": {
+                    "schema": {"type": "string", "format": "binary"}
+                }
+            },
+        }
+    },
+)
+async def ingest_stream(
+    request: Request,
+    auth_subject: auth.EventWrite,
+    session: AsyncSession = Depends(get_db_session),
+) -> EventsIngestResponse:
+    """
+    Ingest a stream of events, as newline-delimited JSON.
+
+    Each line is an event, with the same schema as in the batch endpoint.
+    Prefer this endpoint for large volumes: the events are processed
+    as they're received. If any event is invalid, no event is ingested.
+    """
+    return await event_service.ingest_stream(session, auth_subject, request.stream())
@@ -8,22 +8,41 @@ from sqlalchemy import (
     ColumnExpressionArgument,
     Select,
     and_,
+    column,
     func,
-    insert,
     or_,
     select,
+    table,
+    text,
 )
+from sqlalchemy.dialects.postgresql import Insert, insert
 from sqlalchemy.orm import joinedload
 
 from polar.auth.models import AuthSubject, Organization, User, is_organization, is_user
+from polar.kit.db.postgres import json_serializer
 from polar.kit.repository import RepositoryBase, RepositoryIDMixin
 from polar.kit.repository.base import Options
+from polar.kit.utils import generate_uuid, utc_now
 from polar.models import BillingEntry, Customer, Event, Meter, UserOrganization
 from polar.models.event import EventSource
 from polar.models.product_price import ProductPriceMeteredUnit
 
 from .system import SystemEvent
 
+_COPY_COLUMNS = (
+    "id",
+    "ingested_at",
+    "timestamp",
+    "name",
+    "source",
+    "customer_id",
+    "external_customer_id",
+    "organization_id",
+    "user_metadata",
+    "external_id",
+)
+_COPY_TABLE = "events_copy"
+
 
 class EventRepository(RepositoryBase[Event], RepositoryIDMixin[Event, UUID]):
     model = Event
@@ -38,13 +57,98 @@ class EventRepository(RepositoryBase[Event], RepositoryIDMixin[Event, UUID]):
         )
         return await self.get_all(statement)
 
+    async def get_cost_organization_ids(
+        self, event_ids: Sequence[UUID]
+    ) -> Sequence[UUID]:
+        """Return the organizations of the given events carrying a cost."""
+        statement = (
+            select(Event.organization_id)
+            .where(Event.id.in_(event_ids), Event.user_metadata["_cost"].is_not(None))
+            .distinct()
+        )
+        result = await self.session.execute(statement)
+        return result.scalars().all()
+
     async def insert_batch(self, events: Sequence[dict[str, Any]]) -> Sequence[UUID]:
+        """
+        Insert events, skipping the ones with an `external_id`
+        already ingested in their organization.
+
+        Returns the IDs of the inserted events only.
+        """
         if not events:
             return []
-        statement = insert(Event).returning(Event.id)
+        statement = _skip_duplicates(insert(Event)).returning(Event.id)
         result = await self.session.execute(statement, events)
         return result.scalars().all()
 
+    async def copy_batch(self, events: Sequence[dict[str, Any]]) -> Sequence[UUID]:
+        """
+        Insert events with `COPY`, which is much faster than an `INSERT`
+        for large batches.
+
+        IDs are generated client-side, so we don't need to read them back.
+        The copy happens on the session's connection, so it's part of
+        the current transaction.
+
+        `COPY` can't skip conflicting rows, so if some events have an
+        `external_id`, they're copied in a temporary table first, then inserted
+        from there while skipping duplicates, like `insert_batch`.
+
+        Returns the IDs of the inserted events only.
+        """
+        if not events:
+            return []
+
+        ingested_at = utc_now()
+        ids: list[UUID] = []
+        records: list[tuple[Any, ...]] = []
+        for event in events:
+            id = generate_uuid()
+            ids.append(id)
+            records.append(
+                (
+                    id,
+                    ingested_at,
+                    event["timestamp"],
+                    event["name"],
+                    event["source"],
+                    event.get("customer_id"),
+                    event.get("external_customer_id"),
+                    event["organization_id"],
+                    json_serializer(event["user_metadata"]),
+                    event.get("external_id"),
+                )
+            )
+
+        connection = await self.session.connection()
+        raw_connection = await connection.get_raw_connection()
+        driver_connection: Any = raw_connection.driver_connection
+
+        if all(event.get("external_id") is None for event in events):
+            await driver_connection.copy_records_to_table(
+                Event.__tablename__, records=records, columns=_COPY_COLUMNS
+            )
+            return ids
+
+        await self.session.execute(
+            text(
+                f"CREATE TEMPORARY TABLE IF NOT EXISTS {_COPY_TABLE} "
+                f"(LIKE {Event.__tablename__} INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+        )
+        await driver_connection.copy_records_to_table(
+            _COPY_TABLE, records=records, columns=_COPY_COLUMNS
+        )
+        copy_table = table(_COPY_TABLE, *(column(name) for name in _COPY_COLUMNS))
+        result = await self.session.execute(
+            _skip_duplicates(
+                insert(Event).from_select(_COPY_COLUMNS, select(copy_table))
+            ).returning(Event.id)
+        )
+        await self.session.execute(text(f"TRUNCATE {_COPY_TABLE}"))
+        return result.scalars().all()
+
     async def get_latest_meter_reset(
         self, customer: Customer, meter_id: UUID
     ) -> Event | None:
@@ -180,3 +284,10 @@ class EventRepository(RepositoryBase[Event], RepositoryIDMixin[Event, UUID]):
 
     def get_eager_options(self) -> Options:
         return (joinedload(Event.customer),)
+
+
+def _skip_duplicates(statement: Insert) -> Insert:
+    return statement.on_conflict_do_nothing(
+        index_elements=[Event.organization_id, Event.external_id],
+        index_where=Event.external_id.is_not(None),
+    )
@@ -125,6 +125,14 @@ class EventCreateBase(Schema):
         description="The timestamp of the event.",
     )
     name: str = Field(..., description="The name of the event.")
+    external_id: str | None = Field(
+        default=None,
+        description=(
+            "Your unique identifier for the event. "
+            "An event with the same `external_id` as an event already ingested "
+            "in the organization is ignored, so requests can be safely retried."
+        ),
+    )
     organization_id: OrganizationID | None = Field(
         default=None,
         description=(
@@ -159,6 +167,7 @@ class EventCreateExternalCustomer(EventCreateBase):
 
 
 EventCreate = EventCreateCustomer | EventCreateExternalCustomer
+EventCreateTypeAdapter: TypeAdapter[EventCreate] = TypeAdapter(EventCreate)
 
 
 class EventsIngest(Schema):
@@ -167,6 +176,13 @@ class EventsIngest(Schema):
 
 class EventsIngestResponse(Schema):
     inserted: int = Field(description="Number of events inserted.")
+    duplicates: int = Field(
+        default=0,
+        description=(
+            "Number of events ignored because an event with "
+            "the same `external_id` was already ingested."
+        ),
+    )
 
 
 class BaseEvent(IDSchema):
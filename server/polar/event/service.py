@@ -1,12 +1,14 @@
 import uuid
-from collections.abc import Callable, Sequence
+from collections.abc import AsyncIterator, Callable, Iterable, Sequence
 from datetime import datetime
 from typing import Any
 
 import structlog
+from pydantic import ValidationError as PydanticValidationError
 from sqlalchemy import String, UnaryExpression, asc, cast, desc, func, or_, select, text
 
 from polar.auth.models import AuthSubject, is_organization, is_user
+from polar.config import settings
 from polar.customer.repository import CustomerRepository
 from polar.exceptions import PolarError, PolarRequestValidationError, ValidationError
 from polar.kit.metadata import MetadataQuery, apply_metadata_clause
@@ -14,14 +16,21 @@ from polar.kit.pagination import PaginationParams, paginate
 from polar.kit.sorting import Sorting
 from polar.logging import Logger
 from polar.meter.filter import Filter
-from polar.meter.repository import MeterRepository
+from polar.meter.repository import MeterAggregateRepository, MeterRepository
 from polar.models import Customer, Event, Organization, User, UserOrganization
 from polar.models.event import EventSource
 from polar.postgres import AsyncSession
 from polar.worker import enqueue_events
 
 from .repository import EventRepository
-from .schemas import EventCreateCustomer, EventName, EventsIngest, EventsIngestResponse
+from .schemas import (
+    EventCreate,
+    EventCreateCustomer,
+    EventCreateTypeAdapter,
+    EventName,
+    EventsIngest,
+    EventsIngestResponse,
+)
 from .sorting import EventNamesSortProperty, EventSortProperty
 
 log: Logger = structlog.get_logger()
@@ -237,37 +246,75 @@ class EventService:
             session, auth_subject
         )
 
-        events: list[dict[str, Any]] = []
-        errors: list[ValidationError] = []
-        for index, event_create in enumerate(ingest.events):
-            try:
-                organization_id = validate_organization_id(
-                    index, event_create.organization_id
-                )
-                if isinstance(event_create, EventCreateCustomer):
-                    validate_customer_id(index, event_create.customer_id)
-            except EventIngestValidationError as e:
-                errors.extend(e.errors)
-                continue
-            else:
-                events.append(
-                    {
-                        "source": EventSource.user,
-                        "organization_id": organization_id,
-                        **event_create.model_dump(
-                            exclude={"organization_id"}, by_alias=True
-                        ),
-                    }
-                )
-
-        if len(errors) > 0:
-            raise PolarRequestValidationError(errors)
+        events = self._get_events_values(
+            enumerate(ingest.events), validate_organization_id, validate_customer_id
+        )
 
         repository = EventRepository.from_session(session)
         event_ids = await repository.insert_batch(events)
         enqueue_events(*event_ids)
 
-        return EventsIngestResponse(inserted=len(events))
+        return EventsIngestResponse(
+            inserted=len(event_ids), duplicates=len(events) - len(event_ids)
+        )
+
+    async def ingest_stream(
+        self,
+        session: AsyncSession,
+        auth_subject: AuthSubject[User | Organization],
+        stream: AsyncIterator[bytes],
+    ) -> EventsIngestResponse:
+        """
+        Ingest a stream of newline-delimited JSON events.
+
+        Lines are validated and written by chunks with `COPY`, so memory stays
+        bounded whatever the size of the stream. The whole stream is still
+        ingested in a single transaction: if any line is invalid, nothing is.
+        """
+        validate_organization_id = await self._get_organization_validation_function(
+            session, auth_subject
+        )
+        validate_customer_id = await self._get_customer_validation_function(
+            session, auth_subject
+        )
+
+        repository = EventRepository.from_session(session)
+        inserted = 0
+        duplicates = 0
+        index = 0
+        async for lines in _iter_ndjson_chunks(
+            stream, settings.EVENTS_INGEST_STREAM_CHUNK_SIZE
+        ):
+            event_creates: list[tuple[int, EventCreate]] = []
+            errors: list[ValidationError] = []
+            for line in lines:
+                try:
+                    event_creates.append(
+                        (index, EventCreateTypeAdapter.validate_json(line))
+                    )
+                except PydanticValidationError as e:
+                    for error in e.errors():
+                        errors.append(
+                            {
+                                "type": error["type"],
+                                "loc": ("body", "events", index, *error["loc"]),
+                                "msg": error["msg"],
+                                "input": error["input"],
+                            }
+                        )
+                index += 1
+            if errors:
+                raise PolarRequestValidationError(errors)
+
+            events = self._get_events_values(
+                event_creates, validate_organization_id, validate_customer_id
+            )
+            event_ids = await repository.copy_batch(events)
+            enqueue_events(*event_ids)
+            inserted += len(event_ids)
+            duplicates += len(events) - len(event_ids)
+
+        return EventsIngestResponse(inserted=inserted, duplicates=duplicates)
 
     async def create_event(self, session: AsyncSession, event: Event) -> Event:
         repository = EventRepository.from_session(session)
@@ -284,21 +331,68 @@ class EventService:
 
     async def ingested(
         self, session: AsyncSession, event_ids: Sequence[uuid.UUID]
-    ) -> None:
-        repository = EventRepository.from_session(session)
-        statement = (
-            repository.get_base_statement()
-            .where(Event.id.in_(event_ids), Event.customer.is_not(None))
-            .options(*repository.get_eager_options())
-        )
-        events = await repository.get_all(statement)
-        customers: set[Customer] = set()
-        for event in events:
-            assert event.customer is not None
-            customers.add(event.customer)
+    ) -> Sequence[uuid.UUID]:
+        """
+        Process newly ingested events.
 
+        Returns the organizations whose costs changed with these events:
+        their cached metrics have to be invalidated once committed.
+        """
         customer_repository = CustomerRepository.from_session(session)
-        await customer_repository.touch_meters(customers)
+        touched = await customer_repository.touch_meters_by_events(
+            event_ids, debounce=settings.CUSTOMER_METER_DIRTY_DEBOUNCE
+        )
+        log.debug("Customers meters dirtied", events=len(event_ids), customers=touched)
+
+        # Keep the meters aggregates up to date with the new events
+        meter_repository = MeterRepository.from_session(session)
+        aggregate_repository = MeterAggregateRepository.from_session(session)
+        for meter in await meter_repository.get_all_by_events(event_ids):
+            await aggregate_repository.refresh(meter, event_ids)
+
+        # Costs can be back-dated into periods already cached as closed
+        event_repository = EventRepository.from_session(session)
+        return await event_repository.get_cost_organization_ids(event_ids)
+
+    def _get_events_values(
+        self,
+        event_creates: Iterable[tuple[int, EventCreate]],
+        validate_organization_id: Callable[[int, uuid.UUID | None], uuid.UUID],
+        validate_customer_id: Callable[[int, uuid.UUID], uuid.UUID],
+    ) -> list[dict[str, Any]]:
+        events: list[dict[str, Any]] = []
+        errors: list[ValidationError] = []
+        for index, event_create in event_creates:
+            try:
+                organization_id = validate_organization_id(
+                    index, event_create.organization_id
+                )
+                if isinstance(event_create, EventCreateCustomer):
+                    validate_customer_id(index, event_create.customer_id)
+            except EventIngestValidationError as e:
+                errors.extend(e.errors)
+                continue
+            else:
+                # Built by hand rather than with `model_dump`, which is
+                # noticeably slower on large batches
+                values: dict[str, Any] = {
+                    "source": EventSource.user,
+                    "organization_id": organization_id,
+                    "timestamp": event_create.timestamp,
+                    "name": event_create.name,
+                    "user_metadata": event_create.metadata,
+                    "external_id": event_create.external_id,
+                }
+                if isinstance(event_create, EventCreateCustomer):
+                    values["customer_id"] = event_create.customer_id
+                else:
+                    values["external_customer_id"] = event_create.external_customer_id
+                events.append(values)
+
+        if len(errors) > 0:
+            raise PolarRequestValidationError(errors)
+
+        return events
 
     async def _get_organization_validation_function(
         self, session: AsyncSession, auth_subject: AuthSubject[User | Organization]
@@ -405,4 +499,25 @@ class EventService:
         return _validate_customer_id
 
 
+async def _iter_ndjson_chunks(
+    stream: AsyncIterator[bytes], chunk_size: int
+) -> AsyncIterator[list[bytes]]:
+    """Split a stream of bytes into chunks of non-empty lines."""
+    buffer = b""
+    chunk: list[bytes] = []
+    async for data in stream:
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if buffer.strip():
+        chunk.append(buffer)
+    if chunk:
+        yield chunk
+
+
 event = EventService()
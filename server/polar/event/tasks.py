@@ -1,12 +1,37 @@
+import time
 import uuid
 from collections.abc import Sequence
 
-from polar.worker import AsyncSessionMaker, TaskPriority, actor
+import logfire
+from dramatiq.middleware import CurrentMessage
+
+from polar.metrics.service import metrics as metrics_service
+from polar.worker import AsyncSessionMaker, RedisMiddleware, TaskPriority, actor
 
 from .service import event as event_service
 
+ingested_chunk_size = logfire.metric_histogram(
+    "event.ingested.chunk_size",
+    unit="1",
+    description="Number of events processed by an `event.ingested` job.",
+)
+ingested_latency = logfire.metric_histogram(
+    "event.ingested.latency",
+    unit="ms",
+    description="Time between the enqueuing and the end of an `event.ingested` job.",
+)
+
 
 @actor(actor_name="event.ingested", priority=TaskPriority.LOW)
 async def event_ingested(event_ids: Sequence[uuid.UUID]) -> None:
+    ingested_chunk_size.record(len(event_ids))
+
     async with AsyncSessionMaker() as session:
-        await event_service.ingested(session, event_ids)
+        organization_ids = await event_service.ingested(session, event_ids)
+    # Invalidate once the events are processed and committed
+    for organization_id in organization_ids:
+        await metrics_service.invalidate_cache(RedisMiddleware.get(), organization_id)
+
+    message = CurrentMessage.get_current_message()
+    if message is not None:
+        ingested_latency.record(time.time() * 1000 - message.message_timestamp)
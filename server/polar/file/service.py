@@ -94,7 +94,7 @@ class FileService:
         create_schema: FileCreate,
     ) -> FileUpload:
         s3_service = S3_SERVICES[create_schema.service]
-        upload = s3_service.create_multipart_upload(
+        upload = await s3_service.create_multipart_upload(
             create_schema, namespace=create_schema.service.value
         )
 
@@ -124,7 +124,7 @@ class FileService:
         completed_schema: FileUploadCompleted,
     ) -> File:
         s3_service = S3_SERVICES[file.service]
-        s3file = s3_service.complete_multipart_upload(completed_schema)
+        s3file = await s3_service.complete_multipart_upload(completed_schema)
 
         file.is_uploaded = True
 
@@ -167,7 +167,7 @@ class FileService:
         await session.execute(statement)
 
         s3_service = S3_SERVICES[file.service]
-        deleted = s3_service.delete_file(file.path)
+        deleted = await s3_service.delete_file(file.path)
         log.info("file.delete", file_id=file.id, s3_deleted=deleted)
         return True
 
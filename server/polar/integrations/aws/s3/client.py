@@ -1,3 +1,7 @@
+import asyncio
+import functools
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING
 
 import boto3
@@ -9,20 +13,45 @@ if TYPE_CHECKING:
     from mypy_boto3_s3.client import S3Client
 
 
+@functools.cache
 def get_client(
     *, signature_version: str = settings.AWS_SIGNATURE_VERSION
 ) -> "S3Client":
+    """
+    Get the S3 client for a signature version.
+
+    Clients are created once per process: they're thread-safe, and keep
+    a pool of connections to S3.
+    """
     return boto3.client(
         "s3",
         endpoint_url=settings.S3_ENDPOINT_URL,
         aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
         aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
         config=Config(
-            region_name=settings.AWS_REGION, signature_version=signature_version
+            region_name=settings.AWS_REGION,
+            signature_version=signature_version,
+            max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
         ),
     )
 
 
 client = get_client()
 
-__all__ = ("client", "get_client")
+# As many threads as connections: requests beyond them wait for a free one
+_executor = ThreadPoolExecutor(
+    max_workers=settings.S3_MAX_POOL_CONNECTIONS, thread_name_prefix="s3"
+)
+
+
+async def run_in_executor[**P, R](
+    func: Callable[P, R], *args: P.args, **kwargs: P.kwargs
+) -> R:
+    """Run a blocking S3 client call without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+__all__ = ("client", "get_client", "run_in_executor")
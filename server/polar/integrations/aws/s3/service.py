@@ -8,7 +8,7 @@ from botocore.client import ClientError
 
 from polar.kit.utils import generate_uuid, utc_now
 
-from .client import client, get_client
+from .client import client, get_client, run_in_executor
 from .exceptions import S3FileError
 from .schemas import (
     S3File,
@@ -39,7 +39,7 @@ class S3Service:
         self.presign_ttl = presign_ttl
         self.client = client
 
-    def upload(
+    async def upload(
         self,
         data: bytes,
         path: str,
@@ -64,10 +64,10 @@ class S3Service:
         if checksum_sha256_base64:
             request["ChecksumSHA256"] = checksum_sha256_base64
 
-        response = self.client.put_object(**request)
+        await run_in_executor(self.client.put_object, **request)
         return path
 
-    def create_multipart_upload(
+    async def create_multipart_upload(
         self, data: S3FileCreate, namespace: str = ""
     ) -> S3FileUpload:
         if not data.organization_id:
@@ -98,7 +98,8 @@ class S3Service:
             file.checksum_sha256_base64 = sha256_base64
             file.checksum_sha256_hex = base64.b64decode(sha256_base64).hex()
 
-        multipart_upload = self.client.create_multipart_upload(
+        multipart_upload = await run_in_executor(
+            self.client.create_multipart_upload,
             Bucket=self.bucket,
             Key=file.path,
             ContentType=file.mime_type,
@@ -169,9 +170,12 @@ class S3Service:
             )
         return ret
 
-    def get_object_or_raise(self, path: str, s3_version_id: str = "") -> dict[str, Any]:
+    async def get_object_or_raise(
+        self, path: str, s3_version_id: str = ""
+    ) -> dict[str, Any]:
         try:
-            obj = self.client.get_object(
+            obj = await run_in_executor(
+                self.client.get_object,
                 Bucket=self.bucket,
                 Key=path,
                 VersionId=s3_version_id,
@@ -182,26 +186,34 @@ class S3Service:
 
         return cast(dict[str, Any], obj)
 
-    def get_head_or_raise(self, path: str, s3_version_id: str = "") -> dict[str, Any]:
+    async def get_head_or_raise(
+        self, path: str, s3_version_id: str = ""
+    ) -> dict[str, Any]:
         try:
-            head = self.client.head_object(
-                Bucket=self.bucket, Key=path, VersionId=s3_version_id
+            head = await run_in_executor(
+                self.client.head_object,
+                Bucket=self.bucket,
+                Key=path,
+                VersionId=s3_version_id,
             )
         except ClientError:
             raise S3FileError("No metadata from S3")
 
         return cast(dict[str, Any], head)
 
-    def complete_multipart_upload(self, data: S3FileUploadCompleted) -> S3File:
+    async def complete_multipart_upload(self, data: S3FileUploadCompleted) -> S3File:
         boto_arguments = data.get_boto3_arguments()
-        response = self.client.complete_multipart_upload(
-            Bucket=self.bucket, Key=data.path, **boto_arguments
+        response = await run_in_executor(
+            self.client.complete_multipart_upload,
+            Bucket=self.bucket,
+            Key=data.path,
+            **boto_arguments,
         )
         if not response:
             raise S3FileError("No response from S3")
 
         version_id = response.get("VersionId", "")
-        head = self.get_head_or_raise(data.path, s3_version_id=version_id)
+        head = await self.get_head_or_raise(data.path, s3_version_id=version_id)
         file = S3File.from_head(data.path, head)
         return file
 
@@ -234,11 +246,14 @@ class S3Service:
         # This is apparently the *only* way to get a public URL with boto3,
         # apart from building a URL manually 🙄
         # Ref: https://stackoverflow.com/a/48197923
+        # Like the other presigned URLs, it's built locally, without any request.
         unsigned_client = get_client(signature_version=botocore.UNSIGNED)
         return unsigned_client.generate_presigned_url(
             "get_object", ExpiresIn=0, Params=dict(Bucket=self.bucket, Key=path)
         )
 
-    def delete_file(self, path: str) -> bool:
-        deleted = self.client.delete_object(Bucket=self.bucket, Key=path)
+    async def delete_file(self, path: str) -> bool:
+        deleted = await run_in_executor(
+            self.client.delete_object, Bucket=self.bucket, Key=path
+        )
         return deleted.get("DeleteMarker", False)
@@ -1,4 +1,7 @@
+import copy
+import functools
 from datetime import date, datetime
+from io import BytesIO
 from pathlib import Path
 from typing import ClassVar, Self
 
@@ -7,9 +10,10 @@ from babel.dates import format_date as _format_date
 from babel.numbers import format_currency as _format_currency
 from babel.numbers import format_decimal as _format_decimal
 from babel.numbers import format_percent as _format_percent
+from fontTools import ttLib
 from fpdf import FPDF
 from fpdf.enums import Align, TableBordersLayout, XPos, YPos
-from fpdf.fonts import FontFace
+from fpdf.fonts import FontFace, SubsetMap, TTFFont
 from pydantic import BaseModel
 
 from polar.config import Environment, settings
@@ -174,6 +178,16 @@ class Invoice(BaseModel):
         )
 
 
+@functools.cache
+def _read_font_file(font_file: Path) -> bytes:
+    return font_file.read_bytes()
+
+
+@functools.cache
+def _load_font(font_file: Path, fontkey: str, style: str) -> TTFFont:
+    return TTFFont(FPDF(), font_file, fontkey, style)
+
+
 class InvoiceGenerator(FPDF):
     """Class to generate an invoice PDF using fpdf2."""
 
@@ -221,8 +235,8 @@ class InvoiceGenerator(FPDF):
     ) -> None:
         super().__init__()
 
-        self.add_font(self.font_name, fname=self.regular_font_file)
-        self.add_font(self.font_name, fname=self.bold_font_file, style="B")
+        self._add_preloaded_font(self.regular_font_file)
+        self._add_preloaded_font(self.bold_font_file, style="B")
         self.set_font(self.font_name, size=self.base_font_size)
 
         self.alias_nb_pages()
@@ -230,6 +244,28 @@ class InvoiceGenerator(FPDF):
         self.heading_title = heading_title
         self.add_sandbox_warning = add_sandbox_warning
 
+    def _add_preloaded_font(self, font_file: Path, style: str = "") -> None:
+        """
+        Add a font parsed once per process, instead of on every invoice
+        like `add_font` does.
+        """
+        fontkey = f"{self.font_name}{style}"
+        # The parsed metrics and glyph maps are shared, read-only
+        font = copy.copy(_load_font(font_file, fontkey, style))
+        font.i = len(self.fonts) + 1
+        # The font tables are subset in place on output: each invoice needs its own
+        font.ttfont = ttLib.TTFont(
+            BytesIO(_read_font_file(font_file)),
+            recalcTimestamp=False,
+            fontNumber=0,
+            lazy=True,
+        )
+        # So does the state of the document: used glyphs and PDF objects
+        font.desc = copy.copy(font.desc)
+        font.missing_glyphs = []
+        font.subset = SubsetMap(font)
+        self.fonts[fontkey] = font
+
     def cell_height(self, font_size: float | None = None) -> float:
         font_size = font_size or self.base_font_size
         return font_size * 0.35 * self.line_height_percentage
@@ -453,4 +489,33 @@ class InvoiceGenerator(FPDF):
         self.set_creation_date(utc_now())
 
 
-__all__ = ["InvoiceGenerator", "Invoice", "InvoiceItem"]
+def preload_fonts() -> None:
+    """Parse the invoice fonts, typically when starting a process generating them."""
+    _load_font(InvoiceGenerator.regular_font_file, InvoiceGenerator.font_name, "")
+    _load_font(InvoiceGenerator.bold_font_file, f"{InvoiceGenerator.font_name}B", "B")
+
+
+def generate_invoice(
+    invoice: Invoice, heading_title: str, add_sandbox_warning: bool
+) -> bytes:
+    """
+    Generate the PDF of an invoice.
+
+    Module-level, so it can run in a process pool.
+    """
+    generator = InvoiceGenerator(
+        invoice,
+        heading_title=heading_title,
+        add_sandbox_warning=add_sandbox_warning,
+    )
+    generator.generate()
+    return bytes(generator.output())
+
+
+__all__ = [
+    "InvoiceGenerator",
+    "Invoice",
+    "InvoiceItem",
+    "preload_fonts",
+    "generate_invoice",
+]
@@ -1,6 +1,10 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 
-from polar.config import settings
+from polar.config import Environment, settings
 from polar.exceptions import PolarError
 from polar.integrations.aws.s3 import S3Service
 from polar.kit.tax import TaxabilityReason
@@ -12,9 +16,10 @@ from polar.transaction.repository import TransactionRepository
 
 from .generator import (
     Invoice,
-    InvoiceGenerator,
     InvoiceHeadingItem,
     InvoiceItem,
+    generate_invoice,
+    preload_fonts,
 )
 
 
@@ -30,16 +35,54 @@ class MissingAccountBillingDetails(InvoiceError):
         super().__init__(message, 400)
 
 
+_executor: ProcessPoolExecutor | None = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.INVOICES_PROCESS_POOL_SIZE,
+            # Forking the multi-threaded worker processes isn't safe
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=preload_fonts,
+        )
+    return _executor
+
+
+async def _generate(invoice: Invoice, heading_title: str = "Invoice") -> bytes:
+    """
+    Generate the PDF of an invoice in the process pool,
+    so this CPU-bound work doesn't block the event loop.
+    """
+    global _executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            _get_executor(),
+            generate_invoice,
+            invoice,
+            heading_title,
+            settings.ENV == Environment.sandbox,
+        )
+    except BrokenProcessPool:
+        # A process died abruptly: start a new pool for the next invoices
+        _executor = None
+        raise
+
+
+async def _upload(bucket: str, data: bytes, path: str) -> str:
+    s3 = S3Service(bucket)
+    return await s3.upload(data, path, "application/pdf")
+
+
 class InvoiceService:
     async def create_order_invoice(self, order: Order) -> str:
-        invoice = Invoice.from_order(order)
-        generator = InvoiceGenerator(invoice)
-        generator.generate()
-        invoice_bytes = generator.output()
-
-        s3 = S3Service(settings.S3_CUSTOMER_INVOICES_BUCKET_NAME)
-        return s3.upload(
-            bytes(invoice_bytes), order.invoice_filename, "application/pdf"
+        invoice_bytes = await _generate(Invoice.from_order(order))
+        return await _upload(
+            settings.S3_CUSTOMER_INVOICES_BUCKET_NAME,
+            invoice_bytes,
+            order.invoice_filename,
         )
 
     async def get_order_invoice_url(self, order: Order) -> tuple[str, datetime]:
@@ -136,14 +179,11 @@ class InvoiceService:
             ],
         )
 
-        generator = InvoiceGenerator(invoice, heading_title="Reverse Invoice")
-        generator.generate()
-        invoice_bytes = generator.output()
-        s3 = S3Service(settings.S3_PAYOUT_INVOICES_BUCKET_NAME)
-        return s3.upload(
-            bytes(invoice_bytes),
+        invoice_bytes = await _generate(invoice, heading_title="Reverse Invoice")
+        return await _upload(
+            settings.S3_PAYOUT_INVOICES_BUCKET_NAME,
+            invoice_bytes,
             f"{account.id}/Payout-{payout.invoice_number}.pdf",
-            "application/pdf",
         )
 
     async def get_payout_invoice_url(self, payout: Payout) -> tuple[str, datetime]:
@@ -0,0 +1,50 @@
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+
+class TTLCache[K, V]:
+    """
+    In-memory cache, local to the process.
+
+    Entries expire after `ttl`; once `maxsize` is reached,
+    the least recently used entry is evicted.
+
+    Since it's not shared between processes, it should only hold data
+    for which staleness up to `ttl` is acceptable.
+    """
+
+    def __init__(self, *, ttl: timedelta, maxsize: int) -> None:
+        self.ttl = ttl.total_seconds()
+        self.maxsize = maxsize
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        if self.ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
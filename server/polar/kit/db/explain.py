@@ -0,0 +1,55 @@
+import json
+from collections.abc import Iterator
+from typing import Any
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.elements import ClauseElement
+
+from .postgres import AsyncReadSession
+
+
+class Explain(Executable, ClauseElement):
+    """
+    `EXPLAIN (FORMAT JSON)` of a statement.
+
+    Bound parameters are kept as is, so the plan is the one of the actual statement.
+    """
+
+    inherit_cache = False
+
+    def __init__(self, statement: Executable, *, analyze: bool = False) -> None:
+        self.statement = statement
+        self.analyze = analyze
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element: Explain, compiler: SQLCompiler, **kw: Any) -> str:
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if element.analyze else "FORMAT JSON"
+    return f"EXPLAIN ({options}) {compiler.process(element.statement, **kw)}"
+
+
+async def explain(
+    session: AsyncReadSession, statement: Executable, *, analyze: bool = False
+) -> dict[str, Any]:
+    """
+    Return the query plan of a statement, i.e. the top-level object
+    of PostgreSQL's JSON output, with `Plan` and, if analyzed, `Execution Time`.
+    """
+    result = await session.execute(Explain(statement, analyze=analyze))
+    output = result.scalar_one()
+    if isinstance(output, str):
+        output = json.loads(output)
+    return output[0]
+
+
+def iter_plan_nodes(plan: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    """Iterate over all the nodes of a query plan, depth-first."""
+    node = plan.get("Plan", plan)
+    yield node
+    for child in node.get("Plans", []):
+        yield from iter_plan_nodes(child)
+
+
+__all__ = ["Explain", "explain", "iter_plan_nodes"]
@@ -0,0 +1,121 @@
+"""
+Helpers to maintain tables partitioned by range of `created_at`, one partition per day.
+
+Expired partitions are dropped as a whole, which is instant and doesn't leave
+dead rows behind, unlike deleting or updating them.
+"""
+
+import dataclasses
+import datetime
+import re
+
+from sqlalchemy import text
+
+from polar.kit.db.postgres import AsyncSession
+
+# Don't queue behind long-running queries on the parent table, holding up
+# every other query; the next maintenance run will try again.
+MAINTENANCE_LOCK_TIMEOUT = "5s"
+
+_UPPER_BOUND_PATTERN = re.compile(r"TO \('(?P<upper_bound>[^']+)'\)")
+
+
+@dataclasses.dataclass(frozen=True)
+class Partition:
+    name: str
+    upper_bound: datetime.datetime | None
+    """Exclusive upper bound of the partition. `None` for the default partition."""
+
+
+def get_daily_partition_name(table: str, day: datetime.date) -> str:
+    return f"{table}_p{day:%Y%m%d}"
+
+
+async def get_partitions(session: AsyncSession, table: str) -> list[Partition]:
+    result = await session.execute(
+        text(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table
+            ORDER BY child.relname
+            """
+        ),
+        {"table": table},
+    )
+    partitions: list[Partition] = []
+    for name, bound in result.tuples().all():
+        match = _UPPER_BOUND_PATTERN.search(bound)
+        upper_bound = (
+            datetime.datetime.fromisoformat(match.group("upper_bound"))
+            if match is not None
+            else None
+        )
+        partitions.append(Partition(name=name, upper_bound=upper_bound))
+    return partitions
+
+
+def _get_day_start(day: datetime.date) -> datetime.datetime:
+    return datetime.datetime.combine(day, datetime.time(), datetime.UTC)
+
+
+async def create_daily_partition(
+    session: AsyncSession, table: str, day: datetime.date
+) -> None:
+    start = _get_day_start(day)
+    end = start + datetime.timedelta(days=1)
+    await session.execute(
+        text(f"SET LOCAL lock_timeout = '{MAINTENANCE_LOCK_TIMEOUT}'")
+    )
+    await session.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {get_daily_partition_name(table, day)} "
+            f"PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    )
+
+
+async def drop_partition(session: AsyncSession, partition: Partition) -> None:
+    await session.execute(
+        text(f"SET LOCAL lock_timeout = '{MAINTENANCE_LOCK_TIMEOUT}'")
+    )
+    await session.execute(text(f"DROP TABLE {partition.name}"))
+
+
+async def maintain_daily_partitions(
+    session: AsyncSession,
+    table: str,
+    *,
+    older_than: datetime.datetime,
+    premake: int,
+) -> None:
+    """
+    Drop the partitions of `table` entirely older than `older_than`,
+    and create the ones of today and the `premake` following days.
+
+    Days already covered by a partition, like one of the table
+    existing before the partitioning, are skipped.
+
+    Each operation is committed on its own, so they hold the lock
+    on the parent table as briefly as possible.
+    """
+    partitions = await get_partitions(session, table)
+    for partition in partitions:
+        if partition.upper_bound is not None and partition.upper_bound <= older_than:
+            await drop_partition(session, partition)
+            await session.commit()
+
+    covered_until = max(
+        (p.upper_bound for p in partitions if p.upper_bound is not None),
+        default=None,
+    )
+    today = datetime.datetime.now(datetime.UTC).date()
+    for days in range(premake + 1):
+        day = today + datetime.timedelta(days=days)
+        if covered_until is not None and _get_day_start(day) < covered_until:
+            continue
+        await create_daily_partition(session, table, day)
+        await session.commit()
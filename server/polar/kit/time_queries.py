@@ -1,13 +1,18 @@
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from enum import StrEnum
 
 from sqlalchemy import (
     CTE,
+    TIMESTAMP,
+    ColumnElement,
     Function,
     SQLColumnExpression,
     TextClause,
+    and_,
+    case,
     cte,
     func,
+    literal,
     select,
     text,
 )
@@ -28,17 +33,90 @@ class TimeInterval(StrEnum):
     ) -> Function[datetime]:
         return func.date_trunc(self.value, column)
 
+    def date_trunc(self, timestamp: datetime) -> datetime:
+        """Python counterpart of `sql_date_trunc`, in the timestamp's timezone."""
+        timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+        if self == TimeInterval.hour:
+            return timestamp
+        timestamp = timestamp.replace(hour=0)
+        if self == TimeInterval.day:
+            return timestamp
+        if self == TimeInterval.week:
+            return timestamp - timedelta(days=timestamp.weekday())
+        if self == TimeInterval.month:
+            return timestamp.replace(day=1)
+        return timestamp.replace(month=1, day=1)
+
 
 def get_timestamp_series_cte(
-    start_timestamp: datetime, end_timestamp: datetime, interval: TimeInterval
+    start_timestamp: datetime,
+    end_timestamp: datetime,
+    interval: TimeInterval,
+    *,
+    closed_at: datetime | None = None,
+    open_at: datetime | None = None,
 ) -> CTE:
-    return cte(
-        select(
-            func.generate_series(
-                start_timestamp, end_timestamp, interval.sql_interval()
-            ).column_valued("timestamp")
-        )
+    """
+    Generate the series of timestamps between two dates, one for each interval.
+
+    Besides `timestamp`, each row carries the bounds of its bucket,
+    so data can be matched with sargable range predicates
+    (see `sql_bucket_range`) instead of comparing truncated dates:
+
+    * `bucket_start`: start of the interval containing the timestamp;
+    * `bucket_end`: start of the next interval, excluded;
+    * `cumulative_start`: same as `bucket_start`, except for the first bucket
+    where it's `-infinity`, so it also catches data anterior to the series.
+
+    The series can be restricted to the buckets already closed at `closed_at`,
+    or to the ones still open (or in the future) at `open_at`.
+    """
+    timestamp = func.generate_series(
+        start_timestamp, end_timestamp, interval.sql_interval()
+    ).column_valued("timestamp")
+    bucket_start = interval.sql_date_trunc(timestamp)
+    bucket_end = bucket_start + interval.sql_interval()
+    statement = select(
+        timestamp,
+        bucket_start.label("bucket_start"),
+        bucket_end.label("bucket_end"),
+        case(
+            (
+                timestamp == func.min(timestamp).over(),
+                literal("-infinity", TIMESTAMP(timezone=True)),
+            ),
+            else_=bucket_start,
+        ).label("cumulative_start"),
+    )
+    if closed_at is not None:
+        statement = statement.where(bucket_end <= closed_at)
+    if open_at is not None:
+        statement = statement.where(bucket_end > open_at)
+    return cte(statement)
+
+
+def sql_bucket_range(
+    column: SQLColumnExpression[datetime],
+    timestamp_series: CTE,
+    *,
+    cumulative: bool = False,
+) -> ColumnElement[bool]:
+    """
+    Half-open `[bucket_start, bucket_end)` predicate matching the column
+    to the bucket of each timestamp of the series.
+
+    Contrary to `date_trunc` comparisons, it can be served by an index on the column.
+
+    If `cumulative` is set, the first bucket is open on the left: summing the
+    per-bucket results with a window function then gives the running total
+    since the beginning of times.
+    """
+    start_column = (
+        timestamp_series.c.cumulative_start
+        if cumulative
+        else timestamp_series.c.bucket_start
     )
+    return and_(column >= start_column, column < timestamp_series.c.bucket_end)
 
 
 MIN_DATETIME = datetime(2023, 1, 1)  # Before that, Polar didn't even exist! 🚀
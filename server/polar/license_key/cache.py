@@ -0,0 +1,199 @@
+"""
+Read-through cache of the license keys, for validations.
+
+Validating a license key needs its status, expiry, limits, activations and
+customer, which are served from Redis without touching the database.
+
+Entries are versioned per license key: invalidating one bumps its version,
+so an entry read from the database concurrently, before the change,
+isn't stored over it.
+"""
+
+from datetime import datetime
+from typing import Any
+from uuid import UUID
+
+import logfire
+from sqlalchemy.orm.attributes import set_committed_value
+
+from polar.config import settings
+from polar.kit.address import Address
+from polar.kit.schemas import Schema
+from polar.kit.tax import TaxID
+from polar.models import Customer, LicenseKey, LicenseKeyActivation
+from polar.models.license_key import LicenseKeyStatus
+from polar.redis import Redis
+
+# 👋 Whenever you change the cached schemas,
+# please bump this version so stale entries are ignored.
+CACHE_KEY_PREFIX = "polar:license_key:v1"
+
+cache_hits = logfire.metric_counter(
+    "license_key.cache.hits",
+    unit="1",
+    description="License keys validated from cache.",
+)
+cache_misses = logfire.metric_counter(
+    "license_key.cache.misses",
+    unit="1",
+    description="License keys loaded from the database for validation.",
+)
+
+# Stores the entry only if the version wasn't bumped since it was read.
+#
+# KEYS: version, entry
+# ARGV: version read before loading the entry, entry, TTL (s)
+_SET_SCRIPT = """
+local version = tonumber(redis.call('GET', KEYS[1]) or '0')
+if version ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class _CachedCustomer(Schema):
+    id: UUID
+    created_at: datetime
+    modified_at: datetime | None
+    deleted_at: datetime | None
+    organization_id: UUID
+    external_id: str | None
+    email: str
+    email_verified: bool
+    name: str | None
+    billing_address: Address | None
+    tax_id: TaxID | None
+    user_metadata: dict[str, Any]
+    legacy_user_id: UUID
+
+
+class _CachedActivation(Schema):
+    id: UUID
+    created_at: datetime
+    modified_at: datetime | None
+    license_key_id: UUID
+    label: str
+    conditions: dict[str, Any]
+    meta: dict[str, Any]
+
+
+class _CachedLicenseKey(Schema):
+    id: UUID
+    created_at: datetime
+    modified_at: datetime | None
+    organization_id: UUID
+    customer_id: UUID
+    benefit_id: UUID
+    key: str
+    status: LicenseKeyStatus
+    limit_activations: int | None
+    limit_usage: int | None
+    usage: int
+    validations: int
+    last_validated_at: datetime | None
+    expires_at: datetime | None
+    customer: _CachedCustomer
+    activations: list[_CachedActivation]
+
+
+class _CacheEntry(Schema):
+    version: int
+    license_key: _CachedLicenseKey
+
+
+def _get_key(organization_id: UUID, key: str) -> str:
+    return f"{CACHE_KEY_PREFIX}:{organization_id}:{key}"
+
+
+def _get_version_key(organization_id: UUID, key: str) -> str:
+    return f"{_get_key(organization_id, key)}:version"
+
+
+def _build_license_key(cached: _CachedLicenseKey) -> LicenseKey:
+    """
+    Build a transient license key from a cache entry.
+
+    It doesn't belong to any session, so it's only meant to be read.
+    """
+    cached_customer = cached.customer
+    customer = Customer(
+        **cached_customer.model_dump(exclude={"legacy_user_id"}),
+        _legacy_user_id=(
+            cached_customer.legacy_user_id
+            if cached_customer.legacy_user_id != cached_customer.id
+            else None
+        ),
+    )
+    license_key = LicenseKey(
+        **cached.model_dump(exclude={"customer", "activations"}),
+        customer=customer,
+    )
+    set_committed_value(
+        license_key,
+        "activations",
+        [
+            LicenseKeyActivation(**activation.model_dump())
+            for activation in cached.activations
+        ],
+    )
+    return license_key
+
+
+async def get_license_key(
+    redis: Redis, organization_id: UUID, key: str
+) -> tuple[int, LicenseKey | None]:
+    """
+    Get a cached license key, with its customer and activations.
+
+    Returns the current version of the entry, to pass to `set_license_key` on a miss.
+    """
+    raw_version, raw_entry = await redis.mget(
+        _get_version_key(organization_id, key), _get_key(organization_id, key)
+    )
+    version = int(raw_version) if raw_version is not None else 0
+    if raw_entry is not None:
+        entry = _CacheEntry.model_validate_json(raw_entry)
+        if entry.version == version:
+            cache_hits.add(1)
+            return version, _build_license_key(entry.license_key)
+    cache_misses.add(1)
+    return version, None
+
+
+async def set_license_key(redis: Redis, license_key: LicenseKey, version: int) -> None:
+    """
+    Cache a license key, with its customer and activations loaded,
+    unless it was invalidated since `version` was read.
+    """
+    entry = _CacheEntry(
+        version=version,
+        license_key=_CachedLicenseKey.model_validate(license_key),
+    )
+    script = redis.register_script(_SET_SCRIPT)
+    await script(
+        keys=[
+            _get_version_key(license_key.organization_id, license_key.key),
+            _get_key(license_key.organization_id, license_key.key),
+        ],
+        args=[
+            version,
+            entry.model_dump_json(),
+            int(settings.LICENSE_KEY_CACHE_TTL.total_seconds()),
+        ],
+    )
+
+
+async def invalidate_license_key(redis: Redis, organization_id: UUID, key: str) -> None:
+    version_key = _get_version_key(organization_id, key)
+    async with redis.pipeline(transaction=True) as pipeline:
+        pipeline.incr(version_key)
+        # Outlives the entries stored with the previous version
+        pipeline.expire(
+            version_key, int(settings.LICENSE_KEY_CACHE_TTL.total_seconds())
+        )
+        await pipeline.execute()
+
+
+__all__ = ["get_license_key", "set_license_key", "invalidate_license_key"]
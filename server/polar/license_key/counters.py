@@ -0,0 +1,299 @@
+"""
+Write-behind counters of the license keys validations and usage.
+
+Validating a license key increments its counters in Redis, checking the usage
+limit atomically, instead of updating its row on every call: popular apps
+validating on each launch would otherwise contend on a handful of rows.
+
+Redis holds the current value of the counters of the recently validated keys,
+and they're flushed to the database periodically, in a single update.
+A license key modified after its counters were read is left for the next flush,
+so the update doesn't overwrite the change.
+
+Updating the usage directly, like when resetting it, keeps counting the
+validations in Redis meanwhile: once the update is committed, its change is
+applied to the counters, which aren't flushed until then.
+"""
+
+from collections.abc import Sequence
+from datetime import UTC, datetime
+from uuid import UUID
+
+import logfire
+from sqlalchemy.orm.attributes import set_committed_value
+
+from polar.config import settings
+from polar.kit.db.postgres import AsyncSession
+from polar.models import LicenseKey
+from polar.redis import Redis
+
+from .repository import LicenseKeyRepository
+
+KEY_PREFIX = "polar:license_key:counters"
+DIRTY_KEY = f"{KEY_PREFIX}:dirty"
+
+# Number of license keys written at once by the flush
+FLUSH_BATCH_SIZE = 1000
+
+# Expiration of the marker of a usage update, in case it's never applied,
+# like when the update is rolled back
+USAGE_UPDATE_TTL = 300
+
+counters_flushed = logfire.metric_counter(
+    "license_key.counters.flushed",
+    unit="1",
+    description="License keys whose counters were flushed to the database.",
+)
+
+# Initializes the counters from the database values if they're not in Redis yet,
+# then counts the validation, unless the usage would exceed the limit.
+#
+# KEYS: counters, dirty set
+# ARGV: usage, validations, last validated at (ms), usage increment,
+#       usage limit (empty if unlimited), now (ms), TTL (s), license key ID
+# Returns: {validated (0 or 1), usage, validations, last validated at (ms)}
+_INCREMENT_SCRIPT = """
+local counters, dirty = KEYS[1], KEYS[2]
+if redis.call('EXISTS', counters) == 0 then
+    redis.call(
+        'HSET', counters,
+        'usage', ARGV[1], 'validations', ARGV[2], 'last_validated_at', ARGV[3]
+    )
+end
+
+local increment = tonumber(ARGV[4])
+local limit = tonumber(ARGV[5])
+local usage = tonumber(redis.call('HGET', counters, 'usage'))
+if limit and increment > 0 and usage + increment > limit then
+    return {
+        0,
+        usage,
+        tonumber(redis.call('HGET', counters, 'validations')),
+        tonumber(redis.call('HGET', counters, 'last_validated_at')),
+    }
+end
+
+usage = redis.call('HINCRBY', counters, 'usage', increment)
+local validations = redis.call('HINCRBY', counters, 'validations', 1)
+redis.call('HSET', counters, 'last_validated_at', ARGV[6])
+redis.call('EXPIRE', counters, ARGV[7])
+redis.call('SADD', dirty, ARGV[8])
+return {1, usage, validations, tonumber(ARGV[6])}
+"""
+
+# Applies the change of the usage by a committed update, on top of the validations
+# counted meanwhile. If they're not in Redis, initializes the counters from the
+# updated database values instead.
+#
+# KEYS: counters, dirty set, usage update marker
+# ARGV: usage change, usage, validations, last validated at (ms), TTL (s),
+#       license key ID
+_APPLY_USAGE_UPDATE_SCRIPT = """
+local counters, dirty, marker = KEYS[1], KEYS[2], KEYS[3]
+if redis.call('EXISTS', counters) == 1 then
+    redis.call('HINCRBY', counters, 'usage', ARGV[1])
+    redis.call('SADD', dirty, ARGV[6])
+else
+    redis.call(
+        'HSET', counters,
+        'usage', ARGV[2], 'validations', ARGV[3], 'last_validated_at', ARGV[4]
+    )
+    redis.call('EXPIRE', counters, ARGV[5])
+end
+redis.call('DEL', marker)
+"""
+
+_COUNTERS_FIELDS = ("usage", "validations", "last_validated_at")
+
+type _Counters = tuple[int, int, datetime | None]
+
+
+def _get_counters_key(license_key_id: UUID | str) -> str:
+    return f"{KEY_PREFIX}:{license_key_id}"
+
+
+def _get_usage_update_key(license_key_id: UUID | str) -> str:
+    return f"{KEY_PREFIX}:{license_key_id}:usage_update"
+
+
+def _to_timestamp(value: datetime | None) -> int:
+    return int(value.timestamp() * 1000) if value is not None else 0
+
+
+def _from_timestamp(value: int) -> datetime | None:
+    return datetime.fromtimestamp(value / 1000, UTC) if value else None
+
+
+def _parse_counters(values: Sequence[str | bytes | None]) -> _Counters | None:
+    usage, validations, last_validated_at = values
+    if usage is None or validations is None or last_validated_at is None:
+        return None
+    return int(usage), int(validations), _from_timestamp(int(last_validated_at))
+
+
+def _set_counters(license_key: LicenseKey, counters: _Counters) -> None:
+    # Committed values: the license key row isn't updated on the way
+    usage, validations, last_validated_at = counters
+    set_committed_value(license_key, "usage", usage)
+    set_committed_value(license_key, "validations", validations)
+    set_committed_value(license_key, "last_validated_at", last_validated_at)
+
+
+async def increment(
+    redis: Redis, license_key: LicenseKey, *, increment_usage: int = 0
+) -> bool:
+    """
+    Count a validation of the license key, and increment its usage.
+
+    Returns `False`, without counting anything, if the usage would exceed
+    the limit. Either way, the counters of `license_key` are set to
+    their current value.
+    """
+    script = redis.register_script(_INCREMENT_SCRIPT)
+    validated, usage, validations, last_validated_at = await script(
+        keys=[_get_counters_key(license_key.id), DIRTY_KEY],
+        args=[
+            license_key.usage,
+            license_key.validations,
+            _to_timestamp(license_key.last_validated_at),
+            increment_usage,
+            license_key.limit_usage or "",
+            _to_timestamp(datetime.now(UTC)),
+            int(settings.LICENSE_KEY_COUNTERS_TTL.total_seconds()),
+            str(license_key.id),
+        ],
+    )
+    _set_counters(license_key, (usage, validations, _from_timestamp(last_validated_at)))
+    return bool(validated)
+
+
+async def load(redis: Redis, license_keys: Sequence[LicenseKey]) -> None:
+    """Set the counters of the license keys to their current value, if pending."""
+    if not license_keys:
+        return
+    async with redis.pipeline(transaction=False) as pipeline:
+        for license_key in license_keys:
+            pipeline.hmget(_get_counters_key(license_key.id), _COUNTERS_FIELDS)
+        results = await pipeline.execute()
+    for license_key, values in zip(license_keys, results):
+        counters = _parse_counters(values)
+        if counters is not None:
+            _set_counters(license_key, counters)
+
+
+async def load_for_update(redis: Redis, license_key: LicenseKey) -> None:
+    """
+    Set the counters of the license key to their current value, if pending,
+    so they're saved along its next update.
+
+    They're kept in Redis, where the validations go on being counted.
+    """
+    values = await redis.hmget(_get_counters_key(license_key.id), _COUNTERS_FIELDS)
+    counters = _parse_counters(values)
+    if counters is not None:
+        license_key.usage, license_key.validations, license_key.last_validated_at = (
+            counters
+        )
+
+
+async def begin_usage_update(redis: Redis, license_key: LicenseKey) -> None:
+    """
+    Hold off the flush of the counters of the license key, whose usage is
+    being updated, until `apply_usage_update` is called after the commit.
+    """
+    await redis.set(_get_usage_update_key(license_key.id), 1, ex=USAGE_UPDATE_TTL)
+
+
+async def apply_usage_update(
+    redis: Redis, license_key: LicenseKey, usage_change: int
+) -> None:
+    """
+    Apply the committed change of the usage of the license key to its counters.
+
+    `license_key` holds the values committed by the update.
+    """
+    script = redis.register_script(_APPLY_USAGE_UPDATE_SCRIPT)
+    await script(
+        keys=[
+            _get_counters_key(license_key.id),
+            DIRTY_KEY,
+            _get_usage_update_key(license_key.id),
+        ],
+        args=[
+            usage_change,
+            license_key.usage,
+            license_key.validations,
+            _to_timestamp(license_key.last_validated_at),
+            int(settings.LICENSE_KEY_COUNTERS_TTL.total_seconds()),
+            str(license_key.id),
+        ],
+    )
+
+
+async def flush(redis: Redis, session: AsyncSession) -> int:
+    """
+    Write the counters of the license keys validated since the last flush
+    to the database, and return how many were written.
+    """
+    repository = LicenseKeyRepository.from_session(session)
+    flushed = 0
+    skipped: set[UUID] = set()
+    try:
+        while members := await redis.spop(DIRTY_KEY, FLUSH_BATCH_SIZE):
+            # Raw bytes, unless the client decodes the responses
+            license_key_ids = [
+                member.decode() if isinstance(member, bytes) else member
+                for member in members
+            ]
+            try:
+                # Rows modified after this, like by a reset popping the counters, are skipped
+                read_at = datetime.now(UTC)
+                async with redis.pipeline(transaction=False) as pipeline:
+                    for license_key_id in license_key_ids:
+                        pipeline.exists(_get_usage_update_key(license_key_id))
+                        pipeline.hmget(
+                            _get_counters_key(license_key_id), _COUNTERS_FIELDS
+                        )
+                    results = await pipeline.execute()
+
+                counters: dict[UUID, _Counters] = {}
+                for license_key_id, usage_update, values in zip(
+                    license_key_ids, results[::2], results[1::2]
+                ):
+                    # Usage being updated: written once it's applied
+                    if usage_update:
+                        skipped.add(UUID(license_key_id))
+                        continue
+                    license_key_counters = _parse_counters(values)
+                    if license_key_counters is not None:
+                        counters[UUID(license_key_id)] = license_key_counters
+
+                updated: set[UUID] = set()
+                if counters:
+                    updated = await repository.update_counters(
+                        counters, read_at=read_at
+                    )
+                    await session.commit()
+            except Exception:
+                # Don't lose them: they'll be written by the next flush
+                await redis.sadd(DIRTY_KEY, *license_key_ids)
+                raise
+
+            skipped.update(counters.keys() - updated)
+            counters_flushed.add(len(updated))
+            flushed += len(updated)
+    finally:
+        # Written by the next flush, if still pending
+        if skipped:
+            await redis.sadd(DIRTY_KEY, *(str(id) for id in skipped))
+    return flushed
+
+
+__all__ = [
+    "increment",
+    "load",
+    "load_for_update",
+    "begin_usage_update",
+    "apply_usage_update",
+    "flush",
+]
@@ -1,6 +1,7 @@
 from fastapi import Depends, Query
 from pydantic import UUID4
 
+from polar.auth.models import is_organization
 from polar.benefit.schemas import BenefitID
 from polar.exceptions import ResourceNotFound
 from polar.kit.db.postgres import AsyncReadSession, AsyncSession
@@ -10,9 +11,11 @@ from polar.models import LicenseKey, LicenseKeyActivation
 from polar.openapi import APITag
 from polar.organization.schemas import OrganizationID
 from polar.postgres import get_db_read_session, get_db_session
+from polar.redis import Redis, get_redis
 from polar.routing import APIRouter
 
 from . import auth
+from . import counters as license_key_counters
 from .repository import LicenseKeyRepository
 from .schemas import (
     ActivationNotPermitted,
@@ -51,6 +54,7 @@ async def list(
         None, title="BenefitID Filter", description="Filter by benefit ID."
     ),
     session: AsyncReadSession = Depends(get_db_read_session),
+    redis: Redis = Depends(get_redis),
 ) -> ListResource[LicenseKeyRead]:
     """Get license keys connected to the given organization & filters."""
     results, count = await license_key_service.list(
@@ -60,6 +64,7 @@ async def list(
         benefit_id=benefit_id,
         pagination=pagination,
     )
+    await license_key_counters.load(redis, results)
 
     return ListResource.from_paginated_results(
         [LicenseKeyRead.model_validate(result) for result in results],
@@ -81,12 +86,14 @@ async def get(
     auth_subject: auth.LicenseKeysRead,
     id: UUID4,
     session: AsyncReadSession = Depends(get_db_read_session),
+    redis: Redis = Depends(get_redis),
 ) -> LicenseKey:
     """Get a license key."""
     lk = await license_key_service.get(session, auth_subject, id)
     if not lk:
         raise ResourceNotFound()
 
+    await license_key_counters.load(redis, [lk])
     return lk
 
 
@@ -104,13 +111,16 @@ async def update(
     id: UUID4,
     updates: LicenseKeyUpdate,
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
 ) -> LicenseKey:
     """Update a license key."""
     lk = await license_key_service.get(session, auth_subject, id)
     if not lk:
         raise ResourceNotFound()
 
-    updated = await license_key_service.update(session, license_key=lk, updates=updates)
+    updated = await license_key_service.update(
+        session, redis, license_key=lk, updates=updates
+    )
     return updated
 
 
@@ -154,21 +164,32 @@ async def validate(
     auth_subject: auth.LicenseKeysWrite,
     validate: LicenseKeyValidate,
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
 ) -> LicenseKey:
     """Validate a license key."""
-    repository = LicenseKeyRepository.from_session(session)
-    license_key = await repository.get_readable_by_key(
-        validate.key,
-        validate.organization_id,
-        auth_subject,
-        options=repository.get_eager_options(),
-    )
-
-    if license_key is None:
-        raise ResourceNotFound()
+    if is_organization(auth_subject):
+        if validate.organization_id != auth_subject.subject.id:
+            raise ResourceNotFound()
+        license_key = await license_key_service.get_cached_or_raise_by_key(
+            session,
+            redis,
+            organization_id=validate.organization_id,
+            key=validate.key,
+        )
+    else:
+        repository = LicenseKeyRepository.from_session(session)
+        readable_license_key = await repository.get_readable_by_key(
+            validate.key,
+            validate.organization_id,
+            auth_subject,
+            options=repository.get_eager_options(),
+        )
+        if readable_license_key is None:
+            raise ResourceNotFound()
+        license_key = readable_license_key
 
     return await license_key_service.validate(
-        session, license_key=license_key, validate=validate
+        session, redis, license_key=license_key, validate=validate
     )
 
 
@@ -185,6 +206,7 @@ async def activate(
     auth_subject: auth.LicenseKeysWrite,
     activate: LicenseKeyActivate,
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
 ) -> LicenseKeyActivation:
     """Activate a license key instance."""
     repository = LicenseKeyRepository.from_session(session)
@@ -199,7 +221,7 @@ async def activate(
         raise ResourceNotFound()
 
     return await license_key_service.activate(
-        session, license_key=license_key, activate=activate
+        session, redis, license_key=license_key, activate=activate
     )
 
 
@@ -216,6 +238,7 @@ async def deactivate(
     auth_subject: auth.LicenseKeysWrite,
     deactivate: LicenseKeyDeactivate,
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
 ) -> None:
     """Deactivate a license key instance."""
     repository = LicenseKeyRepository.from_session(session)
@@ -230,5 +253,5 @@ async def deactivate(
         raise ResourceNotFound()
 
     await license_key_service.deactivate(
-        session, license_key=license_key, deactivate=deactivate
+        session, redis, license_key=license_key, deactivate=deactivate
     )
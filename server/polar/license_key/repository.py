@@ -1,7 +1,21 @@
+from collections.abc import Mapping
+from datetime import datetime
 from uuid import UUID
 
-from sqlalchemy import Select, select
+from sqlalchemy import (
+    TIMESTAMP,
+    Integer,
+    Select,
+    Uuid,
+    column,
+    func,
+    or_,
+    select,
+    update,
+    values,
+)
 from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 
 from polar.auth.models import AuthSubject, User, is_organization, is_user
 from polar.kit.repository import (
@@ -75,6 +89,87 @@ class LicenseKeyRepository(
         )
         return await self.get_one_or_none(statement)
 
+    async def update_counters(
+        self,
+        counters: Mapping[UUID, tuple[int, int, datetime | None]],
+        *,
+        read_at: datetime,
+    ) -> set[UUID]:
+        """
+        Write the counters of the license keys, read from Redis at `read_at`.
+
+        License keys modified since then are skipped, as their counters may
+        have been reset in the meantime. Returns the IDs of the updated ones.
+        """
+        counters_values = values(
+            column("id", Uuid),
+            column("usage", Integer),
+            column("validations", Integer),
+            column("last_validated_at", TIMESTAMP(timezone=True)),
+            name="counters",
+        ).data(
+            [
+                (id, *license_key_counters)
+                for id, license_key_counters in counters.items()
+            ]
+        )
+        statement = (
+            update(LicenseKey)
+            .where(
+                LicenseKey.id == counters_values.c.id,
+                or_(
+                    LicenseKey.modified_at.is_(None),
+                    LicenseKey.modified_at < read_at,
+                ),
+            )
+            .values(
+                usage=counters_values.c.usage,
+                validations=counters_values.c.validations,
+                last_validated_at=counters_values.c.last_validated_at,
+            )
+            .returning(LicenseKey.id)
+            .execution_options(synchronize_session="fetch")
+        )
+        result = await self.session.execute(statement)
+        return set(result.scalars().all())
+
+    async def increment_activations_count(self, license_key: LicenseKey) -> bool:
+        """
+        Count a new activation of the license key, unless the limit is reached.
+
+        The row stays locked until the end of the transaction, so concurrent
+        activations can't both take the last one.
+        """
+        statement = (
+            update(LicenseKey)
+            .where(
+                LicenseKey.id == license_key.id,
+                LicenseKey.activations_count < LicenseKey.limit_activations,
+            )
+            .values(activations_count=LicenseKey.activations_count + 1)
+            .returning(LicenseKey.activations_count)
+            .execution_options(synchronize_session="fetch")
+        )
+        result = await self.session.execute(statement)
+        activations_count = result.scalar_one_or_none()
+        if activations_count is None:
+            return False
+        set_committed_value(license_key, "activations_count", activations_count)
+        return True
+
+    async def decrement_activations_count(self, license_key: LicenseKey) -> None:
+        statement = (
+            update(LicenseKey)
+            .where(LicenseKey.id == license_key.id)
+            .values(
+                activations_count=func.greatest(LicenseKey.activations_count - 1, 0)
+            )
+            .returning(LicenseKey.activations_count)
+            .execution_options(synchronize_session="fetch")
+        )
+        result = await self.session.execute(statement)
+        set_committed_value(license_key, "activations_count", result.scalar_one())
+
     def get_eager_options(self) -> Options:
         return (
             joinedload(LicenseKey.customer),
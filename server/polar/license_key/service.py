@@ -3,7 +3,7 @@ from typing import cast
 from uuid import UUID
 
 import structlog
-from sqlalchemy import Select, func, select
+from sqlalchemy import Select, select
 from sqlalchemy.orm import joinedload
 
 from polar.auth.models import AuthSubject
@@ -22,7 +22,11 @@ from polar.models import (
     User,
 )
 from polar.postgres import AsyncReadSession, AsyncSession
+from polar.redis import Redis
+from polar.worker import enqueue_job
 
+from . import cache as license_key_cache
+from . import counters as license_key_counters
 from .repository import LicenseKeyRepository
 from .schemas import (
     LicenseKeyActivate,
@@ -91,6 +95,31 @@ class LicenseKeyService:
             raise ResourceNotFound()
         return lk
 
+    async def get_cached_or_raise_by_key(
+        self,
+        session: AsyncSession,
+        redis: Redis,
+        *,
+        organization_id: UUID,
+        key: str,
+    ) -> LicenseKey:
+        """
+        Get a license key, with its customer and activations, from the cache
+        or from the database on a miss.
+
+        A cached license key doesn't belong to the session:
+        it's only meant to be validated.
+        """
+        version, lk = await license_key_cache.get_license_key(
+            redis, organization_id, key
+        )
+        if lk is None:
+            lk = await self.get_or_raise_by_key(
+                session, organization_id=organization_id, key=key
+            )
+            await license_key_cache.set_license_key(redis, lk, version)
+        return lk
+
     async def get_by_grant_or_raise(
         self,
         session: AsyncSession,
@@ -131,21 +160,37 @@ class LicenseKeyService:
     async def update(
         self,
         session: AsyncSession,
+        redis: Redis,
         *,
         license_key: LicenseKey,
         updates: LicenseKeyUpdate,
     ) -> LicenseKey:
+        # Save the pending counters with the update
+        await license_key_counters.load_for_update(redis, license_key)
+        previous_usage = license_key.usage
+
         update_dict = updates.model_dump(exclude_unset=True)
         for key, value in update_dict.items():
             setattr(license_key, key, value)
 
+        # Validations go on counting from the previous usage until it's committed
+        if license_key.usage != previous_usage:
+            await license_key_counters.begin_usage_update(redis, license_key)
+            enqueue_job(
+                "license_key.apply_usage_update",
+                license_key.id,
+                license_key.usage - previous_usage,
+            )
+
         session.add(license_key)
         await session.flush()
+        await self._invalidate_cache(redis, license_key)
         return license_key
 
     async def validate(
         self,
         session: AsyncSession,
+        redis: Redis,
         *,
         license_key: LicenseKey,
         validate: LicenseKeyValidate,
@@ -166,11 +211,16 @@ class LicenseKeyService:
                 raise ResourceNotFound("License key has expired.")
 
         if validate.activation_id:
-            activation = await self.get_activation_or_raise(
-                session,
-                license_key=license_key,
-                activation_id=validate.activation_id,
+            activation = next(
+                (
+                    activation
+                    for activation in license_key.activations
+                    if activation.id == validate.activation_id
+                ),
+                None,
             )
+            if activation is None:
+                raise ResourceNotFound()
             if activation.conditions and validate.conditions != activation.conditions:
                 # Skip logging UGC conditions
                 bound_logger.info("license_key.validate.invalid_conditions")
@@ -188,39 +238,26 @@ class LicenseKeyService:
             )
             raise ResourceNotFound("License key does not match given user.")
 
-        if validate.increment_usage and license_key.limit_usage:
+        validated = await license_key_counters.increment(
+            redis, license_key, increment_usage=validate.increment_usage or 0
+        )
+        if not validated:
+            assert license_key.limit_usage is not None
             remaining = license_key.limit_usage - license_key.usage
-            if validate.increment_usage > remaining:
-                bound_logger.info(
-                    "license_key.validate.insufficient_usage",
-                    usage_remaining=remaining,
-                    usage_requested=validate.increment_usage,
-                )
-                raise BadRequest(f"License key only has {remaining} more usages.")
-
-        license_key.mark_validated(increment_usage=validate.increment_usage)
-        session.add(license_key)
+            bound_logger.info(
+                "license_key.validate.insufficient_usage",
+                usage_remaining=remaining,
+                usage_requested=validate.increment_usage,
+            )
+            raise BadRequest(f"License key only has {remaining} more usages.")
+
         bound_logger.info("license_key.validate")
         return license_key
 
-    async def get_activation_count(
-        self,
-        session: AsyncSession,
-        license_key: LicenseKey,
-    ) -> int:
-        query = select(func.count(LicenseKeyActivation.id)).where(
-            LicenseKeyActivation.license_key_id == license_key.id,
-            LicenseKeyActivation.deleted_at.is_(None),
-        )
-        res = await session.execute(query)
-        count = res.scalar()
-        if count:
-            return count
-        return 0
-
     async def activate(
         self,
         session: AsyncSession,
+        redis: Redis,
         license_key: LicenseKey,
         activate: LicenseKeyActivate,
     ) -> LicenseKeyActivation:
@@ -240,11 +277,8 @@ class LicenseKeyService:
                 "Use the /validate endpoint instead to check license validity."
             )
 
-        current_activation_count = await self.get_activation_count(
-            session,
-            license_key=license_key,
-        )
-        if current_activation_count >= license_key.limit_activations:
+        repository = LicenseKeyRepository.from_session(session)
+        if not await repository.increment_activations_count(license_key):
             log.info(
                 "license_key.activate.limit_reached",
                 license_key_id=license_key.id,
@@ -263,6 +297,7 @@ class LicenseKeyService:
         session.add(instance)
         await session.flush()
         assert instance.id
+        await self._invalidate_cache(redis, license_key)
         log.info(
             "license_key.activate",
             license_key_id=license_key.id,
@@ -276,6 +311,7 @@ class LicenseKeyService:
     async def deactivate(
         self,
         session: AsyncSession,
+        redis: Redis,
         license_key: LicenseKey,
         deactivate: LicenseKeyDeactivate,
     ) -> bool:
@@ -288,6 +324,9 @@ class LicenseKeyService:
         session.add(activation)
         await session.flush()
         assert activation.deleted_at is not None
+        repository = LicenseKeyRepository.from_session(session)
+        await repository.decrement_activations_count(license_key)
+        await self._invalidate_cache(redis, license_key)
         log.info(
             "license_key.deactivate",
             license_key_id=license_key.id,
@@ -301,6 +340,7 @@ class LicenseKeyService:
     async def customer_grant(
         self,
         session: AsyncSession,
+        redis: Redis,
         *,
         customer: Customer,
         benefit: Benefit,
@@ -325,6 +365,7 @@ class LicenseKeyService:
         if license_key_id:
             return await self.customer_update_grant(
                 session,
+                redis,
                 create_schema=create_schema,
                 license_key_id=license_key_id,
             )
@@ -337,6 +378,7 @@ class LicenseKeyService:
     async def customer_update_grant(
         self,
         session: AsyncSession,
+        redis: Redis,
         *,
         license_key_id: UUID,
         create_schema: LicenseKeyCreate,
@@ -364,6 +406,7 @@ class LicenseKeyService:
         session.add(key)
         await session.flush()
         assert key.id is not None
+        await self._invalidate_cache(redis, key)
         log.info(
             "license_key.grant.update",
             license_key_id=key.id,
@@ -395,6 +438,7 @@ class LicenseKeyService:
     async def customer_revoke(
         self,
         session: AsyncSession,
+        redis: Redis,
         customer: Customer,
         benefit: Benefit,
         license_key_id: UUID,
@@ -409,6 +453,7 @@ class LicenseKeyService:
         key.mark_revoked()
         session.add(key)
         await session.flush()
+        await self._invalidate_cache(redis, key)
         log.info(
             "license_key.revoke",
             license_key_id=key.id,
@@ -469,5 +514,16 @@ class LicenseKeyService:
             )
         )
 
+    async def _invalidate_cache(self, redis: Redis, license_key: LicenseKey) -> None:
+        await license_key_cache.invalidate_license_key(
+            redis, license_key.organization_id, license_key.key
+        )
+        # Once more after commit, in case it's cached again meanwhile
+        enqueue_job(
+            "license_key.invalidate_cache",
+            license_key.organization_id,
+            license_key.key,
+        )
+
 
 license_key = LicenseKeyService()
@@ -0,0 +1,44 @@
+from uuid import UUID
+
+from polar.worker import (
+    AsyncSessionMaker,
+    CronTrigger,
+    RedisMiddleware,
+    TaskPriority,
+    actor,
+)
+
+from . import cache as license_key_cache
+from . import counters as license_key_counters
+from .repository import LicenseKeyRepository
+
+
+@actor(
+    actor_name="license_key.flush_counters",
+    cron_trigger=CronTrigger(minute="*"),
+    priority=TaskPriority.LOW,
+)
+async def license_key_flush_counters() -> None:
+    async with AsyncSessionMaker() as session:
+        await license_key_counters.flush(RedisMiddleware.get(), session)
+
+
+@actor(actor_name="license_key.apply_usage_update", priority=TaskPriority.HIGH)
+async def license_key_apply_usage_update(
+    license_key_id: UUID, usage_change: int
+) -> None:
+    async with AsyncSessionMaker() as session:
+        repository = LicenseKeyRepository.from_session(session)
+        license_key = await repository.get_by_id(license_key_id)
+        if license_key is None:
+            return
+        await license_key_counters.apply_usage_update(
+            RedisMiddleware.get(), license_key, usage_change
+        )
+
+
+@actor(actor_name="license_key.invalidate_cache", priority=TaskPriority.HIGH)
+async def license_key_invalidate_cache(organization_id: UUID, key: str) -> None:
+    await license_key_cache.invalidate_license_key(
+        RedisMiddleware.get(), organization_id, key
+    )
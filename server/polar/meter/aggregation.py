@@ -1,14 +1,19 @@
+import json
+from collections.abc import Callable
 from enum import StrEnum
-from typing import Annotated, Any, Literal
+from typing import Annotated, Any, Literal, TypedDict
 
 from pydantic import AfterValidator, BaseModel, Discriminator, TypeAdapter
 from sqlalchemy import (
     ColumnExpressionArgument,
     Dialect,
     Float,
+    FromClause,
     TypeDecorator,
+    cast,
     false,
     func,
+    null,
     true,
 )
 from sqlalchemy.dialects.postgresql import JSONB
@@ -38,6 +43,62 @@ class AggregationFunction(StrEnum):
                 return func.count(func.distinct(attr))
 
 
+class AggregationState(TypedDict):
+    """
+    Mergeable state of an aggregation over a set of events.
+
+    Merging the states of two sets of events gives the state of their union,
+    so an aggregated value can be updated with new events only.
+    """
+
+    events: int
+    sum: float | None
+    min: float | None
+    max: float | None
+    values: list[Any] | None
+    """Distinct values, for unique aggregations."""
+
+
+def merge_aggregation_states(
+    state: AggregationState, other: AggregationState
+) -> AggregationState:
+    values: list[Any] | None = None
+    if state["values"] is not None or other["values"] is not None:
+        distinct_values = {
+            json.dumps(value, sort_keys=True): value
+            for value in (*(state["values"] or []), *(other["values"] or []))
+        }
+        values = list(distinct_values.values())
+
+    return {
+        "events": state["events"] + other["events"],
+        "sum": _merge_optional(sum, state["sum"], other["sum"]),
+        "min": _merge_optional(min, state["min"], other["min"]),
+        "max": _merge_optional(max, state["max"], other["max"]),
+        "values": values,
+    }
+
+
+def _merge_optional(
+    merge: Callable[[tuple[float, float]], float],
+    value: float | None,
+    other: float | None,
+) -> float | None:
+    if value is None:
+        return other
+    if other is None:
+        return value
+    return merge((value, other))
+
+
+def _null_float() -> Any:
+    return cast(null(), Float)
+
+
+def _null_value() -> Any:
+    return cast(null(), JSONB)
+
+
 class CountAggregation(BaseModel):
     func: Literal[AggregationFunction.cnt] = AggregationFunction.cnt
 
@@ -47,6 +108,23 @@ class CountAggregation(BaseModel):
     def get_sql_clause(self, model: type[Any]) -> ColumnExpressionArgument[bool]:
         return true()
 
+    def get_aggregate_value_columns(
+        self, model: type[Any]
+    ) -> tuple[Any, Any, Any, Any]:
+        """
+        Per-event `value_sum`, `value_min`, `value_max` and `value`
+        of a `MeterAggregate`. Counting only needs the number of events.
+        """
+        return _null_float(), _null_float(), _null_float(), _null_value()
+
+    def get_merge_sql_column(self, partials: FromClause) -> Any:
+        """Merge `MeterAggregate`-shaped partial rows into the aggregated value."""
+        return func.sum(partials.c.events)
+
+    def get_state_value(self, state: AggregationState) -> float:
+        """Aggregated value of an `AggregationState`."""
+        return state["events"]
+
     def is_summable(self) -> bool:
         """
         Whether this aggregation can be computed separately across different price groups
@@ -70,13 +148,7 @@ class PropertyAggregation(BaseModel):
     property: Annotated[str, AfterValidator(_strip_metadata_prefix)]
 
     def get_sql_column(self, model: type[Any]) -> Any:
-        if self.property in model._filterable_fields:
-            _, attr = model._filterable_fields[self.property]
-            attr = func.cast(attr, Float)
-        else:
-            attr = model.user_metadata[self.property].as_float()
-
-        return self.func.get_sql_function(attr)
+        return self.func.get_sql_function(self._get_sql_attr(model))
 
     def get_sql_clause(self, model: type[Any]) -> ColumnExpressionArgument[bool]:
         if self.property in model._filterable_fields:
@@ -85,6 +157,53 @@ class PropertyAggregation(BaseModel):
 
         return func.jsonb_typeof(model.user_metadata[self.property]) == "number"
 
+    def get_aggregate_value_columns(
+        self, model: type[Any]
+    ) -> tuple[Any, Any, Any, Any]:
+        """
+        Per-event `value_sum`, `value_min`, `value_max` and `value`
+        of a `MeterAggregate`. The average is merged from the sum and the count.
+        """
+        attr = self._get_sql_attr(model)
+        return attr, attr, attr, _null_value()
+
+    def get_merge_sql_column(self, partials: FromClause) -> Any:
+        """Merge `MeterAggregate`-shaped partial rows into the aggregated value."""
+        match self.func:
+            case AggregationFunction.sum:
+                return func.sum(partials.c.value_sum)
+            case AggregationFunction.max:
+                return func.max(partials.c.value_max)
+            case AggregationFunction.min:
+                return func.min(partials.c.value_min)
+            case AggregationFunction.avg:
+                return func.sum(partials.c.value_sum) / func.nullif(
+                    func.sum(partials.c.events), 0
+                )
+
+    def get_state_value(self, state: AggregationState) -> float:
+        """Aggregated value of an `AggregationState`."""
+        match self.func:
+            case AggregationFunction.sum:
+                value = state["sum"]
+            case AggregationFunction.max:
+                value = state["max"]
+            case AggregationFunction.min:
+                value = state["min"]
+            case AggregationFunction.avg:
+                value = (
+                    state["sum"] / state["events"]
+                    if state["sum"] is not None and state["events"] > 0
+                    else None
+                )
+        return value or 0.0
+
+    def _get_sql_attr(self, model: type[Any]) -> Any:
+        if self.property in model._filterable_fields:
+            _, attr = model._filterable_fields[self.property]
+            return func.cast(attr, Float)
+        return model.user_metadata[self.property].as_float()
+
     def is_summable(self) -> bool:
         """
         Whether this aggregation can be computed separately across different groups
@@ -104,6 +223,29 @@ class UniqueAggregation(BaseModel):
     def get_sql_clause(self, model: type[Any]) -> ColumnExpressionArgument[bool]:
         return true()
 
+    def get_aggregate_value_columns(
+        self, model: type[Any]
+    ) -> tuple[Any, Any, Any, Any]:
+        """
+        Per-event `value_sum`, `value_min`, `value_max` and `value`
+        of a `MeterAggregate`. Keeping the distinct values themselves
+        makes the unique count exactly mergeable across rows.
+        """
+        return (
+            _null_float(),
+            _null_float(),
+            _null_float(),
+            model.user_metadata[self.property],
+        )
+
+    def get_merge_sql_column(self, partials: FromClause) -> Any:
+        """Merge `MeterAggregate`-shaped partial rows into the aggregated value."""
+        return func.count(func.distinct(partials.c.value))
+
+    def get_state_value(self, state: AggregationState) -> float:
+        """Aggregated value of an `AggregationState`."""
+        return len(state["values"] or [])
+
     def is_summable(self) -> bool:
         """
         Whether this aggregation can be computed separately across different groups
@@ -8,6 +8,7 @@ from sqlalchemy import (
     Dialect,
     TypeDecorator,
     and_,
+    bindparam,
     case,
     false,
     func,
@@ -24,6 +25,17 @@ INT_MAX_VALUE = 2_147_483_647
 MAX_STRING_LENGTH = 1000
 
 
+def _get_literal_key(key: str) -> Any:
+    # Render the key inline rather than as a bound parameter: PostgreSQL can
+    # only match an expression index when the key is a constant of the query.
+    return bindparam(None, key, literal_execute=True)
+
+
+def _get_metadata_attr(model: type[Any], key: str) -> Any:
+    """`user_metadata -> 'key'`, with the key inlined so indexes can match it."""
+    return model.user_metadata[_get_literal_key(key)]
+
+
 class FilterOperator(StrEnum):
     eq = "eq"
     ne = "ne"
@@ -56,37 +68,63 @@ class FilterClause(BaseModel):
                 return false()
             return self._get_comparison_clause(attr, self.value)
 
-        attr = model.user_metadata[self.property]
+        attr = _get_metadata_attr(model, self.property)
 
         # The operator is LIKE OR NOT LIKE, treat everything as a string
         if self.operator in (FilterOperator.like, FilterOperator.not_like):
             return self._get_comparison_clause(attr.as_string(), self._get_str_value())
 
-        return case(
-            # The property is a string, compare it with the value as a string
-            (
-                func.jsonb_typeof(attr) == "string",
+        # Only emit the branches the value can match. The string one doesn't
+        # need a cast, so it's a plain comparison of `user_metadata ->> 'key'`
+        # that can be served by the expression index of the key.
+        clauses: list[ColumnExpressionArgument[bool]] = [
+            and_(
+                model.user_metadata.has_key(_get_literal_key(self.property)),
                 self._get_comparison_clause(attr.as_string(), self._get_str_value()),
-            ),
-            # The property is a number
-            (
-                func.jsonb_typeof(attr) == "number",
-                # Compare it with the value if it's a number
-                self._get_comparison_clause(attr.as_float(), self._get_number_value())
-                if isinstance(self.value, int | float)
-                # Otherwise return false
-                else false(),
-            ),
-            # The property is a boolean
-            (
-                func.jsonb_typeof(attr) == "boolean",
-                # Compare it with the value if it's a boolean
-                self._get_comparison_clause(attr.as_boolean(), self.value)
-                if isinstance(self.value, bool)
-                # Otherwise return false
-                else false(),
-            ),
-        )
+                func.jsonb_typeof(attr) == "string",
+            )
+        ]
+        # Casting to number or boolean must only happen on values of that type,
+        # so they're guarded by a CASE, whose evaluation order is guaranteed.
+        if isinstance(self.value, int | float):
+            clauses.append(
+                case(
+                    (
+                        func.jsonb_typeof(attr) == "number",
+                        self._get_comparison_clause(
+                            attr.as_float(), self._get_number_value()
+                        ),
+                    ),
+                    else_=false(),
+                )
+            )
+        if isinstance(self.value, bool):
+            clauses.append(
+                case(
+                    (
+                        func.jsonb_typeof(attr) == "boolean",
+                        self._get_comparison_clause(attr.as_boolean(), self.value),
+                    ),
+                    else_=false(),
+                )
+            )
+        return or_(*clauses)
+
+    def get_indexable_properties(self, model: type[Any]) -> set[str]:
+        """
+        Metadata keys this clause compares as strings,
+        i.e. the ones an expression index can serve.
+        """
+        # Numbers and booleans may also be stored with their own JSON type,
+        # which the index doesn't cover
+        if (
+            self.property in model._filterable_fields
+            or not isinstance(self.value, str)
+            or self.operator
+            in (FilterOperator.ne, FilterOperator.like, FilterOperator.not_like)
+        ):
+            return set()
+        return {self.property}
 
     def _get_comparison_clause(self, attr: Any, value: str | int | bool) -> Any:
         if self.operator == FilterOperator.eq:
@@ -141,6 +179,16 @@ class Filter(BaseModel):
         conjunction = and_ if self.conjunction == FilterConjunction.and_ else or_
         return conjunction(*sql_clauses or (true(),))
 
+    def get_indexable_properties(self, model: type[Any]) -> set[str]:
+        """
+        Metadata keys compared as strings by this filter and its sub-filters,
+        i.e. the ones an expression index can serve.
+        """
+        properties: set[str] = set()
+        for clause in self.clauses:
+            properties |= clause.get_indexable_properties(model)
+        return properties
+
 
 class FilterType(TypeDecorator[Any]):
     impl = JSONB
@@ -0,0 +1,94 @@
+"""
+Partial expression indexes on `events` for the metadata keys compared by meters.
+
+Meter filters compare metadata values as strings with
+`user_metadata ->> 'key'` (see `FilterClause.get_sql_clause`).
+For each of those keys, we maintain an index on
+`(organization_id, (user_metadata ->> 'key')) WHERE user_metadata ? 'key'`,
+so meter queries don't need to scan all the events of the organization.
+Being partial, the index only grows with the events actually carrying the key.
+"""
+
+import hashlib
+from collections.abc import Iterable, Sequence
+
+from sqlalchemy import Dialect, column, select, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+INDEX_NAME_PREFIX = "ix_events_metadata_"
+
+
+def get_metadata_index_name(key: str) -> str:
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return f"{INDEX_NAME_PREFIX}{digest}"
+
+
+def get_create_metadata_index_ddl(
+    key: str, dialect: Dialect, *, concurrently: bool = False
+) -> str:
+    """
+    `CREATE INDEX` statement of a metadata key.
+
+    The key is rendered with the dialect of the connection, exactly like
+    meter filters render it, so PostgreSQL can match the index expression.
+    """
+    user_metadata = column("user_metadata", JSONB)
+    expression = (
+        user_metadata[key]
+        .as_string()
+        .compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    )
+    predicate = user_metadata.has_key(key).compile(
+        dialect=dialect, compile_kwargs={"literal_binds": True}
+    )
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}"
+        f"IF NOT EXISTS {get_metadata_index_name(key)} "
+        f"ON events (organization_id, ({expression})) WHERE {predicate}"
+    )
+
+
+async def ensure_metadata_indexes(
+    connection: AsyncConnection, keys: Iterable[str]
+) -> Sequence[str]:
+    """
+    Create the missing metadata indexes of the given keys, concurrently.
+
+    The connection must be in autocommit mode. Indexes left invalid by
+    a previous failed build are dropped and built again.
+
+    Returns the names of the created indexes.
+    """
+    index_names = {get_metadata_index_name(key): key for key in keys}
+    if not index_names:
+        return []
+
+    result = await connection.execute(
+        select(column("relname"), column("indisvalid"))
+        .select_from(text("pg_index JOIN pg_class ON pg_class.oid = indexrelid"))
+        .where(column("relname").in_(index_names.keys()))
+    )
+    existing = {name: is_valid for name, is_valid in result.tuples().all()}
+
+    created: list[str] = []
+    for name, key in sorted(index_names.items()):
+        is_valid = existing.get(name)
+        if is_valid:
+            continue
+        if is_valid is False:
+            await connection.exec_driver_sql(
+                f"DROP INDEX CONCURRENTLY IF EXISTS {name}"
+            )
+        await connection.exec_driver_sql(
+            get_create_metadata_index_ddl(key, connection.dialect, concurrently=True)
+        )
+        created.append(name)
+    return created
+
+
+__all__ = [
+    "ensure_metadata_indexes",
+    "get_create_metadata_index_ddl",
+    "get_metadata_index_name",
+]
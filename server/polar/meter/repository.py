@@ -1,10 +1,40 @@
+from collections.abc import Sequence
+from datetime import datetime
+from typing import Any
 from uuid import UUID
 
-from sqlalchemy import Select, select
+from sqlalchemy import (
+    CTE,
+    ColumnExpressionArgument,
+    Select,
+    String,
+    and_,
+    case,
+    cast,
+    delete,
+    exists,
+    func,
+    literal,
+    or_,
+    select,
+    text,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import insert
 
 from polar.auth.models import AuthSubject, Organization, User, is_organization, is_user
+from polar.event.repository import EventRepository
+from polar.kit.metadata import MetadataQuery, get_metadata_clause
 from polar.kit.repository import RepositoryBase, RepositoryIDMixin
-from polar.models import Meter, UserOrganization
+from polar.kit.time_queries import sql_bucket_range
+from polar.models import (
+    Customer,
+    Event,
+    Meter,
+    MeterAggregate,
+    MeterBillingRange,
+    UserOrganization,
+)
 
 
 class MeterRepository(RepositoryBase[Meter], RepositoryIDMixin[Meter, UUID]):
@@ -16,6 +46,15 @@ class MeterRepository(RepositoryBase[Meter], RepositoryIDMixin[Meter, UUID]):
         statement = self.get_readable_statement(auth_subject).where(Meter.id == id)
         return await self.get_one_or_none(statement)
 
+    async def get_all_by_events(self, event_ids: Sequence[UUID]) -> Sequence[Meter]:
+        """Return the meters of the organizations the given events belong to."""
+        statement = self.get_base_statement().where(
+            Meter.organization_id.in_(
+                select(Event.organization_id).where(Event.id.in_(event_ids))
+            )
+        )
+        return await self.get_all(statement)
+
     def get_readable_statement(
         self, auth_subject: AuthSubject[User | Organization]
     ) -> Select[tuple[Meter]]:
@@ -37,3 +76,352 @@ class MeterRepository(RepositoryBase[Meter], RepositoryIDMixin[Meter, UUID]):
             )
 
         return statement
+
+
+class MeterBillingRangeRepository(
+    RepositoryBase[MeterBillingRange], RepositoryIDMixin[MeterBillingRange, UUID]
+):
+    model = MeterBillingRange
+
+    async def get_all_by_meter(self, meter_id: UUID) -> Sequence[MeterBillingRange]:
+        statement = (
+            self.get_base_statement()
+            .where(MeterBillingRange.meter_id == meter_id)
+            .order_by(MeterBillingRange.start_timestamp.asc())
+        )
+        return await self.get_all(statement)
+
+    async def get_last_end_timestamp(self, meter_id: UUID) -> datetime | None:
+        statement = select(func.max(MeterBillingRange.end_timestamp)).where(
+            MeterBillingRange.meter_id == meter_id
+        )
+        return await self.session.scalar(statement)
+
+    async def get_pending_for_update(self, id: UUID) -> MeterBillingRange | None:
+        """
+        Lock a range which is not completed yet.
+
+        Returns `None` if the range is completed, or locked by another worker.
+        """
+        statement = (
+            self.get_base_statement()
+            .where(
+                MeterBillingRange.id == id,
+                MeterBillingRange.completed_at.is_(None),
+            )
+            .with_for_update(skip_locked=True)
+        )
+        return await self.get_one_or_none(statement)
+
+    async def delete_all(self, billing_ranges: Sequence[MeterBillingRange]) -> None:
+        statement = delete(MeterBillingRange).where(
+            MeterBillingRange.id.in_(
+                [billing_range.id for billing_range in billing_ranges]
+            )
+        )
+        await self.session.execute(statement)
+
+
+class MeterAggregateRepository(RepositoryBase[MeterAggregate]):
+    model = MeterAggregate
+
+    async def refresh(self, meter: Meter, event_ids: Sequence[UUID]) -> None:
+        """
+        Apply newly ingested events to the aggregates of a meter.
+
+        The partial aggregates of the events are merged into the existing rows,
+        so each event must be applied once: the `event.ingested` job does so,
+        its transaction being rolled back on failure.
+
+        If the aggregates were rebuilt since the events were ingested, they may
+        already include them: the hours and customers touched by the events
+        are then recomputed from the raw events instead.
+        """
+        await self._lock(meter)
+
+        # Read once locked, so a concurrent rebuild is seen
+        aggregates_built_at = await self.session.scalar(
+            select(Meter.aggregates_built_at).where(Meter.id == meter.id)
+        )
+        # Not built yet: the pending build will include the events
+        if aggregates_built_at is None:
+            return
+
+        events_clause = and_(
+            Event.id.in_(event_ids),
+            Event.organization_id == meter.organization_id,
+        )
+        first_ingested_at = await self.session.scalar(
+            select(func.min(Event.ingested_at)).where(events_clause)
+        )
+        if first_ingested_at is None:
+            return
+
+        if first_ingested_at > aggregates_built_at:
+            await self._insert(
+                meter, self._get_aggregates_statement(meter).where(events_clause)
+            )
+            return
+
+        touched = (
+            select(
+                _get_bucket(Event.timestamp).label("bucket"),
+                Event.customer_id,
+                Event.external_customer_id,
+            )
+            .where(events_clause)
+            .distinct()
+            .subquery("touched")
+        )
+        await self.session.execute(
+            delete(MeterAggregate).where(
+                MeterAggregate.meter_id == meter.id,
+                exists().where(
+                    touched.c.bucket == MeterAggregate.bucket,
+                    touched.c.customer_id.is_not_distinct_from(
+                        MeterAggregate.customer_id
+                    ),
+                    touched.c.external_customer_id.is_not_distinct_from(
+                        MeterAggregate.external_customer_id
+                    ),
+                ),
+            )
+        )
+        await self._insert(
+            meter,
+            self._get_aggregates_statement(meter).join(
+                touched,
+                and_(
+                    Event.timestamp >= touched.c.bucket,
+                    Event.timestamp < touched.c.bucket + text("'1 hour'::interval"),
+                    Event.customer_id.is_not_distinct_from(touched.c.customer_id),
+                    Event.external_customer_id.is_not_distinct_from(
+                        touched.c.external_customer_id
+                    ),
+                ),
+            ),
+        )
+
+    async def rebuild(self, meter: Meter) -> None:
+        """Recompute all the aggregates of a meter from its raw events."""
+        await self._lock(meter)
+        await self.session.execute(
+            delete(MeterAggregate).where(MeterAggregate.meter_id == meter.id)
+        )
+        await self._insert(meter, self._get_aggregates_statement(meter))
+
+    def get_partials_cte(
+        self,
+        meter: Meter,
+        timestamp_series: CTE,
+        *,
+        customer_id: Sequence[UUID] | None = None,
+        external_customer_id: Sequence[str] | None = None,
+        metadata: MetadataQuery | None = None,
+    ) -> CTE:
+        """
+        Partial aggregation states of a meter, matched to the buckets of a series.
+
+        Each row has the shape of a `MeterAggregate`, with the `timestamp` of the
+        bucket it belongs to and the `resolved_customer_id`, so they can be merged
+        with `Aggregation.get_merge_sql_column`.
+
+        Once the aggregates of the meter are built, whole hours are read from them
+        and only the edges of the buckets not aligned on UTC hours are read
+        from the raw events. Aggregates don't keep the events metadata,
+        so filtering on it always reads the raw events.
+        """
+        event_repository = EventRepository.from_session(self.session)
+        bucket_start = timestamp_series.c.bucket_start
+        bucket_end = timestamp_series.c.bucket_end
+
+        event_clauses: list[ColumnExpressionArgument[bool]] = [
+            Event.organization_id == meter.organization_id,
+            event_repository.get_meter_clause(meter),
+        ]
+        if customer_id is not None:
+            event_clauses.append(
+                event_repository.get_customer_id_filter_clause(customer_id)
+            )
+        if external_customer_id is not None:
+            event_clauses.append(
+                event_repository.get_external_customer_id_filter_clause(
+                    external_customer_id
+                )
+            )
+        if metadata is not None:
+            event_clauses.append(get_metadata_clause(Event, metadata))
+
+        statements: list[Select[Any]] = []
+        if meter.aggregates_built_at is not None and metadata is None:
+            aggregates_start = _get_bucket(
+                bucket_start
+                + text("'1 hour'::interval")
+                - text("'1 microsecond'::interval")
+            )
+            aggregates_end = _get_bucket(bucket_end)
+            event_clauses.append(
+                or_(
+                    and_(
+                        Event.timestamp >= bucket_start,
+                        Event.timestamp < aggregates_start,
+                    ),
+                    and_(
+                        Event.timestamp >= aggregates_end,
+                        Event.timestamp < bucket_end,
+                    ),
+                )
+            )
+
+            aggregate_clauses: list[ColumnExpressionArgument[bool]] = [
+                MeterAggregate.meter_id == meter.id,
+                MeterAggregate.bucket >= aggregates_start,
+                MeterAggregate.bucket < aggregates_end,
+            ]
+            if customer_id is not None:
+                aggregate_clauses.append(
+                    or_(
+                        MeterAggregate.customer_id.in_(customer_id),
+                        MeterAggregate.external_customer_id.in_(
+                            select(Customer.external_id).where(
+                                Customer.id.in_(customer_id)
+                            )
+                        ),
+                    )
+                )
+            if external_customer_id is not None:
+                aggregate_clauses.append(
+                    or_(
+                        MeterAggregate.external_customer_id.in_(external_customer_id),
+                        MeterAggregate.customer_id.in_(
+                            select(Customer.id).where(
+                                Customer.external_id.in_(external_customer_id)
+                            )
+                        ),
+                    )
+                )
+            statements.append(
+                select(
+                    timestamp_series.c.timestamp,
+                    case(
+                        (
+                            MeterAggregate.customer_id.is_not(None),
+                            cast(MeterAggregate.customer_id, String),
+                        ),
+                        else_=MeterAggregate.external_customer_id,
+                    ).label("resolved_customer_id"),
+                    MeterAggregate.events,
+                    MeterAggregate.value_sum,
+                    MeterAggregate.value_min,
+                    MeterAggregate.value_max,
+                    MeterAggregate.value,
+                ).select_from(
+                    timestamp_series.join(MeterAggregate, and_(*aggregate_clauses))
+                )
+            )
+        else:
+            event_clauses.append(sql_bucket_range(Event.timestamp, timestamp_series))
+
+        value_sum, value_min, value_max, value = (
+            meter.aggregation.get_aggregate_value_columns(Event)
+        )
+        statements.append(
+            select(
+                timestamp_series.c.timestamp,
+                Event.resolved_customer_id.label("resolved_customer_id"),
+                literal(1).label("events"),
+                value_sum.label("value_sum"),
+                value_min.label("value_min"),
+                value_max.label("value_max"),
+                value.label("value"),
+            ).select_from(timestamp_series.join(Event, and_(*event_clauses)))
+        )
+
+        if len(statements) == 1:
+            return statements[0].cte("partials")
+        return union_all(*statements).cte("partials")
+
+    async def _lock(self, meter: Meter) -> None:
+        """
+        Serialize concurrent refreshes of the same meter
+        with a transaction-level advisory lock.
+        """
+        await self.session.execute(
+            select(func.pg_advisory_xact_lock(func.hashtext(str(meter.id))))
+        )
+
+    def _get_aggregates_statement(self, meter: Meter) -> Select[Any]:
+        """Aggregate the raw events of a meter, with the columns of `_insert`."""
+        event_repository = EventRepository.from_session(self.session)
+        bucket = _get_bucket(Event.timestamp)
+        value_sum, value_min, value_max, value = (
+            meter.aggregation.get_aggregate_value_columns(Event)
+        )
+        return (
+            select(
+                func.gen_random_uuid(),
+                literal(meter.id),
+                bucket,
+                Event.customer_id,
+                Event.external_customer_id,
+                value,
+                func.count(Event.id),
+                func.sum(value_sum),
+                func.min(value_min),
+                func.max(value_max),
+            )
+            .where(
+                Event.organization_id == meter.organization_id,
+                event_repository.get_meter_clause(meter),
+            )
+            .group_by(bucket, Event.customer_id, Event.external_customer_id, value)
+        )
+
+    async def _insert(self, meter: Meter, statement: Select[Any]) -> None:
+        """Insert aggregates, merging them into the existing rows if any."""
+        insert_statement = insert(MeterAggregate).from_select(
+            [
+                "id",
+                "meter_id",
+                "bucket",
+                "customer_id",
+                "external_customer_id",
+                "value",
+                "events",
+                "value_sum",
+                "value_min",
+                "value_max",
+            ],
+            statement,
+        )
+        excluded = insert_statement.excluded
+        await self.session.execute(
+            insert_statement.on_conflict_do_update(
+                index_elements=[
+                    "meter_id",
+                    "bucket",
+                    "customer_id",
+                    "external_customer_id",
+                    "value",
+                ],
+                set_={
+                    "events": MeterAggregate.events + excluded.events,
+                    "value_sum": func.coalesce(
+                        MeterAggregate.value_sum + excluded.value_sum,
+                        MeterAggregate.value_sum,
+                        excluded.value_sum,
+                    ),
+                    # `LEAST` and `GREATEST` ignore `NULL` values
+                    "value_min": func.least(
+                        MeterAggregate.value_min, excluded.value_min
+                    ),
+                    "value_max": func.greatest(
+                        MeterAggregate.value_max, excluded.value_max
+                    ),
+                },
+            )
+        )
+
+
+def _get_bucket(column: ColumnExpressionArgument[Any]) -> Any:
+    return func.date_trunc("hour", column, "UTC")
@@ -3,12 +3,11 @@ from collections.abc import Sequence
 from datetime import UTC, datetime
 from typing import Any
 
+import structlog
 from sqlalchemy import (
     ColumnElement,
-    ColumnExpressionArgument,
     Select,
     UnaryExpression,
-    and_,
     asc,
     cte,
     desc,
@@ -23,33 +22,41 @@ from polar.billing_entry.repository import BillingEntryRepository
 from polar.config import settings
 from polar.event.repository import EventRepository
 from polar.exceptions import PolarError, PolarRequestValidationError, ValidationError
-from polar.kit.metadata import MetadataQuery, apply_metadata_clause, get_metadata_clause
+from polar.kit.metadata import MetadataQuery, apply_metadata_clause
 from polar.kit.pagination import PaginationParams
 from polar.kit.sorting import Sorting
-from polar.kit.time_queries import TimeInterval, get_timestamp_series_cte
-from polar.meter.aggregation import AggregationFunction
+from polar.kit.time_queries import MIN_DATETIME, TimeInterval, get_timestamp_series_cte
+from polar.kit.utils import utc_now
+from polar.logging import Logger
+from polar.meter.aggregation import AggregationFunction, AggregationState
 from polar.models import (
     Benefit,
-    BillingEntry,
     Customer,
     Event,
     Meter,
+    MeterBillingRange,
     Product,
     ProductPriceMeteredUnit,
-    SubscriptionProductPrice,
 )
 from polar.organization.resolver import get_payload_organization
 from polar.postgres import AsyncReadSession, AsyncSession
-from polar.subscription.repository import (
-    CustomerSubscriptionProductPrice,
-    SubscriptionProductPriceRepository,
-)
+from polar.subscription.repository import SubscriptionProductPriceRepository
 from polar.worker import enqueue_job
 
-from .repository import MeterRepository
+from .indexes import ensure_metadata_indexes
+from .repository import (
+    MeterAggregateRepository,
+    MeterBillingRangeRepository,
+    MeterRepository,
+)
 from .schemas import MeterCreate, MeterQuantities, MeterQuantity, MeterUpdate
 from .sorting import MeterSortProperty
 
+log: Logger = structlog.get_logger()
+
+# Ingestion timestamp before any event, for meters never billed
+BILLING_START = MIN_DATETIME.replace(tzinfo=UTC)
+
 
 class MeterError(PolarError): ...
 
@@ -150,6 +157,10 @@ class MeterService:
             meter, update_dict={"last_billed_event": last_billed_event}
         )
 
+        enqueue_job("meter.build_aggregates", meter.id)
+        if settings.METER_METADATA_INDEXES_ENABLED:
+            enqueue_job("meter.index_metadata", meter.id)
+
         return meter
 
     async def update(
@@ -187,6 +198,13 @@ class MeterService:
         if meter_update.aggregation is not None:
             update_dict["aggregation"] = meter_update.aggregation
 
+        # The aggregates don't match the definition anymore: rebuild them
+        if "filter" in update_dict or "aggregation" in update_dict:
+            update_dict["aggregates_built_at"] = None
+            enqueue_job("meter.build_aggregates", meter.id)
+        if "filter" in update_dict and settings.METER_METADATA_INDEXES_ENABLED:
+            enqueue_job("meter.index_metadata", meter.id)
+
         # Handle archiving/unarchiving
         if meter_update.is_archived is not None:
             if meter_update.is_archived:
@@ -284,73 +302,56 @@ class MeterService:
         )
         timestamp_column: ColumnElement[datetime] = timestamp_series.c.timestamp
 
-        event_clauses: list[ColumnExpressionArgument[bool]] = [
-            Event.organization_id == meter.organization_id,
-        ]
-        event_repository = EventRepository.from_session(session)
-        if customer_id is not None:
-            event_clauses.append(
-                event_repository.get_customer_id_filter_clause(customer_id)
+        aggregate_repository = MeterAggregateRepository.from_session(session)
+        partials = aggregate_repository.get_partials_cte(
+            meter,
+            timestamp_series,
+            customer_id=customer_id,
+            external_customer_id=external_customer_id,
+            metadata=metadata,
+        )
+        all_partials = partials.alias("all_partials")
+        aggregation = meter.aggregation
+
+        if customer_aggregation_function is None:
+            quantity_column = aggregation.get_merge_sql_column(partials)
+            total_statement = select(aggregation.get_merge_sql_column(all_partials))
+            joined_partials = partials
+        else:
+            customer_quantities = cte(
+                select(
+                    partials.c.timestamp,
+                    aggregation.get_merge_sql_column(partials).label("quantity"),
+                ).group_by(partials.c.timestamp, partials.c.resolved_customer_id)
             )
-        if external_customer_id is not None:
-            event_clauses.append(
-                event_repository.get_external_customer_id_filter_clause(
-                    external_customer_id
-                )
+            customer_totals = (
+                select(aggregation.get_merge_sql_column(all_partials).label("total"))
+                .group_by(all_partials.c.resolved_customer_id)
+                .subquery()
             )
-        if metadata is not None:
-            event_clauses.append(get_metadata_clause(Event, metadata))
-        event_clauses.append(event_repository.get_meter_clause(meter))
+            quantity_column = customer_aggregation_function.get_sql_function(
+                customer_quantities.c.quantity
+            )
+            total_statement = select(
+                customer_aggregation_function.get_sql_function(customer_totals.c.total)
+            )
+            joined_partials = customer_quantities
 
         statement = (
             select(
                 timestamp_column.label("timestamp"),
-                func.coalesce(
-                    meter.aggregation.get_sql_column(Event).filter(
-                        interval.sql_date_trunc(Event.timestamp)
-                        == interval.sql_date_trunc(timestamp_column),
-                    ),
-                    0,
-                ).label("quantity"),
-                func.coalesce(
-                    meter.aggregation.get_sql_column(Event).filter(
-                        interval.sql_date_trunc(Event.timestamp)
-                        >= interval.sql_date_trunc(start_timestamp),
-                        interval.sql_date_trunc(Event.timestamp)
-                        <= interval.sql_date_trunc(end_timestamp),
-                    ),
-                    0,
-                ).label("total"),
+                func.coalesce(quantity_column, 0).label("quantity"),
+                func.coalesce(total_statement.scalar_subquery(), 0).label("total"),
+            )
+            .join(
+                joined_partials,
+                onclause=joined_partials.c.timestamp == timestamp_column,
+                isouter=True,
             )
-            .join(Event, onclause=and_(*event_clauses), isouter=True)
             .group_by(timestamp_column)
             .order_by(timestamp_column.asc())
         )
 
-        if customer_aggregation_function is not None:
-            inner_statement = cte(
-                statement.add_columns(Event.resolved_customer_id).group_by(
-                    timestamp_column, Event.resolved_customer_id
-                )
-            )
-            statement = (
-                select(
-                    timestamp_column.label("timestamp"),
-                    customer_aggregation_function.get_sql_function(
-                        inner_statement.c.quantity
-                    ).label("quantity"),
-                    customer_aggregation_function.get_sql_function(
-                        inner_statement.c.total
-                    ).label("total"),
-                )
-                .join(
-                    inner_statement,
-                    onclause=inner_statement.c.timestamp == timestamp_column,
-                )
-                .group_by(timestamp_column)
-                .order_by(timestamp_column.asc())
-            )
-
         total = 0.0
         quantities: list[MeterQuantity] = []
         result = await session.stream(
@@ -363,100 +364,260 @@ class MeterService:
 
         return MeterQuantities(quantities=quantities, total=total)
 
+    async def build_aggregates(self, session: AsyncSession, meter: Meter) -> None:
+        """
+        Build the aggregates of a meter from all its raw events.
+
+        From then on, they're kept up to date when events are ingested,
+        and `get_quantities` reads from them.
+        """
+        aggregate_repository = MeterAggregateRepository.from_session(session)
+        await aggregate_repository.rebuild(meter)
+        repository = MeterRepository.from_session(session)
+        await repository.update(meter, update_dict={"aggregates_built_at": utc_now()})
+
+    async def index_metadata(self, session: AsyncSession, meter: Meter) -> None:
+        """
+        Create the indexes serving the metadata comparisons of the meter filter.
+
+        Indexes are built concurrently, so the session must not have started
+        a transaction yet: its connection is switched to autocommit mode.
+        """
+        connection = await session.connection(
+            execution_options={"isolation_level": "AUTOCOMMIT"}
+        )
+        created = await ensure_metadata_indexes(
+            connection, meter.filter.get_indexable_properties(Event)
+        )
+        for index_name in created:
+            log.info(
+                "Created meter metadata index", meter_id=meter.id, index=index_name
+            )
+
     async def enqueue_billing(self, session: AsyncSession) -> None:
         repository = MeterRepository.from_session(session)
         statement = repository.get_base_statement().order_by(Meter.created_at.asc())
         async for meter in repository.stream(statement):
             enqueue_job("meter.billing_entries", meter.id)
 
-    async def _create_subscription_holder_billing_entry(
-        self,
-        session: AsyncSession,
-        event: Event,
-        customer: "Customer",
-        subscription_product_price: SubscriptionProductPrice,
-    ) -> BillingEntry:
-        billing_entry_repository = BillingEntryRepository.from_session(session)
-        return await billing_entry_repository.create(
-            BillingEntry.from_metered_event(customer, subscription_product_price, event)
-        )
-
     async def create_billing_entries(
         self, session: AsyncSession, meter: Meter
-    ) -> Sequence[BillingEntry]:
-        event_repository = EventRepository.from_session(session)
-        statement = (
-            event_repository.get_base_statement()
+    ) -> set[uuid.UUID]:
+        """
+        Bill all the meter events ingested since the last run, in this session.
+
+        It goes through the same ranges as the parallel pipeline
+        (see `enqueue_billing_ranges`), one after the other.
+
+        Returns the IDs of the subscriptions having new billing entries.
+        """
+        updated_subscriptions: set[uuid.UUID] = set()
+        range_repository = MeterBillingRangeRepository.from_session(session)
+        for billing_range in await self.plan_billing_ranges(session, meter):
+            locked_range = await range_repository.get_pending_for_update(
+                billing_range.id
+            )
+            if locked_range is not None:
+                updated_subscriptions |= await self._bill_range(
+                    session, meter, locked_range
+                )
+
+        for subscription_id in updated_subscriptions:
+            enqueue_job("subscription.update_meters", subscription_id)
+
+        return updated_subscriptions
+
+    async def enqueue_billing_ranges(self, session: AsyncSession, meter: Meter) -> None:
+        """Plan the billing ranges of the meter and bill them in parallel."""
+        for billing_range in await self.plan_billing_ranges(session, meter):
+            enqueue_job("meter.billing_range", billing_range.id)
+
+    async def plan_billing_ranges(
+        self, session: AsyncSession, meter: Meter
+    ) -> Sequence[MeterBillingRange]:
+        """
+        Split the events ingested after the last planned range into new ranges
+        of at most `METER_BILLING_RANGE_SIZE` events.
+
+        Returns all the ranges of the meter not completed yet, including the ones
+        planned previously, so ranges interrupted by a crash are billed again.
+        """
+        watermark = await self._lock_billing_watermark(session, meter)
+        range_repository = MeterBillingRangeRepository.from_session(session)
+        start = await range_repository.get_last_end_timestamp(meter.id) or watermark
+
+        statement = self._get_billable_events_statement(session, meter).where(
+            Event.ingested_at > start
+        )
+        numbered = (
+            statement.with_only_columns(
+                Event.ingested_at,
+                func.row_number().over(order_by=Event.ingested_at.asc()).label("row"),
+                func.count().over().label("total"),
+            )
+            .order_by(None)
+            .subquery()
+        )
+        ends_statement = (
+            select(numbered.c.ingested_at)
             .where(
-                Event.organization_id == meter.organization_id,
-                Event.customer.is_not(None),
                 or_(
-                    # Events matching meter definitions
-                    event_repository.get_meter_clause(meter),
-                    # System events impacting the meter balance
-                    event_repository.get_meter_system_clause(meter),
-                ),
+                    numbered.c.row % settings.METER_BILLING_RANGE_SIZE == 0,
+                    numbered.c.row == numbered.c.total,
+                )
             )
-            .order_by(Event.ingested_at.asc())
-            .options(*event_repository.get_eager_options())
+            .distinct()
+            .order_by(numbered.c.ingested_at.asc())
         )
-        last_billed_event = meter.last_billed_event
-        if last_billed_event is not None:
-            statement = statement.where(
-                Event.ingested_at > last_billed_event.ingested_at
+        for end in await session.scalars(ends_statement):
+            await range_repository.create(
+                MeterBillingRange(
+                    meter_id=meter.id, start_timestamp=start, end_timestamp=end
+                )
             )
+            start = end
+        await session.flush()
+
+        return [
+            billing_range
+            for billing_range in await range_repository.get_all_by_meter(meter.id)
+            if billing_range.completed_at is None
+        ]
+
+    async def bill_range(
+        self, session: AsyncSession, billing_range_id: uuid.UUID
+    ) -> set[uuid.UUID]:
+        """
+        Create the billing entries of a range, and advance the meter's
+        `last_billed_event` if all the previous ranges are completed.
+
+        Does nothing if the range is already completed or being billed.
+
+        Returns the IDs of the subscriptions having new billing entries.
+        """
+        range_repository = MeterBillingRangeRepository.from_session(session)
+        billing_range = await range_repository.get_pending_for_update(billing_range_id)
+        if billing_range is None:
+            return set()
+
+        repository = MeterRepository.from_session(session)
+        meter = await repository.get_by_id(billing_range.meter_id)
+        assert meter is not None
+
+        updated_subscriptions = await self._bill_range(session, meter, billing_range)
+        for subscription_id in updated_subscriptions:
+            enqueue_job("subscription.update_meters", subscription_id)
+
+        return updated_subscriptions
+
+    async def _bill_range(
+        self, session: AsyncSession, meter: Meter, billing_range: MeterBillingRange
+    ) -> set[uuid.UUID]:
+        statement = self._get_billable_events_statement(session, meter).where(
+            Event.ingested_at > billing_range.start_timestamp,
+            Event.ingested_at <= billing_range.end_timestamp,
+        )
+        events = statement.with_only_columns(
+            Event.id,
+            Event.timestamp,
+            func.coalesce(
+                Event.customer_id,
+                select(Customer.id)
+                .where(
+                    Customer.external_id == Event.external_customer_id,
+                    Customer.organization_id == Event.organization_id,
+                )
+                .limit(1)
+                .scalar_subquery(),
+            ).label("customer_id"),
+        ).subquery()
 
         subscription_product_price_repository = (
             SubscriptionProductPriceRepository.from_session(session)
         )
-        customer_price_map: dict[
-            uuid.UUID, CustomerSubscriptionProductPrice | None
-        ] = {}
+        prices = subscription_product_price_repository.get_metered_prices_by_customer_statement(
+            meter.id
+        ).subquery()
 
-        entries: list[BillingEntry] = []
-        updated_subscriptions: set[uuid.UUID] = set()
-        last_event: Event | None = None
-        async for event in event_repository.stream(statement):
-            last_event = event
-            customer = event.customer
-            assert customer is not None
-
-            # Retrieve the paying customer and subscription product price
-            try:
-                customer_price = customer_price_map[customer.id]
-            except KeyError:
-                customer_price = await subscription_product_price_repository.get_by_customer_and_meter(
-                    customer.id, meter.id
-                )
-                customer_price_map[customer.id] = customer_price
+        billing_entry_repository = BillingEntryRepository.from_session(session)
+        updated_subscriptions = await billing_entry_repository.create_metered(
+            events, prices
+        )
 
-            if customer_price is None:
-                continue
+        billing_range.completed_at = utc_now()
+        session.add(billing_range)
+        await self._advance_billing_watermark(session, meter)
 
-            # Get the paying customer (billing manager) from the subscription
-            paying_customer = (
-                customer_price.subscription_product_price.subscription.customer
-            )
+        return updated_subscriptions
 
-            entry = await self._create_subscription_holder_billing_entry(
-                session,
-                event,
-                paying_customer,
-                customer_price.subscription_product_price,
-            )
-            entries.append(entry)
-            if entry.subscription is not None:
-                updated_subscriptions.add(entry.subscription.id)
+    async def _advance_billing_watermark(
+        self, session: AsyncSession, meter: Meter
+    ) -> None:
+        """
+        Move `last_billed_event` past the completed ranges following it,
+        and delete them: they're not needed anymore.
+
+        Ranges can complete in any order: the watermark stops at the first
+        range not completed yet.
+        """
+        watermark = await self._lock_billing_watermark(session, meter)
+        range_repository = MeterBillingRangeRepository.from_session(session)
+
+        completed_ranges: list[MeterBillingRange] = []
+        for billing_range in await range_repository.get_all_by_meter(meter.id):
+            if (
+                billing_range.completed_at is None
+                or billing_range.start_timestamp != watermark
+            ):
+                break
+            completed_ranges.append(billing_range)
+            watermark = billing_range.end_timestamp
+
+        if not completed_ranges:
+            return
 
-        meter.last_billed_event = (
-            last_event if last_event is not None else last_billed_event
+        event_repository = EventRepository.from_session(session)
+        last_billed_event = await event_repository.get_one_or_none(
+            self._get_billable_events_statement(session, meter)
+            .where(Event.ingested_at <= watermark)
+            .order_by(Event.ingested_at.desc())
+            .limit(1)
         )
+        meter.last_billed_event = last_billed_event
         session.add(meter)
+        await range_repository.delete_all(completed_ranges)
 
-        for subscription_id in updated_subscriptions:
-            enqueue_job("subscription.update_meters", subscription_id)
+    async def _lock_billing_watermark(
+        self, session: AsyncSession, meter: Meter
+    ) -> datetime:
+        """
+        Lock the meter row until the end of the transaction,
+        and return the ingestion timestamp of its `last_billed_event`.
+        """
+        statement = (
+            select(Event.ingested_at)
+            .select_from(Meter)
+            .join(Event, onclause=Event.id == Meter.last_billed_event_id, isouter=True)
+            .where(Meter.id == meter.id)
+            .with_for_update(of=Meter)
+        )
+        watermark = await session.scalar(statement)
+        return watermark or BILLING_START
 
-        return entries
+    def _get_billable_events_statement(
+        self, session: AsyncSession, meter: Meter
+    ) -> Select[tuple[Event]]:
+        event_repository = EventRepository.from_session(session)
+        return event_repository.get_base_statement().where(
+            Event.organization_id == meter.organization_id,
+            Event.customer.is_not(None),
+            or_(
+                # Events matching meter definitions
+                event_repository.get_meter_clause(meter),
+                # System events impacting the meter balance
+                event_repository.get_meter_system_clause(meter),
+            ),
+        )
 
     async def get_quantity(
         self,
@@ -470,5 +631,36 @@ class MeterService:
         result = await session.scalar(statement)
         return result or 0.0
 
+    async def get_aggregation_state(
+        self,
+        session: AsyncSession,
+        meter: Meter,
+        events_statement: Select[tuple[uuid.UUID]],
+    ) -> AggregationState:
+        """
+        Mergeable aggregation state of the events, to be combined
+        with `merge_aggregation_states` instead of recomputing `get_quantity`
+        over all the events.
+        """
+        value_sum, value_min, value_max, value = (
+            meter.aggregation.get_aggregate_value_columns(Event)
+        )
+        statement = select(
+            func.count(Event.id),
+            func.sum(value_sum),
+            func.min(value_min),
+            func.max(value_max),
+            func.jsonb_agg(value.distinct()).filter(value.is_not(None)),
+        ).where(Event.id.in_(events_statement))
+        result = await session.execute(statement)
+        events, state_sum, state_min, state_max, values = result.one()._tuple()
+        return {
+            "events": events,
+            "sum": state_sum,
+            "min": state_min,
+            "max": state_max,
+            "values": values,
+        }
+
 
 meter = MeterService()
@@ -40,4 +40,34 @@ async def meter_billing_entries(meter_id: uuid.UUID) -> None:
         if meter is None:
             raise MeterDoesNotExist(meter_id)
 
-        await meter_service.create_billing_entries(session, meter)
+        await meter_service.enqueue_billing_ranges(session, meter)
+
+
+@actor(actor_name="meter.billing_range", priority=TaskPriority.LOW)
+async def meter_billing_range(billing_range_id: uuid.UUID) -> None:
+    async with AsyncSessionMaker() as session:
+        await meter_service.bill_range(session, billing_range_id)
+
+
+@actor(actor_name="meter.build_aggregates", priority=TaskPriority.LOW)
+async def meter_build_aggregates(meter_id: uuid.UUID) -> None:
+    async with AsyncSessionMaker() as session:
+        repository = MeterRepository.from_session(session)
+        meter = await repository.get_by_id(meter_id)
+        if meter is None:
+            raise MeterDoesNotExist(meter_id)
+
+        await meter_service.build_aggregates(session, meter)
+
+
+@actor(actor_name="meter.index_metadata", priority=TaskPriority.LOW)
+async def meter_index_metadata(meter_id: uuid.UUID) -> None:
+    async with AsyncSessionMaker() as session:
+        repository = MeterRepository.from_session(session)
+        meter = await repository.get_by_id(meter_id)
+        if meter is None:
+            raise MeterDoesNotExist(meter_id)
+
+    # Indexes are built concurrently, outside of any transaction
+    async with AsyncSessionMaker() as session:
+        await meter_service.index_metadata(session, meter)
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import uuid
+from collections.abc import Sequence
+from typing import Any
+
+import logfire
+from pydantic import TypeAdapter
+
+from polar.config import settings
+from polar.redis import Redis
+
+from .schemas import MetricsPeriod
+
+# 👋 Whenever you change the metrics computation or the periods schema,
+# please bump this version so stale entries are ignored.
+CACHE_KEY_PREFIX = "polar:metrics:v1"
+
+cache_hits = logfire.metric_counter(
+    "metrics.cache.hits", unit="1", description="Metrics periods served from cache."
+)
+cache_misses = logfire.metric_counter(
+    "metrics.cache.misses",
+    unit="1",
+    description="Metrics periods computed because they were not cached.",
+)
+
+_periods_adapter = TypeAdapter(list[MetricsPeriod])
+
+
+def _get_watermark_key(organization_id: uuid.UUID) -> str:
+    return f"{CACHE_KEY_PREFIX}:watermark:{organization_id}"
+
+
+async def get_watermarks(
+    redis: Redis, organization_ids: Sequence[uuid.UUID]
+) -> list[int]:
+    """Return the data watermark of each organization."""
+    if not organization_ids:
+        return []
+    values = await redis.mget(
+        [_get_watermark_key(organization_id) for organization_id in organization_ids]
+    )
+    return [int(value) if value is not None else 0 for value in values]
+
+
+async def bump_watermark(redis: Redis, organization_id: uuid.UUID) -> int:
+    """
+    Bump the data watermark of an organization,
+    so all the cached metrics involving it are ignored from now on.
+    """
+    return await redis.incr(_get_watermark_key(organization_id))
+
+
+def get_cache_key(**parts: Any) -> str:
+    """Build a cache key from the normalized parts of a metrics request."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    digest = hashlib.sha256(payload.encode()).hexdigest()
+    return f"{CACHE_KEY_PREFIX}:periods:{digest}"
+
+
+async def get_periods(redis: Redis, key: str) -> list[MetricsPeriod] | None:
+    raw_periods = await redis.get(key)
+    if raw_periods is None:
+        cache_misses.add(1)
+        return None
+    cache_hits.add(1)
+    return _periods_adapter.validate_json(raw_periods)
+
+
+async def set_periods(redis: Redis, key: str, periods: list[MetricsPeriod]) -> None:
+    await redis.set(
+        key,
+        _periods_adapter.dump_json(periods, exclude_unset=True).decode(),
+        ex=int(settings.METRICS_CACHE_TTL.total_seconds()),
+    )
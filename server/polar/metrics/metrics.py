@@ -12,6 +12,7 @@ from sqlalchemy import (
     Float,
     Integer,
     SQLColumnExpression,
+    Subquery,
     case,
     func,
     or_,
@@ -48,6 +49,8 @@ class Metric(Protocol):
     display_name: ClassVar[str]
     type: ClassVar[MetricType]
     query: ClassVar[MetricQuery]
+    dependencies: ClassVar[tuple[str, ...]] = ()
+    """Slugs of the other metrics needed by `get_cumulative`."""
 
     @classmethod
     def get_sql_expression(
@@ -57,6 +60,17 @@ class Metric(Protocol):
     @classmethod
     def get_cumulative(cls, periods: Iterable["MetricsPeriod"]) -> int | float: ...
 
+    @classmethod
+    def get_rollup_sql_expression(
+        cls, r: Subquery
+    ) -> ColumnElement[int] | ColumnElement[float] | None:
+        """
+        Expression computing the metric from hourly rollups, if it can.
+
+        Return `None` when the metric can't be derived from the rollup measures.
+        """
+        return None
+
 
 class OrdersMetric(Metric):
     slug = "orders"
@@ -74,6 +88,10 @@ class OrdersMetric(Metric):
     def get_cumulative(cls, periods: Iterable["MetricsPeriod"]) -> int | float:
         return cumulative_sum(periods, cls.slug)
 
+    @classmethod
+    def get_rollup_sql_expression(cls, r: Subquery) -> ColumnElement[int]:
+        return func.sum(r.c.orders)
+
 
 class RevenueMetric(Metric):
     slug = "revenue"
@@ -91,6 +109,10 @@ class RevenueMetric(Metric):
     def get_cumulative(cls, periods: Iterable["MetricsPeriod"]) -> int | float:
         return cumulative_sum(periods, cls.slug)
 
+    @classmethod
+    def get_rollup_sql_expression(cls, r: Subquery) -> ColumnElement[int]:
+        return func.sum(r.c.revenue)
+
 
 class NetRevenueMetric(Metric):
     slug = "net_revenue"
@@ -108,6 +130,10 @@ class NetRevenueMetric(Metric):
     def get_cumulative(cls, periods: Iterable["MetricsPeriod"]) -> int | float:
         return cumulative_sum(periods, cls.slug)
 
+    @classmethod
+    def get_rollup_sql_expression(cls, r: Subquery) -> ColumnElement[int]:
+        return func.sum(r.c.net_revenue)
+
 
 class CumulativeRevenueMetric(Metric):
     slug = "cumulative_revenue"
@@ -148,6 +174,7 @@ class AverageOrderValueMetric(Metric):
     display_name = "Average Order Value"
     type = MetricType.currency
     query = MetricQuery.orders
+    dependencies = ("orders", "revenue")
 
     @classmethod
     def get_sql_expression(
@@ -161,12 +188,20 @@ class AverageOrderValueMetric(Metric):
         revenue = sum(getattr(p, "revenue") for p in periods)
         return revenue / total_orders if total_orders > 0 else 0.0
 
+    @classmethod
+    def get_rollup_sql_expression(cls, r: Subquery) -> ColumnElement[int]:
+        return func.cast(
+            func.ceil(func.sum(r.c.revenue) / func.nullif(func.sum(r.c.orders), 0)),
+            Integer,
+        )
+
 
 class NetAverageOrderValueMetric(Metric):
     slug = "net_average_order_value"
     display_name = "Net Average Order Value"
     type = MetricType.currency
     query = MetricQuery.orders
+    dependencies = ("orders", "net_revenue")
 
     @classmethod
     def get_sql_expression(
@@ -180,6 +215,13 @@ class NetAverageOrderValueMetric(Metric):
         revenue = sum(getattr(p, "net_revenue") for p in periods)
         return revenue / total_orders if total_orders > 0 else 0.0
 
+    @classmethod
+    def get_rollup_sql_expression(cls, r: Subquery) -> ColumnElement[int]:
+        return func.cast(
+            func.ceil(func.sum(r.c.net_revenue) / func.nullif(func.sum(r.c.orders), 0)),
+            Integer,
+        )
+
 
 class OneTimeProductsMetric(Metric):
     slug = "one_time_products"
@@ -197,6 +239,10 @@ class OneTimeProductsMetric(Metric):
     def get_cumulative(cls, periods: Iterable["MetricsPeriod"]) -> int | float:
         return cumulative_sum(periods, cls.slug)
 
+    @classmethod
+    def get_rollup_sql_expression(cls, r: Subquery) -> ColumnElement[int]:
+        return func.sum(r.c.one_time_products)
+
 
 class OneTimeProductsRevenueMetric(Metric):
     slug = "one_time_products_revenue"
@@ -214,6 +260,10 @@ class OneTimeProductsRevenueMetric(Metric):
     def get_cumulative(cls, periods: Iterable["MetricsPeriod"]) -> int | float:
         return cumulative_sum(periods, cls.slug)
 
+    @classmethod
+    def get_rollup_sql_expression(cls, r: Subquery) -> ColumnElement[int]:
+        return func.sum(r.c.one_time_products_revenue)
+
 
 class OneTimeProductsNetRevenueMetric(Metric):
     slug = "one_time_products_net_revenue"
@@ -231,6 +281,10 @@ class OneTimeProductsNetRevenueMetric(Metric):
     def get_cumulative(cls, periods: Iterable["MetricsPeriod"]) -> int | float:
         return cumulative_sum(periods, cls.slug)
 
+    @classmethod
+    def get_rollup_sql_expression(cls, r: Subquery) -> ColumnElement[int]:
+        return func.sum(r.c.one_time_products_net_revenue)
+
 
 class NewSubscriptionsMetric(Metric):
     slug = "new_subscriptions"
@@ -476,6 +530,10 @@ class CheckoutsMetric(Metric):
     def get_cumulative(cls, periods: Iterable["MetricsPeriod"]) -> int | float:
         return cumulative_sum(periods, cls.slug)
 
+    @classmethod
+    def get_rollup_sql_expression(cls, r: Subquery) -> ColumnElement[int]:
+        return func.sum(r.c.checkouts)
+
 
 class SucceededCheckoutsMetric(Metric):
     slug = "succeeded_checkouts"
@@ -495,12 +553,17 @@ class SucceededCheckoutsMetric(Metric):
     def get_cumulative(cls, periods: Iterable["MetricsPeriod"]) -> int | float:
         return cumulative_sum(periods, cls.slug)
 
+    @classmethod
+    def get_rollup_sql_expression(cls, r: Subquery) -> ColumnElement[int]:
+        return func.sum(r.c.succeeded_checkouts)
+
 
 class CheckoutsConversionMetric(Metric):
     slug = "checkouts_conversion"
     display_name = "Checkouts Conversion Rate"
     type = MetricType.percentage
     query = MetricQuery.checkouts
+    dependencies = ("checkouts", "succeeded_checkouts")
 
     @classmethod
     def get_sql_expression(
@@ -523,6 +586,17 @@ class CheckoutsConversionMetric(Metric):
         total_succeeded = sum(getattr(p, "succeeded_checkouts") for p in periods)
         return total_succeeded / total_checkouts if total_checkouts > 0 else 0.0
 
+    @classmethod
+    def get_rollup_sql_expression(cls, r: Subquery) -> ColumnElement[float]:
+        return type_coerce(
+            func.coalesce(
+                func.sum(r.c.succeeded_checkouts)
+                / func.nullif(func.sum(r.c.checkouts), 0),
+                0,
+            ),
+            Float,
+        )
+
 
 class CanceledSubscriptionsMetric(Metric):
     slug = "canceled_subscriptions"
@@ -771,4 +845,23 @@ METRICS: list[type[Metric]] = [
     CanceledSubscriptionsOtherMetric,
 ]
 
-__all__ = ["MetricType", "Metric", "METRICS"]
+METRICS_BY_SLUG: dict[str, type[Metric]] = {metric.slug: metric for metric in METRICS}
+
+
+def resolve_metrics(slugs: Iterable[str]) -> list[type[Metric]]:
+    """
+    Return the metrics to compute to output the given slugs,
+    i.e. including their dependencies, in the order of `METRICS`.
+    """
+    resolved: set[str] = set()
+    pending = list(slugs)
+    while pending:
+        slug = pending.pop()
+        if slug in resolved:
+            continue
+        resolved.add(slug)
+        pending.extend(METRICS_BY_SLUG[slug].dependencies)
+    return [metric for metric in METRICS if metric.slug in resolved]
+
+
+__all__ = ["MetricType", "Metric", "METRICS", "METRICS_BY_SLUG", "resolve_metrics"]
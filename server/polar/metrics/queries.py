@@ -17,7 +17,7 @@ from sqlalchemy import (
 )
 
 from polar.auth.models import AuthSubject, is_organization, is_user
-from polar.kit.time_queries import TimeInterval
+from polar.kit.time_queries import TimeInterval, sql_bucket_range
 from polar.models import (
     Checkout,
     CheckoutProduct,
@@ -62,6 +62,30 @@ def _get_metrics_columns(
     )
 
 
+def _get_cumulative_metrics_columns(
+    metric_cte: MetricQuery,
+    timestamp_column: ColumnElement[datetime],
+    interval: TimeInterval,
+    metrics: list["type[Metric]"],
+    now: datetime,
+) -> Generator[ColumnElement[int] | ColumnElement[float], None, None]:
+    """
+    Running total of per-bucket metrics.
+
+    The query is expected to match data with `sql_bucket_range(..., cumulative=True)`,
+    so the first bucket also includes everything before the series.
+    """
+    return (
+        func.sum(
+            func.coalesce(metric.get_sql_expression(timestamp_column, interval, now), 0)
+        )
+        .over(order_by=timestamp_column)
+        .label(metric.slug)
+        for metric in metrics
+        if metric.query == metric_cte
+    )
+
+
 class QueryCallable(Protocol):
     def __call__(
         self,
@@ -152,8 +176,7 @@ def get_orders_cte(
                 Order,
                 isouter=True,
                 onclause=and_(
-                    interval.sql_date_trunc(Order.created_at)
-                    == interval.sql_date_trunc(timestamp_column),
+                    sql_bucket_range(Order.created_at, timestamp_series),
                     Order.paid.is_(True),
                     Order.id.in_(readable_orders_statement),
                 ),
@@ -193,7 +216,7 @@ def get_cumulative_orders_cte(
     return cte(
         select(
             timestamp_column.label("timestamp"),
-            *_get_metrics_columns(
+            *_get_cumulative_metrics_columns(
                 MetricQuery.cumulative_orders, timestamp_column, interval, metrics, now
             ),
         )
@@ -202,8 +225,9 @@ def get_cumulative_orders_cte(
                 Order,
                 isouter=True,
                 onclause=and_(
-                    interval.sql_date_trunc(Order.created_at)
-                    <= interval.sql_date_trunc(timestamp_column),
+                    sql_bucket_range(
+                        Order.created_at, timestamp_series, cumulative=True
+                    ),
                     Order.paid.is_(True),
                     Order.id.in_(readable_orders_statement),
                 ),
@@ -258,24 +282,14 @@ def get_active_subscriptions_cte(
                 onclause=and_(
                     or_(
                         Subscription.started_at.is_(None),
-                        interval.sql_date_trunc(
-                            cast(SQLColumnExpression[datetime], Subscription.started_at)
-                        )
-                        <= interval.sql_date_trunc(timestamp_column),
+                        Subscription.started_at < timestamp_series.c.bucket_end,
                     ),
                     or_(
                         func.coalesce(Subscription.ended_at, Subscription.ends_at).is_(
                             None
                         ),
-                        interval.sql_date_trunc(
-                            cast(
-                                SQLColumnExpression[datetime],
-                                func.coalesce(
-                                    Subscription.ended_at, Subscription.ends_at
-                                ),
-                            )
-                        )
-                        > interval.sql_date_trunc(timestamp_column),
+                        func.coalesce(Subscription.ended_at, Subscription.ends_at)
+                        >= timestamp_series.c.bucket_end,
                     ),
                     Subscription.id.in_(readable_subscriptions_statement),
                 ),
@@ -394,8 +408,7 @@ def get_checkouts_cte(
                 Checkout,
                 isouter=True,
                 onclause=and_(
-                    interval.sql_date_trunc(Checkout.created_at)
-                    == interval.sql_date_trunc(timestamp_column),
+                    sql_bucket_range(Checkout.created_at, timestamp_series),
                     Checkout.id.in_(readable_checkouts_statement),
                 ),
             )
@@ -443,11 +456,10 @@ def get_canceled_subscriptions_cte(
                 Subscription,
                 isouter=True,
                 onclause=and_(
-                    Subscription.canceled_at.is_not(None),
-                    interval.sql_date_trunc(
-                        cast(SQLColumnExpression[datetime], Subscription.canceled_at)
-                    )
-                    == interval.sql_date_trunc(timestamp_column),
+                    sql_bucket_range(
+                        cast(SQLColumnExpression[datetime], Subscription.canceled_at),
+                        timestamp_series,
+                    ),
                     Subscription.id.in_(readable_subscriptions_statement),
                 ),
             )
@@ -507,8 +519,7 @@ def get_cost_events_cte(
                 Event,
                 isouter=True,
                 onclause=and_(
-                    interval.sql_date_trunc(Event.timestamp)
-                    == interval.sql_date_trunc(timestamp_column),
+                    sql_bucket_range(Event.timestamp, timestamp_series),
                     Event.id.in_(readable_cost_events_statement),
                 ),
             )
@@ -540,7 +551,7 @@ def get_cumulative_cost_events_cte(
     return cte(
         select(
             timestamp_column.label("timestamp"),
-            *_get_metrics_columns(
+            *_get_cumulative_metrics_columns(
                 MetricQuery.cumulative_costs, timestamp_column, interval, metrics, now
             ),
         )
@@ -549,8 +560,9 @@ def get_cumulative_cost_events_cte(
                 Event,
                 isouter=True,
                 onclause=and_(
-                    interval.sql_date_trunc(Event.timestamp)
-                    <= interval.sql_date_trunc(timestamp_column),
+                    sql_bucket_range(
+                        Event.timestamp, timestamp_series, cumulative=True
+                    ),
                     Event.id.in_(readable_cost_events_statement),
                 ),
             )
@@ -560,12 +572,12 @@ def get_cumulative_cost_events_cte(
     )
 
 
-QUERIES: list[QueryCallable] = [
-    get_orders_cte,
-    get_cumulative_orders_cte,
-    get_active_subscriptions_cte,
-    get_checkouts_cte,
-    get_canceled_subscriptions_cte,
-    get_cost_events_cte,
-    get_cumulative_cost_events_cte,
-]
+QUERIES: dict[MetricQuery, QueryCallable] = {
+    MetricQuery.orders: get_orders_cte,
+    MetricQuery.cumulative_orders: get_cumulative_orders_cte,
+    MetricQuery.active_subscriptions: get_active_subscriptions_cte,
+    MetricQuery.checkouts: get_checkouts_cte,
+    MetricQuery.canceled_subscriptions: get_canceled_subscriptions_cte,
+    MetricQuery.costs: get_cost_events_cte,
+    MetricQuery.cumulative_costs: get_cumulative_cost_events_cte,
+}
@@ -0,0 +1,97 @@
+from collections.abc import Sequence
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy import and_, delete, func, insert, or_, select
+
+from polar.kit.repository import RepositoryBase
+from polar.models import MetricsRollup
+
+from .rollup import ROLLUP_MEASURES, get_rollup_source_statement
+
+
+class MetricsRollupRepository(RepositoryBase[MetricsRollup]):
+    model = MetricsRollup
+
+    async def refresh(
+        self, organization_id: UUID, start: datetime, end: datetime
+    ) -> None:
+        """
+        Recompute the rollups of an organization for the hours in `[start, end)`.
+
+        A transaction-level advisory lock serializes concurrent refreshes
+        of the same organization.
+        """
+        await self.session.execute(
+            select(func.pg_advisory_xact_lock(func.hashtext(str(organization_id))))
+        )
+        await self.session.execute(
+            delete(MetricsRollup).where(
+                MetricsRollup.organization_id == organization_id,
+                MetricsRollup.bucket >= start,
+                MetricsRollup.bucket < end,
+            )
+        )
+        source = get_rollup_source_statement(
+            start=start, end=end, organization_id=organization_id
+        ).subquery()
+        await self.session.execute(
+            insert(MetricsRollup).from_select(
+                [
+                    "organization_id",
+                    "bucket",
+                    "product_id",
+                    "billing_type",
+                    *ROLLUP_MEASURES,
+                    "refreshed_at",
+                ],
+                select(source, func.now()),
+            )
+        )
+
+    async def get_inconsistent_buckets(
+        self, organization_id: UUID, start: datetime, end: datetime
+    ) -> Sequence[datetime]:
+        """
+        Return the hours in `[start, end)` where the stored rollups differ
+        from the raw tables.
+        """
+        stored = (
+            select(MetricsRollup)
+            .where(
+                MetricsRollup.organization_id == organization_id,
+                MetricsRollup.bucket >= start,
+                MetricsRollup.bucket < end,
+            )
+            .subquery("stored")
+        )
+        source = get_rollup_source_statement(
+            start=start, end=end, organization_id=organization_id
+        ).subquery("source")
+
+        statement = (
+            select(func.coalesce(stored.c.bucket, source.c.bucket).label("bucket"))
+            .select_from(
+                stored.join(
+                    source,
+                    and_(
+                        stored.c.bucket == source.c.bucket,
+                        stored.c.product_id == source.c.product_id,
+                    ),
+                    full=True,
+                )
+            )
+            .where(
+                or_(
+                    *(
+                        func.coalesce(stored.c[measure], 0)
+                        != func.coalesce(source.c[measure], 0)
+                        for measure in ROLLUP_MEASURES
+                    )
+                )
+            )
+            .distinct()
+            .order_by("bucket")
+        )
+        result = await self.session.execute(statement)
+        return result.scalars().all()
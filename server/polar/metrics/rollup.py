@@ -0,0 +1,252 @@
+import uuid
+from collections.abc import Generator, Sequence
+from datetime import UTC, datetime, timedelta
+from typing import TYPE_CHECKING, Any
+
+from sqlalchemy import (
+    CTE,
+    ColumnElement,
+    Select,
+    Subquery,
+    cte,
+    func,
+    literal,
+    select,
+    union_all,
+)
+
+from polar.auth.models import AuthSubject, is_organization, is_user
+from polar.kit.time_queries import sql_bucket_range
+from polar.models import (
+    Checkout,
+    CheckoutProduct,
+    MetricsRollup,
+    Order,
+    Organization,
+    Product,
+    User,
+    UserOrganization,
+)
+from polar.models.checkout import CheckoutStatus
+from polar.models.product import ProductBillingType
+
+if TYPE_CHECKING:
+    from .metrics import Metric
+
+
+ROLLUP_BUCKET = timedelta(hours=1)
+
+ROLLUP_MEASURES = (
+    "orders",
+    "revenue",
+    "net_revenue",
+    "one_time_products",
+    "one_time_products_revenue",
+    "one_time_products_net_revenue",
+    "checkouts",
+    "succeeded_checkouts",
+)
+
+
+def get_rollup_bucket(timestamp: datetime) -> datetime:
+    """Return the start of the UTC hour containing the timestamp."""
+    return timestamp.astimezone(UTC).replace(minute=0, second=0, microsecond=0)
+
+
+def is_rollup_aligned(timestamp: datetime) -> bool:
+    """
+    Whether interval boundaries in the timestamp's timezone fall on UTC hours,
+    which is required to sum hourly rollups into them.
+    """
+    offset = timestamp.utcoffset()
+    return offset is None or offset % ROLLUP_BUCKET == timedelta(0)
+
+
+def _sql_rollup_bucket(column: ColumnElement[datetime]) -> ColumnElement[datetime]:
+    return func.date_trunc("hour", column, "UTC")
+
+
+def get_rollup_source_statement(
+    *,
+    start: datetime,
+    end: datetime | None = None,
+    organization_id: uuid.UUID | None = None,
+) -> Select[Any]:
+    """
+    Compute the rollup rows for the hours in `[start, end)` from the raw tables.
+
+    The selected columns match the ones of `MetricsRollup`, so the statement can be
+    used to refresh the table, to compare its content or to complete it with
+    the still-open bucket.
+    """
+    order_bucket = _sql_rollup_bucket(Order.created_at)
+    orders_statement = (
+        select(
+            Product.organization_id.label("organization_id"),
+            order_bucket.label("bucket"),
+            Product.id.label("product_id"),
+            func.count(Order.id).label("orders"),
+            func.coalesce(func.sum(Order.net_amount), 0).label("revenue"),
+            func.coalesce(func.sum(Order.payout_amount), 0).label("net_revenue"),
+            func.count(Order.id)
+            .filter(Order.subscription_id.is_(None))
+            .label("one_time_products"),
+            func.coalesce(
+                func.sum(Order.net_amount).filter(Order.subscription_id.is_(None)), 0
+            ).label("one_time_products_revenue"),
+            func.coalesce(
+                func.sum(Order.payout_amount).filter(Order.subscription_id.is_(None)),
+                0,
+            ).label("one_time_products_net_revenue"),
+            literal(0).label("checkouts"),
+            literal(0).label("succeeded_checkouts"),
+        )
+        .join(Product, onclause=Order.product_id == Product.id)
+        .where(Order.paid.is_(True), Order.created_at >= start)
+        .group_by(Product.organization_id, order_bucket, Product.id)
+    )
+
+    # Like the raw checkouts query, checkouts belong to every product they offer
+    checkout_bucket = _sql_rollup_bucket(Checkout.created_at)
+    checkouts_statement = (
+        select(
+            Product.organization_id.label("organization_id"),
+            checkout_bucket.label("bucket"),
+            Product.id.label("product_id"),
+            literal(0).label("orders"),
+            literal(0).label("revenue"),
+            literal(0).label("net_revenue"),
+            literal(0).label("one_time_products"),
+            literal(0).label("one_time_products_revenue"),
+            literal(0).label("one_time_products_net_revenue"),
+            func.count(Checkout.id).label("checkouts"),
+            func.count(Checkout.id)
+            .filter(Checkout.status == CheckoutStatus.succeeded)
+            .label("succeeded_checkouts"),
+        )
+        .join(CheckoutProduct, onclause=CheckoutProduct.checkout_id == Checkout.id)
+        .join(Product, onclause=CheckoutProduct.product_id == Product.id)
+        .where(Checkout.created_at >= start)
+        .group_by(Product.organization_id, checkout_bucket, Product.id)
+    )
+
+    if end is not None:
+        orders_statement = orders_statement.where(Order.created_at < end)
+        checkouts_statement = checkouts_statement.where(Checkout.created_at < end)
+
+    if organization_id is not None:
+        orders_statement = orders_statement.where(
+            Product.organization_id == organization_id
+        )
+        checkouts_statement = checkouts_statement.where(
+            Product.organization_id == organization_id
+        )
+
+    source = union_all(orders_statement, checkouts_statement).subquery("source")
+
+    return (
+        select(
+            source.c.organization_id,
+            source.c.bucket,
+            source.c.product_id,
+            Product.billing_type.label("billing_type"),
+            *(
+                func.sum(source.c[measure]).label(measure)
+                for measure in ROLLUP_MEASURES
+            ),
+        )
+        .join(Product, onclause=source.c.product_id == Product.id)
+        .group_by(
+            source.c.organization_id,
+            source.c.bucket,
+            source.c.product_id,
+            Product.id,
+        )
+    )
+
+
+def get_readable_rollups_subquery(
+    auth_subject: AuthSubject[User | Organization],
+    now: datetime,
+    *,
+    organization_id: Sequence[uuid.UUID] | None = None,
+    product_id: Sequence[uuid.UUID] | None = None,
+    billing_type: Sequence[ProductBillingType] | None = None,
+) -> Subquery:
+    """
+    Rollup rows readable by the auth subject.
+
+    Closed hours are read from `MetricsRollup`,
+    while the still-open one is computed from the raw tables.
+    """
+    open_bucket = get_rollup_bucket(now)
+    rollups = union_all(
+        select(
+            MetricsRollup.organization_id,
+            MetricsRollup.bucket,
+            MetricsRollup.product_id,
+            MetricsRollup.billing_type,
+            *(getattr(MetricsRollup, measure) for measure in ROLLUP_MEASURES),
+        ).where(MetricsRollup.bucket < open_bucket),
+        get_rollup_source_statement(start=open_bucket),
+    ).subquery("all_rollups")
+
+    statement = select(rollups)
+
+    if is_user(auth_subject):
+        statement = statement.where(
+            rollups.c.organization_id.in_(
+                select(UserOrganization.organization_id).where(
+                    UserOrganization.user_id == auth_subject.subject.id,
+                    UserOrganization.deleted_at.is_(None),
+                )
+            )
+        )
+    elif is_organization(auth_subject):
+        statement = statement.where(
+            rollups.c.organization_id == auth_subject.subject.id
+        )
+
+    if organization_id is not None:
+        statement = statement.where(rollups.c.organization_id.in_(organization_id))
+
+    if product_id is not None:
+        statement = statement.where(rollups.c.product_id.in_(product_id))
+
+    if billing_type is not None:
+        statement = statement.where(rollups.c.billing_type.in_(billing_type))
+
+    return statement.subquery("rollups")
+
+
+def _get_rollup_metrics_columns(
+    rollups: Subquery, metrics: list["type[Metric]"]
+) -> Generator[ColumnElement[int] | ColumnElement[float], None, None]:
+    for metric in metrics:
+        expression = metric.get_rollup_sql_expression(rollups)
+        if expression is not None:
+            yield func.coalesce(expression, 0).label(metric.slug)
+
+
+def get_rollups_cte(
+    timestamp_series: CTE,
+    rollups: Subquery,
+    metrics: list["type[Metric]"],
+) -> CTE:
+    timestamp_column: ColumnElement[datetime] = timestamp_series.c.timestamp
+
+    return cte(
+        select(
+            timestamp_column.label("timestamp"),
+            *_get_rollup_metrics_columns(rollups, metrics),
+        )
+        .select_from(
+            timestamp_series.join(
+                rollups,
+                isouter=True,
+                onclause=sql_bucket_range(rollups.c.bucket, timestamp_series),
+            )
+        )
+        .group_by(timestamp_column)
+        .order_by(timestamp_column.asc())
+    )
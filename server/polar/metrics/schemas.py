@@ -1,4 +1,5 @@
 from datetime import date
+from enum import StrEnum
 from typing import TYPE_CHECKING
 
 from pydantic import AwareDatetime, Field, create_model
@@ -7,6 +8,13 @@ from polar.kit.schemas import Schema
 
 from .metrics import METRICS, MetricType
 
+if TYPE_CHECKING:
+
+    class MetricSlug(StrEnum): ...
+
+else:
+    MetricSlug = StrEnum("MetricSlug", [(m.slug, m.slug) for m in METRICS])
+
 
 class Metric(Schema):
     """Information about a metric."""
@@ -27,7 +35,7 @@ if TYPE_CHECKING:
 
 else:
     Metrics = create_model(
-        "Metrics", **{m.slug: (Metric, ...) for m in METRICS}, __base__=Schema
+        "Metrics", **{m.slug: (Metric | None, None) for m in METRICS}, __base__=Schema
     )
 
 
@@ -36,6 +44,7 @@ class MetricsPeriodBase(Schema):
     A period of time with metrics data.
 
     It maps each metric slug to its value for this timestamp.
+    Only the requested metrics are present.
     """
 
     timestamp: AwareDatetime = Field(description="Timestamp of this period data.")
@@ -49,7 +58,7 @@ if TYPE_CHECKING:
 else:
     MetricsPeriod = create_model(
         "MetricPeriod",
-        **{m.slug: (int | float, ...) for m in METRICS},
+        **{m.slug: (int | float | None, None) for m in METRICS},
         __base__=MetricsPeriodBase,
     )
 
@@ -60,6 +69,7 @@ class MetricsTotalsBase(Schema):
 
     It maps each metric slug to its value for this period. The aggregation is done
     differently depending on the metric type.
+    Only the requested metrics are present.
     """
 
 
@@ -72,7 +82,7 @@ if TYPE_CHECKING:
 else:
     MetricsTotals = create_model(
         "MetricsTotals",
-        **{m.slug: (int | float, ...) for m in METRICS},
+        **{m.slug: (int | float | None, None) for m in METRICS},
         __base__=MetricsTotalsBase,
     )
 
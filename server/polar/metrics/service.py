@@ -1,21 +1,43 @@
+import functools
 import uuid
 from collections.abc import Sequence
 from datetime import date, datetime
 from zoneinfo import ZoneInfo
 
-from sqlalchemy import ColumnElement, FromClause, select, text
+import structlog
+from sqlalchemy import CTE, ColumnElement, FromClause, select, text
 
-from polar.auth.models import AuthSubject
+from polar.auth.models import AuthSubject, is_organization, is_user
 from polar.config import settings
 from polar.kit.time_queries import TimeInterval, get_timestamp_series_cte
-from polar.models import Organization, User
+from polar.logging import Logger
+from polar.models import (
+    Checkout,
+    Order,
+    Organization,
+    Product,
+    User,
+    UserOrganization,
+)
 from polar.models.product import ProductBillingType
 from polar.postgres import AsyncReadSession, AsyncSession
+from polar.redis import Redis
 
-from .metrics import METRICS
-from .queries import QUERIES
+from . import cache as metrics_cache
+from .metrics import METRICS, Metric, resolve_metrics
+from .queries import QUERIES, MetricQuery
+from .repository import MetricsRollupRepository
+from .rollup import (
+    ROLLUP_BUCKET,
+    get_readable_rollups_subquery,
+    get_rollup_bucket,
+    get_rollups_cte,
+    is_rollup_aligned,
+)
 from .schemas import MetricsPeriod, MetricsResponse
 
+log: Logger = structlog.get_logger()
+
 
 class MetricsService:
     async def get_metrics(
@@ -31,6 +53,8 @@ class MetricsService:
         product_id: Sequence[uuid.UUID] | None = None,
         billing_type: Sequence[ProductBillingType] | None = None,
         customer_id: Sequence[uuid.UUID] | None = None,
+        metrics: Sequence[str] | None = None,
+        redis: Redis | None = None,
         now: datetime | None = None,
     ) -> MetricsResponse:
         await session.execute(text(f"SET LOCAL TIME ZONE '{timezone.key}'"))
@@ -41,25 +65,152 @@ class MetricsService:
             end_date.year, end_date.month, end_date.day, 23, 59, 59, 999999, timezone
         )
 
+        now = now or datetime.now(tz=timezone)
+
+        # Only compute the requested metrics and the ones they depend on,
+        # so we skip the queries nobody asked for.
+        selected_metrics = (
+            METRICS
+            if metrics is None
+            else [metric for metric in METRICS if metric.slug in metrics]
+        )
+        computed_metrics = resolve_metrics(metric.slug for metric in selected_metrics)
+
+        get_periods = functools.partial(
+            self._get_periods,
+            session,
+            auth_subject,
+            start_timestamp=start_timestamp,
+            end_timestamp=end_timestamp,
+            interval=interval,
+            metrics=computed_metrics,
+            now=now,
+            organization_id=organization_id,
+            product_id=product_id,
+            billing_type=billing_type,
+            customer_id=customer_id,
+        )
+
+        periods: list[MetricsPeriod]
+        if redis is None:
+            periods = await get_periods()
+        else:
+            # Buckets closed before the current one won't change until
+            # the data of the organizations change, which bumps their watermark.
+            # So we cache them and only compute the still-open buckets.
+            organization_ids = await self._get_organization_ids(
+                session, auth_subject, organization_id
+            )
+            cache_key = metrics_cache.get_cache_key(
+                organization_ids=organization_ids,
+                watermarks=await metrics_cache.get_watermarks(redis, organization_ids),
+                open_bucket=interval.date_trunc(now),
+                start_date=start_date,
+                end_date=end_date,
+                timezone=timezone.key,
+                interval=interval,
+                product_id=sorted(product_id) if product_id is not None else None,
+                billing_type=sorted(billing_type) if billing_type is not None else None,
+                customer_id=sorted(customer_id) if customer_id is not None else None,
+                metrics=[metric.slug for metric in computed_metrics],
+            )
+            closed_periods = await metrics_cache.get_periods(redis, cache_key)
+            if closed_periods is None:
+                closed_periods = await get_periods(closed_at=now)
+                await metrics_cache.set_periods(redis, cache_key, closed_periods)
+            periods = [*closed_periods, *await get_periods(open_at=now)]
+
+        totals: dict[str, int | float] = {}
+        for metric in selected_metrics:
+            totals[metric.slug] = metric.get_cumulative(periods)
+
+        # Strip the dependencies that were only computed for the totals
+        if len(computed_metrics) > len(selected_metrics):
+            periods = [
+                MetricsPeriod(
+                    timestamp=period.timestamp,
+                    **{m.slug: getattr(period, m.slug) for m in selected_metrics},
+                )
+                for period in periods
+            ]
+
+        return MetricsResponse.model_validate(
+            {
+                "periods": periods,
+                "totals": totals,
+                "metrics": {m.slug: m for m in selected_metrics},
+            }
+        )
+
+    async def _get_periods(
+        self,
+        session: AsyncSession | AsyncReadSession,
+        auth_subject: AuthSubject[User | Organization],
+        *,
+        start_timestamp: datetime,
+        end_timestamp: datetime,
+        interval: TimeInterval,
+        metrics: list[type[Metric]],
+        now: datetime,
+        organization_id: Sequence[uuid.UUID] | None = None,
+        product_id: Sequence[uuid.UUID] | None = None,
+        billing_type: Sequence[ProductBillingType] | None = None,
+        customer_id: Sequence[uuid.UUID] | None = None,
+        closed_at: datetime | None = None,
+        open_at: datetime | None = None,
+    ) -> list[MetricsPeriod]:
         timestamp_series = get_timestamp_series_cte(
-            start_timestamp, end_timestamp, interval
+            start_timestamp,
+            end_timestamp,
+            interval,
+            closed_at=closed_at,
+            open_at=open_at,
         )
         timestamp_column: ColumnElement[datetime] = timestamp_series.c.timestamp
 
-        queries = [
-            query(
-                timestamp_series,
-                interval,
+        queries: list[CTE] = []
+
+        raw_metrics: list[type[Metric]] = metrics
+        if self._can_use_rollups(start_timestamp, end_timestamp, customer_id):
+            rollups = get_readable_rollups_subquery(
                 auth_subject,
-                METRICS,
-                now or datetime.now(tz=timezone),
+                now,
                 organization_id=organization_id,
                 product_id=product_id,
                 billing_type=billing_type,
-                customer_id=customer_id,
             )
-            for query in QUERIES
-        ]
+            rollup_metrics = [
+                metric
+                for metric in metrics
+                if metric.get_rollup_sql_expression(rollups) is not None
+                and (
+                    metric.query != MetricQuery.checkouts
+                    or self._can_use_checkouts_rollups(product_id)
+                )
+            ]
+            if rollup_metrics:
+                queries.append(
+                    get_rollups_cte(timestamp_series, rollups, rollup_metrics)
+                )
+            raw_metrics = [metric for metric in metrics if metric not in rollup_metrics]
+
+        raw_queries = {metric.query for metric in raw_metrics}
+        for metric_query, get_query_cte in QUERIES.items():
+            if metric_query not in raw_queries:
+                continue
+            queries.append(
+                get_query_cte(
+                    timestamp_series,
+                    interval,
+                    auth_subject,
+                    raw_metrics,
+                    now,
+                    organization_id=organization_id,
+                    product_id=product_id,
+                    billing_type=billing_type,
+                    customer_id=customer_id,
+                )
+            )
 
         from_query: FromClause = timestamp_series
         for query in queries:
@@ -84,18 +235,153 @@ class MetricsService:
         periods: list[MetricsPeriod] = []
         async for row in result:
             periods.append(MetricsPeriod(**row._asdict()))
+        return periods
 
-        totals: dict[str, int | float] = {}
-        for metric in METRICS:
-            totals[metric.slug] = metric.get_cumulative(periods)
+    async def _get_organization_ids(
+        self,
+        session: AsyncSession | AsyncReadSession,
+        auth_subject: AuthSubject[User | Organization],
+        organization_id: Sequence[uuid.UUID] | None,
+    ) -> list[uuid.UUID]:
+        """Organizations whose data may be part of the metrics."""
+        organization_ids: Sequence[uuid.UUID] = []
+        if is_user(auth_subject):
+            result = await session.execute(
+                select(UserOrganization.organization_id).where(
+                    UserOrganization.user_id == auth_subject.subject.id,
+                    UserOrganization.deleted_at.is_(None),
+                )
+            )
+            organization_ids = result.scalars().all()
+        elif is_organization(auth_subject):
+            organization_ids = [auth_subject.subject.id]
 
-        return MetricsResponse.model_validate(
-            {
-                "periods": periods,
-                "totals": totals,
-                "metrics": {m.slug: m for m in METRICS},
-            }
+        if organization_id is not None:
+            organization_ids = [id for id in organization_ids if id in organization_id]
+
+        return sorted(organization_ids)
+
+    async def invalidate_cache(self, redis: Redis, organization_id: uuid.UUID) -> None:
+        """
+        Invalidate the cached metrics involving an organization.
+
+        Call it after changing its data outside of the usual flows, e.g. backfills.
+        """
+        await metrics_cache.bump_watermark(redis, organization_id)
+
+    async def refresh_rollups(
+        self,
+        session: AsyncSession,
+        organization_id: uuid.UUID,
+        start: datetime,
+        end: datetime,
+    ) -> None:
+        """Recompute the metrics rollups of an organization between two dates."""
+        repository = MetricsRollupRepository.from_session(session)
+        await repository.refresh(
+            organization_id, get_rollup_bucket(start), get_rollup_bucket(end)
+        )
+
+    async def refresh_order_rollups(
+        self, session: AsyncSession, order_id: uuid.UUID
+    ) -> uuid.UUID | None:
+        """
+        Recompute the rollups of the hour of the order.
+
+        Returns the ID of its organization, or `None` if the order doesn't exist.
+        """
+        statement = (
+            select(Product.organization_id, Order.created_at)
+            .join(Product, onclause=Order.product_id == Product.id)
+            .where(Order.id == order_id)
         )
+        result = await session.execute(statement)
+        row = result.one_or_none()
+        if row is None:
+            return None
+        organization_id, created_at = row._tuple()
+        await self.refresh_rollups(
+            session, organization_id, created_at, created_at + ROLLUP_BUCKET
+        )
+        return organization_id
+
+    async def refresh_checkout_rollups(
+        self, session: AsyncSession, checkout_id: uuid.UUID
+    ) -> uuid.UUID | None:
+        """
+        Recompute the rollups of the hour of the checkout.
+
+        Returns the ID of its organization, or `None` if the checkout doesn't exist.
+        """
+        statement = (
+            select(Product.organization_id, Checkout.created_at)
+            .join(Product, onclause=Checkout.product_id == Product.id)
+            .where(Checkout.id == checkout_id)
+        )
+        result = await session.execute(statement)
+        row = result.one_or_none()
+        if row is None:
+            return None
+        organization_id, created_at = row._tuple()
+        await self.refresh_rollups(
+            session, organization_id, created_at, created_at + ROLLUP_BUCKET
+        )
+        return organization_id
+
+    async def check_rollups(
+        self,
+        session: AsyncSession,
+        organization_id: uuid.UUID,
+        start: datetime,
+        end: datetime,
+        *,
+        repair: bool = False,
+    ) -> Sequence[datetime]:
+        """
+        Compare the stored rollups of an organization with the raw tables.
+
+        Returns the inconsistent hourly buckets. If `repair` is set,
+        they are recomputed.
+        """
+        repository = MetricsRollupRepository.from_session(session)
+        buckets = await repository.get_inconsistent_buckets(
+            organization_id, get_rollup_bucket(start), get_rollup_bucket(end)
+        )
+        if buckets:
+            log.warning(
+                "metrics.rollups.inconsistent",
+                organization_id=organization_id,
+                buckets=len(buckets),
+            )
+        if repair:
+            for bucket in buckets:
+                await repository.refresh(
+                    organization_id, bucket, bucket + ROLLUP_BUCKET
+                )
+        return buckets
+
+    def _can_use_rollups(
+        self,
+        start_timestamp: datetime,
+        end_timestamp: datetime,
+        customer_id: Sequence[uuid.UUID] | None,
+    ) -> bool:
+        # Rollups are not broken down per customer
+        # and can only be summed into hour-aligned intervals.
+        return (
+            settings.METRICS_ROLLUPS_ENABLED
+            and customer_id is None
+            and is_rollup_aligned(start_timestamp)
+            and is_rollup_aligned(end_timestamp)
+        )
+
+    def _can_use_checkouts_rollups(
+        self, product_id: Sequence[uuid.UUID] | None
+    ) -> bool:
+        # Checkouts are rolled up under each product they offer: summing several
+        # products would count a checkout offering many of them more than once,
+        # while the raw query counts it once.
+        return product_id is not None and len(product_id) == 1
 
 
 metrics = MetricsService()
@@ -0,0 +1,30 @@
+import uuid
+
+from polar.worker import AsyncSessionMaker, RedisMiddleware, TaskPriority, actor
+
+from .service import metrics as metrics_service
+
+
+@actor(actor_name="metrics.rollup_order", priority=TaskPriority.LOW)
+async def metrics_rollup_order(order_id: uuid.UUID) -> None:
+    async with AsyncSessionMaker() as session:
+        organization_id = await metrics_service.refresh_order_rollups(session, order_id)
+    # Invalidate once the rollups are committed
+    if organization_id is not None:
+        await metrics_service.invalidate_cache(RedisMiddleware.get(), organization_id)
+
+
+@actor(actor_name="metrics.rollup_checkout", priority=TaskPriority.LOW)
+async def metrics_rollup_checkout(checkout_id: uuid.UUID) -> None:
+    async with AsyncSessionMaker() as session:
+        organization_id = await metrics_service.refresh_checkout_rollups(
+            session, checkout_id
+        )
+    # Invalidate once the rollups are committed
+    if organization_id is not None:
+        await metrics_service.invalidate_cache(RedisMiddleware.get(), organization_id)
+
+
+@actor(actor_name="metrics.invalidate_cache", priority=TaskPriority.LOW)
+async def metrics_invalidate_cache(organization_id: uuid.UUID) -> None:
+    await metrics_service.invalidate_cache(RedisMiddleware.get(), organization_id)
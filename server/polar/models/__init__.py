@@ -29,6 +29,9 @@ from .license_key import LicenseKey
 from .license_key_activation import LicenseKeyActivation
 from .login_code import LoginCode
 from .meter import Meter
+from .meter_aggregate import MeterAggregate
+from .meter_billing_range import MeterBillingRange
+from .metrics_rollup import MetricsRollup
 from .notification import Notification
 from .notification_recipient import NotificationRecipient
 from .oauth2_authorization_code import OAuth2AuthorizationCode
@@ -107,6 +110,9 @@ __all__ = [
     "LicenseKeyActivation",
     "LoginCode",
     "Meter",
+    "MeterAggregate",
+    "MeterBillingRange",
+    "MetricsRollup",
     "Notification",
     "NotificationRecipient",
     "OAuth2AuthorizationCode",
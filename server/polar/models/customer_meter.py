@@ -1,8 +1,9 @@
 from decimal import Decimal
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 from uuid import UUID
 
 from sqlalchemy import BigInteger, ForeignKey, Numeric, UniqueConstraint, Uuid
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.associationproxy import AssociationProxy, association_proxy
 from sqlalchemy.orm import Mapped, declared_attr, mapped_column, relationship
 
@@ -37,6 +38,18 @@ class CustomerMeter(RecordModel):
     balance: Mapped[Decimal] = mapped_column(
         Numeric, nullable=False, default=Decimal(0), index=True
     )
+    aggregation_state: Mapped[dict[str, Any] | None] = mapped_column(
+        JSONB(none_as_null=True), nullable=True, default=None
+    )
+    """
+    Running state of the meter aggregation over the current window,
+    so new events can be applied without recomputing the whole window.
+
+    Only holds the events ingested up to its cursor, which lags behind
+    the last event until events are settled.
+
+    `None` when the balance has to be fully recomputed.
+    """
 
     @declared_attr
     def customer(cls) -> Mapped["Customer"]:
@@ -8,6 +8,7 @@ from sqlalchemy import (
     BigInteger,
     ColumnElement,
     ForeignKey,
+    Index,
     String,
     Uuid,
     and_,
@@ -106,6 +107,15 @@ class CustomerComparator(Relationship.Comparator[Customer]):
 
 class Event(Model, MetadataMixin):
     __tablename__ = "events"
+    __table_args__ = (
+        Index(
+            "ix_events_organization_id_external_id",
+            "organization_id",
+            "external_id",
+            unique=True,
+            postgresql_where="external_id IS NOT NULL",
+        ),
+    )
 
     id: Mapped[UUID] = mapped_column(Uuid, primary_key=True, default=generate_uuid)
     ingested_at: Mapped[datetime.datetime] = mapped_column(
@@ -127,6 +137,13 @@ class Event(Model, MetadataMixin):
         String, nullable=True, index=True
     )
 
+    external_id: Mapped[str | None] = mapped_column(String, nullable=True)
+    """
+    Identifier of the event in the client's system.
+
+    Unique per organization, so ingesting the same event twice is a no-op.
+    """
+
     @declared_attr
     def customer(cls) -> Mapped[Customer | None]:
         return relationship(
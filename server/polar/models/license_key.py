@@ -13,7 +13,6 @@ from sqlalchemy import (
 from sqlalchemy.orm import Mapped, declared_attr, mapped_column, relationship
 
 from polar.kit.db.models import RecordModel
-from polar.kit.utils import utc_now
 
 from .benefit import Benefit
 from .customer import Customer
@@ -69,6 +68,8 @@ class LicenseKey(RecordModel):
     )
 
     limit_activations: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    activations_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    """Number of active activations, maintained along with them."""
 
     @declared_attr
     def all_activations(cls) -> Mapped[list["LicenseKeyActivation"]]:
@@ -123,11 +124,5 @@ class LicenseKey(RecordModel):
     def mark_revoked(self) -> None:
         self.status = LicenseKeyStatus.revoked
 
-    def mark_validated(self, increment_usage: int | None = None) -> None:
-        self.validations += 1
-        self.last_validated_at = utc_now()
-        if increment_usage:
-            self.usage += increment_usage
-
     def is_active(self) -> bool:
         return self.status == LicenseKeyStatus.granted
@@ -27,6 +27,14 @@ class Meter(RecordModel, MetadataMixin):
     archived_at: Mapped[datetime] = mapped_column(
         TIMESTAMP(timezone=True), nullable=True, default=None
     )
+    aggregates_built_at: Mapped[datetime | None] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=True, default=None
+    )
+    """
+    When the `MeterAggregate` rows of this meter were last fully built.
+
+    Until then, quantities are computed from the raw events.
+    """
 
     @declared_attr
     def last_billed_event(cls) -> Mapped["Event | None"]:
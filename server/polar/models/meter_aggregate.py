@@ -0,0 +1,60 @@
+from datetime import datetime
+from typing import Any
+from uuid import UUID
+
+from sqlalchemy import (
+    TIMESTAMP,
+    BigInteger,
+    Float,
+    ForeignKey,
+    Index,
+    String,
+    Uuid,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from polar.kit.db.models import Model
+from polar.kit.utils import generate_uuid
+
+
+class MeterAggregate(Model):
+    """
+    Mergeable aggregation state of a meter's events per customer and UTC hour.
+
+    `events`, `value_sum`, `value_min` and `value_max` can be merged across
+    rows to get exact counts, sums, minimums, maximums and averages.
+    For unique aggregations, there is one row per distinct `value`,
+    so the distinct count can be computed exactly across rows.
+
+    Rows are built from the raw events, then the worker merges the partial
+    aggregates of the events into them as they're ingested.
+    """
+
+    __tablename__ = "meter_aggregates"
+    __table_args__ = (
+        Index(
+            "ix_meter_aggregates_unique_key",
+            "meter_id",
+            "bucket",
+            "customer_id",
+            "external_customer_id",
+            "value",
+            unique=True,
+            postgresql_nulls_not_distinct=True,
+        ),
+    )
+
+    id: Mapped[UUID] = mapped_column(Uuid, primary_key=True, default=generate_uuid)
+    meter_id: Mapped[UUID] = mapped_column(
+        Uuid, ForeignKey("meters.id", ondelete="cascade"), nullable=False
+    )
+    bucket: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=False)
+    customer_id: Mapped[UUID | None] = mapped_column(Uuid, nullable=True)
+    external_customer_id: Mapped[str | None] = mapped_column(String, nullable=True)
+    value: Mapped[Any | None] = mapped_column(JSONB, nullable=True)
+
+    events: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    value_sum: Mapped[float | None] = mapped_column(Float, nullable=True)
+    value_min: Mapped[float | None] = mapped_column(Float, nullable=True)
+    value_max: Mapped[float | None] = mapped_column(Float, nullable=True)
@@ -0,0 +1,36 @@
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy import TIMESTAMP, ForeignKey, UniqueConstraint, Uuid
+from sqlalchemy.orm import Mapped, mapped_column
+
+from polar.kit.db.models import RecordModel
+
+
+class MeterBillingRange(RecordModel):
+    """
+    Range of ingested events of a meter to be billed.
+
+    A meter's billing backlog is split into contiguous ranges, billed in parallel
+    by the worker. Each range is a durable checkpoint: once completed, it's never
+    billed again, and the meter's `last_billed_event` only moves past it when
+    all the previous ranges are completed too.
+    """
+
+    __tablename__ = "meter_billing_ranges"
+    __table_args__ = (UniqueConstraint("meter_id", "start_timestamp"),)
+
+    meter_id: Mapped[UUID] = mapped_column(
+        Uuid, ForeignKey("meters.id", ondelete="cascade"), nullable=False
+    )
+    start_timestamp: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=False
+    )
+    """Events ingested strictly after this timestamp are in the range."""
+    end_timestamp: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=False
+    )
+    """Events ingested until this timestamp, included, are in the range."""
+    completed_at: Mapped[datetime | None] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=True, default=None
+    )
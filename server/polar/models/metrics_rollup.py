@@ -0,0 +1,63 @@
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy import TIMESTAMP, BigInteger, ForeignKey, Uuid
+from sqlalchemy.orm import Mapped, mapped_column
+
+from polar.kit.db.models import Model
+from polar.kit.extensions.sqlalchemy import StringEnum
+from polar.kit.utils import utc_now
+
+from .product import ProductBillingType
+
+
+class MetricsRollup(Model):
+    """
+    Pre-aggregated metrics measures per organization, product and UTC hour.
+
+    Rows are recomputed from the raw tables by the worker whenever an order or
+    a checkout changes, so they can be summed over any interval aligned on hours.
+    """
+
+    __tablename__ = "metrics_rollups"
+
+    organization_id: Mapped[UUID] = mapped_column(
+        Uuid,
+        ForeignKey("organizations.id", ondelete="cascade"),
+        nullable=False,
+        primary_key=True,
+    )
+    bucket: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=False, primary_key=True
+    )
+    product_id: Mapped[UUID] = mapped_column(
+        Uuid,
+        ForeignKey("products.id", ondelete="cascade"),
+        nullable=False,
+        primary_key=True,
+        index=True,
+    )
+    billing_type: Mapped[ProductBillingType] = mapped_column(
+        StringEnum(ProductBillingType), nullable=False
+    )
+
+    orders: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    revenue: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    net_revenue: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    one_time_products: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, default=0
+    )
+    one_time_products_revenue: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, default=0
+    )
+    one_time_products_net_revenue: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, default=0
+    )
+    checkouts: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    succeeded_checkouts: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, default=0
+    )
+
+    refreshed_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=False, default=utc_now
+    )
@@ -1,7 +1,16 @@
 from typing import TYPE_CHECKING
 from uuid import UUID
 
-from sqlalchemy import Boolean, ForeignKey, Integer, Text, Uuid
+from sqlalchemy import (
+    DDL,
+    Boolean,
+    ForeignKey,
+    Integer,
+    PrimaryKeyConstraint,
+    Text,
+    Uuid,
+    event,
+)
 from sqlalchemy.orm import Mapped, declared_attr, mapped_column, relationship
 
 from polar.kit.db.models.base import RecordModel
@@ -12,7 +21,15 @@ if TYPE_CHECKING:
 
 
 class WebhookDelivery(RecordModel):
+    """
+    Webhook deliveries are partitioned by day of `created_at`, like webhook events.
+    """
+
     __tablename__ = "webhook_deliveries"
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
     webhook_endpoint_id: Mapped[UUID] = mapped_column(
         Uuid,
@@ -25,17 +42,26 @@ class WebhookDelivery(RecordModel):
     def webhook_endpoint(cls) -> Mapped["WebhookEndpoint"]:
         return relationship("WebhookEndpoint", lazy="raise")
 
-    webhook_event_id: Mapped[UUID] = mapped_column(
-        Uuid,
-        ForeignKey("webhook_events.id", ondelete="CASCADE"),
-        nullable=False,
-        index=True,
-    )
+    # No foreign key: the event partition may be dropped before the delivery one,
+    # since an event can be redelivered until it expires.
+    webhook_event_id: Mapped[UUID] = mapped_column(Uuid, nullable=False, index=True)
 
     @declared_attr
     def webhook_event(cls) -> Mapped["WebhookEvent"]:
-        return relationship("WebhookEvent", lazy="raise")
+        return relationship(
+            "WebhookEvent",
+            lazy="raise",
+            primaryjoin="foreign(WebhookDelivery.webhook_event_id) == WebhookEvent.id",
+        )
 
     succeeded: Mapped[bool] = mapped_column(Boolean, nullable=False)
     http_code: Mapped[int | None] = mapped_column(Integer, nullable=True)
     response: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+
+# Catch-all partition, in case the daily partitions haven't been created in time
+event.listen(
+    WebhookDelivery.__table__,
+    "after_create",
+    DDL("CREATE TABLE %(table)s_default PARTITION OF %(table)s DEFAULT"),
+)
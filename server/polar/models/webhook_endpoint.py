@@ -1,8 +1,9 @@
+from datetime import datetime
 from enum import StrEnum
 from typing import TYPE_CHECKING, Literal
 from uuid import UUID
 
-from sqlalchemy import ForeignKey, String, Uuid
+from sqlalchemy import TIMESTAMP, Float, ForeignKey, Integer, String, Uuid
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, declared_attr, mapped_column, relationship
 
@@ -59,6 +60,15 @@ class WebhookFormat(StrEnum):
     slack = "slack"
 
 
+class WebhookCircuitState(StrEnum):
+    closed = "closed"
+    """Deliveries go through."""
+    open = "open"
+    """Deliveries are paused after repeated failures."""
+    half_open = "half_open"
+    """A single delivery probes the endpoint before resuming."""
+
+
 class WebhookEndpoint(RecordModel):
     __tablename__ = "webhook_endpoints"
 
@@ -69,6 +79,24 @@ class WebhookEndpoint(RecordModel):
         JSONB, nullable=False, default=[]
     )
 
+    circuit_state: Mapped[WebhookCircuitState] = mapped_column(
+        String, nullable=False, default=WebhookCircuitState.closed
+    )
+    circuit_opened_at: Mapped[datetime | None] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=True, default=None
+    )
+    consecutive_failures: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0
+    )
+    latency_ewma: Mapped[float | None] = mapped_column(
+        Float, nullable=True, default=None
+    )
+    """Exponentially weighted moving average of the delivery latency, in ms."""
+    error_rate_ewma: Mapped[float | None] = mapped_column(
+        Float, nullable=True, default=None
+    )
+    """Exponentially weighted moving average of the delivery failures."""
+
     organization_id: Mapped[UUID] = mapped_column(
         Uuid,
         ForeignKey("organizations.id", ondelete="CASCADE"),
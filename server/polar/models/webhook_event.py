@@ -1,7 +1,18 @@
 from typing import TYPE_CHECKING
 from uuid import UUID
 
-from sqlalchemy import Boolean, ColumnElement, ForeignKey, Index, Integer, String, Uuid
+from sqlalchemy import (
+    DDL,
+    Boolean,
+    ColumnElement,
+    ForeignKey,
+    Index,
+    Integer,
+    PrimaryKeyConstraint,
+    String,
+    Uuid,
+    event,
+)
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import Mapped, declared_attr, mapped_column, relationship
 
@@ -15,13 +26,28 @@ if TYPE_CHECKING:
 
 
 class WebhookEvent(RecordModel):
+    """
+    Webhook events are partitioned by day of `created_at`, so the partitions
+    older than the retention period can be dropped as a whole.
+
+    See `polar.kit.db.partitioning`.
+    """
+
     __tablename__ = "webhook_events"
     __table_args__ = (
+        # The partition key has to be part of the primary key
+        PrimaryKeyConstraint("id", "created_at"),
         Index(
             "ix_webhook_events_created_at_non_archived",
             "created_at",
             postgresql_where="payload IS NOT NULL",
         ),
+        Index(
+            "ix_webhook_events_webhook_endpoint_id_created_at",
+            "webhook_endpoint_id",
+            "created_at",
+        ),
+        {"postgresql_partition_by": "RANGE (created_at)"},
     )
 
     webhook_endpoint_id: Mapped[UUID] = mapped_column(
@@ -50,3 +76,11 @@ class WebhookEvent(RecordModel):
     @classmethod
     def _is_archived_expression(cls) -> ColumnElement[bool]:
         return cls.payload.is_(None)
+
+
+# Catch-all partition, in case the daily partitions haven't been created in time
+event.listen(
+    WebhookEvent.__table__,
+    "after_create",
+    DDL("CREATE TABLE %(table)s_default PARTITION OF %(table)s DEFAULT"),
+)
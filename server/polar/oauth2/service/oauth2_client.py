@@ -95,7 +95,7 @@ class OAuth2ClientService(ResourceServiceReader[OAuth2Client]):
 
         if client.user is not None:
             email = client.user.email
-            body = render_email_template(
+            body = await render_email_template(
                 OAuth2LeakedClientEmail(
                     props=OAuth2LeakedClientProps(
                         email=email,
@@ -104,7 +104,7 @@ class OAuth2TokenService(ResourceServiceReader[OAuth2Token]):
         oauth2_client = oauth2_token.client
 
         for recipient in recipients:
-            body = render_email_template(
+            body = await render_email_template(
                 OAuth2LeakedTokenEmail(
                     props=OAuth2LeakedTokenProps(
                         email=recipient,
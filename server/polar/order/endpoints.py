@@ -8,7 +8,7 @@ from polar.customer.schemas.customer import CustomerID
 from polar.exceptions import ResourceNotFound
 from polar.kit.csv import IterableCSVWriter
 from polar.kit.metadata import MetadataQuery, get_metadata_query_openapi_schema
-from polar.kit.pagination import ListResource, PaginationParams, PaginationParamsQuery
+from polar.kit.pagination import ListResource, PaginationParamsQuery
 from polar.kit.schemas import MultipleQueryFilter
 from polar.models import Order
 from polar.models.product import ProductBillingType
@@ -24,6 +24,7 @@ from polar.product.schemas import ProductID
 from polar.routing import APIRouter
 
 from . import auth, sorting
+from .repository import OrderRepository
 from .schemas import Order as OrderSchema
 from .schemas import OrderID, OrderInvoice, OrderNotFound, OrderUpdate
 from .service import MissingInvoiceBillingDetails, NotPaidOrder
@@ -120,24 +121,29 @@ async def export(
             )
         )
 
-        (results, _) = await order_service.list(
-            session,
-            auth_subject,
-            organization_id=organization_id,
-            product_id=product_id,
-            pagination=PaginationParams(limit=1000000, page=1),
+        repository = OrderRepository.from_session(session)
+        stream = repository.stream_export(
+            auth_subject, organization_id=organization_id, product_id=product_id
         )
 
-        for order in results:
+        async for (
+            email,
+            created_at,
+            product_name,
+            net_amount,
+            currency,
+            status,
+            invoice_number,
+        ) in stream:
             yield csv_writer.getrow(
                 (
-                    order.customer.email,
-                    order.created_at.isoformat(),
-                    order.description,
-                    order.net_amount / 100,
-                    order.currency,
-                    order.status,
-                    order.invoice_number,
+                    email,
+                    created_at.isoformat(),
+                    product_name,
+                    net_amount / 100,
+                    currency,
+                    status,
+                    invoice_number,
                 )
             )
 
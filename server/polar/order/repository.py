@@ -1,4 +1,5 @@
-from collections.abc import Sequence
+from collections.abc import AsyncGenerator, Sequence
+from datetime import datetime
 from typing import TYPE_CHECKING, cast
 from uuid import UUID
 
@@ -14,6 +15,7 @@ from polar.auth.models import (
     is_organization,
     is_user,
 )
+from polar.config import settings
 from polar.kit.repository import (
     Options,
     RepositoryBase,
@@ -155,6 +157,51 @@ class OrderRepository(
 
         return statement
 
+    async def stream_export(
+        self,
+        auth_subject: AuthSubject[User | Organization],
+        *,
+        organization_id: Sequence[UUID] | None = None,
+        product_id: Sequence[UUID] | None = None,
+    ) -> AsyncGenerator[tuple[str, datetime, str, int, str, OrderStatus, str]]:
+        """
+        Stream the columns of the orders CSV export, with a server-side cursor.
+
+        Only plain rows are fetched, so memory usage doesn't depend
+        on the number of orders.
+        """
+        statement = (
+            self.get_readable_statement(auth_subject)
+            .join(Order.product)
+            .with_only_columns(
+                Customer.email,
+                Order.created_at,
+                Product.name,
+                Order.net_amount,
+                Order.currency,
+                Order.status,
+                Order.invoice_number,
+            )
+            .select_from(Order)
+            .order_by(Order.created_at.desc())
+        )
+
+        if organization_id is not None:
+            statement = statement.where(Customer.organization_id.in_(organization_id))
+
+        if product_id is not None:
+            statement = statement.where(Order.product_id.in_(product_id))
+
+        results = await self.session.stream(
+            statement,
+            execution_options={"yield_per": settings.DATABASE_STREAM_YIELD_PER},
+        )
+        try:
+            async for result in results:
+                yield result._tuple()
+        finally:
+            await results.close()
+
     def get_eager_options(
         self,
         *,
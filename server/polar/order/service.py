@@ -1546,7 +1546,7 @@ class OrderService:
                 {"remote_url": invoice.url, "filename": order.invoice_filename}
             ]
 
-        body = render_email_template(email)
+        body = await render_email_template(email)
         enqueue_email(
             **organization.email_from_reply,
             to_email_addr=customer.email,
@@ -1590,6 +1590,7 @@ class OrderService:
     ) -> Order:
         order.update_refunds(refunded_amount, refunded_tax_amount=refunded_tax_amount)
         session.add(order)
+        enqueue_job("metrics.rollup_order", order.id)
         return order
 
     async def create_order_balance(
@@ -1667,6 +1668,7 @@ class OrderService:
             incoming.amount for _, incoming in platform_fee_transactions
         )
         session.add(order)
+        enqueue_job("metrics.rollup_order", order.id)
 
     async def send_webhook(
         self,
@@ -1711,6 +1713,7 @@ class OrderService:
         self, session: AsyncSession, order: Order, previous_status: OrderStatus
     ) -> None:
         await self.send_webhook(session, order, WebhookEventType.order_updated)
+        enqueue_job("metrics.rollup_order", order.id)
 
         became_paid = (
             order.status == OrderStatus.paid and previous_status != OrderStatus.paid
@@ -317,7 +317,7 @@ async def invite_member(
 
     # Send invitation email
     email = invite_body.email
-    body = render_email_template(
+    body = await render_email_template(
         OrganizationInviteEmail(
             props=OrganizationInviteProps(
                 email=email,
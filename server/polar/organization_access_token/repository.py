@@ -1,7 +1,17 @@
+from collections.abc import Mapping
 from datetime import datetime
 from uuid import UUID
 
-from sqlalchemy import Select, or_, select, update
+from sqlalchemy import (
+    TIMESTAMP,
+    Select,
+    Uuid,
+    column,
+    or_,
+    select,
+    update,
+    values,
+)
 from sqlalchemy.orm import contains_eager
 
 from polar.auth.models import AuthSubject, User
@@ -43,6 +53,19 @@ class OrganizationAccessTokenRepository(
             )
         return await self.get_one_or_none(statement)
 
+    async def record_usages(self, usages: Mapping[UUID, datetime]) -> None:
+        usages_values = values(
+            column("id", Uuid),
+            column("last_used_at", TIMESTAMP(timezone=True)),
+            name="usages",
+        ).data(list(usages.items()))
+        statement = (
+            update(OrganizationAccessToken)
+            .where(OrganizationAccessToken.id == usages_values.c.id)
+            .values(last_used_at=usages_values.c.last_used_at)
+        )
+        await self.session.execute(statement)
+
     async def record_usage(self, id: UUID, last_used_at: datetime) -> None:
         statement = (
             update(OrganizationAccessToken)
@@ -6,6 +6,7 @@ from uuid import UUID
 import structlog
 from sqlalchemy import UnaryExpression, asc, desc
 
+from polar.auth import cache as auth_token_cache
 from polar.auth.models import AuthSubject
 from polar.config import settings
 from polar.email.react import render_email_template
@@ -144,15 +145,18 @@ class OrganizationAccessTokenService:
         if update_schema.scopes is not None:
             update_dict["scope"] = " ".join(update_schema.scopes)
 
-        return await repository.update(
+        organization_access_token = await repository.update(
             organization_access_token, update_dict=update_dict
         )
+        auth_token_cache.invalidate_token(organization_access_token.token)
+        return organization_access_token
 
     async def delete(
         self, session: AsyncSession, organization_access_token: OrganizationAccessToken
     ) -> None:
         repository = OrganizationAccessTokenRepository.from_session(session)
         await repository.soft_delete(organization_access_token)
+        auth_token_cache.invalidate_token(organization_access_token.token)
 
     async def revoke_leaked(
         self,
@@ -170,13 +174,14 @@ class OrganizationAccessTokenService:
 
         repository = OrganizationAccessTokenRepository.from_session(session)
         await repository.soft_delete(organization_access_token)
+        auth_token_cache.invalidate_token(organization_access_token.token)
 
         organization_members = await user_organization_service.list_by_org(
             session, organization_access_token.organization_id
         )
         for organization_member in organization_members:
             email = organization_member.user.email
-            body = render_email_template(
+            body = await render_email_template(
                 OrganizationAccessTokenLeakedEmail(
                     props=OrganizationAccessTokenLeakedProps(
                         email=email,
@@ -1,11 +1,21 @@
-from collections.abc import Sequence
+from collections.abc import Mapping, Sequence
 from datetime import datetime
 from uuid import UUID
 
 import structlog
-from sqlalchemy import Select, or_, select, update
+from sqlalchemy import (
+    TIMESTAMP,
+    Select,
+    Uuid,
+    column,
+    or_,
+    select,
+    update,
+    values,
+)
 from sqlalchemy.orm import contains_eager
 
+from polar.auth import cache as auth_token_cache
 from polar.auth.models import AuthSubject
 from polar.config import settings
 from polar.email.react import render_email_template
@@ -79,6 +89,22 @@ class PersonalAccessTokenService(ResourceServiceReader[PersonalAccessToken]):
     ) -> None:
         personal_access_token.set_deleted_at()
         session.add(personal_access_token)
+        auth_token_cache.invalidate_token(personal_access_token.token)
+
+    async def record_usages(
+        self, session: AsyncSession, usages: Mapping[UUID, datetime]
+    ) -> None:
+        usages_values = values(
+            column("id", Uuid),
+            column("last_used_at", TIMESTAMP(timezone=True)),
+            name="usages",
+        ).data(list(usages.items()))
+        statement = (
+            update(PersonalAccessToken)
+            .where(PersonalAccessToken.id == usages_values.c.id)
+            .values(last_used_at=usages_values.c.last_used_at)
+        )
+        await session.execute(statement)
 
     async def record_usage(
         self, session: AsyncSession, id: UUID, last_used_at: datetime
@@ -106,10 +132,11 @@ class PersonalAccessTokenService(ResourceServiceReader[PersonalAccessToken]):
 
         personal_access_token.set_deleted_at()
         session.add(personal_access_token)
+        auth_token_cache.invalidate_token(personal_access_token.token)
 
         email = personal_access_token.user.email
 
-        body = render_email_template(
+        body = await render_email_template(
             PersonalAccessTokenLeakedEmail(
                 props=PersonalAccessTokenLeakedProps(
                     email=email,
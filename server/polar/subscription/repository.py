@@ -3,7 +3,7 @@ from dataclasses import dataclass
 from typing import TYPE_CHECKING
 from uuid import UUID
 
-from sqlalchemy import Select, case, or_, select
+from sqlalchemy import Select, case, literal, or_, select, union_all
 from sqlalchemy.orm import contains_eager
 from sqlalchemy.orm.strategy_options import joinedload, selectinload
 
@@ -258,6 +258,82 @@ class SubscriptionProductPriceRepository(
 
         return await self._get_seat_subscription_price(customer_id, meter_id)
 
+    def get_metered_prices_by_customer_statement(
+        self, meter_id: UUID
+    ) -> Select[tuple[UUID, UUID, UUID, UUID]]:
+        """
+        Set-based counterpart of `get_by_customer_and_meter`: for each customer
+        having access to a metered price of the meter, select the columns
+        `customer_id`, `paying_customer_id`, `subscription_id` and `product_price_id`.
+
+        A direct subscription takes precedence over a seat; between several direct
+        subscriptions, the earliest one is taken.
+        """
+        direct_statement = (
+            select(
+                Subscription.customer_id.label("customer_id"),
+                Subscription.customer_id.label("paying_customer_id"),
+                Subscription.id.label("subscription_id"),
+                SubscriptionProductPrice.product_price_id.label("product_price_id"),
+                literal(0).label("priority"),
+                Subscription.started_at.label("started_at"),
+            )
+            .join(
+                ProductPrice,
+                SubscriptionProductPrice.product_price_id == ProductPrice.id,
+            )
+            .join(
+                Subscription,
+                Subscription.id == SubscriptionProductPrice.subscription_id,
+            )
+            .where(
+                SubscriptionProductPrice.deleted_at.is_(None),
+                ProductPrice.is_metered.is_(True),
+                ProductPriceMeteredUnit.meter_id == meter_id,
+                Subscription.billable.is_(True),
+            )
+        )
+        seat_statement = (
+            select(
+                CustomerSeat.customer_id.label("customer_id"),
+                Subscription.customer_id.label("paying_customer_id"),
+                Subscription.id.label("subscription_id"),
+                SubscriptionProductPrice.product_price_id.label("product_price_id"),
+                literal(1).label("priority"),
+                Subscription.started_at.label("started_at"),
+            )
+            .join(Subscription, Subscription.id == CustomerSeat.subscription_id)
+            .join(
+                SubscriptionProductPrice,
+                SubscriptionProductPrice.subscription_id == Subscription.id,
+            )
+            .join(
+                ProductPrice,
+                SubscriptionProductPrice.product_price_id == ProductPrice.id,
+            )
+            .where(
+                CustomerSeat.status == SeatStatus.claimed,
+                SubscriptionProductPrice.deleted_at.is_(None),
+                ProductPrice.is_metered.is_(True),
+                ProductPriceMeteredUnit.meter_id == meter_id,
+            )
+        )
+        prices = union_all(direct_statement, seat_statement).subquery()
+        return (
+            select(
+                prices.c.customer_id,
+                prices.c.paying_customer_id,
+                prices.c.subscription_id,
+                prices.c.product_price_id,
+            )
+            .distinct(prices.c.customer_id)
+            .order_by(
+                prices.c.customer_id,
+                prices.c.priority.asc(),
+                prices.c.started_at.asc(),
+            )
+        )
+
     async def _get_direct_subscription_price(
         self, customer_id: UUID, meter_id: UUID
     ) -> CustomerSubscriptionProductPrice | None:
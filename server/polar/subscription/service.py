@@ -1019,6 +1019,7 @@ class SubscriptionService:
             WebhookEventType.customer_state_changed,
             subscription.customer_id,
         )
+        enqueue_job("metrics.invalidate_cache", subscription.product.organization_id)
 
     @contextlib.asynccontextmanager
     async def lock(
@@ -2082,6 +2083,7 @@ class SubscriptionService:
             WebhookEventType.customer_state_changed,
             subscription.customer_id,
         )
+        enqueue_job("metrics.invalidate_cache", subscription.product.organization_id)
 
     async def _on_subscription_updated(
         self,
@@ -2401,7 +2403,7 @@ class SubscriptionService:
             }
         )
 
-        body = render_email_template(email)
+        body = await render_email_template(email)
 
         subject = subject_template.format(product=product)
 
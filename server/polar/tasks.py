@@ -11,7 +11,9 @@ from polar.event import tasks as event
 from polar.eventstream import tasks as eventstream
 from polar.integrations.loops import tasks as loops
 from polar.integrations.stripe import tasks as stripe
+from polar.license_key import tasks as license_key
 from polar.meter import tasks as meter
+from polar.metrics import tasks as metrics
 from polar.notifications import tasks as notifications
 from polar.order import tasks as order
 from polar.organization import tasks as organization
@@ -36,8 +38,10 @@ __all__ = [
     "email_update",
     "event",
     "eventstream",
+    "license_key",
     "loops",
     "meter",
+    "metrics",
     "stripe",
     "order",
     "notifications",
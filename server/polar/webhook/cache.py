@@ -0,0 +1,109 @@
+"""
+In-process cache of the webhook endpoints targeted by each organization.
+
+Sending a webhook event needs the endpoints of the organization, which are
+cached so the hot paths, like checkout updates, don't look them up every time.
+
+Once a change to the endpoints is committed, they're evicted from the cache
+of every process through Redis pub/sub. Entries read from the database while
+an eviction was in flight aren't stored, so they can't outlive the change.
+"""
+
+import asyncio
+from typing import NamedTuple
+from uuid import UUID
+
+import structlog
+from redis import RedisError
+
+from polar.config import settings
+from polar.kit.cache import TTLCache
+from polar.logging import Logger
+from polar.models.webhook_endpoint import WebhookEventType, WebhookFormat
+from polar.redis import Redis
+
+log: Logger = structlog.get_logger()
+
+INVALIDATION_CHANNEL = "webhook:endpoints_cache:invalidate"
+
+
+class TargetEndpoint(NamedTuple):
+    id: UUID
+    format: WebhookFormat
+    events: frozenset[WebhookEventType]
+
+
+_cache = TTLCache[UUID, list[TargetEndpoint]](
+    ttl=settings.WEBHOOK_ENDPOINTS_CACHE_TTL,
+    maxsize=settings.WEBHOOK_ENDPOINTS_CACHE_MAXSIZE,
+)
+# Bumped on every eviction
+_generation = 0
+
+
+def _evict(organization_id: UUID) -> None:
+    global _generation
+    _cache.pop(organization_id)
+    _generation += 1
+
+
+def get_endpoints(organization_id: UUID) -> tuple[int, list[TargetEndpoint] | None]:
+    """
+    Get the cached endpoints of an organization.
+
+    Returns the current generation of the cache, to pass to `set_endpoints` on a miss.
+    """
+    return _generation, _cache.get(organization_id)
+
+
+def set_endpoints(
+    organization_id: UUID, endpoints: list[TargetEndpoint], generation: int
+) -> None:
+    """Cache the endpoints of an organization, unless evicted since `generation`."""
+    if generation == _generation:
+        _cache.set(organization_id, endpoints)
+
+
+def invalidate_endpoints(organization_id: UUID) -> None:
+    """
+    Evict the endpoints of an organization from the cache of this process.
+
+    Once the change is committed, the organization ID has to be published
+    on `INVALIDATION_CHANNEL` to evict them from every process.
+    """
+    _evict(organization_id)
+
+
+def clear() -> None:
+    global _generation
+    _cache.clear()
+    _generation += 1
+
+
+async def listen_invalidations(redis: Redis) -> None:
+    """Evict the endpoints changed by any process, until cancelled."""
+    while True:
+        try:
+            async with redis.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        _evict(UUID(message["data"]))
+        except RedisError as e:
+            # Invalidations may have been missed while disconnected
+            log.warning(
+                "Webhook endpoints cache invalidations interrupted", error=str(e)
+            )
+            clear()
+            await asyncio.sleep(1)
+
+
+__all__ = [
+    "TargetEndpoint",
+    "INVALIDATION_CHANNEL",
+    "get_endpoints",
+    "set_endpoints",
+    "invalidate_endpoints",
+    "clear",
+    "listen_invalidations",
+]
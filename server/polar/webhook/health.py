@@ -0,0 +1,50 @@
+import random
+from datetime import timedelta
+
+from polar.config import settings
+from polar.kit.utils import utc_now
+from polar.models.webhook_endpoint import WebhookCircuitState, WebhookEndpoint
+
+
+def get_timeout(endpoint: WebhookEndpoint) -> float:
+    """
+    Delivery timeout of an endpoint, in seconds.
+
+    Endpoints answering quickly on average don't get to hold a worker
+    for the full timeout when they hang.
+    """
+    maximum = settings.WEBHOOK_TIMEOUT.total_seconds()
+    if endpoint.latency_ewma is None:
+        return maximum
+    timeout = endpoint.latency_ewma / 1000 * settings.WEBHOOK_TIMEOUT_LATENCY_FACTOR
+    return min(max(timeout, settings.WEBHOOK_MIN_TIMEOUT.total_seconds()), maximum)
+
+
+def get_concurrency(endpoint: WebhookEndpoint) -> int:
+    """Maximum concurrent deliveries to an endpoint, given its average latency."""
+    maximum = settings.WEBHOOK_MAX_CONNECTIONS_PER_HOST
+    if not endpoint.latency_ewma:
+        return maximum
+    budget = settings.WEBHOOK_CONCURRENCY_LATENCY_BUDGET.total_seconds() * 1000
+    return min(max(int(budget / endpoint.latency_ewma), 1), maximum)
+
+
+def get_park_delay(endpoint: WebhookEndpoint) -> timedelta:
+    """
+    Time to wait before trying again to deliver an event to an endpoint
+    whose circuit is not closed.
+
+    A bit of jitter spreads the parked events, so they don't all wake up at once.
+    """
+    if endpoint.circuit_state == WebhookCircuitState.half_open:
+        # The probe should be done by then
+        delay = settings.WEBHOOK_TIMEOUT
+    else:
+        assert endpoint.circuit_opened_at is not None
+        delay = max(
+            endpoint.circuit_opened_at
+            + settings.WEBHOOK_CIRCUIT_OPEN_DURATION
+            - utc_now(),
+            timedelta(seconds=1),
+        )
+    return delay * random.uniform(1.0, 1.1)
@@ -1,16 +1,129 @@
 from collections.abc import Sequence
 from datetime import datetime
+from typing import Any
 from uuid import UUID
 
+from sqlalchemy import ColumnElement, and_, case, func, or_, select, update
+
+from polar.config import settings
 from polar.kit.repository import (
     RepositoryBase,
     RepositorySoftDeletionIDMixin,
     RepositorySoftDeletionMixin,
 )
+from polar.kit.utils import utc_now
 from polar.models.webhook_delivery import WebhookDelivery
+from polar.models.webhook_endpoint import WebhookCircuitState, WebhookEndpoint
 from polar.models.webhook_event import WebhookEvent
 
 
+def _ewma(column: ColumnElement[float | None], value: float) -> ColumnElement[float]:
+    alpha = settings.WEBHOOK_HEALTH_EWMA_ALPHA
+    return case(
+        (column.is_(None), value),
+        else_=column * (1 - alpha) + value * alpha,
+    )
+
+
+class WebhookEndpointRepository(
+    RepositorySoftDeletionIDMixin[WebhookEndpoint, UUID],
+    RepositorySoftDeletionMixin[WebhookEndpoint],
+    RepositoryBase[WebhookEndpoint],
+):
+    model = WebhookEndpoint
+
+    async def record_delivery(
+        self, endpoint_id: UUID, *, succeeded: bool, latency: float
+    ) -> None:
+        """
+        Update the health of an endpoint after a delivery attempt,
+        and open or close its circuit accordingly.
+
+        Everything is computed by the database, so concurrent deliveries
+        don't overwrite each other.
+        """
+        error_rate = _ewma(WebhookEndpoint.error_rate_ewma, 0.0 if succeeded else 1.0)
+        values: dict[str, Any] = {
+            "latency_ewma": _ewma(WebhookEndpoint.latency_ewma, latency),
+            "error_rate_ewma": error_rate,
+        }
+
+        if succeeded:
+            values |= {
+                "consecutive_failures": 0,
+                "circuit_state": WebhookCircuitState.closed,
+                "circuit_opened_at": None,
+            }
+        else:
+            consecutive_failures = WebhookEndpoint.consecutive_failures + 1
+            should_open = or_(
+                # The probe failed
+                WebhookEndpoint.circuit_state == WebhookCircuitState.half_open,
+                and_(
+                    WebhookEndpoint.circuit_state == WebhookCircuitState.closed,
+                    consecutive_failures >= settings.WEBHOOK_CIRCUIT_FAILURE_THRESHOLD,
+                    error_rate >= settings.WEBHOOK_CIRCUIT_ERROR_RATE_THRESHOLD,
+                ),
+            )
+            values |= {
+                "consecutive_failures": consecutive_failures,
+                "circuit_state": case(
+                    (should_open, WebhookCircuitState.open),
+                    else_=WebhookEndpoint.circuit_state,
+                ),
+                "circuit_opened_at": case(
+                    (should_open, utc_now()),
+                    else_=WebhookEndpoint.circuit_opened_at,
+                ),
+            }
+
+        statement = (
+            update(WebhookEndpoint)
+            .where(WebhookEndpoint.id == endpoint_id)
+            .values(values)
+            .execution_options(synchronize_session="fetch")
+        )
+        await self.session.execute(statement)
+
+    async def claim_probe(self, endpoint_id: UUID, *, opened_before: datetime) -> bool:
+        """
+        Switch an endpoint whose circuit has been open long enough to half-open.
+
+        Only one caller wins, and is in charge of probing the endpoint.
+        A stale half-open circuit can be claimed again, in case the probe was lost.
+        """
+        statement = (
+            update(WebhookEndpoint)
+            .where(
+                WebhookEndpoint.id == endpoint_id,
+                WebhookEndpoint.circuit_state.in_(
+                    (WebhookCircuitState.open, WebhookCircuitState.half_open)
+                ),
+                WebhookEndpoint.circuit_opened_at <= opened_before,
+            )
+            .values(
+                circuit_state=WebhookCircuitState.half_open,
+                circuit_opened_at=utc_now(),
+            )
+            .returning(WebhookEndpoint.id)
+            .execution_options(synchronize_session="fetch")
+        )
+        result = await self.session.execute(statement)
+        return result.scalar_one_or_none() is not None
+
+    async def count_by_circuit_state(self) -> dict[WebhookCircuitState, int]:
+        statement = (
+            select(WebhookEndpoint.circuit_state, func.count(WebhookEndpoint.id))
+            .where(WebhookEndpoint.deleted_at.is_(None))
+            .group_by(WebhookEndpoint.circuit_state)
+        )
+        result = await self.session.execute(statement)
+        counts = dict.fromkeys(WebhookCircuitState, 0)
+        for state, count in result.tuples().all():
+            counts[WebhookCircuitState(state)] = count
+        return counts
+
+
 class WebhookEventRepository(
     RepositorySoftDeletionIDMixin[WebhookEvent, UUID],
     RepositorySoftDeletionMixin[WebhookEvent],
@@ -21,16 +134,22 @@ class WebhookEventRepository(
     async def get_all_undelivered(
         self, older_than: datetime | None = None
     ) -> Sequence[WebhookEvent]:
+        # Bound the timestamps, so only the partitions still retained are scanned
+        retained_since = utc_now() - settings.WEBHOOK_EVENT_RETENTION_PERIOD
         statement = (
             self.get_base_statement()
             .join(
                 WebhookDelivery,
-                WebhookDelivery.webhook_event_id == WebhookEvent.id,
+                and_(
+                    WebhookDelivery.webhook_event_id == WebhookEvent.id,
+                    WebhookDelivery.created_at >= retained_since,
+                ),
                 isouter=True,
             )
             .where(
                 WebhookDelivery.id.is_(None),
                 WebhookEvent.payload.is_not(None),
+                WebhookEvent.created_at >= retained_since,
             )
         )
         if older_than is not None:
@@ -3,7 +3,11 @@ from typing import Annotated
 from pydantic import UUID4, AnyUrl, Field, PlainSerializer, UrlConstraints
 
 from polar.kit.schemas import IDSchema, Schema, TimestampedSchema
-from polar.models.webhook_endpoint import WebhookEventType, WebhookFormat
+from polar.models.webhook_endpoint import (
+    WebhookCircuitState,
+    WebhookEventType,
+    WebhookFormat,
+)
 from polar.organization.schemas import OrganizationID
 
 HttpsUrl = Annotated[
@@ -52,6 +56,23 @@ class WebhookEndpoint(IDSchema, TimestampedSchema):
         description="The organization ID associated with the webhook endpoint."
     )
     events: EndpointEvents
+    circuit_state: WebhookCircuitState = Field(
+        description=(
+            "The health of the webhook endpoint. "
+            "When `open`, deliveries are paused after repeated failures, "
+            "until a test delivery succeeds."
+        )
+    )
+    average_latency: float | None = Field(
+        validation_alias="latency_ewma",
+        description=(
+            "Moving average of the response time of the endpoint, in milliseconds."
+        ),
+    )
+    error_rate: float | None = Field(
+        validation_alias="error_rate_ewma",
+        description="Moving average of the share of failed deliveries, from 0 to 1.",
+    )
 
 
 class WebhookEndpointCreate(Schema):
@@ -1,23 +1,25 @@
 import datetime
 import json
 from collections.abc import Sequence
-from typing import Literal, cast, overload
+from typing import Literal, overload
 from uuid import UUID
 
 import structlog
-from sqlalchemy import CursorResult, Select, desc, func, select, text, update
+from sqlalchemy import Select, and_, desc, func, select
 from sqlalchemy.orm import contains_eager, joinedload
 
 from polar.auth.models import AuthSubject, is_organization, is_user
 from polar.checkout.eventstream import CheckoutEvent, publish_checkout_event
 from polar.checkout.repository import CheckoutRepository
+from polar.config import settings
 from polar.customer.schemas.state import CustomerState
 from polar.exceptions import PolarError, ResourceNotFound
 from polar.integrations.loops.service import loops as loops_service
 from polar.kit.crypto import generate_token
+from polar.kit.db.partitioning import maintain_daily_partitions
 from polar.kit.db.postgres import AsyncSession
 from polar.kit.pagination import PaginationParams, paginate
-from polar.kit.utils import utc_now
+from polar.kit.utils import generate_uuid, utc_now
 from polar.logging import Logger
 from polar.models import (
     Benefit,
@@ -51,11 +53,16 @@ from polar.webhook.schemas import (
 )
 from polar.worker import enqueue_job
 
+from . import cache as webhook_endpoints_cache
 from .webhooks import SkipEvent, UnsupportedTarget, WebhookPayloadTypeAdapter
 
 log: Logger = structlog.get_logger()
 
 
+# Earlier events of the endpoint are not waited for once they're this old
+ORDERING_AGE_LIMIT = datetime.timedelta(minutes=1)
+
+
 class WebhookError(PolarError): ...
 
 
@@ -126,6 +133,7 @@ class WebhookService:
             organization=organization,
         )
         session.add(endpoint)
+        _invalidate_endpoints_cache(organization.id)
 
         # Store it in Loops in case we need to announce technical things regarding webhooks
         user_organizations = await user_organization_service.list_by_org(
@@ -150,6 +158,7 @@ class WebhookService:
         ).items():
             setattr(endpoint, attr, value)
         session.add(endpoint)
+        _invalidate_endpoints_cache(endpoint.organization_id)
         return endpoint
 
     async def reset_endpoint_secret(
@@ -166,6 +175,7 @@ class WebhookService:
     ) -> WebhookEndpoint:
         endpoint.deleted_at = utc_now()
         session.add(endpoint)
+        _invalidate_endpoints_cache(endpoint.organization_id)
         return endpoint
 
     async def list_deliveries(
@@ -181,16 +191,21 @@ class WebhookService:
         readable_endpoints_statement = self._get_readable_endpoints_statement(
             auth_subject
         )
+        # Bound the timestamps, so only the partitions still retained are scanned
+        retained_since = utc_now() - settings.WEBHOOK_EVENT_RETENTION_PERIOD
         statement = (
             select(WebhookDelivery)
             .join(WebhookEndpoint)
+            .join(WebhookDelivery.webhook_event)
             .where(
                 WebhookDelivery.deleted_at.is_(None),
+                WebhookDelivery.created_at >= retained_since,
+                WebhookEvent.created_at >= retained_since,
                 WebhookEndpoint.id.in_(
                     readable_endpoints_statement.with_only_columns(WebhookEndpoint.id)
                 ),
             )
-            .options(joinedload(WebhookDelivery.webhook_event))
+            .options(contains_eager(WebhookDelivery.webhook_event))
             .order_by(desc(WebhookDelivery.created_at))
         )
 
@@ -279,12 +294,24 @@ class WebhookService:
         return res.scalars().unique().one_or_none()
 
     async def is_latest_event(self, session: AsyncSession, event: WebhookEvent) -> bool:
-        age_limit = utc_now() - datetime.timedelta(minutes=1)
+        """
+        Check that no earlier event of the endpoint is waiting for its first
+        delivery attempt.
+
+        Events older than `ORDERING_AGE_LIMIT` are not waited for.
+        """
+        age_limit = utc_now() - ORDERING_AGE_LIMIT
         statement = (
             select(func.count(WebhookEvent.id))
             .join(
                 WebhookDelivery,
-                WebhookDelivery.webhook_event_id == WebhookEvent.id,
+                and_(
+                    WebhookDelivery.webhook_event_id == WebhookEvent.id,
+                    # Deliveries can't predate their event: skip older partitions
+                    WebhookDelivery.created_at >= WebhookEvent.created_at,
+                    # Constant bound, so they're pruned when planning
+                    WebhookDelivery.created_at >= age_limit,
+                ),
                 isouter=True,
             )
             .where(
@@ -302,6 +329,54 @@ class WebhookService:
         count = res.scalar_one()
         return count == 0
 
+    async def get_next_pending_event(
+        self, session: AsyncSession, event: WebhookEvent
+    ) -> WebhookEvent | None:
+        """
+        Get the event of the endpoint following the given one,
+        and still waiting for its first delivery attempt.
+
+        That's the event to release once the given one has been attempted.
+        """
+        statement = (
+            select(WebhookEvent)
+            .join(
+                WebhookDelivery,
+                and_(
+                    WebhookDelivery.webhook_event_id == WebhookEvent.id,
+                    # Deliveries can't predate their event: skip older partitions
+                    WebhookDelivery.created_at >= WebhookEvent.created_at,
+                    # Constant bound, so they're pruned when planning
+                    WebhookDelivery.created_at >= event.created_at,
+                ),
+                isouter=True,
+            )
+            .where(
+                WebhookEvent.deleted_at.is_(None),
+                WebhookEvent.webhook_endpoint_id == event.webhook_endpoint_id,
+                WebhookEvent.is_archived.is_(False),
+                WebhookDelivery.id.is_(None),
+                WebhookEvent.created_at > event.created_at,
+            )
+            .order_by(WebhookEvent.created_at.asc())
+            .limit(1)
+        )
+        res = await session.execute(statement)
+        return res.scalars().first()
+
+    async def is_attempted(self, session: AsyncSession, event: WebhookEvent) -> bool:
+        statement = select(
+            select(WebhookDelivery.id)
+            .where(
+                WebhookDelivery.webhook_event_id == event.id,
+                # Deliveries can't predate their event: skip older partitions
+                WebhookDelivery.created_at >= event.created_at,
+            )
+            .exists()
+        )
+        res = await session.execute(statement)
+        return res.scalar_one()
+
     @overload
     async def send(
         self,
@@ -584,68 +659,65 @@ class WebhookService:
             {"type": event, "timestamp": now, "data": data}
         )
 
+        # Endpoints often share the same format: render each one only once
+        payloads: dict[WebhookFormat, str | None] = {}
         events: list[WebhookEvent] = []
         for endpoint in await self._get_event_target_endpoints(
             session, event=event, target=target
         ):
-            try:
-                payload_data = payload.get_payload(endpoint.format, target)
-                event_type = WebhookEvent(
+            if endpoint.format not in payloads:
+                try:
+                    payloads[endpoint.format] = payload.get_payload(
+                        endpoint.format, target
+                    )
+                except UnsupportedTarget as e:
+                    # Log the error but do not raise to not fail the whole request
+                    log.error(e.message)
+                    payloads[endpoint.format] = None
+                except SkipEvent:
+                    payloads[endpoint.format] = None
+
+            payload_data = payloads[endpoint.format]
+            if payload_data is None:
+                continue
+
+            events.append(
+                WebhookEvent(
+                    id=generate_uuid(),
                     created_at=payload.timestamp,
-                    webhook_endpoint=endpoint,
+                    webhook_endpoint_id=endpoint.id,
                     type=event,
                     payload=payload_data,
                 )
-                session.add(event_type)
-                events.append(event_type)
-                await session.flush()
-                enqueue_job("webhook_event.send", webhook_event_id=event_type.id)
-            except UnsupportedTarget as e:
-                # Log the error but do not raise to not fail the whole request
-                log.error(e.message)
-                continue
-            except SkipEvent:
-                continue
+            )
+
+        if not events:
+            return events
+
+        # Insert all the events at once
+        session.add_all(events)
+        await session.flush()
+        for webhook_event in events:
+            enqueue_job("webhook_event.send", webhook_event_id=webhook_event.id)
 
         return events
 
     async def archive_events(
-        self,
-        session: AsyncSession,
-        older_than: datetime.datetime,
-        batch_size: int = 5000,
+        self, session: AsyncSession, older_than: datetime.datetime
     ) -> None:
-        log.debug(
-            "Archive webhook events", older_than=older_than, batch_size=batch_size
-        )
-
-        while True:
-            batch_subquery = (
-                select(WebhookEvent.id)
-                .where(
-                    WebhookEvent.created_at < older_than,
-                    WebhookEvent.payload.is_not(None),
-                )
-                .order_by(WebhookEvent.created_at.asc())
-                .limit(batch_size)
-            )
-            statement = (
-                update(WebhookEvent)
-                .where(WebhookEvent.id.in_(batch_subquery))
-                .values(payload=None)
+        """
+        Drop the partitions of webhook events and deliveries older than `older_than`,
+        and create the ones of the upcoming days.
+        """
+        for table in (WebhookEvent.__tablename__, WebhookDelivery.__tablename__):
+            log.debug("Maintain webhook partitions", table=table, older_than=older_than)
+            await maintain_daily_partitions(
+                session,
+                table,
+                older_than=older_than,
+                premake=settings.WEBHOOK_PARTITIONS_PREMAKE,
             )
 
-            # https://github.com/sqlalchemy/sqlalchemy/commit/67f62aac5b49b6d048ca39019e5bd123d3c9cfb2
-            result = cast(CursorResult[WebhookEvent], await session.execute(statement))
-            updated_count = result.rowcount
-
-            await session.commit()
-
-            log.debug("Archived webhook events batch", updated_count=updated_count)
-
-            if updated_count < batch_size:
-                break
-
     def _get_readable_endpoints_statement(
         self, auth_subject: AuthSubject[User | Organization]
     ) -> Select[tuple[WebhookEndpoint]]:
@@ -674,14 +746,34 @@ class WebhookService:
         *,
         event: WebhookEventType,
         target: Organization,
-    ) -> Sequence[WebhookEndpoint]:
-        statement = select(WebhookEndpoint).where(
-            WebhookEndpoint.deleted_at.is_(None),
-            WebhookEndpoint.events.bool_op("@>")(text(f"'[\"{event}\"]'")),
-            WebhookEndpoint.organization_id == target.id,
-        )
-        res = await session.execute(statement)
-        return res.scalars().unique().all()
+    ) -> list[webhook_endpoints_cache.TargetEndpoint]:
+        generation, endpoints = webhook_endpoints_cache.get_endpoints(target.id)
+        if endpoints is None:
+            statement = select(
+                WebhookEndpoint.id, WebhookEndpoint.format, WebhookEndpoint.events
+            ).where(
+                WebhookEndpoint.deleted_at.is_(None),
+                WebhookEndpoint.organization_id == target.id,
+            )
+            res = await session.execute(statement)
+            endpoints = [
+                webhook_endpoints_cache.TargetEndpoint(id, format, frozenset(events))
+                for id, format, events in res.tuples().all()
+            ]
+            webhook_endpoints_cache.set_endpoints(target.id, endpoints, generation)
+
+        return [endpoint for endpoint in endpoints if event in endpoint.events]
+
+
+def _invalidate_endpoints_cache(organization_id: UUID) -> None:
+    webhook_endpoints_cache.invalidate_endpoints(organization_id)
+    # Evict them from every process once committed: the eventstream task
+    # publishes raw messages on Redis channels
+    enqueue_job(
+        "eventstream.publish",
+        str(organization_id),
+        [webhook_endpoints_cache.INVALIDATION_CHANNEL],
+    )
 
 
 webhook = WebhookService()
@@ -1,40 +1,247 @@
+import asyncio
 import base64
-from collections.abc import Mapping
+import contextlib
+import time
+import weakref
+from collections.abc import AsyncIterator, Mapping
+from datetime import timedelta
 from ssl import SSLError
+from typing import Any
 from uuid import UUID
 
+import dramatiq
 import httpx
+import logfire
 import structlog
 from apscheduler.triggers.cron import CronTrigger
 from dramatiq import Retry
+from redis.asyncio.lock import Lock
+from redis.exceptions import LockNotOwnedError, RedisError
 from standardwebhooks.webhooks import Webhook as StandardWebhook
 
 from polar.config import settings
 from polar.kit.db.postgres import AsyncSession
 from polar.kit.utils import utc_now
+from polar.locker import Locker, TimeoutLockError
 from polar.logging import Logger
 from polar.models.webhook_delivery import WebhookDelivery
-from polar.worker import AsyncSessionMaker, TaskPriority, actor, can_retry, enqueue_job
+from polar.models.webhook_endpoint import WebhookCircuitState, WebhookEndpoint
+from polar.models.webhook_event import WebhookEvent
+from polar.worker import (
+    AsyncSessionMaker,
+    HTTPXMiddleware,
+    JobQueueManager,
+    RedisMiddleware,
+    TaskPriority,
+    actor,
+    can_retry,
+    enqueue_job,
+    get_retries,
+)
 
+from . import health as webhook_health
+from .repository import WebhookEndpointRepository
+from .service import ORDERING_AGE_LIMIT
 from .service import webhook as webhook_service
 
 log: Logger = structlog.get_logger()
 
+# Longer than the delivery timeout, so the lock outlives the request.
+# It's renewed while the delivery runs, as waiting for a slot of the origin
+# may take a while.
+SEND_LOCK_TIMEOUT = 30.0
+
+delivery_duration = logfire.metric_histogram(
+    "webhook.delivery.duration",
+    unit="ms",
+    description="Duration of the HTTP request delivering a webhook event.",
+)
+delivery_connections = logfire.metric_counter(
+    "webhook.delivery.connections",
+    unit="1",
+    description="Webhook deliveries, by whether they reused a pooled connection.",
+)
+
+delivery_parked = logfire.metric_counter(
+    "webhook.delivery.parked",
+    unit="1",
+    description="Webhook events postponed while their endpoint circuit is open.",
+)
+
+
+class _ConcurrencyLimit:
+    """Semaphore whose limit can be changed while it's held."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def __aexit__(self, *args: object) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+
+# Limit the concurrent deliveries to each endpoint origin.
+# Limits are dropped as soon as no delivery holds them anymore.
+_origin_limits: weakref.WeakValueDictionary[
+    tuple[str, str, int | None], _ConcurrencyLimit
+] = weakref.WeakValueDictionary()
+
+
+def _get_origin_limit(url: str, limit: int) -> _ConcurrencyLimit:
+    parsed_url = httpx.URL(url)
+    origin = (parsed_url.scheme, parsed_url.host, parsed_url.port)
+    origin_limit = _origin_limits.get(origin)
+    if origin_limit is None:
+        origin_limit = _ConcurrencyLimit(limit)
+        _origin_limits[origin] = origin_limit
+    # Follow the latest observed latency of the endpoint
+    origin_limit.limit = limit
+    return origin_limit
+
+
+@contextlib.asynccontextmanager
+async def _renew_lock(lock: Lock) -> AsyncIterator[None]:
+    """Keep the lock from expiring until the block exits."""
+
+    async def _renew() -> None:
+        while True:
+            await asyncio.sleep(SEND_LOCK_TIMEOUT / 3)
+            await lock.reacquire()
+
+    task = asyncio.create_task(_renew())
+    try:
+        yield
+    finally:
+        task.cancel()
+        # Lost anyway: the ownership is checked again before sending
+        with contextlib.suppress(asyncio.CancelledError, LockNotOwnedError, RedisError):
+            await task
+
+
+class _ConnectionTrace:
+    """`httpcore` trace hook, telling if the request opened a new connection."""
+
+    def __init__(self) -> None:
+        self.connected = False
+
+    async def __call__(self, event_name: str, info: dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self.connected = True
+
+
+class _DeliveryResult:
+    """Duration of a delivery request, in milliseconds, set once it's done."""
+
+    duration: float | None = None
+
+
+async def _post(
+    endpoint: WebhookEndpoint,
+    *,
+    lock: Lock,
+    content: str,
+    headers: Mapping[str, str],
+    result: _DeliveryResult,
+) -> httpx.Response:
+    """
+    Deliver the request to the endpoint, once a slot of its origin is available.
+
+    Raises `LockNotOwnedError`, without sending anything, if the lock of the event
+    expired in the meantime: another job may be delivering it.
+    """
+    client = HTTPXMiddleware.get()
+    trace = _ConnectionTrace()
+    limit = _get_origin_limit(endpoint.url, webhook_health.get_concurrency(endpoint))
+    async with limit:
+        # Still ours, and for long enough to complete the request
+        await lock.reacquire()
+        # Total deadline, shorter than the lock: the timeout of httpx is per phase
+        timeout = webhook_health.get_timeout(endpoint)
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(timeout):
+                response = await client.post(
+                    endpoint.url,
+                    content=content,
+                    headers=headers,
+                    timeout=timeout,
+                    extensions={"trace": trace},
+                )
+        except TimeoutError as e:
+            raise httpx.TimeoutException(
+                f"Delivery timed out after {timeout} seconds"
+            ) from e
+        finally:
+            result.duration = (time.perf_counter() - start) * 1000
+            delivery_duration.record(result.duration)
+    delivery_connections.add(1, {"reused": not trace.connected})
+    return response
+
 
 @actor(
     actor_name="webhook_event.send",
     max_retries=settings.WEBHOOK_MAX_RETRIES,
     priority=TaskPriority.MEDIUM,
 )
-async def webhook_event_send(webhook_event_id: UUID, redeliver: bool = False) -> None:
+async def webhook_event_send(
+    webhook_event_id: UUID, redeliver: bool = False, parked_since: float | None = None
+) -> None:
     async with AsyncSessionMaker() as session:
         return await _webhook_event_send(
-            session, webhook_event_id=webhook_event_id, redeliver=redeliver
+            session,
+            webhook_event_id=webhook_event_id,
+            redeliver=redeliver,
+            parked_since=parked_since,
         )
 
 
 async def _webhook_event_send(
-    session: AsyncSession, *, webhook_event_id: UUID, redeliver: bool = False
+    session: AsyncSession,
+    *,
+    webhook_event_id: UUID,
+    redeliver: bool = False,
+    parked_since: float | None = None,
+) -> None:
+    # The same event may be enqueued twice: by `send` and when it's released
+    # by the previous event of the endpoint. Make sure only one job delivers it.
+    locker = Locker(RedisMiddleware.get())
+    try:
+        async with (
+            locker.lock(
+                f"webhook_event:{webhook_event_id}",
+                timeout=SEND_LOCK_TIMEOUT,
+                blocking_timeout=0,
+            ) as lock,
+            _renew_lock(lock),
+        ):
+            return await _deliver_event(
+                session,
+                lock=lock,
+                webhook_event_id=webhook_event_id,
+                redeliver=redeliver,
+                parked_since=parked_since,
+            )
+    except TimeoutLockError:
+        log.info(
+            "Event is being delivered by another job, skipping", id=webhook_event_id
+        )
+
+
+async def _deliver_event(
+    session: AsyncSession,
+    *,
+    lock: Lock,
+    webhook_event_id: UUID,
+    redeliver: bool,
+    parked_since: float | None,
 ) -> None:
     event = await webhook_service.get_event_by_id(session, webhook_event_id)
     if not event:
@@ -50,18 +257,70 @@ async def _webhook_event_send(
         bound_log.info("Archived event, skipping")
         return
 
+    # Endpoints are cached when sending, so an event may target a deleted one
+    if event.webhook_endpoint.deleted_at is not None:
+        bound_log.info("Deleted endpoint, skipping")
+        return
+
     if event.succeeded and not redeliver:
         bound_log.info("Event already succeeded, skipping")
         return
 
-    if not await webhook_service.is_latest_event(session, event):
-        log.info(
-            "Earlier events need to be delivered first, retrying later",
-            id=event.id,
-            type=event.type,
-            webhook_endpoint_id=event.webhook_endpoint_id,
-        )
-        raise Retry()
+    # Events of an endpoint are delivered in order: the first attempt of an event
+    # waits for the previous one, which releases it once attempted.
+    first_attempt = not redeliver and get_retries() == 0
+    if first_attempt:
+        if await webhook_service.is_attempted(session, event):
+            bound_log.info("Event already attempted, skipping")
+            return
+
+        if not await webhook_service.is_latest_event(session, event):
+            bound_log.info(
+                "Earlier events need to be delivered first, waiting to be released"
+            )
+            # Should the release never come, e.g. if the releasing job was
+            # skipped, earlier events are no longer waited for after a while.
+            await _send_later(
+                webhook_event_id, redeliver=redeliver, delay=ORDERING_AGE_LIMIT
+            )
+            return
+
+    # While the circuit of the endpoint is open, events are postponed without
+    # consuming their retries, until one of them gets to probe the endpoint.
+    endpoint = event.webhook_endpoint
+    if endpoint.circuit_state != WebhookCircuitState.closed:
+        endpoint_repository = WebhookEndpointRepository.from_session(session)
+        if not await endpoint_repository.claim_probe(
+            endpoint.id,
+            opened_before=utc_now() - settings.WEBHOOK_CIRCUIT_OPEN_DURATION,
+        ):
+            # Not forever though: past the maximum duration, the event fails
+            if parked_since is None:
+                parked_since = time.time()
+            elif (
+                time.time() - parked_since
+                > settings.WEBHOOK_MAX_PARK_DURATION.total_seconds()
+            ):
+                bound_log.info("Endpoint circuit is still open, giving up on event")
+                event.succeeded = False
+                session.add(event)
+                await session.commit()
+                if not redeliver:
+                    await _release_next_event(session, event)
+                return
+
+            delay = webhook_health.get_park_delay(endpoint)
+            bound_log.info("Endpoint circuit is open, parking event", delay=delay)
+            await _park_event(
+                webhook_event_id,
+                redeliver=redeliver,
+                delay=delay,
+                parked_since=parked_since,
+            )
+            return
+        # Let the other jobs know the probe is in progress
+        await session.commit()
+        bound_log.info("Endpoint circuit is half-open, probing endpoint")
 
     ts = utc_now()
 
@@ -84,46 +343,110 @@ async def _webhook_event_send(
     delivery = WebhookDelivery(
         webhook_event_id=webhook_event_id, webhook_endpoint_id=event.webhook_endpoint_id
     )
+    result = _DeliveryResult()
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                event.webhook_endpoint.url,
-                content=event.payload,
-                headers=headers,
-                timeout=20.0,
-            )
-            delivery.http_code = response.status_code
-            delivery.response = (
-                # Limit to first 2048 characters to avoid bloating the DB
-                response.text[:2048] if response.text else None
-            )
-            event.last_http_code = response.status_code
-            response.raise_for_status()
-        # Error
-        except (httpx.HTTPError, SSLError) as e:
-            bound_log.info("An error occurred while sending a webhook", error=e)
-            delivery.succeeded = False
-            if delivery.response is None:
-                delivery.response = str(e)
-
-            # Permanent failure
-            if not can_retry():
-                event.succeeded = False
-            # Retry
-            else:
-                raise Retry() from e
-        # Success
+    try:
+        response = await _post(
+            endpoint,
+            lock=lock,
+            content=event.payload,
+            headers=headers,
+            result=result,
+        )
+        delivery.http_code = response.status_code
+        delivery.response = (
+            # Limit to first 2048 characters to avoid bloating the DB
+            response.text[:2048] if response.text else None
+        )
+        event.last_http_code = response.status_code
+        response.raise_for_status()
+    # Error
+    except (httpx.HTTPError, SSLError) as e:
+        bound_log.info("An error occurred while sending a webhook", error=e)
+        delivery.succeeded = False
+        if delivery.response is None:
+            delivery.response = str(e)
+
+        # Permanent failure
+        if not can_retry():
+            event.succeeded = False
+        # Retry
         else:
-            delivery.succeeded = True
-            event.succeeded = True
-            enqueue_job("webhook_event.success", webhook_event_id=webhook_event_id)
-        # Either way, save the delivery
-        finally:
-            assert delivery.succeeded is not None
+            raise Retry() from e
+    # Lost the lock before sending: try again once the job holding it is done
+    except LockNotOwnedError:
+        bound_log.info("Lost the lock of the event, sending it later")
+        await _send_later(
+            webhook_event_id,
+            redeliver=redeliver,
+            delay=timedelta(seconds=SEND_LOCK_TIMEOUT),
+            parked_since=parked_since,
+        )
+    # Success
+    else:
+        delivery.succeeded = True
+        event.succeeded = True
+        enqueue_job("webhook_event.success", webhook_event_id=webhook_event_id)
+    # Either way, save the delivery
+    finally:
+        # Not attempted if the lock was lost
+        if delivery.succeeded is not None:
             session.add(delivery)
             session.add(event)
+            if result.duration is not None:
+                await WebhookEndpointRepository.from_session(session).record_delivery(
+                    endpoint.id, succeeded=delivery.succeeded, latency=result.duration
+                )
             await session.commit()
+            if not redeliver:
+                await _release_next_event(session, event)
+
+
+async def _send_later(
+    webhook_event_id: UUID,
+    *,
+    redeliver: bool,
+    delay: timedelta,
+    parked_since: float | None = None,
+) -> None:
+    # Send a new message rather than raising `Retry`, so the retries are kept
+    actor = dramatiq.get_broker().get_actor("webhook_event.send")
+    kwargs: dict[str, Any] = {
+        "webhook_event_id": webhook_event_id,
+        "redeliver": redeliver,
+    }
+    if parked_since is not None:
+        kwargs["parked_since"] = parked_since
+    await asyncio.to_thread(
+        actor.send_with_options,
+        kwargs=kwargs,
+        delay=int(delay.total_seconds() * 1000),
+        retries=get_retries(),
+    )
+
+
+async def _park_event(
+    webhook_event_id: UUID,
+    *,
+    redeliver: bool,
+    delay: timedelta,
+    parked_since: float,
+) -> None:
+    await _send_later(
+        webhook_event_id, redeliver=redeliver, delay=delay, parked_since=parked_since
+    )
+    delivery_parked.add(1)
+
+
+async def _release_next_event(session: AsyncSession, event: WebhookEvent) -> None:
+    next_event = await webhook_service.get_next_pending_event(session, event)
+    if next_event is None:
+        return
+
+    enqueue_job("webhook_event.send", webhook_event_id=next_event.id)
+    # Enqueued jobs are only flushed when the actor returns, not when it raises
+    # `Retry`: flush right away, so a failing event doesn't hold the next ones.
+    await JobQueueManager.get().flush(dramatiq.get_broker(), RedisMiddleware.get())
 
 
 @actor(actor_name="webhook_event.success", priority=TaskPriority.HIGH)
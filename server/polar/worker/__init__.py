@@ -16,11 +16,14 @@ from dramatiq.brokers.redis import RedisBroker
 from polar.config import settings
 from polar.logfire import instrument_httpx
 
+from ._email import EmailRendererMiddleware
 from ._encoder import JSONEncoder
 from ._enqueue import JobQueueManager, enqueue_events, enqueue_job
 from ._health import HealthMiddleware
+from ._httpx import HTTPXMiddleware
 from ._redis import RedisMiddleware
 from ._sqlalchemy import AsyncSessionMaker, SQLAlchemyMiddleware
+from ._webhook import WebhookEndpointsCacheMiddleware
 
 
 class MaxRetriesMiddleware(dramatiq.Middleware):
@@ -165,6 +168,9 @@ broker.add_middleware(middleware.CurrentMessage())
 broker.add_middleware(MaxRetriesMiddleware())
 broker.add_middleware(SQLAlchemyMiddleware())
 broker.add_middleware(RedisMiddleware())
+broker.add_middleware(HTTPXMiddleware())
+broker.add_middleware(EmailRendererMiddleware())
+broker.add_middleware(WebhookEndpointsCacheMiddleware())
 broker.add_middleware(scheduler_middleware)
 broker.add_middleware(LogfireMiddleware())
 broker.add_middleware(LogContextMiddleware())
@@ -231,6 +237,7 @@ __all__ = [
     "CronTrigger",
     "AsyncSessionMaker",
     "RedisMiddleware",
+    "HTTPXMiddleware",
     "JobQueueManager",
     "scheduler_middleware",
     "enqueue_job",
@@ -0,0 +1,27 @@
+import dramatiq
+from dramatiq.asyncio import get_event_loop_thread
+
+from polar.email import react as email_renderer
+
+
+class EmailRendererMiddleware(dramatiq.Middleware):
+    """
+    Middleware managing the lifecycle of the pool of email renderers.
+
+    The renderer processes are spawned once, on the event loop of the worker,
+    and reused across jobs, instead of spawning one for each email.
+    """
+
+    def after_worker_boot(
+        self, broker: dramatiq.Broker, worker: dramatiq.Worker
+    ) -> None:
+        event_loop_thread = get_event_loop_thread()
+        assert event_loop_thread is not None
+        event_loop_thread.run_coroutine(email_renderer.start_pool())
+
+    def before_worker_shutdown(
+        self, broker: dramatiq.Broker, worker: dramatiq.Worker
+    ) -> None:
+        event_loop_thread = get_event_loop_thread()
+        assert event_loop_thread is not None
+        event_loop_thread.run_coroutine(email_renderer.close_pool())
@@ -32,6 +32,7 @@ _job_queue_manager: contextvars.ContextVar["JobQueueManager | None"] = (
 )
 
 FLUSH_BATCH_SIZE = 50
+INGESTED_EVENTS_BATCH_SIZE = 1000
 
 
 class JobQueueManager:
@@ -53,8 +54,11 @@ class JobQueueManager:
         self._ingested_events.extend(event_ids)
 
     async def flush(self, broker: dramatiq.Broker, redis: Redis) -> None:
-        if len(self._ingested_events) > 0:
-            self.enqueue_job("event.ingested", self._ingested_events)
+        # Keep `event.ingested` messages bounded, whatever the number of events
+        for event_ids in itertools.batched(
+            self._ingested_events, INGESTED_EVENTS_BATCH_SIZE
+        ):
+            self.enqueue_job("event.ingested", list(event_ids))
 
         if not self._enqueued_jobs:
             self.reset()
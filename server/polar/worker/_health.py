@@ -22,7 +22,10 @@ from polar.kit.utils import utc_now
 from polar.logging import Logger
 from polar.postgres import create_async_engine, create_async_read_engine
 from polar.redis import Redis, create_redis
-from polar.webhook.repository import WebhookEventRepository
+from polar.webhook.repository import (
+    WebhookEndpointRepository,
+    WebhookEventRepository,
+)
 
 log: Logger = structlog.get_logger()
 
@@ -72,6 +75,16 @@ async def webhooks(request: Request) -> JSONResponse:
     return JSONResponse({"status": "ok"})
 
 
+async def webhook_endpoints(request: Request) -> JSONResponse:
+    async_sessionmaker: AsyncSessionMaker = request.state.async_sessionmaker
+    async with async_sessionmaker() as session:
+        repository = WebhookEndpointRepository(session)
+        circuit_states = await repository.count_by_circuit_state()
+
+    # Informative only: unhealthy endpoints are on the customers' side
+    return JSONResponse({"status": "ok", "circuit_states": circuit_states})
+
+
 async def external_events(request: Request) -> JSONResponse:
     async_sessionmaker: AsyncSessionMaker = request.state.async_sessionmaker
     async with async_sessionmaker() as session:
@@ -111,6 +124,7 @@ def create_app() -> Starlette:
     routes = [
         Route("/", health, methods=["GET"]),
         Route("/webhooks", webhooks, methods=["GET"]),
+        Route("/webhook-endpoints", webhook_endpoints, methods=["GET"]),
         Route("/unhandled-external-events", external_events, methods=["GET"]),
     ]
     return Starlette(routes=routes, lifespan=lifespan)
@@ -0,0 +1,65 @@
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+
+import dramatiq
+import httpx
+import structlog
+from dramatiq.asyncio import get_event_loop_thread
+
+from polar.config import settings
+from polar.logging import Logger
+
+log: Logger = structlog.get_logger()
+
+
+_client: httpx.AsyncClient | None = None
+
+
+def create_http_client() -> httpx.AsyncClient:
+    # Shared by requests to many third-party endpoints: never keep their cookies
+    cookies = httpx.Cookies(CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])))
+    return httpx.AsyncClient(
+        http2=True,
+        cookies=cookies,
+        limits=httpx.Limits(
+            max_connections=settings.WORKER_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.WORKER_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.WORKER_HTTP_KEEPALIVE_EXPIRY.total_seconds(),
+        ),
+    )
+
+
+async def _close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        log.info("Closed HTTP client")
+        _client = None
+
+
+class HTTPXMiddleware(dramatiq.Middleware):
+    """
+    Middleware managing the lifecycle of a shared HTTP client.
+
+    Connections are kept alive and reused across jobs of the worker process,
+    instead of opening a new one (and doing a TLS handshake) for each request.
+    """
+
+    @classmethod
+    def get(cls) -> httpx.AsyncClient:
+        if _client is None:
+            raise RuntimeError("HTTP client not initialized")
+        return _client
+
+    def before_worker_boot(
+        self, broker: dramatiq.Broker, worker: dramatiq.Worker
+    ) -> None:
+        global _client
+        _client = create_http_client()
+        log.info("Created HTTP client")
+
+    def after_worker_shutdown(
+        self, broker: dramatiq.Broker, worker: dramatiq.Worker
+    ) -> None:
+        event_loop_thread = get_event_loop_thread()
+        assert event_loop_thread is not None
+        event_loop_thread.run_coroutine(_close_http_client())
@@ -0,0 +1,48 @@
+import asyncio
+import contextlib
+
+import dramatiq
+from dramatiq.asyncio import get_event_loop_thread
+
+from polar.webhook import cache as webhook_endpoints_cache
+
+from ._redis import RedisMiddleware
+
+
+class WebhookEndpointsCacheMiddleware(dramatiq.Middleware):
+    """
+    Middleware listening to the invalidations of the webhook endpoints cache.
+
+    Webhook events are sent from the worker too, so its cache of endpoints
+    has to be evicted when they change, like the one of the API.
+    """
+
+    def __init__(self) -> None:
+        self._task: asyncio.Task[None] | None = None
+
+    def after_worker_boot(
+        self, broker: dramatiq.Broker, worker: dramatiq.Worker
+    ) -> None:
+        event_loop_thread = get_event_loop_thread()
+        assert event_loop_thread is not None
+        self._task = event_loop_thread.run_coroutine(self._start())
+
+    def before_worker_shutdown(
+        self, broker: dramatiq.Broker, worker: dramatiq.Worker
+    ) -> None:
+        event_loop_thread = get_event_loop_thread()
+        assert event_loop_thread is not None
+        event_loop_thread.run_coroutine(self._stop())
+
+    async def _start(self) -> asyncio.Task[None]:
+        return asyncio.create_task(
+            webhook_endpoints_cache.listen_invalidations(RedisMiddleware.get())
+        )
+
+    async def _stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
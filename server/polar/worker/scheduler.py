@@ -2,9 +2,11 @@ import logfire
 from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.schedulers.base import STATE_STOPPED
 from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.interval import IntervalTrigger
 
 from polar import tasks
-from polar.customer_meter.scheduler import CustomerMeterJobStore
+from polar.config import settings
+from polar.customer_meter.scheduler import CustomerMeterClaimer, CustomerMeterJobStore
 from polar.logfire import configure_logfire
 from polar.logging import configure as configure_logging
 from polar.sentry import configure_sentry
@@ -31,7 +33,20 @@ def start() -> None:
 
     scheduler.add_jobstore(MemoryJobStore(), "memory")
     scheduler.add_jobstore(SubscriptionJobStore(), "subscription")
-    scheduler.add_jobstore(CustomerMeterJobStore(), "customer_meter")
+    customer_meter_claimer: CustomerMeterClaimer | None = None
+    if settings.CUSTOMER_METER_SCHEDULER_MODE == "claim":
+        customer_meter_claimer = CustomerMeterClaimer()
+        scheduler.add_job(
+            customer_meter_claimer,
+            IntervalTrigger(
+                seconds=settings.CUSTOMER_METER_SCHEDULER_INTERVAL.total_seconds()
+            ),
+            jobstore="memory",
+            max_instances=1,
+            coalesce=True,
+        )
+    else:
+        scheduler.add_jobstore(CustomerMeterJobStore(), "customer_meter")
 
     for func, cron_trigger in scheduler_middleware.cron_triggers:
         scheduler.add_job(func, cron_trigger, jobstore="memory")
@@ -40,6 +55,9 @@ def start() -> None:
         scheduler.start()
     except KeyboardInterrupt:
         scheduler.shutdown()
+    finally:
+        if customer_meter_claimer is not None:
+            customer_meter_claimer.shutdown()
 
 
 __all__ = ["tasks", "start"]
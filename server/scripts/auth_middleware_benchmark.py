@@ -0,0 +1,121 @@
+import asyncio
+import logging.config
+import statistics
+import time
+from datetime import timedelta
+from functools import wraps
+from typing import Any
+from uuid import UUID
+
+import structlog
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from polar.auth import cache as auth_token_cache
+from polar.auth.middlewares import get_token_auth_subject
+from polar.config import settings
+from polar.kit.crypto import generate_token_hash_pair
+from polar.kit.db.postgres import AsyncSession, create_async_sessionmaker
+from polar.kit.utils import utc_now
+from polar.models import PersonalAccessToken
+from polar.personal_access_token.service import TOKEN_PREFIX
+from polar.postgres import create_async_engine
+from polar.worker import JobQueueManager
+
+cli = typer.Typer()
+
+
+def drop_all(*args: Any, **kwargs: Any) -> Any:
+    raise structlog.DropEvent
+
+
+structlog.configure(processors=[drop_all])
+logging.config.dictConfig(
+    {
+        "version": 1,
+        "disable_existing_loggers": True,
+    }
+)
+
+
+def typer_async(f):  # type: ignore
+    # From https://github.com/tiangolo/typer/issues/85
+    @wraps(f)
+    def wrapper(*args, **kwargs):  # type: ignore
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+async def _run(
+    session: AsyncSession, token: str, requests: int, cached: bool
+) -> tuple[float, list[float]]:
+    latencies: list[float] = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        if not cached:
+            auth_token_cache.clear()
+        # Each request gets its own session in production
+        session.expunge_all()
+        request_start = time.perf_counter()
+        auth_subject = await get_token_auth_subject(session, token)
+        latencies.append((time.perf_counter() - request_start) * 1000)
+        assert auth_subject is not None
+    return time.perf_counter() - start, latencies
+
+
+@cli.command()
+@typer_async
+async def benchmark(
+    user_id: UUID = typer.Argument(..., help="User owning the seeded token."),
+    requests: int = typer.Option(5_000, help="Number of authentications."),
+) -> None:
+    """
+    Compare the authentication of a personal access token
+    with and without the in-process token cache.
+
+    The token is seeded and rolled back at the end.
+    """
+    console = Console()
+    engine = create_async_engine("script")
+    sessionmaker = create_async_sessionmaker(engine)
+    JobQueueManager.set()
+
+    table = Table("Cache", "Requests/s", "p50", "p95", "p99")
+    async with sessionmaker() as session:
+        try:
+            token, token_hash = generate_token_hash_pair(
+                secret=settings.SECRET, prefix=TOKEN_PREFIX
+            )
+            session.add(
+                PersonalAccessToken(
+                    comment="Benchmark",
+                    token=token_hash,
+                    user_id=user_id,
+                    expires_at=utc_now() + timedelta(days=1),
+                    scope="openid",
+                )
+            )
+            await session.flush()
+
+            for name, cached in (("Cold", False), ("Cached", True)):
+                with console.status(f"Authenticating {requests} requests ({name})..."):
+                    duration, latencies = await _run(session, token, requests, cached)
+                quantiles = statistics.quantiles(latencies, n=100)
+                table.add_row(
+                    name,
+                    f"{requests / duration:,.0f}",
+                    f"{quantiles[49]:.3f}ms",
+                    f"{quantiles[94]:.3f}ms",
+                    f"{quantiles[98]:.3f}ms",
+                )
+        finally:
+            await session.rollback()
+            JobQueueManager.close()
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    cli()
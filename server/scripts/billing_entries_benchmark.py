@@ -0,0 +1,135 @@
+import asyncio
+import logging.config
+import time
+from functools import wraps
+from typing import Any
+from uuid import UUID
+
+import structlog
+import typer
+from rich.console import Console
+from sqlalchemy import ColumnElement, func, insert, literal, null, select, text, true
+
+from polar.event.repository import EventRepository
+from polar.kit.db.postgres import AsyncSession, create_async_sessionmaker
+from polar.kit.utils import utc_now
+from polar.meter.repository import MeterRepository
+from polar.meter.service import meter as meter_service
+from polar.models import BillingEntry, Event, Meter
+from polar.postgres import create_async_engine
+from polar.worker import JobQueueManager
+
+cli = typer.Typer()
+
+
+def drop_all(*args: Any, **kwargs: Any) -> Any:
+    raise structlog.DropEvent
+
+
+structlog.configure(processors=[drop_all])
+logging.config.dictConfig(
+    {
+        "version": 1,
+        "disable_existing_loggers": True,
+    }
+)
+
+
+def typer_async(f):  # type: ignore
+    # From https://github.com/tiangolo/typer/issues/85
+    @wraps(f)
+    def wrapper(*args, **kwargs):  # type: ignore
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+async def _seed_events(
+    session: AsyncSession, meter: Meter, customer_id: UUID, count: int
+) -> None:
+    """Clone an event of the customer matching the meter `count` times."""
+    event_repository = EventRepository.from_session(session)
+    template_statement = (
+        select(Event.id)
+        .where(
+            Event.organization_id == meter.organization_id,
+            Event.customer_id == customer_id,
+            event_repository.get_meter_clause(meter),
+        )
+        .limit(1)
+    )
+    template_id = await session.scalar(template_statement)
+    if template_id is None:
+        raise typer.BadParameter("The customer doesn't have any event for the meter.")
+
+    table = Event.__table__
+    series = func.generate_series(1, count).table_valued("n")
+    overrides: dict[str, ColumnElement[Any]] = {
+        "id": func.gen_random_uuid(),
+        "ingested_at": literal(utc_now()),
+        "external_id": null(),
+    }
+    await session.execute(
+        insert(table).from_select(
+            [column.name for column in table.c],
+            select(*(overrides.get(column.name, column) for column in table.c))
+            .select_from(table.join(series, true()))
+            .where(table.c.id == template_id),
+        )
+    )
+    await session.execute(text("ANALYZE events"))
+
+
+@cli.command()
+@typer_async
+async def benchmark(
+    meter_id: UUID = typer.Argument(..., help="Meter to bill."),
+    customer_id: UUID = typer.Argument(
+        ..., help="Customer with a metered subscription on the meter."
+    ),
+    events: int = typer.Option(1_000_000, help="Number of events to seed."),
+) -> None:
+    """
+    Measure the creation of the billing entries of seeded meter events.
+
+    Everything is rolled back at the end.
+    """
+    console = Console()
+    engine = create_async_engine("script")
+    sessionmaker = create_async_sessionmaker(engine)
+    JobQueueManager.set()
+
+    async with sessionmaker() as session:
+        try:
+            meter_repository = MeterRepository.from_session(session)
+            meter = await meter_repository.get_by_id(meter_id)
+            if meter is None:
+                raise typer.BadParameter("Meter not found.")
+
+            # Catch up with the existing events first, so only seeded ones are billed
+            await meter_service.create_billing_entries(session, meter)
+
+            with console.status(f"Seeding {events} events..."):
+                await _seed_events(session, meter, customer_id, events)
+
+            count_statement = select(func.count(BillingEntry.id))
+            entries_before = await session.scalar(count_statement) or 0
+            start = time.perf_counter()
+            subscription_ids = await meter_service.create_billing_entries(
+                session, meter
+            )
+            duration = time.perf_counter() - start
+            entries_after = await session.scalar(count_statement) or 0
+        finally:
+            await session.rollback()
+            JobQueueManager.close()
+
+    created = entries_after - entries_before
+    console.print(
+        f"Created {created:,} billing entries for {len(subscription_ids)} "
+        f"subscription(s) in {duration:.2f}s ({created / duration:,.0f} entries/s)"
+    )
+
+
+if __name__ == "__main__":
+    cli()
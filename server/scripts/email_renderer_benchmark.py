@@ -0,0 +1,109 @@
+import asyncio
+import logging.config
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+from functools import wraps
+from typing import Any
+
+import structlog
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from polar.email import react as email_renderer
+from polar.email.schemas import LoginCodeEmail, LoginCodeProps
+
+cli = typer.Typer()
+
+
+def drop_all(*args: Any, **kwargs: Any) -> Any:
+    raise structlog.DropEvent
+
+
+structlog.configure(processors=[drop_all])
+logging.config.dictConfig(
+    {
+        "version": 1,
+        "disable_existing_loggers": True,
+    }
+)
+
+
+def typer_async(f):  # type: ignore
+    # From https://github.com/tiangolo/typer/issues/85
+    @wraps(f)
+    def wrapper(*args, **kwargs):  # type: ignore
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+def _get_email(i: int) -> LoginCodeEmail:
+    return LoginCodeEmail(
+        props=LoginCodeProps(
+            email=f"user{i}@example.com", code=f"{i:06}", code_lifetime_minutes=30
+        )
+    )
+
+
+async def _run(
+    render: Callable[[int], Awaitable[str]], emails: int, concurrency: int
+) -> tuple[float, list[float]]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _task(i: int) -> float:
+        async with semaphore:
+            start = time.perf_counter()
+            await render(i)
+            return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(_task(i) for i in range(emails)))
+    return time.perf_counter() - start, latencies
+
+
+@cli.command()
+@typer_async
+async def benchmark(
+    emails: int = typer.Option(200, help="Number of emails to render."),
+    concurrency: int = typer.Option(20, help="Concurrent renders."),
+    pool_size: int = typer.Option(4, help="Number of renderers in the pool."),
+) -> None:
+    """
+    Compare rendering emails with a one-off renderer process per email,
+    and with a pool of long-lived renderers.
+    """
+    console = Console()
+
+    async def render(i: int) -> str:
+        return await email_renderer.render_email_template(_get_email(i))
+
+    table = Table("Renderer", "Emails/s", "p50", "p95", "p99")
+
+    async def _add_row(name: str, render: Callable[[int], Awaitable[str]]) -> None:
+        with console.status(f"Rendering {emails} emails ({name})..."):
+            duration, latencies = await _run(render, emails, concurrency)
+        quantiles = statistics.quantiles(latencies, n=100)
+        table.add_row(
+            name,
+            f"{emails / duration:,.1f}",
+            f"{quantiles[49]:.2f}ms",
+            f"{quantiles[94]:.2f}ms",
+            f"{quantiles[98]:.2f}ms",
+        )
+
+    # Without a pool, each email is rendered by a one-off process
+    await _add_row("Process per email", render)
+
+    await email_renderer.start_pool(pool_size)
+    try:
+        await _add_row(f"Pool ({pool_size} renderers)", render)
+    finally:
+        await email_renderer.close_pool()
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,102 @@
+import asyncio
+import logging.config
+import random
+import time
+from functools import wraps
+from typing import Any
+from uuid import UUID
+
+import structlog
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from polar.event.repository import EventRepository
+from polar.kit.db.postgres import create_async_sessionmaker
+from polar.kit.utils import utc_now
+from polar.models.event import EventSource
+from polar.postgres import create_async_engine
+
+cli = typer.Typer()
+
+
+def drop_all(*args: Any, **kwargs: Any) -> Any:
+    raise structlog.DropEvent
+
+
+structlog.configure(processors=[drop_all])
+logging.config.dictConfig(
+    {
+        "version": 1,
+        "disable_existing_loggers": True,
+    }
+)
+
+
+def typer_async(f):  # type: ignore
+    # From https://github.com/tiangolo/typer/issues/85
+    @wraps(f)
+    def wrapper(*args, **kwargs):  # type: ignore
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+def _generate_events(organization_id: UUID, count: int) -> list[dict[str, Any]]:
+    now = utc_now()
+    return [
+        {
+            "source": EventSource.user,
+            "organization_id": organization_id,
+            "timestamp": now,
+            "name": "benchmark",
+            "external_customer_id": f"benchmark_{random.randrange(1000)}",
+            "user_metadata": {
+                "model": random.choice(("lite", "pro")),
+                "tokens": random.randrange(10_000),
+            },
+        }
+        for _ in range(count)
+    ]
+
+
+@cli.command()
+@typer_async
+async def benchmark(
+    organization_id: UUID = typer.Argument(..., help="Organization owning the events."),
+    events: int = typer.Option(50_000, help="Number of events to ingest."),
+    chunk_size: int = typer.Option(1000, help="Number of events written at once."),
+) -> None:
+    """
+    Compare the `INSERT` and `COPY` ingestion paths, in events per second.
+
+    Events are rolled back at the end.
+    """
+    console = Console()
+    engine = create_async_engine("script")
+    sessionmaker = create_async_sessionmaker(engine)
+    payload = _generate_events(organization_id, events)
+
+    table = Table(title=f"Events ingestion ({events} events, chunks of {chunk_size})")
+    table.add_column("Method")
+    table.add_column("Seconds", justify="right")
+    table.add_column("Events/s", justify="right")
+
+    for method in ("insert_batch", "copy_batch"):
+        async with sessionmaker() as session:
+            repository = EventRepository.from_session(session)
+            write = getattr(repository, method)
+            try:
+                start = time.perf_counter()
+                for offset in range(0, events, chunk_size):
+                    await write(payload[offset : offset + chunk_size])
+                duration = time.perf_counter() - start
+            finally:
+                await session.rollback()
+        table.add_row(method, f"{duration:.2f}", f"{events / duration:,.0f}")
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    cli()
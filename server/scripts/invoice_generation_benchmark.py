@@ -0,0 +1,159 @@
+import asyncio
+import logging.config
+import multiprocessing
+import time
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ProcessPoolExecutor
+from datetime import UTC, datetime
+from functools import wraps
+from typing import Any
+
+import structlog
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from polar.invoice.generator import (
+    Invoice,
+    InvoiceItem,
+    generate_invoice,
+    preload_fonts,
+)
+from polar.kit.address import Address, CountryAlpha2
+from polar.kit.tax import TaxabilityReason
+
+cli = typer.Typer()
+
+
+def drop_all(*args: Any, **kwargs: Any) -> Any:
+    raise structlog.DropEvent
+
+
+structlog.configure(processors=[drop_all])
+logging.config.dictConfig(
+    {
+        "version": 1,
+        "disable_existing_loggers": True,
+    }
+)
+
+
+def typer_async(f):  # type: ignore
+    # From https://github.com/tiangolo/typer/issues/85
+    @wraps(f)
+    def wrapper(*args, **kwargs):  # type: ignore
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+def _get_invoice(i: int) -> Invoice:
+    return Invoice(
+        number=f"POLAR-{i:06}",
+        date=datetime.now(UTC),
+        seller_name="Polar Software, Inc.",
+        seller_address=Address(
+            line1="123 Polar St",
+            city="San Francisco",
+            state="CA",
+            postal_code="94107",
+            country=CountryAlpha2("US"),
+        ),
+        customer_name=f"Customer {i}",
+        customer_address=Address(country=CountryAlpha2("FR")),
+        subtotal_amount=100_00,
+        discount_amount=0,
+        taxability_reason=TaxabilityReason.standard_rated,
+        tax_amount=20_00,
+        tax_rate={
+            "rate_type": "percentage",
+            "display_name": "VAT",
+            "basis_points": 2000,
+            "country": "FR",
+            "amount": None,
+            "amount_currency": None,
+            "state": None,
+        },
+        currency="eur",
+        items=[
+            InvoiceItem(
+                description=f"Product {i}",
+                quantity=1,
+                unit_amount=100_00,
+                amount=100_00,
+            )
+        ],
+    )
+
+
+async def _measure(
+    generate: Callable[[Invoice], Awaitable[bytes]], invoices: list[Invoice]
+) -> tuple[float, float]:
+    """Generate the invoices, and measure how much the event loop was blocked."""
+    max_lag = 0.0
+    done = asyncio.Event()
+
+    async def _monitor_loop() -> None:
+        nonlocal max_lag
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            max_lag = max(max_lag, time.perf_counter() - start - 0.01)
+
+    monitor = asyncio.create_task(_monitor_loop())
+    start = time.perf_counter()
+    await asyncio.gather(*(generate(invoice) for invoice in invoices))
+    duration = time.perf_counter() - start
+    done.set()
+    await monitor
+    return duration, max_lag * 1000
+
+
+@cli.command()
+@typer_async
+async def benchmark(
+    invoices: int = typer.Option(100, help="Number of invoices to generate."),
+    workers: int = typer.Option(4, help="Number of processes in the pool."),
+) -> None:
+    """
+    Compare generating invoices on the event loop, like it used to be done,
+    and in a process pool, as a batch.
+    """
+    console = Console()
+    batch = [_get_invoice(i) for i in range(invoices)]
+    loop = asyncio.get_running_loop()
+
+    async def generate_inline(invoice: Invoice) -> bytes:
+        return generate_invoice(invoice, "Invoice", False)
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=preload_fonts,
+    )
+
+    async def generate_pool(invoice: Invoice) -> bytes:
+        return await loop.run_in_executor(
+            executor, generate_invoice, invoice, "Invoice", False
+        )
+
+    table = Table("Generation", "Invoices/s", "Max event loop lag")
+    try:
+        # Start the processes beforehand
+        await asyncio.gather(*(generate_pool(invoice) for invoice in batch[:workers]))
+
+        for name, generate in (
+            ("Inline", generate_inline),
+            (f"Process pool ({workers} processes)", generate_pool),
+        ):
+            with console.status(f"Generating {invoices} invoices ({name})..."):
+                duration, max_lag = await _measure(generate, batch)
+            table.add_row(name, f"{invoices / duration:,.1f}", f"{max_lag:.0f}ms")
+    finally:
+        executor.shutdown()
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,133 @@
+import asyncio
+import logging.config
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+from functools import wraps
+from typing import Any
+from uuid import UUID
+
+import structlog
+import typer
+from rich.console import Console
+from rich.table import Table
+from sqlalchemy import update
+
+from polar.kit.db.postgres import create_async_sessionmaker
+from polar.kit.utils import utc_now
+from polar.license_key import counters as license_key_counters
+from polar.license_key.repository import LicenseKeyRepository
+from polar.models import LicenseKey
+from polar.postgres import create_async_engine
+from polar.redis import create_redis
+
+cli = typer.Typer()
+
+
+def drop_all(*args: Any, **kwargs: Any) -> Any:
+    raise structlog.DropEvent
+
+
+structlog.configure(processors=[drop_all])
+logging.config.dictConfig(
+    {
+        "version": 1,
+        "disable_existing_loggers": True,
+    }
+)
+
+
+def typer_async(f):  # type: ignore
+    # From https://github.com/tiangolo/typer/issues/85
+    @wraps(f)
+    def wrapper(*args, **kwargs):  # type: ignore
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+async def _run(
+    validate: Callable[[], Awaitable[bool]], validations: int, concurrency: int
+) -> tuple[float, list[float], int]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _task() -> tuple[float, bool]:
+        async with semaphore:
+            start = time.perf_counter()
+            validated = await validate()
+            return (time.perf_counter() - start) * 1000, validated
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_task() for _ in range(validations)))
+    duration = time.perf_counter() - start
+
+    latencies = [latency for latency, _ in results]
+    validated = sum(1 for _, validated in results if validated)
+    return duration, latencies, validated
+
+
+@cli.command()
+@typer_async
+async def benchmark(
+    license_key_id: UUID = typer.Argument(..., help="License key to validate."),
+    validations: int = typer.Option(5_000, help="Number of validations."),
+    concurrency: int = typer.Option(50, help="Concurrent validations."),
+) -> None:
+    """
+    Compare concurrent validations of a single license key,
+    updating its row every time or counting them in Redis.
+
+    The row updates are rolled back, and the Redis counters are flushed
+    at the end, so the license key counts the Redis validations only.
+    """
+    console = Console()
+    engine = create_async_engine("script")
+    sessionmaker = create_async_sessionmaker(engine)
+    redis = create_redis("script")
+
+    async with sessionmaker() as session:
+        repository = LicenseKeyRepository.from_session(session)
+        license_key = await repository.get_by_id(license_key_id)
+        if license_key is None:
+            raise typer.BadParameter("License key not found.")
+
+    async def validate_row() -> bool:
+        async with sessionmaker() as session:
+            await session.execute(
+                update(LicenseKey)
+                .where(LicenseKey.id == license_key_id)
+                .values(
+                    validations=LicenseKey.validations + 1,
+                    last_validated_at=utc_now(),
+                )
+            )
+            await session.rollback()
+        return True
+
+    async def validate_counters() -> bool:
+        return await license_key_counters.increment(redis, license_key)
+
+    table = Table("Counters", "Validations/s", "p50", "p95", "p99")
+    try:
+        for name, validate in (("Row", validate_row), ("Redis", validate_counters)):
+            with console.status(f"Validating {validations} times ({name})..."):
+                duration, latencies, _ = await _run(validate, validations, concurrency)
+            quantiles = statistics.quantiles(latencies, n=100)
+            table.add_row(
+                name,
+                f"{validations / duration:,.0f}",
+                f"{quantiles[49]:.2f}ms",
+                f"{quantiles[94]:.2f}ms",
+                f"{quantiles[98]:.2f}ms",
+            )
+    finally:
+        async with sessionmaker() as session:
+            await license_key_counters.flush(redis, session)
+        await redis.aclose()
+        await engine.dispose()
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,74 @@
+import asyncio
+import logging.config
+from functools import wraps
+from typing import Any
+from uuid import UUID
+
+import structlog
+import typer
+from rich.progress import Progress
+
+from polar.kit.db.postgres import create_async_sessionmaker
+from polar.meter.repository import MeterRepository
+from polar.meter.service import meter as meter_service
+from polar.models import Meter
+from polar.postgres import create_async_engine
+
+cli = typer.Typer()
+
+
+def drop_all(*args: Any, **kwargs: Any) -> Any:
+    raise structlog.DropEvent
+
+
+structlog.configure(processors=[drop_all])
+logging.config.dictConfig(
+    {
+        "version": 1,
+        "disable_existing_loggers": True,
+    }
+)
+
+
+def typer_async(f):  # type: ignore
+    # From https://github.com/tiangolo/typer/issues/85
+    @wraps(f)
+    def wrapper(*args, **kwargs):  # type: ignore
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+@cli.command()
+@typer_async
+async def build(
+    meter_id: list[UUID] = typer.Option(
+        [], help="Meters to build. Defaults to all meters not built yet."
+    ),
+) -> None:
+    engine = create_async_engine("script")
+    sessionmaker = create_async_sessionmaker(engine)
+    async with sessionmaker() as session:
+        repository = MeterRepository.from_session(session)
+        statement = repository.get_base_statement().with_only_columns(Meter.id)
+        if meter_id:
+            statement = statement.where(Meter.id.in_(meter_id))
+        else:
+            statement = statement.where(Meter.aggregates_built_at.is_(None))
+        result = await session.execute(statement)
+        meter_id = list(result.scalars().all())
+
+    with Progress() as progress:
+        task = progress.add_task("[green]Building...", total=len(meter_id))
+        for id in meter_id:
+            async with sessionmaker() as session:
+                repository = MeterRepository.from_session(session)
+                meter = await repository.get_by_id(id)
+                assert meter is not None
+                await meter_service.build_aggregates(session, meter)
+                await session.commit()
+            progress.update(task, advance=1)
+
+
+if __name__ == "__main__":
+    cli()
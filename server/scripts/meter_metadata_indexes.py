@@ -0,0 +1,72 @@
+import asyncio
+import logging.config
+from functools import wraps
+from typing import Any
+from uuid import UUID
+
+import structlog
+import typer
+from sqlalchemy import select
+
+from polar.kit.db.postgres import create_async_sessionmaker
+from polar.meter.indexes import ensure_metadata_indexes
+from polar.models import Event, Meter
+from polar.postgres import create_async_engine
+
+cli = typer.Typer()
+
+
+def drop_all(*args: Any, **kwargs: Any) -> Any:
+    raise structlog.DropEvent
+
+
+structlog.configure(processors=[drop_all])
+logging.config.dictConfig(
+    {
+        "version": 1,
+        "disable_existing_loggers": True,
+    }
+)
+
+
+def typer_async(f):  # type: ignore
+    # From https://github.com/tiangolo/typer/issues/85
+    @wraps(f)
+    def wrapper(*args, **kwargs):  # type: ignore
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+@cli.command()
+@typer_async
+async def create(
+    organization_id: list[UUID] = typer.Option(
+        [], help="Only index the meters of these organizations."
+    ),
+) -> None:
+    """Create the metadata indexes of the keys compared by meter filters."""
+    engine = create_async_engine("script")
+    sessionmaker = create_async_sessionmaker(engine)
+    async with sessionmaker() as session:
+        statement = select(Meter.filter).where(
+            Meter.deleted_at.is_(None), Meter.archived_at.is_(None)
+        )
+        if organization_id:
+            statement = statement.where(Meter.organization_id.in_(organization_id))
+        result = await session.execute(statement)
+        keys: set[str] = set()
+        for filter in result.scalars().all():
+            keys |= filter.get_indexable_properties(Event)
+
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        created = await ensure_metadata_indexes(connection, keys)
+
+    for index_name in created:
+        typer.echo(index_name)
+    typer.echo(f"{len(created)} index(es) created for {len(keys)} key(s)")
+
+
+if __name__ == "__main__":
+    cli()
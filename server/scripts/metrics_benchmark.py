@@ -0,0 +1,257 @@
+import asyncio
+import logging.config
+import statistics
+import time
+from datetime import UTC, datetime
+from functools import wraps
+from typing import Any
+from uuid import UUID
+
+import structlog
+import typer
+from rich.console import Console
+from rich.table import Table
+from sqlalchemy import (
+    ColumnElement,
+    Select,
+    and_,
+    func,
+    insert,
+    literal,
+    null,
+    select,
+    text,
+    true,
+)
+
+from polar.kit.db.explain import explain
+from polar.kit.db.postgres import AsyncSession, create_async_sessionmaker
+from polar.kit.time_queries import (
+    TimeInterval,
+    get_timestamp_series_cte,
+    sql_bucket_range,
+)
+from polar.models import Order, Product
+from polar.postgres import create_async_engine
+
+cli = typer.Typer()
+
+
+def drop_all(*args: Any, **kwargs: Any) -> Any:
+    raise structlog.DropEvent
+
+
+structlog.configure(processors=[drop_all])
+logging.config.dictConfig(
+    {
+        "version": 1,
+        "disable_existing_loggers": True,
+    }
+)
+
+
+def typer_async(f):  # type: ignore
+    # From https://github.com/tiangolo/typer/issues/85
+    @wraps(f)
+    def wrapper(*args, **kwargs):  # type: ignore
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+async def _seed_orders(
+    session: AsyncSession,
+    organization_id: UUID,
+    count: int,
+    start: datetime,
+    end: datetime,
+) -> None:
+    """
+    Clone a paid order of the organization `count` times,
+    with `created_at` spread randomly between `start` and `end`.
+    """
+    template_statement = (
+        select(Order.id)
+        .join(Product, onclause=Order.product_id == Product.id)
+        .where(Product.organization_id == organization_id, Order.paid.is_(True))
+        .limit(1)
+    )
+    result = await session.execute(template_statement)
+    template_id = result.scalar_one_or_none()
+    if template_id is None:
+        raise typer.BadParameter("The organization doesn't have any paid order.")
+
+    table = Order.__table__
+    series = func.generate_series(1, count).table_valued("n")
+    overrides: dict[str, ColumnElement[Any]] = {
+        "id": func.gen_random_uuid(),
+        "created_at": literal(start) + func.random() * literal(end - start),
+        "modified_at": null(),
+        "invoice_number": func.concat(table.c.invoice_number, "-", series.c.n),
+    }
+    for column in table.c:
+        if column.unique and column.name not in overrides:
+            overrides[column.name] = null()
+
+    await session.execute(
+        insert(table).from_select(
+            [column.name for column in table.c],
+            select(*(overrides.get(column.name, column) for column in table.c))
+            .select_from(table.join(series, true()))
+            .where(table.c.id == template_id),
+        )
+    )
+    await session.execute(text("ANALYZE orders"))
+
+
+def _orders_statement(
+    organization_id: UUID,
+    start: datetime,
+    end: datetime,
+    interval: TimeInterval,
+    *,
+    legacy: bool,
+    cumulative: bool,
+) -> Select[Any]:
+    """
+    Revenue per period, as computed by the `orders` and `cumulative_orders` CTEs.
+
+    `legacy` reproduces the former `date_trunc` join predicates,
+    which prevent the use of an index on `orders.created_at`.
+    """
+    timestamp_series = get_timestamp_series_cte(start, end, interval)
+    timestamp_column: ColumnElement[datetime] = timestamp_series.c.timestamp
+
+    if legacy:
+        truncated = interval.sql_date_trunc(Order.created_at)
+        truncated_timestamp = interval.sql_date_trunc(timestamp_column)
+        range_clause = (
+            truncated <= truncated_timestamp
+            if cumulative
+            else truncated == truncated_timestamp
+        )
+    else:
+        range_clause = sql_bucket_range(
+            Order.created_at, timestamp_series, cumulative=cumulative
+        )
+
+    revenue: ColumnElement[int] = func.coalesce(func.sum(Order.net_amount), 0)
+    if cumulative and not legacy:
+        revenue = func.sum(revenue).over(order_by=timestamp_column)
+
+    return (
+        select(timestamp_column.label("timestamp"), revenue.label("revenue"))
+        .select_from(
+            timestamp_series.join(
+                Order,
+                isouter=True,
+                onclause=and_(
+                    range_clause,
+                    Order.paid.is_(True),
+                    Order.product_id.in_(
+                        select(Product.id).where(
+                            Product.organization_id == organization_id
+                        )
+                    ),
+                ),
+            )
+        )
+        .group_by(timestamp_column)
+        .order_by(timestamp_column.asc())
+    )
+
+
+async def _measure(
+    session: AsyncSession, statement: Select[Any], runs: int
+) -> tuple[float, float, list[Any]]:
+    plan = await explain(session, statement)
+    durations: list[float] = []
+    rows: list[Any] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = await session.execute(statement)
+        rows = list(result.tuples().all())
+        durations.append((time.perf_counter() - start) * 1000)
+    return plan["Plan"]["Total Cost"], statistics.median(durations), rows
+
+
+@cli.command()
+@typer_async
+async def benchmark(
+    organization_id: UUID = typer.Argument(..., help="Organization to query."),
+    start: datetime = typer.Option(datetime(2024, 1, 1), help="Start date (UTC)."),
+    end: datetime = typer.Option(datetime(2024, 12, 31), help="End date (UTC)."),
+    interval: TimeInterval = typer.Option(TimeInterval.day),
+    seed_orders: int = typer.Option(
+        0,
+        help=(
+            "Number of synthetic orders to add before measuring. "
+            "They're rolled back at the end."
+        ),
+    ),
+    runs: int = typer.Option(5, help="Number of executions of each statement."),
+) -> None:
+    """Compare the legacy `date_trunc` metrics joins with the range ones."""
+    start = start.replace(tzinfo=UTC)
+    end = end.replace(tzinfo=UTC)
+    console = Console()
+
+    engine = create_async_engine("script")
+    sessionmaker = create_async_sessionmaker(engine)
+    async with sessionmaker() as session:
+        try:
+            if seed_orders > 0:
+                with console.status(f"Seeding {seed_orders} orders..."):
+                    await _seed_orders(
+                        session, organization_id, seed_orders, start, end
+                    )
+
+            table = Table(title=f"Metrics queries ({interval}, {runs} runs)")
+            table.add_column("Query")
+            table.add_column("Legacy cost", justify="right")
+            table.add_column("Range cost", justify="right")
+            table.add_column("Legacy ms", justify="right")
+            table.add_column("Range ms", justify="right")
+            table.add_column("Same results")
+
+            for name, cumulative in (("orders", False), ("cumulative_orders", True)):
+                legacy_cost, legacy_ms, legacy_rows = await _measure(
+                    session,
+                    _orders_statement(
+                        organization_id,
+                        start,
+                        end,
+                        interval,
+                        legacy=True,
+                        cumulative=cumulative,
+                    ),
+                    runs,
+                )
+                range_cost, range_ms, range_rows = await _measure(
+                    session,
+                    _orders_statement(
+                        organization_id,
+                        start,
+                        end,
+                        interval,
+                        legacy=False,
+                        cumulative=cumulative,
+                    ),
+                    runs,
+                )
+                table.add_row(
+                    name,
+                    f"{legacy_cost:.0f}",
+                    f"{range_cost:.0f}",
+                    f"{legacy_ms:.1f}",
+                    f"{range_ms:.1f}",
+                    "yes" if legacy_rows == range_rows else "[red]no[/red]",
+                )
+
+            console.print(table)
+        finally:
+            await session.rollback()
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,133 @@
+import asyncio
+import logging.config
+from datetime import UTC, datetime, timedelta
+from functools import wraps
+from typing import Any
+from uuid import UUID
+
+import structlog
+import typer
+from rich.progress import Progress
+from sqlalchemy import select
+
+from polar.kit.db.postgres import create_async_sessionmaker
+from polar.kit.time_queries import MIN_DATETIME
+from polar.metrics.service import metrics as metrics_service
+from polar.models import Organization
+from polar.postgres import create_async_engine
+from polar.redis import create_redis
+
+cli = typer.Typer()
+
+
+def drop_all(*args: Any, **kwargs: Any) -> Any:
+    raise structlog.DropEvent
+
+
+structlog.configure(processors=[drop_all])
+logging.config.dictConfig(
+    {
+        "version": 1,
+        "disable_existing_loggers": True,
+    }
+)
+
+
+def typer_async(f):  # type: ignore
+    # From https://github.com/tiangolo/typer/issues/85
+    @wraps(f)
+    def wrapper(*args, **kwargs):  # type: ignore
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+def _get_windows(
+    start: datetime, end: datetime, window: timedelta
+) -> list[tuple[datetime, datetime]]:
+    windows: list[tuple[datetime, datetime]] = []
+    while start < end:
+        windows.append((start, min(start + window, end)))
+        start += window
+    return windows
+
+
+@cli.command()
+@typer_async
+async def backfill(
+    organization_id: list[UUID] = typer.Option(
+        [], help="Organizations to backfill. Defaults to all organizations."
+    ),
+    start: datetime = typer.Option(MIN_DATETIME, help="Start date (UTC)."),
+    window_days: int = typer.Option(30, help="Number of days refreshed per commit."),
+) -> None:
+    engine = create_async_engine("script")
+    sessionmaker = create_async_sessionmaker(engine)
+    async with sessionmaker() as session:
+        if not organization_id:
+            result = await session.execute(select(Organization.id))
+            organization_id = list(result.scalars().all())
+
+    redis = create_redis("script")
+    windows = _get_windows(
+        start.replace(tzinfo=UTC),
+        datetime.now(UTC) + timedelta(hours=1),
+        timedelta(days=window_days),
+    )
+    with Progress() as progress:
+        task = progress.add_task(
+            "[green]Backfilling...", total=len(organization_id) * len(windows)
+        )
+        for id in organization_id:
+            for window_start, window_end in windows:
+                async with sessionmaker() as session:
+                    await metrics_service.refresh_rollups(
+                        session, id, window_start, window_end
+                    )
+                    await session.commit()
+                progress.update(task, advance=1)
+            await metrics_service.invalidate_cache(redis, id)
+
+
+@cli.command()
+@typer_async
+async def check(
+    organization_id: list[UUID] = typer.Option(
+        [], help="Organizations to check. Defaults to all organizations."
+    ),
+    start: datetime = typer.Option(MIN_DATETIME, help="Start date (UTC)."),
+    repair: bool = typer.Option(False, help="Recompute inconsistent buckets."),
+) -> None:
+    engine = create_async_engine("script")
+    sessionmaker = create_async_sessionmaker(engine)
+    async with sessionmaker() as session:
+        if not organization_id:
+            result = await session.execute(select(Organization.id))
+            organization_id = list(result.scalars().all())
+
+        end = datetime.now(UTC)
+        inconsistencies = 0
+        inconsistent_organizations: list[UUID] = []
+        for id in organization_id:
+            buckets = await metrics_service.check_rollups(
+                session, id, start.replace(tzinfo=UTC), end, repair=repair
+            )
+            for bucket in buckets:
+                typer.echo(f"{id}\t{bucket.isoformat()}")
+            if buckets:
+                inconsistent_organizations.append(id)
+            inconsistencies += len(buckets)
+
+        if repair:
+            await session.commit()
+            redis = create_redis("script")
+            for id in inconsistent_organizations:
+                await metrics_service.invalidate_cache(redis, id)
+
+    typer.echo(f"{inconsistencies} inconsistent bucket(s)")
+    if inconsistencies and not repair:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    cli()
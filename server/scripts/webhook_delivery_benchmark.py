@@ -0,0 +1,144 @@
+import asyncio
+import logging.config
+import statistics
+import time
+from functools import wraps
+from typing import Any
+
+import httpx
+import structlog
+import typer
+import uvicorn
+from rich.console import Console
+from rich.table import Table
+
+from polar.webhook.tasks import _ConnectionTrace
+from polar.worker._httpx import create_http_client
+
+cli = typer.Typer()
+
+
+def drop_all(*args: Any, **kwargs: Any) -> Any:
+    raise structlog.DropEvent
+
+
+structlog.configure(processors=[drop_all])
+logging.config.dictConfig(
+    {
+        "version": 1,
+        "disable_existing_loggers": True,
+    }
+)
+
+
+def typer_async(f):  # type: ignore
+    # From https://github.com/tiangolo/typer/issues/85
+    @wraps(f)
+    def wrapper(*args, **kwargs):  # type: ignore
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+async def stub_endpoint(scope: Any, receive: Any, send: Any) -> None:
+    """Minimal webhook endpoint, acknowledging every delivery."""
+    if scope["type"] != "http":
+        return
+    while (await receive()).get("more_body", False):
+        pass
+    await send({"type": "http.response.start", "status": 202, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _deliver(
+    client: httpx.AsyncClient, url: str, payload: str
+) -> tuple[float, bool]:
+    trace = _ConnectionTrace()
+    start = time.perf_counter()
+    response = await client.post(
+        url,
+        content=payload,
+        headers={"content-type": "application/json"},
+        timeout=20.0,
+        extensions={"trace": trace},
+    )
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000, trace.connected
+
+
+async def _run(
+    url: str, payload: str, deliveries: int, concurrency: int, shared: bool
+) -> tuple[float, list[float], int]:
+    semaphore = asyncio.Semaphore(concurrency)
+    shared_client = create_http_client() if shared else None
+
+    async def _task() -> tuple[float, bool]:
+        async with semaphore:
+            if shared_client is not None:
+                return await _deliver(shared_client, url, payload)
+            async with httpx.AsyncClient() as client:
+                return await _deliver(client, url, payload)
+
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(_task() for _ in range(deliveries)))
+    finally:
+        if shared_client is not None:
+            await shared_client.aclose()
+    duration = time.perf_counter() - start
+
+    latencies = [latency for latency, _ in results]
+    connections = sum(1 for _, connected in results if connected)
+    return duration, latencies, connections
+
+
+@cli.command()
+@typer_async
+async def benchmark(
+    deliveries: int = typer.Option(5_000, help="Number of webhooks to deliver."),
+    concurrency: int = typer.Option(50, help="Concurrent deliveries."),
+    port: int = typer.Option(8765, help="Port of the local stub endpoint."),
+) -> None:
+    """
+    Compare a client per delivery with the shared worker client,
+    against a local stub endpoint.
+
+    The stub is served over plain HTTP/1.1, so it measures connection reuse;
+    HTTP/2 is only negotiated with TLS endpoints.
+    """
+    console = Console()
+    server = uvicorn.Server(
+        uvicorn.Config(stub_endpoint, port=port, log_level="error", access_log=False)
+    )
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    url = f"http://127.0.0.1:{port}/hook"
+    payload = '{"type":"benchmark","data":{}}'
+
+    table = Table("Client", "Deliveries/s", "New connections", "p50", "p95", "p99")
+    try:
+        for name, shared in (("Per delivery", False), ("Shared", True)):
+            with console.status(f"Delivering {deliveries} webhooks ({name})..."):
+                duration, latencies, connections = await _run(
+                    url, payload, deliveries, concurrency, shared
+                )
+            quantiles = statistics.quantiles(latencies, n=100)
+            table.add_row(
+                name,
+                f"{deliveries / duration:,.0f}",
+                f"{connections:,} ({connections / deliveries:.1%})",
+                f"{quantiles[49]:.2f}ms",
+                f"{quantiles[94]:.2f}ms",
+                f"{quantiles[98]:.2f}ms",
+            )
+    finally:
+        server.should_exit = True
+        await server_task
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,133 @@
+from datetime import timedelta
+
+import pytest
+from pytest_mock import MockerFixture
+
+from polar.auth import cache as auth_token_cache
+from polar.auth.middlewares import get_token_auth_subject
+from polar.auth.usage import token_usage
+from polar.config import settings
+from polar.kit.crypto import get_token_hash
+from polar.kit.utils import utc_now
+from polar.models import PersonalAccessToken, User
+from polar.personal_access_token.service import (
+    personal_access_token as personal_access_token_service,
+)
+from polar.postgres import AsyncSession
+from tests.fixtures.database import SaveFixture
+
+TOKEN = "polar_pat_123"
+
+
+@pytest.fixture
+async def personal_access_token(
+    save_fixture: SaveFixture, user: User
+) -> PersonalAccessToken:
+    personal_access_token = PersonalAccessToken(
+        comment="Test",
+        token=get_token_hash(TOKEN, secret=settings.SECRET),
+        user_id=user.id,
+        expires_at=utc_now() + timedelta(days=1),
+        scope="openid",
+    )
+    await save_fixture(personal_access_token)
+    return personal_access_token
+
+
+@pytest.mark.asyncio
+class TestGetTokenAuthSubject:
+    async def test_unknown_prefix(
+        self, session: AsyncSession, mocker: MockerFixture
+    ) -> None:
+        get_by_token_mock = mocker.patch.object(
+            personal_access_token_service, "get_by_token"
+        )
+
+        auth_subject = await get_token_auth_subject(session, "polar_xyz_123")
+
+        assert auth_subject is None
+        get_by_token_mock.assert_not_called()
+
+    async def test_prefix_dispatch(
+        self,
+        session: AsyncSession,
+        mocker: MockerFixture,
+        personal_access_token: PersonalAccessToken,
+        user: User,
+    ) -> None:
+        get_customer_session_mock = mocker.patch(
+            "polar.auth.middlewares.get_customer_session"
+        )
+        get_organization_access_token_mock = mocker.patch(
+            "polar.auth.middlewares.get_organization_access_token"
+        )
+        get_oauth2_token_mock = mocker.patch("polar.auth.middlewares.get_oauth2_token")
+
+        auth_subject = await get_token_auth_subject(session, TOKEN)
+
+        assert auth_subject is not None
+        assert auth_subject.subject.id == user.id
+        assert auth_subject.session == personal_access_token
+        get_customer_session_mock.assert_not_called()
+        get_organization_access_token_mock.assert_not_called()
+        get_oauth2_token_mock.assert_not_called()
+
+    async def test_cached(
+        self,
+        session: AsyncSession,
+        mocker: MockerFixture,
+        personal_access_token: PersonalAccessToken,
+        user: User,
+    ) -> None:
+        get_by_token_spy = mocker.spy(personal_access_token_service, "get_by_token")
+
+        await get_token_auth_subject(session, TOKEN)
+        session.expunge_all()
+        auth_subject = await get_token_auth_subject(session, TOKEN)
+
+        assert auth_subject is not None
+        assert auth_subject.subject.id == user.id
+        assert auth_subject.session.id == personal_access_token.id
+        get_by_token_spy.assert_called_once()
+
+    async def test_invalidated(
+        self,
+        session: AsyncSession,
+        mocker: MockerFixture,
+        personal_access_token: PersonalAccessToken,
+    ) -> None:
+        get_by_token_spy = mocker.spy(personal_access_token_service, "get_by_token")
+
+        await get_token_auth_subject(session, TOKEN)
+        auth_token_cache.invalidate_token(personal_access_token.token)
+        await get_token_auth_subject(session, TOKEN)
+
+        assert get_by_token_spy.call_count == 2
+
+
+@pytest.mark.asyncio
+class TestTokenUsageRecorder:
+    async def test_flush(
+        self,
+        session: AsyncSession,
+        mocker: MockerFixture,
+        personal_access_token: PersonalAccessToken,
+    ) -> None:
+        record_usages_mock = mocker.patch.object(
+            personal_access_token_service, "record_usages"
+        )
+        sessionmaker_mock = mocker.MagicMock()
+        sessionmaker_mock.return_value.__aenter__.return_value = session
+        mocker.patch.object(session, "commit")
+
+        await get_token_auth_subject(session, TOKEN)
+        await get_token_auth_subject(session, TOKEN)
+        await token_usage.flush(sessionmaker_mock)
+
+        record_usages_mock.assert_called_once()
+        _, usages = record_usages_mock.call_args.args
+        assert personal_access_token.id in usages
+
+        # Nothing left to flush
+        await token_usage.flush(sessionmaker_mock)
+        record_usages_mock.assert_called_once()
@@ -2,7 +2,7 @@ import uuid
 from datetime import UTC, datetime
 from types import SimpleNamespace
 from typing import Any
-from unittest.mock import ANY, AsyncMock, MagicMock
+from unittest.mock import ANY, AsyncMock, MagicMock, call
 
 import pytest
 import pytest_asyncio
@@ -3476,9 +3476,10 @@ class TestConfirm:
         stripe_service_mock.create_customer.assert_called_once()
         stripe_service_mock.create_payment_intent.assert_not_called()
 
-        enqueue_job_mock.assert_called_once_with(
-            "checkout.handle_free_success", checkout_id=checkout.id
-        )
+        assert enqueue_job_mock.call_args_list == [
+            call("checkout.handle_free_success", checkout_id=checkout.id),
+            call("metrics.rollup_checkout", checkout.id),
+        ]
 
     async def test_valid_stripe_existing_customer(
         self,
@@ -3,6 +3,7 @@ import uuid
 import pytest
 from httpx import AsyncClient
 
+from polar.kit.address import Address, CountryAlpha2
 from polar.models import (
     Benefit,
     Customer,
@@ -106,6 +107,65 @@ class TestListCustomers:
         assert json["items"][0]["external_id"] == "ext_456"
 
 
+@pytest.mark.asyncio
+class TestExport:
+    async def test_anonymous(self, client: AsyncClient) -> None:
+        response = await client.get("/v1/customers/export")
+
+        assert response.status_code == 401
+
+    @pytest.mark.auth
+    async def test_user_not_organization_member(
+        self, client: AsyncClient, customer: Customer
+    ) -> None:
+        response = await client.get("/v1/customers/export")
+
+        assert response.status_code == 200
+        csv_lines = response.text.strip().split("\r\n")
+        assert len(csv_lines) == 1
+
+    @pytest.mark.auth
+    async def test_user_valid(
+        self,
+        save_fixture: SaveFixture,
+        client: AsyncClient,
+        organization: Organization,
+        user_organization: UserOrganization,
+    ) -> None:
+        customer = await create_customer(
+            save_fixture,
+            organization=organization,
+            external_id="EXTERNAL_ID",
+            billing_address=Address(
+                line1="456 Customer Ave",
+                city="Los Angeles",
+                state="CA",
+                postal_code="90001",
+                country=CountryAlpha2("US"),
+            ),
+            user_metadata={"user_id": "ABC"},
+        )
+
+        response = await client.get("/v1/customers/export")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "text/csv; charset=utf-8"
+        assert (
+            response.headers["content-disposition"]
+            == "attachment; filename=polar-customers.csv"
+        )
+
+        csv_lines = response.text.strip().split("\r\n")
+        assert len(csv_lines) == 2
+        data_row = csv_lines[1]
+        assert str(customer.id) in data_row
+        assert "EXTERNAL_ID" in data_row
+        assert customer.email in data_row
+        assert "456 Customer Ave" in data_row
+        assert "Los Angeles" in data_row
+        assert "user_id" in data_row
+
+
 @pytest.mark.asyncio
 class TestGetExternal:
     async def test_anonymous(
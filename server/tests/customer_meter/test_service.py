@@ -4,6 +4,7 @@ from decimal import Decimal
 
 import pytest
 import pytest_asyncio
+from pytest_mock import MockerFixture
 
 from polar.customer_meter.service import customer_meter as customer_meter_service
 from polar.event.system import SystemEvent
@@ -12,6 +13,7 @@ from polar.locker import Locker
 from polar.meter.aggregation import (
     AggregationFunction,
     PropertyAggregation,
+    UniqueAggregation,
 )
 from polar.meter.filter import Filter, FilterClause, FilterConjunction, FilterOperator
 from polar.models import (
@@ -305,3 +307,228 @@ class TestUpdateCustomerMeter:
         assert updated_customer_meter.last_balanced_event == events[-1]
 
         assert updated is True
+
+    async def test_incremental(
+        self,
+        mocker: MockerFixture,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        locker: Locker,
+        customer: Customer,
+        events: list[Event],
+        meter: Meter,
+    ) -> None:
+        mocker.patch(
+            "polar.customer_meter.service.settings.CUSTOMER_METER_SETTLEMENT_DELAY",
+            timedelta(0),
+        )
+        customer_meter, _ = await customer_meter_service.update_customer_meter(
+            session, locker, customer, meter
+        )
+        assert customer_meter is not None
+        assert customer_meter.consumed_units == Decimal(20)
+        assert customer_meter.aggregation_state is not None
+
+        # Tamper with the state: it's expected to be reused as is
+        aggregation_state = customer_meter.aggregation_state["aggregation"]
+        customer_meter.aggregation_state = {
+            **customer_meter.aggregation_state,
+            "aggregation": {**aggregation_state, "sum": 1000.0},
+        }
+        await save_fixture(customer_meter)
+
+        new_events = [
+            await create_event(
+                save_fixture,
+                organization=customer.organization,
+                customer=customer,
+                metadata={"tokens": 5, "model": "lite"},
+            ),
+            await create_event(
+                save_fixture,
+                organization=customer.organization,
+                customer=customer,
+                source=EventSource.system,
+                name=SystemEvent.meter_credited,
+                metadata={"units": 15, "meter_id": str(meter.id)},
+            ),
+        ]
+
+        (
+            updated_customer_meter,
+            updated,
+        ) = await customer_meter_service.update_customer_meter(
+            session, locker, customer, meter
+        )
+
+        assert updated is True
+        assert updated_customer_meter is not None
+        assert updated_customer_meter.consumed_units == Decimal(1005)
+        assert updated_customer_meter.credited_units == 25
+        assert updated_customer_meter.balance == Decimal(-980)
+        assert updated_customer_meter.last_balanced_event == new_events[-1]
+
+    async def test_late_committed_event(
+        self,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        locker: Locker,
+        customer: Customer,
+        events: list[Event],
+        meter: Meter,
+    ) -> None:
+        customer_meter, _ = await customer_meter_service.update_customer_meter(
+            session, locker, customer, meter
+        )
+        assert customer_meter is not None
+        assert customer_meter.consumed_units == Decimal(20)
+
+        # Committed after the balance, but ingested before the last event
+        late_event = await create_event(
+            save_fixture,
+            organization=customer.organization,
+            customer=customer,
+            metadata={"tokens": 5, "model": "lite"},
+        )
+        late_event.ingested_at = events[0].ingested_at
+        await save_fixture(late_event)
+
+        (
+            updated_customer_meter,
+            updated,
+        ) = await customer_meter_service.update_customer_meter(
+            session, locker, customer, meter
+        )
+
+        assert updated is True
+        assert updated_customer_meter is not None
+        assert updated_customer_meter.consumed_units == Decimal(25)
+        assert updated_customer_meter.balance == Decimal(-15)
+        assert updated_customer_meter.last_balanced_event == events[-3]
+
+    async def test_full_recompute_interval(
+        self,
+        mocker: MockerFixture,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        locker: Locker,
+        customer: Customer,
+        events: list[Event],
+        meter: Meter,
+    ) -> None:
+        mocker.patch(
+            "polar.customer_meter.service.settings.CUSTOMER_METER_SETTLEMENT_DELAY",
+            timedelta(0),
+        )
+        customer_meter, _ = await customer_meter_service.update_customer_meter(
+            session, locker, customer, meter
+        )
+        assert customer_meter is not None
+        assert customer_meter.aggregation_state is not None
+
+        # Tamper with the state: it's expected to be discarded
+        aggregation_state = customer_meter.aggregation_state["aggregation"]
+        customer_meter.aggregation_state = {
+            **customer_meter.aggregation_state,
+            "computed_at": (utc_now() - timedelta(days=2)).isoformat(),
+            "aggregation": {**aggregation_state, "sum": 1000.0},
+        }
+        await save_fixture(customer_meter)
+        await create_event(
+            save_fixture,
+            organization=customer.organization,
+            customer=customer,
+            metadata={"tokens": 5, "model": "lite"},
+        )
+
+        (
+            updated_customer_meter,
+            updated,
+        ) = await customer_meter_service.update_customer_meter(
+            session, locker, customer, meter
+        )
+
+        assert updated is True
+        assert updated_customer_meter is not None
+        assert updated_customer_meter.consumed_units == Decimal(25)
+
+    async def test_meter_definition_changed(
+        self,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        locker: Locker,
+        customer: Customer,
+        events: list[Event],
+        meter: Meter,
+    ) -> None:
+        customer_meter, _ = await customer_meter_service.update_customer_meter(
+            session, locker, customer, meter
+        )
+        assert customer_meter is not None
+        assert customer_meter.consumed_units == Decimal(20)
+
+        meter.aggregation = PropertyAggregation(
+            func=AggregationFunction.max, property="tokens"
+        )
+        await save_fixture(meter)
+        await create_event(
+            save_fixture,
+            organization=customer.organization,
+            customer=customer,
+            metadata={"tokens": 5, "model": "lite"},
+        )
+
+        (
+            updated_customer_meter,
+            updated,
+        ) = await customer_meter_service.update_customer_meter(
+            session, locker, customer, meter
+        )
+
+        assert updated is True
+        assert updated_customer_meter is not None
+        assert updated_customer_meter.consumed_units == Decimal(10)
+        assert updated_customer_meter.credited_units == 10
+
+    async def test_incremental_unique(
+        self,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        locker: Locker,
+        customer: Customer,
+        organization: Organization,
+    ) -> None:
+        meter = await create_meter(
+            save_fixture,
+            name="Active Users",
+            filter=Filter(conjunction=FilterConjunction.and_, clauses=[]),
+            aggregation=UniqueAggregation(property="user"),
+            organization=organization,
+        )
+        for user in ("a", "b"):
+            await create_event(
+                save_fixture,
+                organization=organization,
+                customer=customer,
+                metadata={"user": user},
+            )
+
+        customer_meter, _ = await customer_meter_service.update_customer_meter(
+            session, locker, customer, meter
+        )
+        assert customer_meter is not None
+        assert customer_meter.consumed_units == Decimal(2)
+
+        for user in ("b", "c"):
+            await create_event(
+                save_fixture,
+                organization=organization,
+                customer=customer,
+                metadata={"user": user},
+            )
+
+        customer_meter, _ = await customer_meter_service.update_customer_meter(
+            session, locker, customer, meter
+        )
+        assert customer_meter is not None
+        assert customer_meter.consumed_units == Decimal(3)
@@ -0,0 +1,83 @@
+import uuid
+
+import pytest
+from pytest_mock import MockerFixture
+
+from polar.customer_meter.service import CustomerMeterService
+from polar.customer_meter.tasks import (  # type: ignore[attr-defined]
+    customer_meter_service,
+    update_customers,
+)
+from polar.locker import TimeoutLockError
+from polar.models import Customer
+from polar.postgres import AsyncSession
+
+
+@pytest.mark.asyncio
+class TestUpdateCustomers:
+    async def test_not_existing_customer(
+        self, mocker: MockerFixture, session: AsyncSession, customer: Customer
+    ) -> None:
+        update_customer_mock = mocker.patch.object(
+            customer_meter_service,
+            "update_customer",
+            spec=CustomerMeterService.update_customer,
+        )
+
+        # then
+        session.expunge_all()
+
+        await update_customers([uuid.uuid4(), customer.id])
+
+        update_customer_mock.assert_called_once()
+        assert update_customer_mock.call_args.args[2].id == customer.id
+
+    async def test_lock_timeout(
+        self,
+        mocker: MockerFixture,
+        session: AsyncSession,
+        customer: Customer,
+        customer_second: Customer,
+    ) -> None:
+        update_customer_mock = mocker.patch.object(
+            customer_meter_service,
+            "update_customer",
+            spec=CustomerMeterService.update_customer,
+        )
+        update_customer_mock.side_effect = [TimeoutLockError(), None]
+        enqueue_job_mock = mocker.patch("polar.customer_meter.tasks.enqueue_job")
+
+        # then
+        session.expunge_all()
+
+        await update_customers([customer.id, customer_second.id])
+
+        assert update_customer_mock.call_count == 2
+        enqueue_job_mock.assert_called_once_with(
+            "customer_meter.update_customer", customer.id
+        )
+
+    async def test_failure(
+        self,
+        mocker: MockerFixture,
+        session: AsyncSession,
+        customer: Customer,
+        customer_second: Customer,
+    ) -> None:
+        update_customer_mock = mocker.patch.object(
+            customer_meter_service,
+            "update_customer",
+            spec=CustomerMeterService.update_customer,
+        )
+        update_customer_mock.side_effect = [None, ValueError()]
+        enqueue_job_mock = mocker.patch("polar.customer_meter.tasks.enqueue_job")
+
+        # then
+        session.expunge_all()
+
+        await update_customers([customer.id, customer_second.id])
+
+        assert update_customer_mock.call_count == 2
+        enqueue_job_mock.assert_called_once_with(
+            "customer_meter.update_customer", customer_second.id
+        )
@@ -0,0 +1,110 @@
+import asyncio
+import sys
+from collections.abc import AsyncIterator
+from datetime import timedelta
+
+import pytest
+from pytest_mock import MockerFixture
+
+from polar.email import react as email_renderer
+from polar.email.react import EmailRendererError, EmailRendererPool
+from polar.email.schemas import LoginCodeEmail, LoginCodeProps
+
+# Speaks the protocol of the renderer binary, with a few special templates
+FAKE_RENDERER = """
+import json, sys, time
+for line in sys.stdin:
+    request = json.loads(line)
+    if request.get("ping"):
+        response = {"pong": True}
+    elif request["template"] == "crash":
+        sys.exit(1)
+    elif request["template"] == "error":
+        response = {"error": "Template error not found"}
+    else:
+        if request["template"] == "slow":
+            time.sleep(1)
+        response = {"html": f"<p>{request['template']}</p>"}
+    print(json.dumps({"id": request["id"], **response}), flush=True)
+"""
+
+
+@pytest.fixture
+async def pool() -> AsyncIterator[EmailRendererPool]:
+    pool = EmailRendererPool(2, [sys.executable, "-c", FAKE_RENDERER])
+    await pool.start()
+    yield pool
+    await pool.close()
+
+
+@pytest.mark.asyncio
+class TestEmailRendererPool:
+    async def test_render(self, pool: EmailRendererPool) -> None:
+        assert await pool.render("hello", {}) == "<p>hello</p>"
+
+    async def test_concurrent(self, pool: EmailRendererPool) -> None:
+        results = await asyncio.gather(
+            *(pool.render(f"email_{i}", {}) for i in range(20))
+        )
+
+        assert results == [f"<p>email_{i}</p>" for i in range(20)]
+
+    async def test_template_error(self, pool: EmailRendererPool) -> None:
+        with pytest.raises(EmailRendererError):
+            await pool.render("error", {})
+
+        assert await pool.render("hello", {}) == "<p>hello</p>"
+
+    async def test_crash(self, pool: EmailRendererPool) -> None:
+        with pytest.raises(EmailRendererError):
+            await pool.render("crash", {})
+
+        # The crashed renderer is replaced
+        results = await asyncio.gather(*(pool.render("hello", {}) for _ in range(4)))
+        assert results == ["<p>hello</p>"] * 4
+
+    async def test_timeout(
+        self, mocker: MockerFixture, pool: EmailRendererPool
+    ) -> None:
+        mocker.patch(
+            "polar.email.react.settings.EMAIL_RENDERER_TIMEOUT",
+            timedelta(milliseconds=100),
+        )
+
+        with pytest.raises(EmailRendererError):
+            await pool.render("slow", {})
+
+        assert await pool.render("hello", {}) == "<p>hello</p>"
+
+    async def test_health_check(
+        self, mocker: MockerFixture, pool: EmailRendererPool
+    ) -> None:
+        mocker.patch(
+            "polar.email.react.settings.EMAIL_RENDERER_HEALTH_CHECK_INTERVAL",
+            timedelta(0),
+        )
+
+        assert await pool.render("hello", {}) == "<p>hello</p>"
+
+    async def test_closed(self, pool: EmailRendererPool) -> None:
+        await pool.close()
+
+        with pytest.raises(EmailRendererError):
+            await pool.render("hello", {})
+
+
+@pytest.mark.asyncio
+class TestRenderEmailTemplate:
+    async def test_pool(self, mocker: MockerFixture, pool: EmailRendererPool) -> None:
+        mocker.patch("polar.email.react._pool", pool)
+        render_mock = mocker.spy(pool, "render")
+        email = LoginCodeEmail(
+            props=LoginCodeProps(
+                email="user@example.com", code="ABC123", code_lifetime_minutes=30
+            )
+        )
+
+        assert await email_renderer.render_email_template(email) == "<p>login_code</p>"
+        render_mock.assert_called_once_with(
+            "login_code", email.props.model_dump(mode="json")
+        )
@@ -1,3 +1,4 @@
+import json
 from datetime import timedelta
 from typing import Any
 
@@ -110,4 +111,41 @@ class TestIngest:
 
         assert response.status_code == 200
         json = response.json()
-        assert json == {"inserted": len(events)}
+        assert json == {"inserted": len(events), "duplicates": 0}
+
+
+@pytest.mark.asyncio
+class TestIngestStream:
+    async def test_anonymous(self, client: AsyncClient) -> None:
+        response = await client.post("/v1/events/ingest/stream", content=b"")
+
+        assert response.status_code == 401
+
+    @pytest.mark.auth(AuthSubjectFixture(subject="organization"))
+    async def test_valid(self, client: AsyncClient) -> None:
+        events = [
+            {
+                "name": "event1",
+                "external_customer_id": "CUSTOMER_ID",
+                "metadata": {"usage": 127.32},
+            },
+            {"name": "event2", "external_customer_id": "CUSTOMER_ID"},
+        ]
+        response = await client.post(
+            "/v1/events/ingest/stream",
+            content="\n".join(json.dumps(event) for event in events),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {"inserted": len(events), "duplicates": 0}
+
+    @pytest.mark.auth(AuthSubjectFixture(subject="organization"))
+    async def test_invalid(self, client: AsyncClient) -> None:
+        response = await client.post(
+            "/v1/events/ingest/stream",
+            content=b'{"name": "event1", "external_customer_id": "C"}\n{"name": 1}\n',
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+        assert response.status_code == 422
@@ -1,4 +1,5 @@
 import uuid
+from collections.abc import AsyncIterator
 from datetime import timedelta
 from typing import Any
 from unittest.mock import AsyncMock
@@ -512,6 +513,156 @@ class TestIngest:
         events = await event_repository.get_all_by_organization(auth_subject.subject.id)
         assert len(events) == 1
 
+    @pytest.mark.auth(AuthSubjectFixture(subject="organization"))
+    async def test_duplicate_external_id(
+        self,
+        enqueue_events_mock: AsyncMock,
+        session: AsyncSession,
+        auth_subject: AuthSubject[Organization],
+    ) -> None:
+        ingest = EventsIngest(
+            events=[
+                EventCreateExternalCustomer(
+                    name="test", external_customer_id="test", external_id="EVENT_1"
+                ),
+                EventCreateExternalCustomer(
+                    name="test", external_customer_id="test", external_id="EVENT_1"
+                ),
+                EventCreateExternalCustomer(
+                    name="test", external_customer_id="test", external_id="EVENT_2"
+                ),
+                EventCreateExternalCustomer(name="test", external_customer_id="test"),
+                EventCreateExternalCustomer(name="test", external_customer_id="test"),
+            ]
+        )
+
+        response = await event_service.ingest(session, auth_subject, ingest)
+        assert response.inserted == 4
+        assert response.duplicates == 1
+
+        # Retrying the same request is a no-op for events with an external_id
+        response = await event_service.ingest(session, auth_subject, ingest)
+        assert response.inserted == 2
+        assert response.duplicates == 3
+
+        event_repository = EventRepository.from_session(session)
+        events = await event_repository.get_all_by_organization(auth_subject.subject.id)
+        assert len(events) == 6
+        assert sorted(
+            event.external_id for event in events if event.external_id is not None
+        ) == ["EVENT_1", "EVENT_2"]
+
+        enqueued_ids = {
+            id for call in enqueue_events_mock.call_args_list for id in call.args
+        }
+        assert enqueued_ids == {event.id for event in events}
+
+
+async def _stream(*chunks: bytes) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.asyncio
+class TestIngestStream:
+    @pytest.mark.auth(AuthSubjectFixture(subject="organization"))
+    async def test_valid(
+        self,
+        mocker: MockerFixture,
+        enqueue_events_mock: AsyncMock,
+        session: AsyncSession,
+        auth_subject: AuthSubject[Organization],
+        customer: Customer,
+    ) -> None:
+        mocker.patch("polar.event.service.settings.EVENTS_INGEST_STREAM_CHUNK_SIZE", 2)
+        stream = _stream(
+            b'{"name": "test", "external_customer_id": "test", ',
+            b'"metadata": {"tokens": 10}}\n{"name": "test", ',
+            f'"customer_id": "{customer.id}"}}\n\n'.encode(),
+            b'{"name": "test", "external_customer_id": "test"}',
+        )
+
+        response = await event_service.ingest_stream(session, auth_subject, stream)
+
+        assert response.inserted == 3
+
+        event_repository = EventRepository.from_session(session)
+        events = await event_repository.get_all_by_organization(auth_subject.subject.id)
+        assert len(events) == 3
+        assert {event.customer_id for event in events} == {None, customer.id}
+        for event in events:
+            assert event.source == EventSource.user
+
+        # One call per chunk
+        assert enqueue_events_mock.call_count == 2
+        enqueued_ids = {
+            id for call in enqueue_events_mock.call_args_list for id in call.args
+        }
+        assert enqueued_ids == {event.id for event in events}
+
+    @pytest.mark.auth(AuthSubjectFixture(subject="organization"))
+    async def test_invalid(
+        self,
+        enqueue_events_mock: AsyncMock,
+        session: AsyncSession,
+        auth_subject: AuthSubject[Organization],
+    ) -> None:
+        stream = _stream(
+            b'{"name": "test", "external_customer_id": "test"}\n',
+            b'{"name": "test"}\n',
+            f'{{"name": "test", "customer_id": "{uuid.uuid4()}"}}\n'.encode(),
+        )
+
+        with pytest.raises(PolarRequestValidationError) as e:
+            await event_service.ingest_stream(session, auth_subject, stream)
+
+        errors = e.value.errors()
+        assert {error["loc"][2] for error in errors} == {1}
+        enqueue_events_mock.assert_not_called()
+
+    @pytest.mark.auth(AuthSubjectFixture(subject="organization"))
+    async def test_duplicate_external_id(
+        self,
+        mocker: MockerFixture,
+        enqueue_events_mock: AsyncMock,
+        session: AsyncSession,
+        auth_subject: AuthSubject[Organization],
+    ) -> None:
+        mocker.patch("polar.event.service.settings.EVENTS_INGEST_STREAM_CHUNK_SIZE", 2)
+
+        def _get_stream() -> AsyncIterator[bytes]:
+            return _stream(
+                b'{"name": "test", "external_customer_id": "test", '
+                b'"external_id": "EVENT_1"}\n',
+                b'{"name": "test", "external_customer_id": "test", '
+                b'"external_id": "EVENT_2"}\n',
+                # Duplicate in another chunk of the same stream
+                b'{"name": "test", "external_customer_id": "test", '
+                b'"external_id": "EVENT_1"}\n',
+                b'{"name": "test", "external_customer_id": "test"}\n',
+            )
+
+        response = await event_service.ingest_stream(
+            session, auth_subject, _get_stream()
+        )
+        assert response.inserted == 3
+        assert response.duplicates == 1
+
+        response = await event_service.ingest_stream(
+            session, auth_subject, _get_stream()
+        )
+        assert response.inserted == 1
+        assert response.duplicates == 3
+
+        event_repository = EventRepository.from_session(session)
+        events = await event_repository.get_all_by_organization(auth_subject.subject.id)
+        assert len(events) == 4
+
+        enqueued_ids = {
+            id for call in enqueue_events_mock.call_args_list for id in call.args
+        }
+        assert enqueued_ids == {event.id for event in events}
+
 
 @pytest.mark.asyncio
 class TestIngested:
@@ -554,3 +705,86 @@ class TestIngested:
 
         assert customer.meters_dirtied_at is not None
         assert customer_second.meters_dirtied_at is not None
+
+    async def test_external_customer(
+        self,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        customer_external_id: Customer,
+    ) -> None:
+        event = await create_event(
+            save_fixture,
+            external_customer_id=customer_external_id.external_id,
+            organization=customer_external_id.organization,
+            source=EventSource.user,
+        )
+
+        await event_service.ingested(session, [event.id])
+
+        await session.refresh(customer_external_id)
+        assert customer_external_id.meters_dirtied_at is not None
+
+    async def test_debounce(
+        self,
+        mocker: MockerFixture,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        customer: Customer,
+    ) -> None:
+        mocker.patch(
+            "polar.event.service.settings.CUSTOMER_METER_DIRTY_DEBOUNCE",
+            timedelta(minutes=1),
+        )
+        event = await create_event(
+            save_fixture,
+            customer=customer,
+            organization=customer.organization,
+            source=EventSource.user,
+        )
+
+        # Recently dirtied: left as is
+        dirtied_at = utc_now() - timedelta(seconds=30)
+        customer.meters_dirtied_at = dirtied_at
+        await save_fixture(customer)
+
+        await event_service.ingested(session, [event.id])
+
+        await session.refresh(customer)
+        assert customer.meters_dirtied_at == dirtied_at
+
+        # Dirtied before the window: marked again
+        dirtied_at = utc_now() - timedelta(minutes=5)
+        customer.meters_dirtied_at = dirtied_at
+        await save_fixture(customer)
+
+        await event_service.ingested(session, [event.id])
+
+        await session.refresh(customer)
+        assert customer.meters_dirtied_at is not None
+        assert customer.meters_dirtied_at > dirtied_at
+
+    async def test_cost_events(
+        self,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        organization: Organization,
+        customer: Customer,
+    ) -> None:
+        event = await create_event(
+            save_fixture,
+            customer=customer,
+            organization=customer.organization,
+            source=EventSource.user,
+        )
+        assert await event_service.ingested(session, [event.id]) == []
+
+        cost_event = await create_event(
+            save_fixture,
+            customer=customer,
+            organization=customer.organization,
+            source=EventSource.user,
+            metadata={"_cost": {"amount": 100, "currency": "usd"}},
+        )
+        assert await event_service.ingested(session, [event.id, cost_event.id]) == [
+            customer.organization_id
+        ]
@@ -7,11 +7,23 @@ import pytest_asyncio
 from fastapi import FastAPI
 
 from polar.app import app as polar_app
+from polar.auth import cache as auth_token_cache
 from polar.auth.dependencies import _auth_subject_factory_cache
 from polar.auth.models import AuthSubject, Subject
 from polar.checkout.ip_geolocation import _get_client_dependency
 from polar.postgres import AsyncSession, get_db_read_session, get_db_session
 from polar.redis import Redis, get_redis
+from polar.webhook import cache as webhook_endpoints_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_webhook_endpoints_cache() -> None:
+    webhook_endpoints_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_auth_token_cache() -> None:
+    auth_token_cache.clear()
 
 
 class IsolatedSessionTestClient(httpx.AsyncClient):
@@ -1,15 +1,17 @@
-from collections.abc import Iterator
+from collections.abc import AsyncIterator, Iterator
 from typing import Any
 
 import dramatiq
+import httpx
 import pytest
+import pytest_asyncio
 from dramatiq.middleware.current_message import CurrentMessage
 from pytest_mock import MockerFixture
 
 from polar.config import settings
 from polar.kit.db.postgres import AsyncSession
 from polar.redis import Redis
-from polar.worker import JobQueueManager, RedisMiddleware
+from polar.worker import HTTPXMiddleware, JobQueueManager, RedisMiddleware
 from polar.worker._enqueue import _job_queue_manager
 from polar.worker._sqlalchemy import SQLAlchemyMiddleware
 
@@ -27,6 +29,13 @@ def patch_middlewares(
     mocker.patch.object(RedisMiddleware, "get", new=lambda: redis)
 
 
+@pytest_asyncio.fixture(autouse=True)
+async def patch_http_client(mocker: MockerFixture) -> AsyncIterator[httpx.AsyncClient]:
+    async with httpx.AsyncClient() as client:
+        mocker.patch.object(HTTPXMiddleware, "get", new=lambda: client)
+        yield client
+
+
 @pytest.fixture(autouse=True)
 def current_message() -> Iterator[dramatiq.Message[Any]]:
     message = dramatiq.Message[Any](
@@ -0,0 +1,95 @@
+import asyncio
+import uuid
+
+import boto3
+import botocore
+import pytest
+from botocore.config import Config
+
+from polar.config import settings
+from polar.integrations.aws.s3 import S3FileError, S3Service
+from polar.integrations.aws.s3.client import get_client
+
+
+@pytest.fixture
+def s3_service() -> S3Service:
+    return S3Service(settings.S3_FILES_BUCKET_NAME)
+
+
+@pytest.fixture
+def path() -> str:
+    return f"tests/{uuid.uuid4()}.txt"
+
+
+@pytest.mark.asyncio
+class TestUpload:
+    async def test_upload(self, s3_service: S3Service, path: str) -> None:
+        assert await s3_service.upload(b"Hello", path, "text/plain") == path
+
+        head = await s3_service.get_head_or_raise(path)
+        assert head["ContentType"] == "text/plain"
+        assert head["ContentLength"] == 5
+
+        obj = await s3_service.get_object_or_raise(path)
+        assert obj["Body"].read() == b"Hello"
+
+    async def test_concurrent(self, s3_service: S3Service, path: str) -> None:
+        paths = [f"{path}.{i}" for i in range(settings.S3_MAX_POOL_CONNECTIONS * 2)]
+
+        results = await asyncio.gather(
+            *(s3_service.upload(b"Hello", path, "text/plain") for path in paths)
+        )
+
+        assert results == paths
+
+
+@pytest.mark.asyncio
+class TestGetHeadOrRaise:
+    async def test_not_existing(self, s3_service: S3Service, path: str) -> None:
+        with pytest.raises(S3FileError):
+            await s3_service.get_head_or_raise(path)
+
+
+@pytest.mark.asyncio
+class TestDeleteFile:
+    async def test_delete(self, s3_service: S3Service, path: str) -> None:
+        await s3_service.upload(b"Hello", path, "text/plain")
+
+        await s3_service.delete_file(path)
+
+        with pytest.raises(S3FileError):
+            await s3_service.get_head_or_raise(path)
+
+
+class TestPresignedURLs:
+    @pytest.fixture
+    def offline_s3_service(self) -> S3Service:
+        # Nothing listens on this endpoint: any request would fail
+        client = boto3.client(
+            "s3",
+            endpoint_url="http://127.0.0.1:1",
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            config=Config(region_name=settings.AWS_REGION, signature_version="v4"),
+        )
+        return S3Service(settings.S3_FILES_BUCKET_NAME, client=client)
+
+    def test_download_url(self, offline_s3_service: S3Service, path: str) -> None:
+        url, _ = offline_s3_service.generate_presigned_download_url(
+            path=path, filename="hello.txt", mime_type="text/plain"
+        )
+
+        assert "127.0.0.1:1" in url
+        assert path in url
+        assert "X-Amz-Signature=" in url
+
+    def test_public_url(self, s3_service: S3Service, path: str) -> None:
+        url = s3_service.get_public_url(path)
+
+        assert path in url
+        assert "X-Amz-Signature" not in url
+
+        # The unsigned client is created once
+        assert get_client(signature_version=botocore.UNSIGNED) is get_client(
+            signature_version=botocore.UNSIGNED
+        )
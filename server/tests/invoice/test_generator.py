@@ -4,7 +4,13 @@ from typing import Any
 
 import pytest
 
-from polar.invoice.generator import Invoice, InvoiceGenerator, InvoiceItem
+from polar.invoice.generator import (
+    Invoice,
+    InvoiceGenerator,
+    InvoiceItem,
+    generate_invoice,
+    preload_fonts,
+)
 from polar.kit.address import Address, CountryAlpha2
 from polar.kit.tax import TaxabilityReason
 
@@ -100,3 +106,18 @@ def test_generator(overrides: dict[str, Any], id: str, invoice: Invoice) -> None
     generator.output(str(path))
 
     assert path.exists()
+
+
+def test_generate_invoice_preloaded_fonts(invoice: Invoice) -> None:
+    preload_fonts()
+
+    # Fonts are subset on output: the preloaded ones must not be affected
+    first = generate_invoice(invoice, "Invoice", False)
+    second = generate_invoice(
+        invoice.model_copy(update={"customer_name": "Zoë Quixote-Jackson"}),
+        "Invoice",
+        False,
+    )
+
+    assert first.startswith(b"%PDF")
+    assert second.startswith(b"%PDF")
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from pytest_mock import MockerFixture
+
+from polar.kit.cache import TTLCache
+
+
+def test_get_set() -> None:
+    cache = TTLCache[str, int](ttl=timedelta(minutes=1), maxsize=10)
+
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+
+    cache.pop("a")
+    assert cache.get("a") is None
+
+
+def test_expiration(mocker: MockerFixture) -> None:
+    monotonic_mock = mocker.patch("polar.kit.cache.time.monotonic", return_value=0.0)
+    cache = TTLCache[str, int](ttl=timedelta(seconds=10), maxsize=10)
+    cache.set("a", 1)
+
+    monotonic_mock.return_value = 9.0
+    assert cache.get("a") == 1
+
+    monotonic_mock.return_value = 10.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_maxsize() -> None:
+    cache = TTLCache[str, int](ttl=timedelta(minutes=1), maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    # Recently used entries are kept
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_disabled() -> None:
+    cache = TTLCache[str, int](ttl=timedelta(0), maxsize=10)
+    cache.set("a", 1)
+    assert cache.get("a") is None
@@ -0,0 +1,136 @@
+import pytest
+
+from polar.license_key import cache as license_key_cache
+from polar.license_key.repository import LicenseKeyRepository
+from polar.license_key.service import license_key as license_key_service
+from polar.models import Benefit, Customer, LicenseKey, LicenseKeyActivation
+from polar.postgres import AsyncSession
+from polar.redis import Redis
+from tests.fixtures.database import SaveFixture
+
+
+@pytest.fixture
+async def license_key(
+    save_fixture: SaveFixture, customer: Customer, benefit_organization: Benefit
+) -> LicenseKey:
+    license_key = LicenseKey(
+        organization_id=customer.organization_id,
+        customer_id=customer.id,
+        benefit_id=benefit_organization.id,
+        key="TESTING-KEY",
+        limit_activations=2,
+    )
+    await save_fixture(license_key)
+    activation = LicenseKeyActivation(
+        license_key_id=license_key.id, label="Laptop", conditions={}, meta={}
+    )
+    await save_fixture(activation)
+    license_key.activations_count = 1
+    await save_fixture(license_key)
+    return license_key
+
+
+async def _get_from_database(
+    session: AsyncSession, license_key: LicenseKey
+) -> LicenseKey:
+    return await license_key_service.get_or_raise_by_key(
+        session, organization_id=license_key.organization_id, key=license_key.key
+    )
+
+
+@pytest.mark.asyncio
+class TestGetLicenseKey:
+    async def test_miss(self, redis: Redis, license_key: LicenseKey) -> None:
+        version, cached = await license_key_cache.get_license_key(
+            redis, license_key.organization_id, license_key.key
+        )
+
+        assert version == 0
+        assert cached is None
+
+    async def test_hit(
+        self, session: AsyncSession, redis: Redis, license_key: LicenseKey
+    ) -> None:
+        version, _ = await license_key_cache.get_license_key(
+            redis, license_key.organization_id, license_key.key
+        )
+        loaded = await _get_from_database(session, license_key)
+        await license_key_cache.set_license_key(redis, loaded, version)
+
+        _, cached = await license_key_cache.get_license_key(
+            redis, license_key.organization_id, license_key.key
+        )
+
+        assert cached is not None
+        assert cached.id == license_key.id
+        assert cached.status == license_key.status
+        assert cached.customer.id == license_key.customer_id
+        assert cached.customer.email == loaded.customer.email
+        assert [activation.id for activation in cached.activations] == [
+            activation.id for activation in loaded.activations
+        ]
+
+    async def test_invalidated(
+        self, session: AsyncSession, redis: Redis, license_key: LicenseKey
+    ) -> None:
+        version, _ = await license_key_cache.get_license_key(
+            redis, license_key.organization_id, license_key.key
+        )
+        loaded = await _get_from_database(session, license_key)
+        await license_key_cache.set_license_key(redis, loaded, version)
+
+        await license_key_cache.invalidate_license_key(
+            redis, license_key.organization_id, license_key.key
+        )
+
+        version, cached = await license_key_cache.get_license_key(
+            redis, license_key.organization_id, license_key.key
+        )
+        assert version == 1
+        assert cached is None
+
+    async def test_invalidated_while_loading(
+        self, session: AsyncSession, redis: Redis, license_key: LicenseKey
+    ) -> None:
+        version, _ = await license_key_cache.get_license_key(
+            redis, license_key.organization_id, license_key.key
+        )
+        loaded = await _get_from_database(session, license_key)
+
+        await license_key_cache.invalidate_license_key(
+            redis, license_key.organization_id, license_key.key
+        )
+        await license_key_cache.set_license_key(redis, loaded, version)
+
+        # The stale entry wasn't stored
+        _, cached = await license_key_cache.get_license_key(
+            redis, license_key.organization_id, license_key.key
+        )
+        assert cached is None
+
+
+@pytest.mark.asyncio
+class TestActivationsCount:
+    async def test_increment(
+        self, session: AsyncSession, license_key: LicenseKey
+    ) -> None:
+        repository = LicenseKeyRepository.from_session(session)
+
+        assert await repository.increment_activations_count(license_key) is True
+        assert license_key.activations_count == 2
+
+        # Limit reached
+        assert await repository.increment_activations_count(license_key) is False
+        assert license_key.activations_count == 2
+
+    async def test_decrement(
+        self, session: AsyncSession, license_key: LicenseKey
+    ) -> None:
+        repository = LicenseKeyRepository.from_session(session)
+
+        await repository.decrement_activations_count(license_key)
+        assert license_key.activations_count == 0
+
+        # Never below zero
+        await repository.decrement_activations_count(license_key)
+        assert license_key.activations_count == 0
@@ -0,0 +1,216 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import update
+
+from polar.kit.utils import utc_now
+from polar.license_key import counters as license_key_counters
+from polar.license_key.repository import LicenseKeyRepository
+from polar.models import Benefit, Customer, LicenseKey
+from polar.postgres import AsyncSession
+from polar.redis import Redis
+from tests.fixtures.database import SaveFixture
+
+
+@pytest.fixture
+async def license_key(
+    save_fixture: SaveFixture, customer: Customer, benefit_organization: Benefit
+) -> LicenseKey:
+    license_key = LicenseKey(
+        organization_id=customer.organization_id,
+        customer_id=customer.id,
+        benefit_id=benefit_organization.id,
+        key="TESTING-KEY",
+        usage=2,
+        limit_usage=10,
+    )
+    await save_fixture(license_key)
+    return license_key
+
+
+@pytest.mark.asyncio
+class TestIncrement:
+    async def test_valid(self, redis: Redis, license_key: LicenseKey) -> None:
+        validated = await license_key_counters.increment(
+            redis, license_key, increment_usage=3
+        )
+
+        assert validated is True
+        assert license_key.usage == 5
+        assert license_key.validations == 1
+        assert license_key.last_validated_at is not None
+
+    async def test_limit_reached(self, redis: Redis, license_key: LicenseKey) -> None:
+        validated = await license_key_counters.increment(
+            redis, license_key, increment_usage=9
+        )
+
+        assert validated is False
+        assert license_key.usage == 2
+        assert license_key.validations == 0
+
+    async def test_not_written(
+        self, session: AsyncSession, redis: Redis, license_key: LicenseKey
+    ) -> None:
+        await license_key_counters.increment(redis, license_key, increment_usage=1)
+        await session.flush()
+
+        await session.refresh(license_key)
+        assert license_key.usage == 2
+        assert license_key.validations == 0
+
+    async def test_concurrent(self, redis: Redis, license_key: LicenseKey) -> None:
+        results = await asyncio.gather(
+            *(
+                license_key_counters.increment(redis, license_key, increment_usage=1)
+                for _ in range(50)
+            )
+        )
+
+        # Only the usages left below the limit are granted
+        assert results.count(True) == 8
+        assert license_key.usage == 10
+        assert license_key.validations == 8
+
+
+@pytest.mark.asyncio
+class TestLoad:
+    async def test_pending(self, redis: Redis, license_key: LicenseKey) -> None:
+        await license_key_counters.increment(redis, license_key, increment_usage=1)
+        license_key.usage = 2
+        license_key.validations = 0
+
+        await license_key_counters.load(redis, [license_key])
+
+        assert license_key.usage == 3
+        assert license_key.validations == 1
+
+    async def test_not_pending(self, redis: Redis, license_key: LicenseKey) -> None:
+        await license_key_counters.load(redis, [license_key])
+
+        assert license_key.usage == 2
+        assert license_key.validations == 0
+
+
+@pytest.mark.asyncio
+class TestLoadForUpdate:
+    async def test_pending(
+        self, session: AsyncSession, redis: Redis, license_key: LicenseKey
+    ) -> None:
+        await license_key_counters.increment(redis, license_key, increment_usage=1)
+
+        await license_key_counters.load_for_update(redis, license_key)
+        await session.flush()
+
+        await session.refresh(license_key)
+        assert license_key.usage == 3
+        assert license_key.validations == 1
+
+        # Kept in Redis
+        validated_license_key = LicenseKey(
+            id=license_key.id, usage=2, validations=0, limit_usage=10
+        )
+        await license_key_counters.load(redis, [validated_license_key])
+        assert validated_license_key.usage == 3
+
+
+@pytest.mark.asyncio
+class TestUsageUpdate:
+    async def test_validated_during_update(
+        self, session: AsyncSession, redis: Redis, license_key: LicenseKey
+    ) -> None:
+        await license_key_counters.increment(redis, license_key, increment_usage=1)
+
+        # Reset the usage
+        await license_key_counters.load_for_update(redis, license_key)
+        assert license_key.usage == 3
+        license_key.usage = 0
+        await license_key_counters.begin_usage_update(redis, license_key)
+        await session.flush()
+
+        # Validated before the update is committed, from a stale license key
+        validated_license_key = LicenseKey(
+            id=license_key.id, usage=2, validations=0, limit_usage=10
+        )
+        assert await license_key_counters.increment(
+            redis, validated_license_key, increment_usage=2
+        )
+        assert validated_license_key.usage == 5
+
+        # Not flushed until the update is applied
+        assert await license_key_counters.flush(redis, session) == 0
+
+        await license_key_counters.apply_usage_update(redis, license_key, -3)
+
+        assert await license_key_counters.flush(redis, session) == 1
+        await session.refresh(license_key)
+        assert license_key.usage == 2
+        assert license_key.validations == 2
+
+    async def test_not_pending(
+        self, session: AsyncSession, redis: Redis, license_key: LicenseKey
+    ) -> None:
+        license_key.usage = 0
+        await license_key_counters.begin_usage_update(redis, license_key)
+        await session.flush()
+
+        await license_key_counters.apply_usage_update(redis, license_key, -2)
+
+        # Initialized from the updated values
+        validated_license_key = LicenseKey(
+            id=license_key.id, usage=2, validations=0, limit_usage=10
+        )
+        await license_key_counters.load(redis, [validated_license_key])
+        assert validated_license_key.usage == 0
+
+
+@pytest.mark.asyncio
+class TestFlush:
+    async def test_empty(self, session: AsyncSession, redis: Redis) -> None:
+        assert await license_key_counters.flush(redis, session) == 0
+
+    async def test_pending(
+        self, session: AsyncSession, redis: Redis, license_key: LicenseKey
+    ) -> None:
+        for _ in range(3):
+            await license_key_counters.increment(redis, license_key, increment_usage=2)
+        last_validated_at = license_key.last_validated_at
+
+        assert await license_key_counters.flush(redis, session) == 1
+
+        repository = LicenseKeyRepository.from_session(session)
+        session.expunge_all()
+        updated_license_key = await repository.get_by_id(license_key.id)
+        assert updated_license_key is not None
+        assert updated_license_key.usage == 8
+        assert updated_license_key.validations == 3
+        assert updated_license_key.last_validated_at == last_validated_at
+
+        # Already flushed
+        assert await license_key_counters.flush(redis, session) == 0
+
+    async def test_modified_since_read(
+        self, session: AsyncSession, redis: Redis, license_key: LicenseKey
+    ) -> None:
+        await license_key_counters.increment(redis, license_key, increment_usage=2)
+
+        # Usage reset after the flush read the counters
+        await session.execute(
+            update(LicenseKey)
+            .where(LicenseKey.id == license_key.id)
+            .values(usage=0, modified_at=utc_now() + timedelta(minutes=1))
+        )
+
+        assert await license_key_counters.flush(redis, session) == 0
+
+        repository = LicenseKeyRepository.from_session(session)
+        session.expunge_all()
+        updated_license_key = await repository.get_by_id(license_key.id)
+        assert updated_license_key is not None
+        assert updated_license_key.usage == 0
+
+        # Left for the next flush
+        assert await redis.sismember(
+            license_key_counters.DIRTY_KEY, str(license_key.id)
+        )
@@ -4,8 +4,10 @@ import pytest
 from pydantic import ValidationError
 
 from polar.event.repository import EventRepository
+from polar.kit.db.explain import explain, iter_plan_nodes
 from polar.kit.utils import utc_now
 from polar.meter.filter import Filter, FilterClause, FilterConjunction, FilterOperator
+from polar.meter.indexes import get_create_metadata_index_ddl, get_metadata_index_name
 from polar.models import Event, Organization
 from polar.postgres import AsyncSession
 from tests.fixtures.database import SaveFixture
@@ -249,3 +251,75 @@ class TestFilter:
 
         assert len(matching_events) == 1
         assert matching_events[0].id == events[1].id
+
+    async def test_metadata_index(
+        self,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        organization: Organization,
+    ) -> None:
+        for model in ("lite", "lite", "pro"):
+            await create_event(
+                save_fixture,
+                organization=organization,
+                external_customer_id="customer_1",
+                metadata={"model": model},
+            )
+        await create_event(
+            save_fixture,
+            organization=organization,
+            external_customer_id="customer_1",
+            metadata={"other": "lite"},
+        )
+
+        connection = await session.connection()
+        await connection.exec_driver_sql(
+            get_create_metadata_index_ddl("model", connection.dialect)
+        )
+        # The table is tiny: make sure the planner considers the index anyway
+        await connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+
+        filter = Filter(
+            conjunction=FilterConjunction.and_,
+            clauses=[
+                FilterClause(property="model", operator=FilterOperator.eq, value="lite")
+            ],
+        )
+        repository = EventRepository.from_session(session)
+        statement = repository.get_base_statement().where(
+            Event.organization_id == organization.id, filter.get_sql_clause(Event)
+        )
+
+        plan = await explain(session, statement)
+        index_names = {node.get("Index Name") for node in iter_plan_nodes(plan)}
+        assert get_metadata_index_name("model") in index_names
+
+        matching_events = await repository.get_all(statement)
+        assert len(matching_events) == 2
+
+
+def test_get_indexable_properties() -> None:
+    filter = Filter(
+        conjunction=FilterConjunction.and_,
+        clauses=[
+            FilterClause(property="model", operator=FilterOperator.eq, value="lite"),
+            FilterClause(property="name", operator=FilterOperator.eq, value="usage"),
+            FilterClause(property="region", operator=FilterOperator.ne, value="eu"),
+            Filter(
+                conjunction=FilterConjunction.or_,
+                clauses=[
+                    FilterClause(
+                        property="metadata.tier", operator=FilterOperator.gte, value="b"
+                    ),
+                    FilterClause(
+                        property="tokens", operator=FilterOperator.gte, value=2
+                    ),
+                    FilterClause(
+                        property="path", operator=FilterOperator.like, value="/api"
+                    ),
+                ],
+            ),
+        ],
+    )
+
+    assert filter.get_indexable_properties(Event) == {"model", "tier"}
@@ -1,11 +1,13 @@
 import uuid
-from datetime import timedelta
+from datetime import UTC, datetime, timedelta
 from decimal import Decimal
 from unittest.mock import AsyncMock
 
 import pytest
 import pytest_asyncio
 from pytest_mock import MockerFixture
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
 
 from polar.auth.models import AuthSubject
 from polar.enums import SubscriptionRecurringInterval
@@ -18,11 +20,14 @@ from polar.meter.aggregation import (
     AggregationFunction,
     CountAggregation,
     PropertyAggregation,
+    UniqueAggregation,
 )
 from polar.meter.filter import Filter, FilterClause, FilterConjunction, FilterOperator
+from polar.meter.repository import MeterAggregateRepository, MeterBillingRangeRepository
 from polar.meter.schemas import MeterCreate, MeterUpdate
 from polar.meter.service import meter as meter_service
 from polar.models import (
+    BillingEntry,
     Customer,
     Event,
     Meter,
@@ -30,7 +35,7 @@ from polar.models import (
     Product,
     Subscription,
 )
-from polar.models.billing_entry import BillingEntryDirection
+from polar.models.billing_entry import BillingEntryDirection, BillingEntryType
 from polar.models.customer_seat import SeatStatus
 from polar.models.event import EventSource
 from polar.postgres import AsyncSession
@@ -702,6 +707,109 @@ class TestGetQuantities:
         assert quantity.quantity == expected_value
         assert result.total == expected_value
 
+    @pytest.mark.parametrize(
+        "aggregation",
+        [
+            CountAggregation(),
+            PropertyAggregation(func=AggregationFunction.sum, property="tokens"),
+            PropertyAggregation(func=AggregationFunction.max, property="tokens"),
+            PropertyAggregation(func=AggregationFunction.min, property="tokens"),
+            PropertyAggregation(func=AggregationFunction.avg, property="tokens"),
+            UniqueAggregation(property="tokens"),
+        ],
+    )
+    @pytest.mark.parametrize(
+        "customer_aggregation_function", [None, AggregationFunction.avg]
+    )
+    async def test_aggregates(
+        self,
+        aggregation: Aggregation,
+        customer_aggregation_function: AggregationFunction | None,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        customer: Customer,
+        customer_second: Customer,
+    ) -> None:
+        start = datetime(2024, 6, 1, tzinfo=UTC)
+        for hours, tokens, event_customer in [
+            (30, 10, customer),
+            (34, 20, customer_second),
+            (34, 10, customer),
+            (50, 5, customer),
+            (51, 40, customer_second),
+            (71, 10, customer),
+        ]:
+            await create_event(
+                save_fixture,
+                timestamp=start + timedelta(hours=hours),
+                organization=customer.organization,
+                customer=event_customer,
+                metadata={"tokens": tokens, "model": "lite"},
+            )
+
+        meter = await create_meter(
+            save_fixture,
+            name="Lite Model Usage",
+            filter=Filter(
+                conjunction=FilterConjunction.and_,
+                clauses=[
+                    FilterClause(
+                        property="model", operator=FilterOperator.eq, value="lite"
+                    )
+                ],
+            ),
+            aggregation=aggregation,
+            organization=customer.organization,
+        )
+
+        async def _get_quantities() -> list[tuple[float, float]]:
+            result = await meter_service.get_quantities(
+                session,
+                meter,
+                start_timestamp=start,
+                end_timestamp=start + timedelta(days=2),
+                interval=TimeInterval.day,
+                customer_aggregation_function=customer_aggregation_function,
+            )
+            return [(q.quantity, result.total) for q in result.quantities]
+
+        raw_quantities = await _get_quantities()
+
+        await meter_service.build_aggregates(session, meter)
+        assert meter.aggregates_built_at is not None
+        assert await _get_quantities() == pytest.approx(raw_quantities)
+
+        # New events are only visible once the aggregates are refreshed,
+        # whether they create new aggregates or are merged into existing ones
+        new_events = [
+            await create_event(
+                save_fixture,
+                timestamp=start + timedelta(hours=hours),
+                organization=customer.organization,
+                customer=event_customer,
+                metadata={"tokens": tokens, "model": "lite"},
+            )
+            for hours, tokens, event_customer in [
+                (5, 100, customer_second),
+                (34, 10, customer),
+                (34, 1, customer),
+            ]
+        ]
+        assert await _get_quantities() == pytest.approx(raw_quantities)
+
+        aggregate_repository = MeterAggregateRepository.from_session(session)
+        await aggregate_repository.refresh(meter, [event.id for event in new_events])
+        aggregated_quantities = await _get_quantities()
+
+        # Rebuilt after the events were ingested: they're not counted twice
+        await meter_service.build_aggregates(session, meter)
+        await aggregate_repository.refresh(meter, [event.id for event in new_events])
+        assert await _get_quantities() == pytest.approx(aggregated_quantities)
+
+        meter.aggregates_built_at = None
+        assert aggregated_quantities == pytest.approx(await _get_quantities())
+        assert aggregated_quantities != pytest.approx(raw_quantities)
+
 
 @pytest_asyncio.fixture
 async def meter(save_fixture: SaveFixture, organization: Organization) -> Meter:
@@ -805,6 +913,22 @@ async def metered_subscription(
     )
 
 
+async def _get_billing_entries(session: AsyncSession) -> list[BillingEntry]:
+    statement = (
+        select(BillingEntry)
+        .where(BillingEntry.type == BillingEntryType.metered)
+        .order_by(BillingEntry.start_timestamp.asc())
+        .options(
+            joinedload(BillingEntry.event),
+            joinedload(BillingEntry.customer),
+            joinedload(BillingEntry.subscription),
+            joinedload(BillingEntry.product_price),
+        )
+    )
+    result = await session.execute(statement)
+    return list(result.scalars().unique().all())
+
+
 @pytest.mark.asyncio
 class TestCreateBillingEntries:
     async def test_no_subscription(
@@ -817,7 +941,8 @@ class TestCreateBillingEntries:
         meter: Meter,
         product_metered_unit: Product,
     ) -> None:
-        entries = await meter_service.create_billing_entries(session, meter)
+        await meter_service.create_billing_entries(session, meter)
+        entries = await _get_billing_entries(session)
 
         assert len(entries) == 0
         assert meter.last_billed_event == events[-3]
@@ -835,8 +960,10 @@ class TestCreateBillingEntries:
         product_metered_unit: Product,
         metered_subscription: Subscription,
     ) -> None:
-        entries = await meter_service.create_billing_entries(session, meter)
+        subscription_ids = await meter_service.create_billing_entries(session, meter)
+        entries = await _get_billing_entries(session)
 
+        assert subscription_ids == {metered_subscription.id}
         assert len(entries) == 5
         for entry in entries:
             assert entry.event is not None
@@ -865,7 +992,8 @@ class TestCreateBillingEntries:
         metered_subscription: Subscription,
     ) -> None:
         meter.last_billed_event = events[1]
-        entries = await meter_service.create_billing_entries(session, meter)
+        await meter_service.create_billing_entries(session, meter)
+        entries = await _get_billing_entries(session)
 
         assert len(entries) == 3
         for entry in entries:
@@ -883,6 +1011,98 @@ class TestCreateBillingEntries:
             "subscription.update_meters", metered_subscription.id
         )
 
+    async def test_multiple_ranges(
+        self,
+        mocker: MockerFixture,
+        enqueue_job_mock: AsyncMock,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        customer: Customer,
+        events: list[Event],
+        meter: Meter,
+        product_metered_unit: Product,
+        metered_subscription: Subscription,
+    ) -> None:
+        mocker.patch("polar.meter.service.settings.METER_BILLING_RANGE_SIZE", 2)
+
+        subscription_ids = await meter_service.create_billing_entries(session, meter)
+        entries = await _get_billing_entries(session)
+
+        assert subscription_ids == {metered_subscription.id}
+        assert len(entries) == 5
+        assert meter.last_billed_event == events[-3]
+
+        range_repository = MeterBillingRangeRepository.from_session(session)
+        assert await range_repository.get_all_by_meter(meter.id) == []
+
+        enqueue_job_mock.assert_called_once_with(
+            "subscription.update_meters", metered_subscription.id
+        )
+
+
+@pytest.mark.asyncio
+class TestPlanBillingRanges:
+    async def test_ranges(
+        self,
+        mocker: MockerFixture,
+        session: AsyncSession,
+        events: list[Event],
+        meter: Meter,
+    ) -> None:
+        mocker.patch("polar.meter.service.settings.METER_BILLING_RANGE_SIZE", 2)
+
+        billing_ranges = await meter_service.plan_billing_ranges(session, meter)
+
+        assert len(billing_ranges) == 3
+        assert billing_ranges[0].end_timestamp == events[1].ingested_at
+        assert billing_ranges[1].start_timestamp == events[1].ingested_at
+        assert billing_ranges[1].end_timestamp == events[3].ingested_at
+        assert billing_ranges[2].start_timestamp == events[3].ingested_at
+        assert billing_ranges[2].end_timestamp == events[4].ingested_at
+
+        # Planning again doesn't create new ranges, but returns the pending ones
+        assert await meter_service.plan_billing_ranges(session, meter) == (
+            billing_ranges
+        )
+
+
+@pytest.mark.asyncio
+class TestBillRange:
+    async def test_out_of_order(
+        self,
+        mocker: MockerFixture,
+        enqueue_job_mock: AsyncMock,
+        session: AsyncSession,
+        events: list[Event],
+        meter: Meter,
+        product_metered_unit: Product,
+        metered_subscription: Subscription,
+    ) -> None:
+        mocker.patch("polar.meter.service.settings.METER_BILLING_RANGE_SIZE", 2)
+        billing_ranges = await meter_service.plan_billing_ranges(session, meter)
+
+        subscription_ids = await meter_service.bill_range(session, billing_ranges[1].id)
+        assert subscription_ids == {metered_subscription.id}
+        assert len(await _get_billing_entries(session)) == 2
+        # The first range isn't billed yet, so the meter doesn't move
+        assert meter.last_billed_event is None
+
+        await meter_service.bill_range(session, billing_ranges[0].id)
+        assert len(await _get_billing_entries(session)) == 4
+        assert meter.last_billed_event == events[3]
+
+        # Already billed
+        assert await meter_service.bill_range(session, billing_ranges[1].id) == set()
+
+        await meter_service.bill_range(session, billing_ranges[2].id)
+        assert len(await _get_billing_entries(session)) == 5
+        assert meter.last_billed_event == events[4]
+
+        range_repository = MeterBillingRangeRepository.from_session(session)
+        assert await range_repository.get_all_by_meter(meter.id) == []
+
+        assert enqueue_job_mock.call_count == 3
+
 
 @pytest.mark.asyncio
 class TestCreateBillingEntriesWithSeats:
@@ -971,7 +1191,8 @@ class TestCreateBillingEntriesWithSeats:
             ),
         ]
 
-        entries = await meter_service.create_billing_entries(session, meter)
+        await meter_service.create_billing_entries(session, meter)
+        entries = await _get_billing_entries(session)
 
         assert len(entries) == 2
         for entry in entries:
@@ -1060,7 +1281,8 @@ class TestCreateBillingEntriesWithSeats:
             ),
         ]
 
-        entries = await meter_service.create_billing_entries(session, meter)
+        await meter_service.create_billing_entries(session, meter)
+        entries = await _get_billing_entries(session)
 
         assert len(entries) == 0
         enqueue_job_mock.assert_not_called()
@@ -1178,7 +1400,8 @@ class TestCreateBillingEntriesWithSeats:
             ),
         ]
 
-        entries = await meter_service.create_billing_entries(session, meter)
+        await meter_service.create_billing_entries(session, meter)
+        entries = await _get_billing_entries(session)
 
         assert len(entries) == 3
         for entry in entries:
@@ -1299,7 +1522,8 @@ class TestCreateBillingEntriesWithSeats:
             ),
         ]
 
-        entries = await meter_service.create_billing_entries(session, meter)
+        await meter_service.create_billing_entries(session, meter)
+        entries = await _get_billing_entries(session)
 
         assert len(entries) == 3
         for entry in entries:
@@ -100,6 +100,49 @@ class TestGetMetrics:
         json = response.json()
         assert len(json["periods"]) == 12
 
+    @pytest.mark.auth(
+        AuthSubjectFixture(subject="organization", scopes={Scope.metrics_read})
+    )
+    async def test_metrics_selection(self, client: AsyncClient) -> None:
+        response = await client.get(
+            "/v1/metrics/",
+            params={
+                "start_date": "2024-01-01",
+                "end_date": "2024-12-31",
+                "interval": "month",
+                "metrics": ["revenue", "average_order_value"],
+            },
+        )
+
+        assert response.status_code == 200
+
+        json = response.json()
+        assert len(json["periods"]) == 12
+        for period in json["periods"]:
+            assert set(period.keys()) == {
+                "timestamp",
+                "revenue",
+                "average_order_value",
+            }
+        assert set(json["totals"].keys()) == {"revenue", "average_order_value"}
+        assert set(json["metrics"].keys()) == {"revenue", "average_order_value"}
+
+    @pytest.mark.auth(
+        AuthSubjectFixture(subject="organization", scopes={Scope.metrics_read})
+    )
+    async def test_metrics_selection_invalid(self, client: AsyncClient) -> None:
+        response = await client.get(
+            "/v1/metrics/",
+            params={
+                "start_date": "2024-01-01",
+                "end_date": "2024-12-31",
+                "interval": "month",
+                "metrics": "invalid_metric",
+            },
+        )
+
+        assert response.status_code == 422
+
 
 @pytest.mark.asyncio
 class TestGetMetricsLimits:
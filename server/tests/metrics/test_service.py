@@ -1,13 +1,18 @@
+import functools
+import uuid
 from datetime import UTC, date, datetime
 from typing import NotRequired, TypedDict
+from unittest.mock import MagicMock
 
 import pytest
 import pytest_asyncio
 from apscheduler.util import ZoneInfo
+from pytest_mock import MockerFixture
 
 from polar.auth.models import AuthSubject
 from polar.enums import SubscriptionRecurringInterval
 from polar.kit.time_queries import TimeInterval
+from polar.metrics.queries import MetricQuery
 from polar.metrics.service import metrics as metrics_service
 from polar.models import (
     Customer,
@@ -19,14 +24,17 @@ from polar.models import (
     User,
     UserOrganization,
 )
+from polar.models.checkout import CheckoutStatus
 from polar.models.discount import DiscountDuration, DiscountType
 from polar.models.order import OrderStatus
 from polar.models.product import ProductBillingType
 from polar.models.subscription import SubscriptionStatus
 from polar.postgres import AsyncSession
+from polar.redis import Redis
 from tests.fixtures.auth import AuthSubjectFixture
 from tests.fixtures.database import SaveFixture
 from tests.fixtures.random_objects import (
+    create_checkout,
     create_discount,
     create_event,
     create_order,
@@ -576,6 +584,77 @@ class TestGetMetrics:
         assert period.active_subscriptions == 3
         assert period.monthly_recurring_revenue == 283_33
 
+    @pytest.mark.auth
+    async def test_values_cumulative_before_start(
+        self,
+        session: AsyncSession,
+        auth_subject: AuthSubject[User],
+        user_organization: UserOrganization,
+        fixtures: tuple[dict[str, Subscription], dict[str, Order]],
+    ) -> None:
+        metrics = await metrics_service.get_metrics(
+            session,
+            auth_subject,
+            start_date=date(2024, 3, 1),
+            end_date=date(2024, 12, 31),
+            timezone=ZoneInfo("UTC"),
+            interval=TimeInterval.month,
+        )
+
+        assert len(metrics.periods) == 10
+
+        mar = metrics.periods[0]
+        assert mar.revenue == 0
+        assert mar.cumulative_revenue == 1300_00
+
+        apr = metrics.periods[1]
+        assert apr.revenue == 0
+        assert apr.cumulative_revenue == 1300_00
+
+        jun = metrics.periods[3]
+        assert jun.revenue == 100_00
+        assert jun.cumulative_revenue == 1400_00
+
+        dec = metrics.periods[-1]
+        assert dec.cumulative_revenue == 1400_00
+
+        assert metrics.totals.cumulative_revenue == 1400_00
+
+    @pytest.mark.auth
+    async def test_metrics_selection(
+        self,
+        session: AsyncSession,
+        auth_subject: AuthSubject[User],
+        user_organization: UserOrganization,
+        fixtures: tuple[dict[str, Subscription], dict[str, Order]],
+        mocker: MockerFixture,
+    ) -> None:
+        get_cost_events_cte_mock = MagicMock()
+        mocker.patch.dict(
+            "polar.metrics.service.QUERIES",
+            {MetricQuery.costs: get_cost_events_cte_mock},
+        )
+
+        metrics = await metrics_service.get_metrics(
+            session,
+            auth_subject,
+            start_date=date(2024, 1, 1),
+            end_date=date(2024, 12, 31),
+            timezone=ZoneInfo("UTC"),
+            interval=TimeInterval.year,
+            metrics=["average_order_value"],
+        )
+
+        get_cost_events_cte_mock.assert_not_called()
+        period = metrics.periods[0]
+        assert period.average_order_value == 280_00
+        assert period.orders is None
+        assert period.revenue is None
+        assert metrics.totals.average_order_value == 280_00
+        assert metrics.totals.revenue is None
+        assert metrics.metrics.average_order_value is not None
+        assert metrics.metrics.revenue is None
+
     @pytest.mark.auth
     async def test_values_free_subscription(
         self,
@@ -1016,3 +1095,201 @@ class TestGetMetrics:
         jan_1 = metrics.periods[0]
         assert jan_1.costs == 0.000001
         assert jan_1.cumulative_costs == 0.000001
+
+
+@pytest.mark.asyncio
+class TestRollups:
+    @pytest.mark.auth
+    async def test_get_metrics_from_rollups(
+        self,
+        mocker: MockerFixture,
+        session: AsyncSession,
+        auth_subject: AuthSubject[User],
+        user_organization: UserOrganization,
+        organization: Organization,
+        fixtures: tuple[dict[str, Subscription], dict[str, Order]],
+    ) -> None:
+        raw_metrics = await metrics_service.get_metrics(
+            session,
+            auth_subject,
+            start_date=date(2024, 1, 1),
+            end_date=date(2024, 12, 31),
+            timezone=ZoneInfo("UTC"),
+            interval=TimeInterval.month,
+        )
+
+        await metrics_service.refresh_rollups(
+            session,
+            organization.id,
+            datetime(2024, 1, 1, tzinfo=UTC),
+            datetime(2025, 1, 1, tzinfo=UTC),
+        )
+        mocker.patch("polar.metrics.service.settings.METRICS_ROLLUPS_ENABLED", True)
+
+        rollup_metrics = await metrics_service.get_metrics(
+            session,
+            auth_subject,
+            start_date=date(2024, 1, 1),
+            end_date=date(2024, 12, 31),
+            timezone=ZoneInfo("UTC"),
+            interval=TimeInterval.month,
+        )
+
+        assert rollup_metrics.periods == raw_metrics.periods
+        assert rollup_metrics.totals == raw_metrics.totals
+
+    @pytest.mark.auth
+    async def test_checkouts_from_rollups(
+        self,
+        mocker: MockerFixture,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        auth_subject: AuthSubject[User],
+        user_organization: UserOrganization,
+        organization: Organization,
+        fixtures: tuple[dict[str, Product], dict[str, Subscription], dict[str, Order]],
+    ) -> None:
+        products, _, _ = fixtures
+        offered_products = [
+            products["one_time_product"],
+            products["monthly_subscription"],
+        ]
+        checkout = await create_checkout(
+            save_fixture, products=offered_products, status=CheckoutStatus.succeeded
+        )
+        checkout.created_at = datetime(2024, 6, 1, 12, tzinfo=UTC)
+        await save_fixture(checkout)
+
+        product_ids: list[list[uuid.UUID] | None] = [
+            None,
+            [offered_products[0].id],
+            [offered_products[1].id],
+            [product.id for product in offered_products],
+        ]
+        get_metrics = functools.partial(
+            metrics_service.get_metrics,
+            session,
+            auth_subject,
+            start_date=date(2024, 1, 1),
+            end_date=date(2024, 12, 31),
+            timezone=ZoneInfo("UTC"),
+            interval=TimeInterval.month,
+            metrics=["checkouts", "succeeded_checkouts"],
+        )
+        raw_metrics = [
+            await get_metrics(product_id=product_id) for product_id in product_ids
+        ]
+
+        await metrics_service.refresh_rollups(
+            session,
+            organization.id,
+            datetime(2024, 1, 1, tzinfo=UTC),
+            datetime(2025, 1, 1, tzinfo=UTC),
+        )
+        mocker.patch("polar.metrics.service.settings.METRICS_ROLLUPS_ENABLED", True)
+
+        for product_id, raw in zip(product_ids, raw_metrics):
+            rollup = await get_metrics(product_id=product_id)
+            assert rollup.periods == raw.periods
+            assert rollup.totals == raw.totals
+            assert rollup.totals["checkouts"] == 1
+
+    async def test_check_rollups(
+        self,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        customer: Customer,
+        organization: Organization,
+        fixtures: tuple[dict[str, Product], dict[str, Subscription], dict[str, Order]],
+    ) -> None:
+        start = datetime(2024, 1, 1, tzinfo=UTC)
+        end = datetime(2025, 1, 1, tzinfo=UTC)
+        await metrics_service.refresh_rollups(session, organization.id, start, end)
+
+        assert (
+            await metrics_service.check_rollups(session, organization.id, start, end)
+            == []
+        )
+
+        products, _, _ = fixtures
+        await create_order(
+            save_fixture,
+            status=OrderStatus.paid,
+            product=products["one_time_product"],
+            customer=customer,
+            subtotal_amount=100_00,
+            created_at=datetime(2024, 3, 1, 10, 30, tzinfo=UTC),
+            stripe_invoice_id=None,
+        )
+
+        buckets = await metrics_service.check_rollups(
+            session, organization.id, start, end, repair=True
+        )
+        assert buckets == [datetime(2024, 3, 1, 10, tzinfo=UTC)]
+
+        assert (
+            await metrics_service.check_rollups(session, organization.id, start, end)
+            == []
+        )
+
+
+@pytest.mark.asyncio
+class TestCache:
+    @pytest.mark.auth
+    async def test_closed_periods(
+        self,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        redis: Redis,
+        auth_subject: AuthSubject[User],
+        user_organization: UserOrganization,
+        customer: Customer,
+        organization: Organization,
+        fixtures: tuple[dict[str, Product], dict[str, Subscription], dict[str, Order]],
+    ) -> None:
+        get_metrics = functools.partial(
+            metrics_service.get_metrics,
+            session,
+            auth_subject,
+            start_date=date(2024, 1, 1),
+            end_date=date(2024, 12, 31),
+            timezone=ZoneInfo("UTC"),
+            interval=TimeInterval.month,
+            now=datetime(2024, 6, 15, tzinfo=UTC),
+        )
+
+        raw_metrics = await get_metrics()
+        cached_metrics = await get_metrics(redis=redis)
+        assert cached_metrics.periods == raw_metrics.periods
+        assert cached_metrics.totals == raw_metrics.totals
+
+        products, _, _ = fixtures
+        for created_at in (
+            datetime(2024, 3, 1, tzinfo=UTC),
+            datetime(2024, 6, 2, tzinfo=UTC),
+        ):
+            await create_order(
+                save_fixture,
+                status=OrderStatus.paid,
+                product=products["one_time_product"],
+                customer=customer,
+                subtotal_amount=100_00,
+                created_at=created_at,
+                stripe_invoice_id=None,
+            )
+
+        # Closed buckets are served from the cache, the open one is recomputed
+        cached_metrics = await get_metrics(redis=redis)
+        mar = cached_metrics.periods[2]
+        assert mar.orders == 0
+        jun = cached_metrics.periods[5]
+        assert jun.orders == 2
+
+        await metrics_service.invalidate_cache(redis, organization.id)
+
+        cached_metrics = await get_metrics(redis=redis)
+        mar = cached_metrics.periods[2]
+        assert mar.orders == 1
+        jun = cached_metrics.periods[5]
+        assert jun.orders == 2
+        assert cached_metrics.periods == (await get_metrics()).periods
@@ -46,7 +46,7 @@ async def test_MaintainerNewPaidSubscriptionNotification() -> None:
         tier_price_recurring_interval="month",
     )
 
-    await check_diff(n.render())
+    await check_diff(await n.render())
 
 
 @pytest.mark.asyncio
@@ -58,7 +58,7 @@ async def test_MaintainerNewProductSaleNotification() -> None:
         organization_name="myorg",
     )
 
-    await check_diff(n.render())
+    await check_diff(await n.render())
 
 
 @pytest.mark.asyncio
@@ -68,7 +68,7 @@ async def test_MaintainerCreateAccountNotificationPayload() -> None:
         url="https://example.com/url",
     )
 
-    await check_diff(n.render())
+    await check_diff(await n.render())
 
 
 @pytest.mark.asyncio
@@ -95,7 +95,7 @@ async def test_MaintainerCreateAccountNotificationPayload() -> None:
     ],
 )
 async def test_injection_payloads(payload: NotificationPayloadBase) -> None:
-    subject, body = payload.render()
+    subject, body = await payload.render()
     assert str(123456 * 9) not in subject
     assert str(123456 * 9) not in body
 
@@ -138,7 +138,7 @@ async def test_all_notification_types() -> None:
             raise TypeError(f"Missing test case for {notification_type}")
 
     # Check that it renders!
-    subject, body = n.render()
+    subject, body = await n.render()
 
     # Check that there are no leftover placeholders
     assert re.search(r"{ ?[^\s}]+ ?}", subject) is None
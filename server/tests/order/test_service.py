@@ -2271,10 +2271,11 @@ class TestHandlePayment:
         assert updated_order.status == OrderStatus.paid
         assert updated_order.tax_transaction_processor_id == "tax_txn_456"
 
-        # Verify enqueue_job was called to balance the order
-        enqueue_job_mock.assert_called_once_with(
-            "order.balance", order_id=order.id, charge_id="stripe_payment_123"
-        )
+        # Verify enqueue_job was called to balance the order and refresh metrics
+        assert enqueue_job_mock.call_args_list == [
+            call("order.balance", order_id=order.id, charge_id="stripe_payment_123"),
+            call("metrics.rollup_order", order.id),
+        ]
 
         # Verify stripe tax transaction was created
         stripe_service_mock.create_tax_transaction.assert_called_once_with(
@@ -73,3 +73,31 @@ class TestRevokeLeaked:
         assert updated_personal_access_token.deleted_at is not None
 
         enqueue_email_mock.assert_called_once()
+
+
+@pytest.mark.asyncio
+class TestRecordUsages:
+    async def test_valid(
+        self, save_fixture: SaveFixture, session: AsyncSession, user: User
+    ) -> None:
+        personal_access_tokens: list[PersonalAccessToken] = []
+        for i in range(2):
+            personal_access_token = PersonalAccessToken(
+                comment="Test",
+                token=get_token_hash(f"polar_pat_{i}", secret=settings.SECRET),
+                user_id=user.id,
+                expires_at=utc_now() + timedelta(days=1),
+                scope="openid",
+            )
+            await save_fixture(personal_access_token)
+            personal_access_tokens.append(personal_access_token)
+
+        last_used_at = utc_now()
+        await personal_access_token_service.record_usages(
+            session, {personal_access_tokens[0].id: last_used_at}
+        )
+
+        for personal_access_token in personal_access_tokens:
+            await session.refresh(personal_access_token)
+        assert personal_access_tokens[0].last_used_at == last_used_at
+        assert personal_access_tokens[1].last_used_at is None
@@ -0,0 +1,69 @@
+import asyncio
+import uuid
+
+import pytest
+from fakeredis import FakeAsyncRedis
+
+from polar.models.webhook_endpoint import WebhookEventType, WebhookFormat
+from polar.webhook import cache as webhook_endpoints_cache
+
+ENDPOINTS = [
+    webhook_endpoints_cache.TargetEndpoint(
+        uuid.uuid4(),
+        WebhookFormat.raw,
+        frozenset({WebhookEventType.customer_created}),
+    )
+]
+
+
+def test_set_endpoints() -> None:
+    organization_id = uuid.uuid4()
+    generation, endpoints = webhook_endpoints_cache.get_endpoints(organization_id)
+    assert endpoints is None
+
+    webhook_endpoints_cache.set_endpoints(organization_id, ENDPOINTS, generation)
+    assert webhook_endpoints_cache.get_endpoints(organization_id)[1] == ENDPOINTS
+
+
+def test_set_endpoints_invalidated_since_read() -> None:
+    organization_id = uuid.uuid4()
+    generation, _ = webhook_endpoints_cache.get_endpoints(organization_id)
+
+    # Evicted while the endpoints were read from the database
+    webhook_endpoints_cache.invalidate_endpoints(organization_id)
+    webhook_endpoints_cache.set_endpoints(organization_id, ENDPOINTS, generation)
+
+    assert webhook_endpoints_cache.get_endpoints(organization_id)[1] is None
+
+
+async def _wait_subscribed(redis: FakeAsyncRedis) -> None:
+    channel = webhook_endpoints_cache.INVALIDATION_CHANNEL
+    while True:
+        [(_, subscribers)] = await redis.pubsub_numsub(channel)
+        if subscribers > 0:
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_listen_invalidations() -> None:
+    organization_id = uuid.uuid4()
+    generation, _ = webhook_endpoints_cache.get_endpoints(organization_id)
+    webhook_endpoints_cache.set_endpoints(organization_id, ENDPOINTS, generation)
+
+    redis = FakeAsyncRedis(decode_responses=True)
+    task = asyncio.create_task(webhook_endpoints_cache.listen_invalidations(redis))
+    try:
+        await _wait_subscribed(redis)
+        await redis.publish(
+            webhook_endpoints_cache.INVALIDATION_CHANNEL, str(organization_id)
+        )
+        for _ in range(100):
+            if webhook_endpoints_cache.get_endpoints(organization_id)[1] is None:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert webhook_endpoints_cache.get_endpoints(organization_id)[1] is None
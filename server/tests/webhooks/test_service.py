@@ -1,4 +1,5 @@
 import uuid
+from datetime import UTC, datetime, time, timedelta
 from typing import cast
 from unittest.mock import MagicMock
 
@@ -8,9 +9,16 @@ from pytest_mock import MockerFixture
 from polar.auth.models import AuthSubject
 from polar.auth.scope import Scope
 from polar.checkout.eventstream import CheckoutEvent
+from polar.config import settings
 from polar.exceptions import PolarRequestValidationError, ResourceNotFound
+from polar.kit.db.partitioning import (
+    create_daily_partition,
+    get_daily_partition_name,
+    get_partitions,
+)
 from polar.kit.utils import utc_now
 from polar.models import (
+    Customer,
     Organization,
     Product,
     WebhookDelivery,
@@ -19,10 +27,11 @@ from polar.models import (
 )
 from polar.models.webhook_endpoint import WebhookEventType, WebhookFormat
 from polar.postgres import AsyncSession
+from polar.webhook import cache as webhook_endpoints_cache
 from polar.webhook.schemas import HttpsUrl, WebhookEndpointCreate, WebhookEndpointUpdate
 from polar.webhook.service import EventDoesNotExist, EventNotSuccessul
 from polar.webhook.service import webhook as webhook_service
-from polar.webhook.webhooks import WebhookCheckoutUpdatedPayload
+from polar.webhook.webhooks import BaseWebhookPayload, WebhookCheckoutUpdatedPayload
 from tests.fixtures.auth import AuthSubjectFixture
 from tests.fixtures.database import SaveFixture
 from tests.fixtures.random_objects import create_checkout
@@ -123,6 +132,101 @@ class TestDeleteEndpoint:
         assert deleted_endpoint.deleted_at is not None
 
 
+@pytest.mark.asyncio
+class TestSend:
+    async def test_render_once_per_format(
+        self,
+        mocker: MockerFixture,
+        enqueue_job_mock: MagicMock,
+        save_fixture: SaveFixture,
+        session: AsyncSession,
+        organization: Organization,
+        customer: Customer,
+    ) -> None:
+        endpoints = [
+            WebhookEndpoint(
+                url=webhook_url,
+                format=format,
+                organization=organization,
+                secret="mysecret",
+                events=[WebhookEventType.customer_created],
+            )
+            for format in (WebhookFormat.raw, WebhookFormat.raw, WebhookFormat.slack)
+        ]
+        for endpoint in endpoints:
+            await save_fixture(endpoint)
+        get_payload_spy = mocker.spy(BaseWebhookPayload, "get_payload")
+
+        events = await webhook_service.send(
+            session, organization, WebhookEventType.customer_created, customer
+        )
+
+        assert {event.webhook_endpoint_id for event in events} == {
+            endpoint.id for endpoint in endpoints
+        }
+        assert get_payload_spy.call_count == 2
+        assert enqueue_job_mock.call_count == 3
+
+    @pytest.mark.auth(
+        AuthSubjectFixture(subject="organization", scopes={Scope.webhooks_write})
+    )
+    async def test_endpoints_cache_invalidation(
+        self,
+        enqueue_job_mock: MagicMock,
+        auth_subject: AuthSubject[Organization],
+        session: AsyncSession,
+        organization: Organization,
+        customer: Customer,
+    ) -> None:
+        events = await webhook_service.send(
+            session, organization, WebhookEventType.customer_created, customer
+        )
+        assert len(events) == 0
+
+        endpoint = await webhook_service.create_endpoint(
+            session,
+            auth_subject,
+            WebhookEndpointCreate(
+                url=webhook_url,
+                format=WebhookFormat.raw,
+                events=[],
+                organization_id=None,
+            ),
+        )
+        await session.flush()
+        events = await webhook_service.send(
+            session, organization, WebhookEventType.customer_created, customer
+        )
+        assert len(events) == 0
+
+        await webhook_service.update_endpoint(
+            session,
+            endpoint=endpoint,
+            update_schema=WebhookEndpointUpdate(
+                events=[WebhookEventType.customer_created]
+            ),
+        )
+        await session.flush()
+        events = await webhook_service.send(
+            session, organization, WebhookEventType.customer_created, customer
+        )
+        assert len(events) == 1
+
+        await webhook_service.delete_endpoint(session, endpoint)
+        await session.flush()
+        events = await webhook_service.send(
+            session, organization, WebhookEventType.customer_created, customer
+        )
+        assert len(events) == 0
+
+        # Evicted from the other processes once committed
+        enqueue_job_mock.assert_any_call(
+            "eventstream.publish",
+            str(organization.id),
+            [webhook_endpoints_cache.INVALIDATION_CHANNEL],
+        )
+
+
 @pytest.mark.asyncio
 class TestRedeliverEvent:
     @pytest.mark.auth(
@@ -346,3 +450,108 @@ class TestIsLatestEvent:
         await save_fixture(event)
 
         assert await webhook_service.is_latest_event(session, event) is True
+
+
+@pytest.mark.asyncio
+class TestGetNextPendingEvent:
+    async def test_no_next_event(
+        self,
+        session: AsyncSession,
+        save_fixture: SaveFixture,
+        webhook_endpoint_organization: WebhookEndpoint,
+    ) -> None:
+        event = WebhookEvent(
+            webhook_endpoint=webhook_endpoint_organization,
+            type=WebhookEventType.checkout_updated,
+            payload="{}",
+        )
+        await save_fixture(event)
+
+        assert await webhook_service.get_next_pending_event(session, event) is None
+
+    async def test_next_events(
+        self,
+        session: AsyncSession,
+        save_fixture: SaveFixture,
+        webhook_endpoint_organization: WebhookEndpoint,
+    ) -> None:
+        event = WebhookEvent(
+            webhook_endpoint=webhook_endpoint_organization,
+            type=WebhookEventType.checkout_updated,
+            payload="{}",
+        )
+        await save_fixture(event)
+
+        attempted_event = WebhookEvent(
+            webhook_endpoint=webhook_endpoint_organization,
+            succeeded=False,
+            type=WebhookEventType.checkout_updated,
+            payload="{}",
+        )
+        await save_fixture(attempted_event)
+        await save_fixture(
+            WebhookDelivery(
+                webhook_event=attempted_event,
+                webhook_endpoint=webhook_endpoint_organization,
+                succeeded=False,
+                http_code=500,
+            )
+        )
+
+        archived_event = WebhookEvent(
+            webhook_endpoint=webhook_endpoint_organization,
+            type=WebhookEventType.checkout_updated,
+            payload=None,
+        )
+        await save_fixture(archived_event)
+
+        next_event = WebhookEvent(
+            webhook_endpoint=webhook_endpoint_organization,
+            type=WebhookEventType.checkout_updated,
+            payload="{}",
+        )
+        await save_fixture(next_event)
+
+        later_event = WebhookEvent(
+            webhook_endpoint=webhook_endpoint_organization,
+            type=WebhookEventType.checkout_updated,
+            payload="{}",
+        )
+        await save_fixture(later_event)
+
+        assert await webhook_service.get_next_pending_event(session, event) == (
+            next_event
+        )
+
+
+@pytest.mark.asyncio
+class TestArchiveEvents:
+    async def test_partitions(self, session: AsyncSession) -> None:
+        today = utc_now().date()
+        expired_day = today - timedelta(days=40)
+        retained_day = today - timedelta(days=10)
+        tables = ("webhook_events", "webhook_deliveries")
+        for table in tables:
+            await create_daily_partition(session, table, expired_day)
+            await create_daily_partition(session, table, retained_day)
+
+        await webhook_service.archive_events(
+            session, older_than=utc_now() - settings.WEBHOOK_EVENT_RETENTION_PERIOD
+        )
+
+        for table in tables:
+            partitions = {
+                partition.name: partition
+                for partition in await get_partitions(session, table)
+            }
+            assert get_daily_partition_name(table, expired_day) not in partitions
+            assert get_daily_partition_name(table, retained_day) in partitions
+            for days in range(settings.WEBHOOK_PARTITIONS_PREMAKE + 1):
+                day = today + timedelta(days=days)
+                partition = partitions[get_daily_partition_name(table, day)]
+                assert partition.upper_bound == datetime.combine(
+                    day + timedelta(days=1), time(), UTC
+                )
+
+            # Never dropped
+            assert partitions[f"{table}_default"].upper_bound is None
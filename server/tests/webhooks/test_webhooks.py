@@ -1,3 +1,5 @@
+import asyncio
+from datetime import timedelta
 from typing import Any, cast
 from unittest.mock import MagicMock
 
@@ -7,13 +9,17 @@ import pytest
 import respx
 from dramatiq import Retry
 from pytest_mock import MockerFixture
+from redis.asyncio.lock import Lock
+from redis.exceptions import LockNotOwnedError
 from standardwebhooks.webhooks import Webhook as StandardWebhook
 
 from polar.config import settings
 from polar.kit.db.postgres import AsyncSession
+from polar.kit.utils import utc_now
 from polar.models.organization import Organization
 from polar.models.subscription import Subscription
 from polar.models.webhook_endpoint import (
+    WebhookCircuitState,
     WebhookEndpoint,
     WebhookEventType,
     WebhookFormat,
@@ -21,7 +27,11 @@ from polar.models.webhook_endpoint import (
 from polar.models.webhook_event import WebhookEvent
 from polar.webhook.repository import WebhookDeliveryRepository
 from polar.webhook.service import webhook as webhook_service
-from polar.webhook.tasks import _webhook_event_send, webhook_event_send
+from polar.webhook.tasks import (
+    _get_origin_limit,
+    _webhook_event_send,
+    webhook_event_send,
+)
 from tests.fixtures.database import SaveFixture
 
 
@@ -53,7 +63,7 @@ async def test_webhook_send(
     assert len(events) == 1
 
     event = events[0]
-    assert event.webhook_endpoint == endpoint
+    assert event.webhook_endpoint_id == endpoint.id
 
     enqueue_job_mock.assert_called_once_with(
         "webhook_event.send", webhook_event_id=event.id
@@ -255,3 +265,398 @@ async def test_webhook_standard_webhooks_compatible(
     request = route_mock.calls.last.request
     w = StandardWebhook(secret.encode("utf-8"))
     assert w.verify(request.content, cast(dict[str, str], request.headers)) is not None
+
+
+@pytest.mark.asyncio
+async def test_webhook_delivery_ordered(
+    mocker: MockerFixture,
+    session: AsyncSession,
+    save_fixture: SaveFixture,
+    respx_mock: respx.MockRouter,
+    organization: Organization,
+) -> None:
+    enqueue_job_mock = mocker.patch("polar.webhook.tasks.enqueue_job")
+    actor = dramatiq.get_broker().get_actor("webhook_event.send")
+    send_mock = mocker.patch.object(actor, "send_with_options")
+    route_mock = respx_mock.post("https://example.com/hook").mock(
+        return_value=httpx.Response(200)
+    )
+
+    endpoint = WebhookEndpoint(
+        url="https://example.com/hook",
+        format=WebhookFormat.raw,
+        organization_id=organization.id,
+        secret="mysecret",
+    )
+    await save_fixture(endpoint)
+
+    first_event = WebhookEvent(
+        webhook_endpoint_id=endpoint.id,
+        type=WebhookEventType.customer_created,
+        payload='{"foo":"bar"}',
+    )
+    await save_fixture(first_event)
+    second_event = WebhookEvent(
+        webhook_endpoint_id=endpoint.id,
+        type=WebhookEventType.customer_updated,
+        payload='{"foo":"bar"}',
+    )
+    await save_fixture(second_event)
+
+    # Waits for the first event, without retrying
+    await _webhook_event_send(session=session, webhook_event_id=second_event.id)
+    assert route_mock.call_count == 0
+    # Sent again once the first event is no longer waited for,
+    # in case it's never released
+    send_mock.assert_called_once()
+    assert send_mock.call_args.kwargs["kwargs"]["webhook_event_id"] == second_event.id
+    assert send_mock.call_args.kwargs["delay"] >= 60_000
+
+    # Releases the second event once delivered
+    await _webhook_event_send(session=session, webhook_event_id=first_event.id)
+    assert route_mock.call_count == 1
+    enqueue_job_mock.assert_any_call(
+        "webhook_event.send", webhook_event_id=second_event.id
+    )
+
+    await _webhook_event_send(session=session, webhook_event_id=second_event.id)
+    assert route_mock.call_count == 2
+
+    # Already attempted by the released job
+    await _webhook_event_send(session=session, webhook_event_id=second_event.id)
+    assert route_mock.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_webhook_delivery_failure_releases_next_event(
+    mocker: MockerFixture,
+    session: AsyncSession,
+    save_fixture: SaveFixture,
+    respx_mock: respx.MockRouter,
+    organization: Organization,
+) -> None:
+    enqueue_job_mock = mocker.patch("polar.webhook.tasks.enqueue_job")
+    respx_mock.post("https://example.com/hook").mock(
+        return_value=httpx.Response(500, text="Internal Error")
+    )
+
+    endpoint = WebhookEndpoint(
+        url="https://example.com/hook",
+        format=WebhookFormat.raw,
+        organization_id=organization.id,
+        secret="mysecret",
+    )
+    await save_fixture(endpoint)
+
+    first_event = WebhookEvent(
+        webhook_endpoint_id=endpoint.id,
+        type=WebhookEventType.customer_created,
+        payload='{"foo":"bar"}',
+    )
+    await save_fixture(first_event)
+    second_event = WebhookEvent(
+        webhook_endpoint_id=endpoint.id,
+        type=WebhookEventType.customer_updated,
+        payload='{"foo":"bar"}',
+    )
+    await save_fixture(second_event)
+
+    with pytest.raises(Retry):
+        await _webhook_event_send(session=session, webhook_event_id=first_event.id)
+
+    enqueue_job_mock.assert_called_once_with(
+        "webhook_event.send", webhook_event_id=second_event.id
+    )
+
+
+def test_webhook_origin_limit() -> None:
+    limit = _get_origin_limit("https://example.com/hook", 2)
+    assert limit.limit == 2
+    assert _get_origin_limit("https://example.com/other?foo=bar", 2) is limit
+    assert _get_origin_limit("https://example.com:8443/hook", 2) is not limit
+    assert _get_origin_limit("https://example.org/hook", 2) is not limit
+
+    # Follows the latest concurrency of the endpoint
+    assert _get_origin_limit("https://example.com/hook", 1) is limit
+    assert limit.limit == 1
+
+
+@pytest.mark.asyncio
+async def test_webhook_delivery_total_timeout(
+    mocker: MockerFixture,
+    session: AsyncSession,
+    save_fixture: SaveFixture,
+    respx_mock: respx.MockRouter,
+    organization: Organization,
+    current_message: dramatiq.Message[Any],
+) -> None:
+    mocker.patch("polar.webhook.tasks.webhook_health.get_timeout", return_value=0.01)
+
+    async def slow_response(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    respx_mock.post("https://example.com/hook").mock(side_effect=slow_response)
+
+    endpoint = WebhookEndpoint(
+        url="https://example.com/hook",
+        format=WebhookFormat.raw,
+        organization_id=organization.id,
+        secret="mysecret",
+    )
+    await save_fixture(endpoint)
+
+    event = WebhookEvent(
+        webhook_endpoint_id=endpoint.id,
+        type=WebhookEventType.customer_created,
+        payload='{"foo":"bar"}',
+    )
+    await save_fixture(event)
+
+    with pytest.raises(Retry):
+        await _webhook_event_send(session=session, webhook_event_id=event.id)
+
+    delivery_repository = WebhookDeliveryRepository.from_session(session)
+    deliveries = await delivery_repository.get_all_by_event(event.id)
+    assert len(deliveries) == 1
+    assert deliveries[0].succeeded is False
+
+
+@pytest.mark.asyncio
+async def test_webhook_delivery_lock_lost(
+    mocker: MockerFixture,
+    session: AsyncSession,
+    save_fixture: SaveFixture,
+    respx_mock: respx.MockRouter,
+    organization: Organization,
+    current_message: dramatiq.Message[Any],
+) -> None:
+    # Expired while waiting for a slot of the origin
+    mocker.patch.object(
+        Lock, "reacquire", side_effect=LockNotOwnedError("Lock expired")
+    )
+    actor = dramatiq.get_broker().get_actor("webhook_event.send")
+    send_mock = mocker.patch.object(actor, "send_with_options")
+    route_mock = respx_mock.post("https://example.com/hook").mock(
+        return_value=httpx.Response(200)
+    )
+
+    endpoint = WebhookEndpoint(
+        url="https://example.com/hook",
+        format=WebhookFormat.raw,
+        organization_id=organization.id,
+        secret="mysecret",
+    )
+    await save_fixture(endpoint)
+
+    event = WebhookEvent(
+        webhook_endpoint_id=endpoint.id,
+        type=WebhookEventType.customer_created,
+        payload='{"foo":"bar"}',
+    )
+    await save_fixture(event)
+
+    await _webhook_event_send(session=session, webhook_event_id=event.id)
+
+    assert route_mock.call_count == 0
+    delivery_repository = WebhookDeliveryRepository.from_session(session)
+    assert len(await delivery_repository.get_all_by_event(event.id)) == 0
+
+    # Sent again, to be delivered unless the job holding the lock did it
+    send_mock.assert_called_once()
+    assert send_mock.call_args.kwargs["kwargs"]["webhook_event_id"] == event.id
+
+
+@pytest.mark.asyncio
+async def test_webhook_delivery_opens_circuit(
+    mocker: MockerFixture,
+    session: AsyncSession,
+    save_fixture: SaveFixture,
+    respx_mock: respx.MockRouter,
+    organization: Organization,
+) -> None:
+    mocker.patch("polar.webhook.tasks.enqueue_job")
+    mocker.patch(
+        "polar.webhook.repository.settings.WEBHOOK_CIRCUIT_FAILURE_THRESHOLD", 2
+    )
+    respx_mock.post("https://example.com/hook").mock(
+        return_value=httpx.Response(500, text="Internal Error")
+    )
+
+    endpoint = WebhookEndpoint(
+        url="https://example.com/hook",
+        format=WebhookFormat.raw,
+        organization_id=organization.id,
+        secret="mysecret",
+    )
+    await save_fixture(endpoint)
+
+    for _ in range(2):
+        event = WebhookEvent(
+            webhook_endpoint_id=endpoint.id,
+            type=WebhookEventType.customer_created,
+            payload='{"foo":"bar"}',
+        )
+        await save_fixture(event)
+        with pytest.raises(Retry):
+            await _webhook_event_send(session=session, webhook_event_id=event.id)
+
+    await session.refresh(endpoint)
+    assert endpoint.circuit_state == WebhookCircuitState.open
+    assert endpoint.circuit_opened_at is not None
+    assert endpoint.consecutive_failures == 2
+    assert endpoint.error_rate_ewma == 1.0
+    assert endpoint.latency_ewma is not None
+
+
+@pytest.mark.asyncio
+async def test_webhook_delivery_circuit_open(
+    mocker: MockerFixture,
+    session: AsyncSession,
+    save_fixture: SaveFixture,
+    respx_mock: respx.MockRouter,
+    organization: Organization,
+    current_message: dramatiq.Message[Any],
+) -> None:
+    actor = dramatiq.get_broker().get_actor("webhook_event.send")
+    send_mock = mocker.patch.object(actor, "send_with_options")
+    route_mock = respx_mock.post("https://example.com/hook").mock(
+        return_value=httpx.Response(200)
+    )
+
+    endpoint = WebhookEndpoint(
+        url="https://example.com/hook",
+        format=WebhookFormat.raw,
+        organization_id=organization.id,
+        secret="mysecret",
+        circuit_state=WebhookCircuitState.open,
+        circuit_opened_at=utc_now(),
+    )
+    await save_fixture(endpoint)
+
+    event = WebhookEvent(
+        webhook_endpoint_id=endpoint.id,
+        type=WebhookEventType.customer_created,
+        payload='{"foo":"bar"}',
+    )
+    await save_fixture(event)
+
+    current_message.options["retries"] = 3
+    await _webhook_event_send(session=session, webhook_event_id=event.id)
+
+    assert route_mock.call_count == 0
+    # Parked without consuming a retry
+    send_mock.assert_called_once()
+    assert send_mock.call_args.kwargs["retries"] == 3
+    assert send_mock.call_args.kwargs["delay"] > 0
+    assert send_mock.call_args.kwargs["kwargs"]["parked_since"] is not None
+
+
+@pytest.mark.asyncio
+async def test_webhook_delivery_circuit_open_max_park_duration(
+    mocker: MockerFixture,
+    session: AsyncSession,
+    save_fixture: SaveFixture,
+    respx_mock: respx.MockRouter,
+    organization: Organization,
+) -> None:
+    enqueue_job_mock = mocker.patch("polar.webhook.tasks.enqueue_job")
+    actor = dramatiq.get_broker().get_actor("webhook_event.send")
+    send_mock = mocker.patch.object(actor, "send_with_options")
+    route_mock = respx_mock.post("https://example.com/hook").mock(
+        return_value=httpx.Response(200)
+    )
+
+    endpoint = WebhookEndpoint(
+        url="https://example.com/hook",
+        format=WebhookFormat.raw,
+        organization_id=organization.id,
+        secret="mysecret",
+        circuit_state=WebhookCircuitState.open,
+        circuit_opened_at=utc_now(),
+    )
+    await save_fixture(endpoint)
+
+    event = WebhookEvent(
+        webhook_endpoint_id=endpoint.id,
+        type=WebhookEventType.customer_created,
+        payload='{"foo":"bar"}',
+    )
+    await save_fixture(event)
+    next_event = WebhookEvent(
+        webhook_endpoint_id=endpoint.id,
+        type=WebhookEventType.customer_updated,
+        payload='{"foo":"bar"}',
+    )
+    await save_fixture(next_event)
+
+    parked_since = (
+        utc_now() - settings.WEBHOOK_MAX_PARK_DURATION - timedelta(minutes=1)
+    ).timestamp()
+    await _webhook_event_send(
+        session=session, webhook_event_id=event.id, parked_since=parked_since
+    )
+
+    assert route_mock.call_count == 0
+    # Failed for good rather than parked again
+    send_mock.assert_not_called()
+    await session.refresh(event)
+    assert event.succeeded is False
+    enqueue_job_mock.assert_called_once_with(
+        "webhook_event.send", webhook_event_id=next_event.id
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "response, expected_state",
+    [
+        (httpx.Response(200), WebhookCircuitState.closed),
+        (httpx.Response(500), WebhookCircuitState.open),
+    ],
+)
+async def test_webhook_delivery_circuit_probe(
+    response: httpx.Response,
+    expected_state: WebhookCircuitState,
+    mocker: MockerFixture,
+    session: AsyncSession,
+    save_fixture: SaveFixture,
+    respx_mock: respx.MockRouter,
+    organization: Organization,
+) -> None:
+    mocker.patch("polar.webhook.tasks.enqueue_job")
+    route_mock = respx_mock.post("https://example.com/hook").mock(return_value=response)
+
+    opened_at = (
+        utc_now() - settings.WEBHOOK_CIRCUIT_OPEN_DURATION - timedelta(seconds=1)
+    )
+    endpoint = WebhookEndpoint(
+        url="https://example.com/hook",
+        format=WebhookFormat.raw,
+        organization_id=organization.id,
+        secret="mysecret",
+        circuit_state=WebhookCircuitState.open,
+        circuit_opened_at=opened_at,
+        consecutive_failures=10,
+    )
+    await save_fixture(endpoint)
+
+    event = WebhookEvent(
+        webhook_endpoint_id=endpoint.id,
+        type=WebhookEventType.customer_created,
+        payload='{"foo":"bar"}',
+    )
+    await save_fixture(event)
+
+    try:
+        await _webhook_event_send(session=session, webhook_event_id=event.id)
+    except Retry:
+        pass
+
+    assert route_mock.call_count == 1
+    await session.refresh(endpoint)
+    assert endpoint.circuit_state == expected_state
+    if expected_state == WebhookCircuitState.open:
+        # Waits again before the next probe
+        assert endpoint.circuit_opened_at is not None
+        assert endpoint.circuit_opened_at > opened_at